@@ -64,8 +64,16 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
     'django_cas.backends.CASBackend',
     'guardian.backends.ObjectPermissionBackend',
+    'auth.backends.DepartmentObjectPermissionBackend',
 ]
 
+# How object permissions are resolved:
+# 'guardian': every permission is stored as a guardian row.
+# 'department': permissions of owners and department groups are derived from
+# auth.utils.OBJECT_PERMISSION_RULES, guardian rows are only kept for
+# exceptions. Run scripts/migrate_object_permissions.py when switching.
+OBJECT_PERMISSION_RESOLVER = 'guardian'
+
 AUTH_USER_MODEL = 'tmsftt_auth.User'
 
 REST_FRAMEWORK = {
@@ -136,6 +144,7 @@ STATIC_URL = '/static/'
 JWT_AUTH = {
     'JWT_AUTH_HEADER_PREFIX': 'Bearer',
     'JWT_GET_USER_SECRET_KEY': 'auth.utils.get_user_secret_key',
+    'JWT_DECODE_HANDLER': 'auth.tokens.jwt_decode_handler',
     'JWT_AUDIENCE': 'TMSFTT clients',
     'JWT_ISSUER': 'TMSFTT server',
     'JWT_AUTH_COOKIE': 'ACCESS_TOKEN',
@@ -160,6 +169,23 @@ SOAP_AUTH_SYS_ID = 'unknown'
 SOAP_AUTH_MODULE_ID = 'unknown'
 SOAP_AUTH_SECRET_KEY = 'unknown'
 SOAP_AUTH_INTERFACE_METHOD = 'unknown'
+# WSDL files are cached on disk, None means the default path of zeep.
+SOAP_WSDL_CACHE_PATH = None
+SOAP_WSDL_CACHE_TIMEOUT = 24 * 3600
+SOAP_OPERATION_TIMEOUT = 10
+# Max number of concurrent requests to SOAP services in each process.
+SOAP_MAX_WORKERS = 8
+
+# Secure file settings
+# Signed download URLs expire after this many seconds, rounded up to the
+# hour, so URLs of a file stay the same within the hour.
+SECURE_FILE_URL_MAX_AGE = 24 * 3600
+# How files of download responses are sent:
+# 'x-accel': Nginx sends /protected-files/<name> by X-Accel-Redirect.
+# 'x-sendfile': Apache or lighttpd sends the file by X-Sendfile.
+# 'stream': Django streams the file in chunks.
+# None means 'stream' if DEBUG is True, 'x-accel' otherwise.
+SECURE_FILE_DOWNLOAD_BACKEND = None
 
 
 # Site settings
@@ -157,12 +157,27 @@ CELERY_BEAT_SCHEDULE = {
     'send_mail_to_inactive_users': {
         'task': 'data_warehouse.tasks.send_mail_to_inactive_users',
         # Every year
-        'schedule': crontab(minute=0, hour=1, day_of_month=1, month_of_year=1)
+        'schedule': crontab(minute=0, hour=1, day_of_month=1,
+                            month_of_year=1),
+        'kwargs': {'fan_out': True},
     },
     'send_mail_to_users_with_events_next_day': {
         'task': 'data_warehouse.tasks.send_mail_to_users_with_events_next_day',
         'schedule': crontab(minute=0, hour=7)  # Daily at morning.
-    }
+    },
+    'close_last_year_period': {
+        'task': 'data_warehouse.tasks.close_last_year_period',
+        # Every year
+        'schedule': crontab(minute=30, hour=0, day_of_month=1, month_of_year=1)
+    },
+    'drain_outbox': {
+        'task': 'infra.tasks.drain_outbox',
+        'schedule': crontab(),  # Every minute.
+    },
+    'rebuild_stale_snapshots': {
+        'task': 'data_warehouse.tasks.rebuild_stale_snapshots',
+        'schedule': crontab(minute=20, hour=0)  # Daily at midnight.
+    },
 }
 
 CACHES = {
@@ -1,12 +1,17 @@
 '''Authentication classes for JWT.'''
+import jwt
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.utils.encoding import smart_text
 from django.utils.translation import ugettext as _
 from rest_framework import exceptions
 from rest_framework.authentication import (
     get_authorization_header
 )
-from rest_framework_jwt.authentication import BaseJSONWebTokenAuthentication
+from rest_framework_jwt.authentication import (
+    BaseJSONWebTokenAuthentication, jwt_decode_handler,
+    jwt_get_username_from_payload
+)
 
 from rest_framework_jwt.settings import api_settings
 
@@ -59,6 +64,60 @@ class JSONWebTokenAuthentication(BaseJSONWebTokenAuthentication):
 
         return auth[1]
 
+    # pylint: disable=W0212
+    def authenticate(self, request):
+        '''Authenticate by the payload and user which have been resolved
+        by auth.middleware.JWTAuthenticationMiddleware for the same token,
+        otherwise decode the token again.'''
+        jwt_value = self.get_jwt_value(request)
+        if jwt_value is None:
+            return None
+        token, payload = getattr(request._request, '_jwt_payload',
+                                 (None, None))
+        if token is None or smart_text(token) != smart_text(jwt_value):
+            try:
+                payload = jwt_decode_handler(jwt_value)
+            except jwt.ExpiredSignature:
+                msg = _('Signature has expired.')
+                raise exceptions.AuthenticationFailed(msg)
+            except jwt.DecodeError:
+                msg = _('Error decoding signature.')
+                raise exceptions.AuthenticationFailed(msg)
+            except jwt.InvalidTokenError:
+                raise exceptions.AuthenticationFailed()
+
+        user = getattr(request._request, '_jwt_cached_user', None)
+        if getattr(user, 'pk', None) != payload.get('user_id'):
+            user = None
+        return (self.authenticate_credentials(payload, user), jwt_value)
+
+    # pylint: disable=W0221
+    def authenticate_credentials(self, payload, user=None):
+        '''Return the active user of the payload, from the user principal
+        cache unless it is given.'''
+        username = jwt_get_username_from_payload(payload)
+        if not username:
+            msg = _('Invalid payload.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        if user is None:
+            # Authentication classes are imported before models are ready.
+            from auth.services import UserService
+            try:
+                user = UserService.get_principal(payload.get('user_id'))
+            except get_user_model().DoesNotExist:
+                msg = _('Invalid signature.')
+                raise exceptions.AuthenticationFailed(msg)
+        if user.get_username() != username:
+            msg = _('Invalid signature.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        if not user.is_active:
+            msg = _('User account is disabled.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        return user
+
     def authenticate_header(self, request):
         """
         Return a string to be used as the value of the `WWW-Authenticate`
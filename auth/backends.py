@@ -0,0 +1,170 @@
+'''Authentication backends provided by auth module.'''
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from guardian.core import ObjectPermissionChecker as GuardianChecker
+
+from auth.services import PermissionService
+from auth.utils import get_object_permission_rule
+
+
+# pylint: disable=protected-access
+def get_user_group_ids(user):
+    '''Return ids of groups of the user, cached on the user object.'''
+    if not hasattr(user, '_object_permission_group_ids'):
+        user._object_permission_group_ids = set(
+            user.groups.values_list('id', flat=True))
+    return user._object_permission_group_ids
+
+
+def get_rule_group_ids(user, permission_map, department_id):
+    '''Return ids of groups which grant the user permissions on objects of
+    the department.'''
+    user_group_ids = get_user_group_ids(user)
+    return [
+        group_id for group_id in
+        permission_map['department_groups'].get(department_id, ())
+        if group_id in user_group_ids
+    ]
+
+
+def get_object_permission_condition(user, perm, model):
+    '''Return a Q object matching objects the permission is derived for.
+
+    Objects are matched by their owner and department columns, see
+    auth.utils.ObjectPermissionRule. None is returned if the model has no
+    rule or nothing can be derived for the user.
+    '''
+    rule = get_object_permission_rule(model)
+    if rule is None or not user.is_active or user.is_anonymous:
+        return None
+    permission_map = PermissionService.get_permission_map()
+    content_type_id = ContentType.objects.get_for_model(model).id
+
+    def has_perm(group_id):
+        return any(
+            permission_map['perm_names'][perm_id] == perm
+            for perm_id in permission_map['group_perms'].get(
+                (group_id, content_type_id), ()))
+
+    conditions = []
+    if rule.owner is not None and has_perm(
+            permission_map['personal_group_id']):
+        conditions.append(Q(**{rule.owner: user.id}))
+    granted_group_ids = {
+        group_id for group_id in get_user_group_ids(user)
+        if has_perm(group_id)
+    }
+    department_ids = [
+        department_id for department_id, group_ids
+        in permission_map['department_groups'].items()
+        if granted_group_ids.intersection(group_ids)
+    ]
+    if department_ids:
+        conditions.append(Q(**{f'{rule.department}__in': department_ids}))
+    if not conditions:
+        return None
+    condition = conditions.pop()
+    for other in conditions:
+        condition |= other
+    return condition
+
+
+class DepartmentObjectPermissionBackend:
+    '''Resolve object permissions by auth.utils.OBJECT_PERMISSION_RULES.
+
+    Owners of objects have the permissions of group 个人权限, and members of
+    groups of a department or its super departments have the permissions of
+    their groups on objects of the department, the same as the guardian rows
+    created by PermissionService.assign_object_permissions(). Guardian rows
+    are still checked by guardian's backend, so exceptions can be stored as
+    rows. This backend does nothing unless
+    settings.OBJECT_PERMISSION_RESOLVER is 'department'.
+    '''
+    # pylint: disable=unused-argument
+    def authenticate(self, request, **credentials):
+        '''This backend doesn't authenticate users.'''
+        return None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        '''Return names of permissions derived for the object.'''
+        if (obj is None or not user_obj.is_active
+                or user_obj.is_anonymous):
+            return set()
+        rule = get_object_permission_rule(obj._meta.model)
+        if rule is None:
+            return set()
+        permission_map = PermissionService.get_permission_map()
+        content_type_id = ContentType.objects.get_for_model(obj).id
+
+        group_ids = get_rule_group_ids(user_obj, permission_map,
+                                       rule.get_department_id(obj))
+        owner_id = rule.get_owner_id(obj)
+        if owner_id is not None and owner_id == user_obj.id:
+            group_ids.append(permission_map['personal_group_id'])
+        return {
+            permission_map['perm_names'][perm_id]
+            for group_id in group_ids
+            for perm_id in permission_map['group_perms'].get(
+                (group_id, content_type_id), ())
+        }
+
+    def has_perm(self, user_obj, perm, obj=None):
+        '''Check whether the permission can be derived for the object.'''
+        return perm in self.get_all_permissions(user_obj, obj)
+
+
+class ObjectPermissionChecker:
+    '''Check object permissions of a user on many objects.
+
+    Guardian rows of a page of objects are loaded by prefetch_perms() in two
+    queries, and permissions derived by DepartmentObjectPermissionBackend are
+    resolved in memory, so checking the page doesn't query per object.
+    Objects which are not prefetched are checked with queries, the same as
+    User.has_perm(). Use get_object_permission_checker() to share one
+    checker between permission classes and serializers of a request.
+    '''
+    def __init__(self, user):
+        self.user = user
+        self._guardian_checker = GuardianChecker(user)
+        self._department_backend = DepartmentObjectPermissionBackend()
+
+    def prefetch_perms(self, objects):
+        '''Load guardian rows of the objects and group names of the user.'''
+        objects = [obj for obj in objects if obj is not None]
+        if not objects or not self.user.is_active or self.user.is_anonymous:
+            return
+        self._guardian_checker.prefetch_perms(objects)
+        # Roles are checked per object by serializers as well.
+        if '_group_names' not in self.user.__dict__:
+            self.user.load_group_names()
+
+    def has_perm(self, perm, obj):
+        '''Check whether the user has the permission on the object.'''
+        if not self.user.is_active or self.user.is_anonymous:
+            return False
+        if self.user.is_superuser:
+            return True
+        app_label, _, codename = perm.rpartition('.')
+        if app_label and app_label != obj._meta.app_label:
+            return False
+        return (codename in self._guardian_checker.get_perms(obj)
+                or self._department_backend.has_perm(self.user, perm, obj))
+
+    def has_perms(self, perms, obj):
+        '''Check whether the user has all the permissions on the object.'''
+        return all(self.has_perm(perm, obj) for perm in perms)
+
+
+def get_object_permission_checker(request):
+    '''Return ObjectPermissionChecker of the request user.
+
+    The checker is stored on the underlying HttpRequest, so permission
+    classes and serializers of a request share prefetched permissions.
+    '''
+    # pylint: disable=protected-access
+    http_request = getattr(request, '_request', request)
+    checker = getattr(http_request, '_object_permission_checker', None)
+    if checker is None or checker.user is not request.user:
+        checker = ObjectPermissionChecker(request.user)
+        http_request._object_permission_checker = checker
+    return checker
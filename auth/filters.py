@@ -1,6 +1,9 @@
 ''' Provide filters used in filtering logic. '''
+from django.db.models import Q
 from django_filters import rest_framework as filters
+from rest_framework_guardian.filters import DjangoObjectPermissionsFilter
 
+from auth.backends import get_object_permission_condition
 from auth.models import Group
 
 
@@ -12,3 +15,25 @@ class GroupFilter(filters.FilterSet):
             'name': ['startswith'],
             'id': ['in'],
         }
+
+
+class ObjectPermissionsFilter(DjangoObjectPermissionsFilter):
+    '''Limit results to objects which the user has view permission on.
+
+    Objects with guardian rows are always included. If permissions of the
+    model can be derived from its owner and department (see
+    auth.backends.DepartmentObjectPermissionBackend), objects matched by the
+    rule are included as well.
+    '''
+    def filter_queryset(self, request, queryset, view):
+        queryset_with_perms = super().filter_queryset(request, queryset, view)
+        permission = self.perm_format % {
+            'app_label': queryset.model._meta.app_label,
+            'model_name': queryset.model._meta.model_name,
+        }
+        condition = get_object_permission_condition(
+            request.user, permission, queryset.model)
+        if condition is None:
+            return queryset_with_perms
+        return queryset.filter(
+            condition | Q(pk__in=queryset_with_perms.values('pk')))
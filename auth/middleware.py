@@ -1,12 +1,10 @@
 '''Middlewares provided by auth module.'''
-from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.functional import SimpleLazyObject
 from rest_framework_jwt.settings import api_settings
 
-
-User = get_user_model()
+from auth.services import UserService
 
 
 # pylint: disable=R0903,C0111,R0201
@@ -23,7 +21,7 @@ class JWTAuthenticationMiddleware(MiddlewareMixin):
         if not hasattr(request, '_jwt_cached_user'):
             try:
                 user_id = int(jwt_payload.get('user_id', '-1'))
-                request._jwt_cached_user = User.objects.get(id=user_id)
+                request._jwt_cached_user = UserService.get_principal(user_id)
             except Exception:  # pylint: disable=W0703
                 request._jwt_cached_user = AnonymousUser()
         return request._jwt_cached_user
@@ -45,6 +43,8 @@ class JWTAuthenticationMiddleware(MiddlewareMixin):
         token = self._get_token(request)
         try:
             jwt_payload = api_settings.JWT_DECODE_HANDLER(token)
+            # Reused by auth.authentication.JSONWebTokenAuthentication.
+            request._jwt_payload = (token, jwt_payload)
         except Exception:  # pylint: disable=W0703
             jwt_payload = {'user_id': '-1'}
         request.user = SimpleLazyObject(
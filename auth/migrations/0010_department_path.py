@@ -0,0 +1,49 @@
+# Generated by Django 2.2 on 2026-10-18 21:17
+
+from django.db import migrations, models
+
+
+def build_department_paths(super_department_ids):
+    paths = {}
+    for department_id in super_department_ids:
+        chain = []
+        current_id = department_id
+        while current_id is not None and current_id not in paths:
+            if current_id in chain:
+                break
+            chain.append(current_id)
+            current_id = super_department_ids.get(current_id)
+        prefix = paths.get(current_id, '')
+        for chain_id in reversed(chain):
+            prefix = f'{prefix}{chain_id}/'
+            paths[chain_id] = prefix
+    return paths
+
+
+def fill_department_paths(apps, schema_editor):
+    Department = apps.get_model('tmsftt_auth', 'Department')
+    departments = list(Department.objects.only('id', 'super_department_id'))
+    paths = build_department_paths({
+        department.id: department.super_department_id
+        for department in departments
+    })
+    for department in departments:
+        department.path = paths[department.id]
+    Department.objects.bulk_update(departments, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmsftt_auth', '0009_auto_20190620_1620'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='路径'),
+        ),
+        migrations.RunPython(fill_department_paths,
+                             migrations.RunPython.noop),
+    ]
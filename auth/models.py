@@ -1,8 +1,12 @@
 '''Define ORM models for auth module.'''
+import uuid
+
 from django.contrib.auth.models import (
     Permission, AbstractUser, Group, UserManager
 )
+from django.core.cache import cache
 from django.db import models
+from django.db.models import signals
 
 from auth.utils import (
     EducationBackgroundConverter,
@@ -61,10 +65,66 @@ class Department(models.Model):
         blank=True,
         null=True
     )
+    # Materialized path, ids from the root to this department, e.g. '1/5/9/'.
+    path = models.CharField(verbose_name='路径', max_length=255,
+                            blank=True, default='', db_index=True)
 
     def __str__(self):
         return str(self.name)
 
+    @property
+    def ancestor_ids(self):
+        '''Ids of departments from the root to this one (inclusive).'''
+        if not self.path:
+            return [self.id]
+        return [int(x) for x in self.path.split('/') if x]
+
+    @property
+    def administrative_department_id(self):
+        '''Id of the administrative department.
+
+        Campuses and departments under campuses are administrative
+        departments of themselves, deeper departments belong to their
+        ancestors under campuses.
+        '''
+        ancestor_ids = self.ancestor_ids
+        return ancestor_ids[min(len(ancestor_ids), 3) - 1]
+
+    def get_ancestors(self):
+        '''Return queryset of this department and its super departments.'''
+        return Department.objects.filter(id__in=self.ancestor_ids)
+
+    def get_descendants(self):
+        '''Return queryset of this department and its sub departments.'''
+        if not self.path:
+            return Department.objects.filter(id=self.id)
+        return Department.objects.filter(path__startswith=self.path)
+
+    # pylint: disable=unused-argument
+    @classmethod
+    def update_path(cls, sender, instance, raw=False, **kwargs):
+        '''Keep paths of the department and its sub departments updated.'''
+        if raw:
+            return
+        super_path = ''
+        if instance.super_department_id is not None:
+            super_path = cls.objects.filter(
+                id=instance.super_department_id,
+            ).values_list('path', flat=True).first() or ''
+        path = f'{super_path}{instance.id}/'
+        old_path = instance.path
+        if path == old_path:
+            return
+        cls.objects.filter(id=instance.id).update(path=path)
+        instance.path = path
+        if not old_path:
+            return
+        descendants = list(cls.objects.filter(
+            path__startswith=old_path).exclude(id=instance.id))
+        for descendant in descendants:
+            descendant.path = path + descendant.path[len(old_path):]
+        cls.objects.bulk_update(descendants, ['path'], batch_size=500)
+
 
 class ActiveUserManager(UserManager):
     '''Filter queryset with active status.'''
@@ -128,31 +188,47 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    def get_group_names(self):
+        '''Return names of groups of the user.
+
+        Names are kept on users loaded by UserService.get_principal(), other
+        users query them on every call.
+        '''
+        group_names = self.__dict__.get('_group_names')
+        if group_names is None:
+            return frozenset(self.groups.values_list('name', flat=True))
+        return group_names
+
+    def load_group_names(self):
+        '''Query names of groups and keep them on the user.'''
+        # pylint: disable=attribute-defined-outside-init
+        self._group_names = frozenset(
+            self.groups.values_list('name', flat=True))
+        return self._group_names
+
     @property
     def is_teacher(self):
         '''Field to indicate whether the user is a teacher.'''
-        return self.groups.filter(name__endswith='专任教师').exists()
+        return any(name.endswith('专任教师')
+                   for name in self.get_group_names())
 
     @property
     def is_department_admin(self):
         '''Field to indicate whether the user is a department admin.'''
-        return (
-            self.groups
-            .exclude(name='大连理工大学-10141-管理员')
-            .filter(name__endswith='管理员').exists()
-        )
+        return any(name.endswith('管理员')
+                   and name != '大连理工大学-10141-管理员'
+                   for name in self.get_group_names())
 
     @property
     def is_school_admin(self):
         '''Field to indicate whether the user is a superadmin.'''
-        return self.is_staff or self.is_superuser or self.groups.filter(
-            name='大连理工大学-10141-管理员').exists()
+        return self.is_staff or self.is_superuser or (
+            '大连理工大学-10141-管理员' in self.get_group_names())
 
     def check_department_admin(self, department):
         '''check department admin.'''
-        return self.groups.filter(
-            name=(f'{department.name}-{department.raw_department_id}-管理员')
-        ).exists()
+        return (f'{department.name}-{department.raw_department_id}-管理员'
+                in self.get_group_names())
 
 
 class UserGroup(models.Model):
@@ -318,3 +394,77 @@ class DepartmentAdminInformation(models.Model):
 
     def delete(self, *args, **kwargs):
         raise Exception('该表状态为只读')
+
+
+signals.post_save.connect(Department.update_path, sender=Department)
+
+
+PERMISSION_MAP_CACHE_KEY = 'auth:permission-map'
+
+
+def invalidate_permission_map(*_, **__):
+    '''Drop the cached map of department groups and group permissions.'''
+    cache.delete(PERMISSION_MAP_CACHE_KEY)
+
+
+for model in (Department, Group, GroupPermission):
+    signals.post_save.connect(invalidate_permission_map, sender=model)
+    signals.post_delete.connect(invalidate_permission_map, sender=model)
+signals.m2m_changed.connect(invalidate_permission_map,
+                            sender=Group.permissions.through)
+
+
+PRINCIPAL_CACHE_KEY_FORMAT = 'auth:principal:{version}:{user_id}'
+PRINCIPAL_VERSION_CACHE_KEY = 'auth:principal-version'
+PRINCIPAL_CACHE_TIMEOUT = 600
+
+
+def get_principal_cache_key(user_id):
+    '''Return the cache key of the user principal at current version.'''
+    version = cache.get(PRINCIPAL_VERSION_CACHE_KEY)
+    if version is None:
+        # A random version never matches entries of an evicted version.
+        cache.add(PRINCIPAL_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(PRINCIPAL_VERSION_CACHE_KEY)
+    return PRINCIPAL_CACHE_KEY_FORMAT.format(version=version, user_id=user_id)
+
+
+def invalidate_principals(*_, **__):
+    '''Expire cached principals of all users by bumping the version.'''
+    cache.set(PRINCIPAL_VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate_user_principal(sender, instance, **kwargs):
+    # pylint: disable=unused-argument
+    '''Drop the cached principal of a user or of a membership's user.'''
+    user_id = instance.pk if isinstance(instance, User) else instance.user_id
+    cache.delete(get_principal_cache_key(user_id))
+
+
+def invalidate_member_principals(sender, instance, action, reverse, pk_set,
+                                 **kwargs):
+    # pylint: disable=unused-argument,too-many-arguments
+    '''Drop cached principals of users whose groups are changed.'''
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif pk_set is None:
+        invalidate_principals()
+        return
+    else:
+        user_ids = pk_set
+    cache.delete_many([get_principal_cache_key(user_id)
+                       for user_id in user_ids])
+
+
+for model in (User, UserGroup):
+    signals.post_save.connect(invalidate_user_principal, sender=model)
+    signals.post_delete.connect(invalidate_user_principal, sender=model)
+for model in (Group, GroupPermission):
+    signals.post_save.connect(invalidate_principals, sender=model)
+    signals.post_delete.connect(invalidate_principals, sender=model)
+signals.m2m_changed.connect(invalidate_principals,
+                            sender=Group.permissions.through)
+for through in (User.groups.through, User.user_permissions.through):
+    signals.m2m_changed.connect(invalidate_member_principals, sender=through)
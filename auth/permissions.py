@@ -2,6 +2,7 @@
 from django.http import Http404
 from rest_framework import permissions, exceptions
 
+from auth.backends import get_object_permission_checker
 from infra.utils import prod_logger
 
 
@@ -148,12 +149,12 @@ class DjangoObjectPermissions(DjangoModelPermissions):
         # authentication checks have already executed via has_permission
         queryset = self._queryset(view)
         model_cls = queryset.model
-        user = request.user
+        checker = get_object_permission_checker(request)
 
         perms = self.get_required_object_permissions(
             request.method, view, model_cls)
 
-        if not user.has_perms(perms, obj):
+        if not checker.has_perms(perms, obj):
             # If the user does not have permissions we need to determine if
             # they have read permissions to see 403, or not, and simply see
             # a 404 response.
@@ -165,7 +166,7 @@ class DjangoObjectPermissions(DjangoModelPermissions):
 
             read_perms = self.get_required_object_permissions(
                 'GET', view, model_cls)
-            if not user.has_perms(read_perms, obj):
+            if not checker.has_perms(read_perms, obj):
                 raise Http404
 
             # Has read permissions.
@@ -1,6 +1,7 @@
 '''Define how to serialize our models.'''
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
+from django.db import models
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 from rest_framework_bulk import (
@@ -9,12 +10,30 @@ from rest_framework_bulk import (
 )
 
 import auth.models
+from auth.backends import get_object_permission_checker
 from auth.services import UserGroupService
 from infra.mixins import HumanReadableValidationErrorMixin
 
 User = get_user_model()
 
 
+class ObjectPermissionListSerializer(serializers.ListSerializer):
+    '''Prefetch object permissions of the request user on listed objects.
+
+    Use it as list_serializer_class of serializers which check permissions
+    per object with get_object_permission_checker(), the checker then
+    answers from the prefetched rows instead of querying per object.
+    '''
+    # pylint: disable=abstract-method
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        request = self.context.get('request')
+        if request is not None:
+            iterable = list(iterable)
+            get_object_permission_checker(request).prefetch_perms(iterable)
+        return super().to_representation(iterable)
+
+
 class DepartmentSerializer(HumanReadableValidationErrorMixin,
                            serializers.ModelSerializer):
     '''Indicate how to serialize Department instance.'''
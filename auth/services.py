@@ -1,73 +1,332 @@
 '''Provide services related to auth module.'''
+import itertools
+from collections import defaultdict
+
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.db import transaction
 from django.db.models import Q
+from guardian.models import GroupObjectPermission, UserObjectPermission
 
-from auth.utils import assign_perm
-from auth.models import Department, UserGroup, User
+from auth.utils import (
+    build_department_paths, get_object_permission_rule,
+    OBJECT_PERMISSION_RULES
+)
+from auth.models import (
+    Department, UserGroup, User, GroupPermission, PERMISSION_MAP_CACHE_KEY,
+    PRINCIPAL_CACHE_TIMEOUT, get_principal_cache_key
+)
 from infra.utils import prod_logger
 
 
 class PermissionService:
     '''Provide services for Permissons.'''
+    PERMISSION_MAP_TIMEOUT = 3600
+
     # pylint: disable=redefined-builtin
     @classmethod
     @transaction.atomic()
-    def assign_object_permissions(cls, user=None, instance=None):
+    def assign_object_permissions(cls, user=None, instance=None,
+                                  department=None):
         '''
         The function is used to provide permissions for releated user when
         an object is created (a teacher create a tranning record for exmaple).
+
+        i: User-Object-Permissions of group 个人权限 for the current user.
+        ii: Group-Object-Permissions for groups of the user's department and
+        its super departments.
+
         Parameters
         ----------
         user: User
             the current user who create the object.
         instance: Model
             a model instance
+        department: Department
+            Groups of this department and its super departments are given
+            permissions instead of those of the user's department.
+            Default: None
         Returns
         -------
         None
         '''
-        # i: assgin User-Object-Permissions for the current user
-        group = Group.objects.get(name='个人权限')
-        cls._assign_group_permissions(group, user, instance)
-
-        # ii: assgin Group-Object-Permissions for DepartmentGroup
-        related_department = user.department
-        while related_department:
-            name_prefix = (
-                f'{related_department.name}-'
-                f'{related_department.raw_department_id}-'
-            )
-            for group in Group.objects.filter(name__startswith=name_prefix):
-                cls._assign_group_permissions(group, group, instance)
-            related_department = related_department.super_department
+        cls.bulk_assign_object_permissions([(user, instance)],
+                                           department=department)
 
-    # pylint: disable=redefined-builtin
+    # pylint: disable=too-many-locals
     @classmethod
-    def _assign_group_permissions(
-            cls, group=None, user_or_group=None, instance=None):
+    def bulk_assign_object_permissions(cls, owners_and_instances,
+                                       department=None):
+        '''Assign object permissions for many objects at once.
+
+        Groups of departments and their permissions are read from a cached
+        map, and object permissions are written by bulk_create(), so the
+        cost doesn't grow with the depth of departments or the number of
+        permissions. Permissions which can be derived by the object's rule
+        (see auth.utils.OBJECT_PERMISSION_RULES) aren't stored if
+        settings.OBJECT_PERMISSION_RESOLVER is 'department'.
+
+        Parameters
+        ----------
+        owners_and_instances: iterable of (User, Model)
+            The user who owns the object and the saved model instance.
+        department: Department
+            Groups of this department and its super departments are given
+            permissions instead of those of each user's department.
+            Default: None
+
+        Returns
+        -------
+        count: int
+            The number of object permissions created.
         '''
-        The function is used to assign object-level-permissons to an user or a
-        group based on model-permissions of a given group.
+        pairs = list(owners_and_instances)
+        if not pairs:
+            return 0
+        permission_map = cls.get_permission_map()
+        personal_group_id = permission_map['personal_group_id']
+        if personal_group_id is None:
+            raise Group.DoesNotExist('个人权限 matching query does not exist.')
+        department_groups = permission_map['department_groups']
+        group_perms = permission_map['group_perms']
+        content_types = ContentType.objects.get_for_models(
+            *{instance._meta.model for _, instance in pairs})
+
+        user_perms = []
+        group_object_perms = []
+        for user, instance in pairs:
+            content_type_id = content_types[instance._meta.model].id
+            object_pk = str(instance.pk)
+            # Skip permissions derived by DepartmentObjectPermissionBackend.
+            derived_owner_id, derived_group_ids = None, ()
+            rule = get_object_permission_rule(instance._meta.model)
+            if rule is not None:
+                derived_owner_id = rule.get_owner_id(instance)
+                derived_group_ids = department_groups.get(
+                    rule.get_department_id(instance), ())
+            if user.id != derived_owner_id:
+                user_perms.extend(
+                    UserObjectPermission(
+                        user_id=user.id, permission_id=perm_id,
+                        content_type_id=content_type_id, object_pk=object_pk)
+                    for perm_id in group_perms.get(
+                        (personal_group_id, content_type_id), ()))
+            department_id = (user.department_id if department is None
+                             else department.id)
+            for group_id in department_groups.get(department_id, ()):
+                if group_id in derived_group_ids:
+                    continue
+                group_object_perms.extend(
+                    GroupObjectPermission(
+                        group_id=group_id, permission_id=perm_id,
+                        content_type_id=content_type_id, object_pk=object_pk)
+                    for perm_id in group_perms.get(
+                        (group_id, content_type_id), ()))
+        # Existing permissions are skipped like assign_perm() does.
+        with transaction.atomic():
+            UserObjectPermission.objects.bulk_create(
+                user_perms, batch_size=500, ignore_conflicts=True)
+            GroupObjectPermission.objects.bulk_create(
+                group_object_perms, batch_size=500, ignore_conflicts=True)
+        count = len(user_perms) + len(group_object_perms)
+        msg = f'为{len(pairs)}个对象批量赋予了{count}项对象权限'
+        prod_logger.info(msg)
+        return count
+
+    @classmethod
+    def prune_derived_object_permissions(cls, model, dry_run=False,
+                                         batch_size=1000):
+        '''Delete guardian rows which the rule of the model can derive.
+
+        This is used to migrate to DepartmentObjectPermissionBackend, rows
+        which can't be derived (exceptions) are kept.
 
         Parameters
         ----------
-        group: Group
-            the group which provide model-permissions
-        user_or_group: User or Group
-            an user or a group which is going to get object-level-permissons
-        instance: Model
-            a model instance
+        model: Model class
+            A model in auth.utils.OBJECT_PERMISSION_RULES.
+        dry_run: bool
+            Only count rows to delete if True.
+
         Returns
         -------
-        None
+        count: int
+            The number of rows deleted (or to delete).
+        '''
+        count = 0
+        content_type_id = ContentType.objects.get_for_model(model).id
+        for user_keys, group_keys, object_pks in (
+                cls._iter_derived_object_permissions(model, batch_size)):
+            for perm_model, keys, subject in (
+                    (UserObjectPermission, user_keys, 'user_id'),
+                    (GroupObjectPermission, group_keys, 'group_id')):
+                ids = [
+                    row_id for row_id, subject_id, perm_id, object_pk in (
+                        perm_model.objects.filter(
+                            content_type_id=content_type_id,
+                            object_pk__in=object_pks,
+                        ).values_list('id', subject, 'permission_id',
+                                      'object_pk'))
+                    if (subject_id, perm_id, object_pk) in keys
+                ]
+                count += len(ids)
+                if ids and not dry_run:
+                    perm_model.objects.filter(id__in=ids).delete()
+        msg = f'删除了{model._meta.verbose_name}的{count}项可推导的对象权限'
+        prod_logger.info(msg)
+        return count
+
+    @classmethod
+    def restore_derived_object_permissions(cls, model, batch_size=1000):
+        '''Store permissions derived by the rule of the model as guardian
+        rows, so that the 'guardian' resolver can be used again.
+
+        Returns
+        -------
+        count: int
+            The number of rows tried to create, existing ones are skipped.
         '''
-        content_type = ContentType.objects.get_for_model(
-            instance._meta.model)
-        for perm in group.permissions.all().filter(
-                content_type_id=content_type.id):
-            assign_perm(perm, user_or_group, instance)
+        count = 0
+        content_type_id = ContentType.objects.get_for_model(model).id
+        for user_keys, group_keys, _ in cls._iter_derived_object_permissions(
+                model, batch_size):
+            UserObjectPermission.objects.bulk_create([
+                UserObjectPermission(
+                    user_id=user_id, permission_id=perm_id,
+                    content_type_id=content_type_id, object_pk=object_pk)
+                for user_id, perm_id, object_pk in user_keys
+            ], batch_size=500, ignore_conflicts=True)
+            GroupObjectPermission.objects.bulk_create([
+                GroupObjectPermission(
+                    group_id=group_id, permission_id=perm_id,
+                    content_type_id=content_type_id, object_pk=object_pk)
+                for group_id, perm_id, object_pk in group_keys
+            ], batch_size=500, ignore_conflicts=True)
+            count += len(user_keys) + len(group_keys)
+        msg = f'恢复了{model._meta.verbose_name}的{count}项对象权限'
+        prod_logger.info(msg)
+        return count
+
+    @classmethod
+    def _iter_derived_object_permissions(cls, model, batch_size):
+        '''Iterate permissions derived by the rule of the model in batches.
+
+        Yields
+        ------
+        user_keys: set of (user id, permission id, object pk)
+        group_keys: set of (group id, permission id, object pk)
+        object_pks: list of object pks in the batch, as strings
+        '''
+        rule = OBJECT_PERMISSION_RULES[model._meta.label_lower]
+        permission_map = cls.get_permission_map()
+        department_groups = permission_map['department_groups']
+        group_perms = permission_map['group_perms']
+        content_type_id = ContentType.objects.get_for_model(model).id
+        owner_perm_ids = group_perms.get(
+            (permission_map['personal_group_id'], content_type_id), ())
+
+        rows = model.objects.order_by('pk').values_list(
+            'pk', rule.owner or 'pk', rule.department).iterator()
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            user_keys = set()
+            group_keys = set()
+            for object_id, owner_id, department_id in batch:
+                object_pk = str(object_id)
+                if rule.owner is not None and owner_id is not None:
+                    user_keys.update((owner_id, perm_id, object_pk)
+                                     for perm_id in owner_perm_ids)
+                for group_id in department_groups.get(department_id, ()):
+                    group_keys.update(
+                        (group_id, perm_id, object_pk)
+                        for perm_id in group_perms.get(
+                            (group_id, content_type_id), ()))
+            yield user_keys, group_keys, [str(row[0]) for row in batch]
+
+    @classmethod
+    def get_permission_map(cls):
+        '''Return the cached map used to assign object permissions.
+
+        The map is invalidated when departments, groups or permissions of
+        groups change, see auth.models.invalidate_permission_map().
+
+        Returns
+        -------
+        permission_map: dict
+            {
+                'personal_group_id': id of group 个人权限,
+                'department_groups': map department id to ids of groups of
+                    the department and its super departments,
+                'group_perms': map (group id, content type id) to
+                    permission ids,
+                'perm_names': map permission id to its full name like
+                    'training_record.view_record',
+            }
+        '''
+        permission_map = cache.get(PERMISSION_MAP_CACHE_KEY)
+        if permission_map is None:
+            permission_map = cls._build_permission_map()
+            cache.set(PERMISSION_MAP_CACHE_KEY, permission_map,
+                      cls.PERMISSION_MAP_TIMEOUT)
+        return permission_map
+
+    @staticmethod
+    def _build_permission_map():
+        '''Build the permission map in three queries.'''
+        departments = {
+            department_id: (f'{name}-{raw_department_id}-',
+                            super_department_id)
+            for department_id, name, raw_department_id, super_department_id
+            in Department.objects.values_list(
+                'id', 'name', 'raw_department_id', 'super_department_id')
+        }
+        department_ids_by_prefix = defaultdict(list)
+        for department_id, (prefix, _) in departments.items():
+            department_ids_by_prefix[prefix].append(department_id)
+
+        personal_group_id = None
+        own_groups = defaultdict(list)
+        for group_id, name in Group.objects.order_by('id').values_list(
+                'id', 'name'):
+            if name == '个人权限':
+                personal_group_id = group_id
+            # Same as name__startswith=prefix for every prefix of the name.
+            for index, char in enumerate(name):
+                if char != '-':
+                    continue
+                for department_id in department_ids_by_prefix.get(
+                        name[:index + 1], ()):
+                    own_groups[department_id].append(group_id)
+
+        department_groups = {}
+        for department_id in departments:
+            group_ids = []
+            visited = set()
+            current_id = department_id
+            while current_id in departments and current_id not in visited:
+                visited.add(current_id)
+                group_ids.extend(own_groups[current_id])
+                current_id = departments[current_id][1]
+            department_groups[department_id] = group_ids
+
+        group_perms = defaultdict(list)
+        perm_names = {}
+        for group_id, content_type_id, perm_id, app_label, codename in (
+                GroupPermission.objects.values_list(
+                    'group_id', 'permission__content_type_id',
+                    'permission_id', 'permission__content_type__app_label',
+                    'permission__codename')):
+            group_perms[(group_id, content_type_id)].append(perm_id)
+            perm_names[perm_id] = f'{app_label}.{codename}'
+        return {
+            'personal_group_id': personal_group_id,
+            'department_groups': department_groups,
+            'group_perms': dict(group_perms),
+            'perm_names': perm_names,
+        }
 
 
 class UserService:
@@ -79,6 +338,31 @@ class UserService:
             teaching_type__in=('专任教师', '实验技术')
         )
 
+    @staticmethod
+    def get_principal(user_id):
+        '''Return the user with names of its groups and its model
+        permissions loaded.
+
+        The user is cached across requests, so roles like is_school_admin
+        and global permissions are resolved without queries. Cached users
+        are dropped when they, their groups or permissions change, see
+        auth.models.
+
+        Raises
+        ------
+        User.DoesNotExist
+            If there is no active user with the id.
+        '''
+        cache_key = get_principal_cache_key(user_id)
+        user = cache.get(cache_key)
+        if user is None:
+            user = User.objects.get(id=user_id)
+            user.load_group_names()
+            # Filled into caches of ModelBackend on the user.
+            user.get_all_permissions()
+            cache.set(cache_key, user, PRINCIPAL_CACHE_TIMEOUT)
+        return user
+
 
 class DepartmentService:
     '''
@@ -110,6 +394,34 @@ class DepartmentService:
                 raw_department_id='000355'
             )
 
+    @staticmethod
+    def rebuild_department_paths():
+        '''Rebuild materialized paths of all departments.
+
+        Paths are kept updated when departments are saved, this is used
+        after departments are changed in bulk.
+
+        Returns
+        -------
+        count: int
+            The number of departments whose paths are changed.
+        '''
+        departments = list(Department.objects.only(
+            'id', 'super_department_id', 'path'))
+        paths = build_department_paths({
+            department.id: department.super_department_id
+            for department in departments
+        })
+        changed = []
+        for department in departments:
+            if department.path != paths[department.id]:
+                department.path = paths[department.id]
+                changed.append(department)
+        Department.objects.bulk_update(changed, ['path'], batch_size=500)
+        msg = f'更新了{len(changed)}个部门的路径'
+        prod_logger.info(msg)
+        return len(changed)
+
 
 class GroupService:
     '''
@@ -129,14 +441,10 @@ class GroupService:
             the queryset of all the groups which belongs to a
             top_level_department
         '''
-        departments = list(Department.objects.filter(id=department_id))
-        if not departments:
+        department = Department.objects.filter(id=department_id).first()
+        if department is None:
             return []
-        search_list = departments
-        while search_list:
-            search_list = list(Department.objects.filter(
-                super_department__in=[d.id for d in search_list]))
-            departments.extend(search_list)
+        departments = department.get_descendants()
         regex = '^({})'.format('|'.join(
             f'{d.name}-{d.raw_department_id}-' for d in departments))
         return Group.objects.filter(name__regex=regex)
@@ -1,4 +1,6 @@
 '''Celery tasks.'''
+import itertools
+from collections import Counter, defaultdict
 from datetime import datetime
 
 from celery import shared_task
@@ -9,211 +11,357 @@ from django.utils.timezone import make_aware, make_naive, now
 from django.contrib.auth.models import Group
 from auth.models import (
     User, Department, DepartmentInformation, TeacherInformation, UserGroup)
-from auth.utils import assign_model_perms_for_department
+from auth.utils import (
+    assign_model_perms_for_departments, build_department_paths)
+from drf_cache.utils import invalidate_all_caches
 
-from infra.utils import prod_logger
+from infra.utils import bulk_create_with_pks, prod_logger
 
 DLUT_ID = '10141'
 DLUT_NAME = '大连理工大学'
 
 
-def update_user_groups(handler, dep, dlut):
-    '''增删某一群用户的department链上的group'''
-    while dep.raw_department_id != dlut.raw_department_id:
-        handler(Group.objects.get(
-            name=f'{dep.name}-{dep.raw_department_id}-专任教师'))
-        dep = dep.super_department
-    handler(Group.objects.get(
-        name=f'{dep.name}-{dep.raw_department_id}-专任教师'))
+DEPARTMENT_GROUP_ROLES = ('管理员', '专任教师')
 
 
+def _get_super_department(raw_department, departments):
+    '''Find the super department of a DepartmentInformation row.'''
+    # DepartmentInformation中不含大连理工大学
+    super_raw_department_id = raw_department.lsdw or DLUT_ID
+    super_department = departments.get(super_raw_department_id)
+    if super_department is None:
+        warn_msg = (
+            f'单位{raw_department.dwid}的隶属单位{super_raw_department_id}'
+            f'不存在, 将其隶属于{DLUT_NAME}'
+        )
+        prod_logger.warning(warn_msg)
+        super_department = departments[DLUT_ID]
+    return super_department
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
 def _update_from_department_information():
-    # pylint: disable=R0912
-    # pylint: disable=R0915
-    # pylint: disable=R1702
-    # pylint: disable=R0914
-    '''Scan table DepartmentInformation and update related tables.'''
+    '''Scan table DepartmentInformation and update related tables.
+
+    DepartmentInformation, Department and Group are each loaded once and
+    compared in memory, then new departments, moves, renames, type changes
+    and paths are written by bulk_create() and bulk_update().
+
+    Returns
+    -------
+    dwid_to_department: dict
+        Map raw department id to department.
+    department_id_to_administrative: dict
+        Map department id to its administrative department.
+    '''
     prod_logger.info('开始扫描并更新部门信息')
     # 校区初始化
-    dlut, _ = Department.objects.get_or_create(raw_department_id=DLUT_ID,
-                                               defaults={'name': DLUT_NAME})
-    raw_departments = DepartmentInformation.objects.exclude(dwid=DLUT_ID)
-    dwid_to_department = {}
-    department_id_to_administrative = {}
+    Department.objects.get_or_create(raw_department_id=DLUT_ID,
+                                     defaults={'name': DLUT_NAME})
+    raw_departments = list(DepartmentInformation.objects.exclude(dwid=DLUT_ID))
+    departments = Department.objects.in_bulk(field_name='raw_department_id')
+    groups_by_prefix = defaultdict(list)
+    for group in Group.objects.all():
+        groups_by_prefix[group.name.rpartition('-')[0]].append(group)
 
-    def update_administrative(department_id_to_administrative):
-        # 更新administrative
-        for department_id in department_id_to_administrative:
-            same_administrative = []
-            administrative = department_id_to_administrative[department_id]
-            while administrative.id != department_id:
-                same_administrative.append(department_id)
-                department_id = administrative.id
-                administrative = department_id_to_administrative[department_id]
-            for item_id in same_administrative:
-                department_id_to_administrative[item_id] = administrative
-        return department_id_to_administrative
-
-    def update_group_and_perms(department, created):
-        # 同步group
-        group_names = [
-            f'{department.name}-{department.raw_department_id}-管理员',
-            f'{department.name}-{department.raw_department_id}-专任教师',
-        ]
-        for group_name in group_names:
-            Group.objects.get_or_create(name=group_name)
-        if created:
-            assign_model_perms_for_department(department)
-
-    def find_all_child_department(super_department):
-        # 将当前department的所有叶子结点返回
-        childs = []
-        child_departments = super_department.child_departments.all()
-        if child_departments:
-            for child_department in child_departments:
-                childs.extend(find_all_child_department(child_department))
-        else:
-            childs.extend([super_department])
-        return childs
+    # 创建新单位, 隶属单位随后与已有单位一起同步
+    new_departments = [
+        Department(raw_department_id=raw_department.dwid,
+                   name=raw_department.dwmc,
+                   department_type=raw_department.dwlx)
+        for raw_department in raw_departments
+        if raw_department.dwid not in departments
+    ]
+    bulk_create_with_pks(Department.objects, new_departments,
+                         ('raw_department_id',))
+    departments.update(
+        (department.raw_department_id, department)
+        for department in new_departments)
+
+    summary = Counter(created=len(new_departments))
+    changed_departments = {}
+    changed_fields = set()
+    renamed_groups = []
+    current_time = now()
     try:
         for raw_department in raw_departments:
-            department, created = Department.objects.get_or_create(
-                raw_department_id=raw_department.dwid,
-                defaults={'name': raw_department.dwmc})
-            update_group_and_perms(department, created)
-            updated = False
+            department = departments[raw_department.dwid]
+            diff = []
             # 同步隶属单位
-            if (department.super_department is None or
-                    department.super_department.raw_department_id !=
-                    raw_department.lsdw):
-                # DepartmentInformation中不含大连理工大学
-                super_department_name = DLUT_NAME
-                if not raw_department.lsdw:
-                    raw_department.lsdw = DLUT_ID
-                if raw_department.lsdw != DLUT_ID:
-                    super_department_name = DepartmentInformation.objects.get(
-                        dwid=raw_department.lsdw).dwmc
-                super_department, created = Department.objects.get_or_create(
-                    raw_department_id=raw_department.lsdw,
-                    defaults={'name': super_department_name}
-                )
-                update_group_and_perms(super_department, created)
-                # 将老师从原有group中删除
-                if department.super_department:
-                    child_departments = find_all_child_department(
-                        department.super_department)
-                    for child in child_departments:
-                        teachers = User.objects.filter(department=child)
-                        UserGroup.objects.filter(
-                            user__in=teachers,
-                            group__name__endswith='-专任教师').delete()
-                        teachers.update(department=None)
+            super_department = _get_super_department(raw_department,
+                                                     departments)
+            if department.super_department_id != super_department.id:
+                if department.super_department_id is not None:
+                    summary['moved'] += 1
                 department.super_department = super_department
-                updated = True
+                diff.append('super_department')
             # 同步单位类型
             if department.department_type != raw_department.dwlx:
                 department.department_type = raw_department.dwlx
-                updated = True
-
+                summary['retyped'] += 1
+                diff.append('department_type')
             # 同步单位名称
             if department.name != raw_department.dwmc:
-                name_prefix = (
-                    f'{department.name}-{department.raw_department_id}-'
-                )
-                related_groups = Group.objects.filter(
-                    name__startswith=name_prefix)
-                for group in related_groups:
-                    _, dwid, suffix = group.name.split('-')
-                    group.name = f'{raw_department.dwmc}-{dwid}-{suffix}'
-                    group.save()
+                old_prefix = f'{department.name}-{raw_department.dwid}'
+                new_prefix = f'{raw_department.dwmc}-{raw_department.dwid}'
+                for group in groups_by_prefix.pop(old_prefix, []):
+                    suffix = group.name.rpartition('-')[2]
+                    group.name = f'{new_prefix}-{suffix}'
+                    renamed_groups.append(group)
+                    groups_by_prefix[new_prefix].append(group)
                 department.name = raw_department.dwmc
-                updated = True
-            if updated:
-                department.save()
-            if dlut in (department.super_department,
-                        department.super_department.super_department):
-                # 校区和二级部门的administrative为本身
-                department_id_to_administrative[department.id] = department
-            else:
-                # 非二级部门的administrative暂为superdepartment
-                department_id_to_administrative[department.id] = (
-                    department.super_department
-                )
+                summary['renamed'] += 1
+                diff.append('name')
+            if diff:
+                department.update_time = current_time
+                changed_departments[department.id] = department
+                changed_fields.update(diff)
     except Exception as exc:
         prod_logger.exception('部门信息更新失败,单位号:%s, excepiton:%s',
                               raw_department.dwid, exc)
         raise
-    department_id_to_administrative = update_administrative(
-        department_id_to_administrative)
+
+    # 同步group
+    group_names = {
+        group.name for groups in groups_by_prefix.values() for group in groups
+    }
+    synced_departments = [departments[DLUT_ID]] + [
+        departments[raw_department.dwid] for raw_department in raw_departments
+    ]
+    missing_groups = [
+        Group(name=group_name)
+        for department in synced_departments
+        for group_name in (
+            f'{department.name}-{department.raw_department_id}-{role}'
+            for role in DEPARTMENT_GROUP_ROLES)
+        if group_name not in group_names
+    ]
+    Group.objects.bulk_update(renamed_groups, ['name'], batch_size=500)
+    Group.objects.bulk_create(missing_groups, batch_size=500)
+    if new_departments:
+        assign_model_perms_for_departments(new_departments)
+
+    # 同步路径, 隶属关系已全部在内存中
+    departments_by_id = {
+        department.id: department for department in departments.values()
+    }
+    paths = build_department_paths({
+        department_id: department.super_department_id
+        for department_id, department in departments_by_id.items()
+    })
+    for department_id, path in paths.items():
+        department = departments_by_id[department_id]
+        if department.path != path:
+            department.path = path
+            changed_departments[department_id] = department
+            changed_fields.add('path')
+    if changed_departments:
+        Department.objects.bulk_update(
+            changed_departments.values(),
+            sorted(changed_fields) + ['update_time'], batch_size=500)
+    if new_departments or changed_departments or renamed_groups \
+            or missing_groups:
+        # Bulk operations don't send signals which invalidate caches and
+        # the permission map.
+        transaction.on_commit(invalidate_all_caches)
+
+    # 校区和二级部门的administrative为本身, 更深的部门为其二级部门
+    dwid_to_department = {}
+    department_id_to_administrative = {}
     for raw_department in raw_departments:
-        department, created = Department.objects.get_or_create(
-            raw_department_id=raw_department.dwid,
-            defaults={'name': raw_department.dwmc})
+        department = departments[raw_department.dwid]
         dwid_to_department[raw_department.dwid] = department
+        department_id_to_administrative[department.id] = departments_by_id[
+            department.administrative_department_id]
 
-    prod_logger.info('部门信息更新完毕')
+    summary['groups_created'] = len(missing_groups)
+    summary['groups_renamed'] = len(renamed_groups)
+    msg = f'部门信息更新完毕: {dict(summary)}'
+    prod_logger.info(msg)
 
     return dwid_to_department, department_id_to_administrative
 
 
+TEACHER_FIELDS = (
+    'first_name', 'department_id', 'administrative_department_id', 'gender',
+    'age', 'onboard_time', 'tenure_status', 'education_background',
+    'technical_title', 'teaching_type', 'cell_phone_number', 'email',
+)
+
+
+def _get_teacher_fields(raw_user, current_time):
+    '''Convert a TeacherInformation row to field values of User.
+
+    Department fields are filled by the caller.
+    '''
+    age = 0
+    if raw_user.csrq:
+        birthday = datetime.strptime(raw_user.csrq, '%Y-%m-%d')
+        age = (current_time - birthday).days // 365
+    fields = {
+        'first_name': raw_user.jsxm,
+        'gender': User.GENDER_CHOICES_MAP.get(
+            raw_user.get_xb_display(), User.GENDER_UNKNOWN),
+        'age': age,
+        'tenure_status': raw_user.get_rzzt_display(),
+        'education_background': raw_user.get_xl_display(),
+        'technical_title': raw_user.get_zyjszc_display(),
+        'teaching_type': raw_user.get_rjlx_display(),
+        'cell_phone_number': raw_user.sjh,
+        'email': raw_user.yxdz if raw_user.yxdz else '',
+    }
+    if raw_user.rxsj:
+        fields['onboard_time'] = make_aware(
+            parse_datetime(f'{raw_user.rxsj}T12:00:00'))
+    return fields
+
+
+def _get_department_teacher_groups():
+    '''Map department id to ids of 专任教师 groups of the department and
+    its super departments.'''
+    group_ids = dict(Group.objects.filter(
+        name__endswith='-专任教师').values_list('name', 'id'))
+    departments = list(Department.objects.only(
+        'id', 'name', 'raw_department_id', 'path'))
+    own_group_ids = {
+        department.id: group_ids.get(
+            f'{department.name}-{department.raw_department_id}-专任教师')
+        for department in departments
+    }
+    department_groups = {}
+    for department in departments:
+        chain = [own_group_ids.get(x) for x in department.ancestor_ids]
+        if None in chain:
+            warn_msg = f'{department}或其上级单位缺少专任教师用户组'
+            prod_logger.warning(warn_msg)
+        department_groups[department.id] = {x for x in chain if x}
+    return department_groups
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
 def _update_from_teacher_information(dwid_to_department,
                                      department_id_to_administrative):
-    '''Scan table TeacherInformation and update related tables.'''
+    '''Scan table TeacherInformation and update related tables.
+
+    Both tables are loaded into memory and compared field by field, only
+    new or changed users are written by bulk_create() and bulk_update(),
+    and 专任教师 groups of users are updated by set differences.
+
+    Returns
+    -------
+    summary: dict
+        Numbers of created, updated and unchanged users, group memberships
+        added and removed, and how many times each field changed.
+    '''
     prod_logger.info('开始扫描并更新用户信息')
-    dlut, _ = Department.objects.get_or_create(raw_department_id=DLUT_ID,
-                                               defaults={'name': DLUT_NAME})
+    Department.objects.get_or_create(raw_department_id=DLUT_ID,
+                                     defaults={'name': DLUT_NAME})
     personal_permission_group, _ = Group.objects.get_or_create(name='个人权限')
-    raw_users = TeacherInformation.objects.all()
-    try:
-        for raw_user in raw_users:
-            user, created = User.all_objects.get_or_create(
-                username=raw_user.zgh)
-            if created:
-                user.groups.add(personal_permission_group)
-                user.set_unusable_password()
-            user.first_name = raw_user.jsxm
-            if raw_user.xy not in dwid_to_department:
-                warn_msg = (
-                    f'职工号为{user.username}的教师'
-                    f'使用了一个系统中不存在的学院{raw_user.xy}'
-                )
-                if created or user.department:
+    raw_users = list(TeacherInformation.objects.all())
+    users = User.all_objects.in_bulk(
+        [raw_user.zgh for raw_user in raw_users], field_name='username')
+    current_time = make_naive(now())
+    summary = {
+        'created': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'groups_added': 0,
+        'groups_removed': 0,
+        'changed_fields': Counter(),
+    }
+
+    new_users = []
+    changed_users = []
+    changed_fields = set()
+    desired_department_ids = {}
+    for raw_user in raw_users:
+        try:
+            fields = _get_teacher_fields(raw_user, current_time)
+            user = users.get(raw_user.zgh)
+            department = dwid_to_department.get(raw_user.xy)
+            if department is None:
+                if user is None or user.department_id:
+                    warn_msg = (
+                        f'职工号为{raw_user.zgh}的教师'
+                        f'使用了一个系统中不存在的学院{raw_user.xy}'
+                    )
                     prod_logger.warning(warn_msg)
-                UserGroup.objects.filter(
-                    user=user,
-                    group__name__endswith='-专任教师').delete()
-                user.department = None
-            elif user.department != dwid_to_department.get(raw_user.xy):
-                if user.department:
-                    update_user_groups(user.groups.remove, user.department,
-                                       dlut)
-                user.department = dwid_to_department.get(raw_user.xy)
-                user.administrative_department = (
-                    department_id_to_administrative[user.department.id]
-                )
-                update_user_groups(user.groups.add, user.department, dlut)
-            user.gender = User.GENDER_CHOICES_MAP.get(
-                raw_user.get_xb_display(), User.GENDER_UNKNOWN)
-            user.age = 0
-            if raw_user.csrq:
-                birthday = datetime.strptime(raw_user.csrq, '%Y-%m-%d')
-                user.age = (make_naive(now()) - birthday).days // 365
-            if raw_user.rxsj and user.onboard_time != raw_user.rxsj:
-                user.onboard_time = make_aware(
-                    parse_datetime(f'{raw_user.rxsj}T12:00:00'))
-
-            user.tenure_status = raw_user.get_rzzt_display()
-            user.education_background = raw_user.get_xl_display()
-            user.technical_title = raw_user.get_zyjszc_display()
-            user.teaching_type = raw_user.get_rjlx_display()
-            user.cell_phone_number = raw_user.sjh
-            user.email = raw_user.yxdz if raw_user.yxdz else ''
-            user.save()
-    except Exception as exc:
-        prod_logger.exception('用户信息更新失败,职工号:%s, exception:%s',
-                              raw_user.zgh, exc)
-        raise
-    prod_logger.info('用户信息更新完毕')
+                fields['department_id'] = None
+            else:
+                fields['department_id'] = department.id
+                fields['administrative_department_id'] = (
+                    department_id_to_administrative[department.id].id)
+        except Exception as exc:
+            prod_logger.exception('用户信息更新失败,职工号:%s, exception:%s',
+                                  raw_user.zgh, exc)
+            raise
+        desired_department_ids[raw_user.zgh] = fields['department_id']
+        if user is None:
+            user = User(username=raw_user.zgh, **fields)
+            user.set_unusable_password()
+            new_users.append(user)
+            continue
+        diff = [name for name, value in fields.items()
+                if getattr(user, name) != value]
+        if not diff:
+            summary['unchanged'] += 1
+            continue
+        for name in diff:
+            setattr(user, name, fields[name])
+        summary['changed_fields'].update(diff)
+        changed_fields.update(diff)
+        changed_users.append(user)
+
+    bulk_create_with_pks(User.all_objects, new_users, ('username',))
+    if changed_users:
+        User.objects.bulk_update(
+            changed_users,
+            [name for name in TEACHER_FIELDS if name in changed_fields],
+            batch_size=500)
+    summary['created'] = len(new_users)
+    summary['updated'] = len(changed_users)
+
+    user_ids = {user.username: user.id
+                for user in itertools.chain(users.values(), new_users)}
+    department_groups = _get_department_teacher_groups()
+    current_memberships = {
+        (user_id, group_id): membership_id
+        for membership_id, user_id, group_id in UserGroup.objects.filter(
+            user_id__in=list(user_ids.values()),
+            group__name__endswith='-专任教师',
+        ).values_list('id', 'user_id', 'group_id')
+    }
+    desired_memberships = {
+        (user_ids[username], group_id)
+        for username, department_id in desired_department_ids.items()
+        for group_id in department_groups.get(department_id, ())
+    }
+    desired_memberships.update(
+        (user_ids[user.username], personal_permission_group.id)
+        for user in new_users)
+    added_memberships = [
+        UserGroup(user_id=user_id, group_id=group_id)
+        for user_id, group_id in desired_memberships.difference(
+            current_memberships)
+    ]
+    removed_membership_ids = [
+        membership_id for key, membership_id in current_memberships.items()
+        if key not in desired_memberships
+    ]
+    UserGroup.objects.bulk_create(added_memberships, batch_size=500,
+                                  ignore_conflicts=True)
+    UserGroup.objects.filter(id__in=removed_membership_ids).delete()
+    summary['groups_added'] = len(added_memberships)
+    summary['groups_removed'] = len(removed_membership_ids)
+
+    if (new_users or changed_users or summary['groups_added']
+            or summary['groups_removed']):
+        # Bulk operations don't send signals which invalidate caches.
+        transaction.on_commit(invalidate_all_caches)
+    summary['changed_fields'] = dict(summary['changed_fields'])
+    msg = f'用户信息更新完毕: {summary}'
+    prod_logger.info(msg)
+    return summary
 
 
 @shared_task
@@ -224,5 +372,5 @@ def update_teachers_and_departments_information():
         _update_from_department_information()
     )
 
-    _update_from_teacher_information(dwid_to_department,
-                                     department_id_to_administrative)
+    return _update_from_teacher_information(dwid_to_department,
+                                            department_id_to_administrative)
@@ -0,0 +1,180 @@
+'''Unit tests for JWT authentication.'''
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from model_mommy import mommy
+from rest_framework import exceptions, status
+from rest_framework.test import APIClient
+from rest_framework_jwt.settings import api_settings
+
+import infra.models
+from auth.authentication import JSONWebTokenAuthentication
+from auth.models import User
+from auth.tokens import jwt_decode_handler
+from auth.utils import assign_perm
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+def make_token(user):
+    '''Encode JWT for the user.'''
+    payload = api_settings.JWT_PAYLOAD_HANDLER(user)
+    return api_settings.JWT_ENCODE_HANDLER(payload)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestJWTDecodeHandler(TestCase):
+    '''Unit tests for jwt_decode_handler().'''
+    def setUp(self):
+        cache.clear()
+
+    def test_decode(self):
+        '''Should decode tokens with the cached user.'''
+        user = mommy.make(User)
+        token = make_token(user)
+        jwt_decode_handler(token)
+
+        with self.assertNumQueries(0):
+            payload = jwt_decode_handler(token)
+
+        self.assertEqual(payload['user_id'], user.id)
+
+    def test_missing_user(self):
+        '''Should treat tokens of missing users as invalid.'''
+        user = mommy.make(User)
+        token = make_token(user)
+        user.delete()
+
+        with self.assertRaisesMessage(Exception, '用户不存在'):
+            jwt_decode_handler(token)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestJSONWebTokenAuthentication(TestCase):
+    '''Unit tests for JSONWebTokenAuthentication.'''
+    def setUp(self):
+        cache.clear()
+        self.user = mommy.make(User)
+        self.token = make_token(self.user)
+        self.authentication = JSONWebTokenAuthentication()
+
+    def make_request(self, token, **attrs):
+        '''Build a DRF request with the token in header.'''
+        # pylint: disable=protected-access
+        django_request = SimpleNamespace(**attrs)
+        return SimpleNamespace(
+            _request=django_request, path='/api/', COOKIES={},
+            META={'HTTP_AUTHORIZATION': f'Bearer {token}'})
+
+    @patch('auth.authentication.jwt_decode_handler')
+    def test_reuse_middleware_payload(self, mocked_decode_handler):
+        '''Should reuse the payload and user of the middleware.'''
+        payload = jwt_decode_handler(self.token)
+        request = self.make_request(
+            self.token, _jwt_payload=(self.token, payload),
+            _jwt_cached_user=self.user)
+
+        with self.assertNumQueries(0):
+            user, token = self.authentication.authenticate(request)
+
+        mocked_decode_handler.assert_not_called()
+        self.assertIs(user, self.user)
+        self.assertEqual(token, self.token.encode())
+
+    def test_decode_other_token(self):
+        '''Should decode the token if the middleware decoded another.'''
+        other_user = mommy.make(User)
+        request = self.make_request(
+            self.token, _jwt_payload=(make_token(other_user), {}),
+            _jwt_cached_user=other_user)
+
+        user, _ = self.authentication.authenticate(request)
+
+        self.assertEqual(user, self.user)
+        self.assertIsNot(user, self.user)
+
+    def test_invalid_token(self):
+        '''Should fail for invalid tokens.'''
+        request = self.make_request('invalid-token')
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate(request)
+
+    def test_authenticate_credentials(self):
+        '''Should check usernames and active status.'''
+        payload = jwt_decode_handler(self.token)
+        self.assertEqual(
+            self.authentication.authenticate_credentials(payload), self.user)
+
+        for invalid_payload in ({'user_id': self.user.id},
+                                {**payload, 'username': 'someone'},
+                                {**payload, 'user_id': -1}):
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                self.authentication.authenticate_credentials(invalid_payload)
+
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        cache.clear()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authentication.authenticate_credentials(payload)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestRequestQueries(TestCase):
+    '''Count queries of authenticated requests to a typical list endpoint.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = mommy.make(User)
+        cls.user.groups.add(mommy.make(Group, name='大连理工大学-10141-管理员'))
+        assign_perm('infra.view_notification', cls.user)
+        for notification in mommy.make(infra.models.Notification,
+                                       recipient=cls.user, _quantity=3):
+            assign_perm('infra.view_notification', cls.user, notification)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {make_token(self.user)}')
+        self.num_requests = 0
+
+    def list_notifications(self):
+        '''Request a page of notifications, bypassing cached responses.'''
+        self.num_requests += 1
+        response = self.client.get(reverse('notification-list'),
+                                   {'_': self.num_requests})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        return response
+
+    def test_cold_cache(self):
+        '''Should load the user, its groups and permissions once per
+        request.'''
+        # User, groups, user and group permissions, then content type,
+        # object permissions, count and page of notifications.
+        with self.assertNumQueries(9):
+            self.list_notifications()
+
+    def test_warm_cache(self):
+        '''Should authenticate without queries once the user is cached.'''
+        self.list_notifications()
+
+        # Object permissions and the page, the count is cached as well.
+        with self.assertNumQueries(4):
+            self.list_notifications()
+
+    def test_invalidate(self):
+        '''Should load the user again after its groups change.'''
+        self.list_notifications()
+        self.user.groups.add(mommy.make(Group))
+
+        with self.assertNumQueries(9):
+            self.list_notifications()
@@ -0,0 +1,339 @@
+'''Unit tests for auth backends.'''
+from types import SimpleNamespace
+
+from django.contrib.auth.models import Group, Permission
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from guardian.core import ObjectPermissionChecker as GuardianChecker
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from model_mommy import mommy
+
+from auth.backends import (
+    DepartmentObjectPermissionBackend, ObjectPermissionChecker,
+    get_object_permission_checker, get_object_permission_condition
+)
+from auth.filters import ObjectPermissionsFilter
+from auth.models import Department, User
+from auth.services import PermissionService
+from auth.utils import assign_perm
+from training_event.models import CampusEvent, OffCampusEvent
+from training_event.services import CampusEventService
+from training_program.models import Program
+from training_program.services import ProgramService
+from training_record.models import Record
+
+
+class ObjectPermissionTestMixin:
+    '''Create departments, groups and records of a teacher.'''
+    @classmethod
+    def setUpTestData(cls):  # pylint: disable=invalid-name
+        '''Create objects shared by tests.'''
+        view_perm = Permission.objects.get(codename='view_record')
+        change_perm = Permission.objects.get(codename='change_record')
+        cls.school = mommy.make(Department, name='大连理工大学',
+                                raw_department_id='10141')
+        cls.college = mommy.make(Department, name='创新创业学院',
+                                 raw_department_id='22',
+                                 super_department=cls.school)
+        cls.other_college = mommy.make(Department, name='化工学院',
+                                       raw_department_id='33',
+                                       super_department=cls.school)
+        personal = mommy.make(Group, name='个人权限')
+        personal.permissions.add(view_perm, change_perm)
+        school_admins = mommy.make(Group, name='大连理工大学-10141-管理员')
+        school_admins.permissions.add(view_perm)
+        college_admins = mommy.make(Group, name='创新创业学院-22-管理员')
+        college_admins.permissions.add(view_perm)
+
+        cls.teacher = mommy.make(User, department=cls.college)
+        cls.other_teacher = mommy.make(User, department=cls.other_college)
+        cls.school_admin = mommy.make(User, department=cls.school)
+        cls.school_admin.groups.add(school_admins)
+        cls.college_admin = mommy.make(User, department=cls.college)
+        cls.college_admin.groups.add(college_admins)
+        cls.record = mommy.make(Record, user=cls.teacher,
+                                campus_event=mommy.make(CampusEvent))
+        cls.other_record = mommy.make(Record, user=cls.other_teacher,
+                                      off_campus_event=mommy.make(
+                                          OffCampusEvent))
+
+
+@override_settings(OBJECT_PERMISSION_RESOLVER='department')
+class TestDepartmentObjectPermissionBackend(ObjectPermissionTestMixin,
+                                            TestCase):
+    '''Unit tests for DepartmentObjectPermissionBackend.'''
+    def setUp(self):
+        self.backend = DepartmentObjectPermissionBackend()
+
+    def test_owner(self):
+        '''Should grant permissions of group 个人权限 to owners.'''
+        self.assertEqual(
+            self.backend.get_all_permissions(self.teacher, self.record),
+            {'training_record.view_record', 'training_record.change_record'})
+        self.assertFalse(self.backend.has_perm(
+            self.other_teacher, 'training_record.view_record', self.record))
+
+    def test_department_groups(self):
+        '''Should grant permissions of groups of super departments.'''
+        for user in (self.college_admin, self.school_admin):
+            self.assertEqual(
+                self.backend.get_all_permissions(user, self.record),
+                {'training_record.view_record'})
+        self.assertTrue(self.backend.has_perm(
+            self.school_admin, 'training_record.view_record',
+            self.other_record))
+        self.assertFalse(self.backend.has_perm(
+            self.college_admin, 'training_record.view_record',
+            self.other_record))
+
+    def test_user_has_perm(self):
+        '''Should be used by User.has_perm().'''
+        self.assertTrue(self.teacher.has_perm('training_record.change_record',
+                                              self.record))
+        self.assertFalse(self.college_admin.has_perm(
+            'training_record.change_record', self.record))
+
+    def test_unsupported(self):
+        '''Should grant nothing for models without rules or global perms.'''
+        self.assertEqual(self.backend.get_all_permissions(self.teacher), set())
+        self.assertEqual(self.backend.get_all_permissions(
+            self.school_admin, self.college), set())
+        inactive_teacher = User.objects.get(pk=self.teacher.pk)
+        inactive_teacher.is_active = False
+        self.assertEqual(self.backend.get_all_permissions(
+            inactive_teacher, self.record), set())
+
+    @override_settings(OBJECT_PERMISSION_RESOLVER='guardian')
+    def test_guardian_resolver(self):
+        '''Should grant nothing unless the department resolver is used.'''
+        self.assertEqual(
+            self.backend.get_all_permissions(self.teacher, self.record), set())
+
+    def test_get_object_permission_condition(self):
+        '''Should match objects of owners and granted departments.'''
+        condition = get_object_permission_condition(
+            mommy.make(User), 'training_record.change_record', Record)
+        self.assertFalse(Record.objects.filter(condition).exists())
+        self.assertIsNone(get_object_permission_condition(
+            mommy.make(User), 'training_record.review_record', Record))
+        self.assertIsNone(get_object_permission_condition(
+            self.teacher, 'auth.view_department', Department))
+
+        condition = get_object_permission_condition(
+            self.college_admin, 'training_record.view_record', Record)
+
+        self.assertEqual(list(Record.objects.filter(condition)),
+                         [self.record])
+
+
+@override_settings(OBJECT_PERMISSION_RESOLVER='department')
+class TestObjectPermissionsFilter(ObjectPermissionTestMixin, TestCase):
+    '''Unit tests for ObjectPermissionsFilter.'''
+    def filter_records(self, user):
+        '''Return ids of records the user can view.'''
+        queryset = ObjectPermissionsFilter().filter_queryset(
+            SimpleNamespace(user=user), Record.objects.all(), None)
+        return set(queryset.values_list('id', flat=True))
+
+    def test_filter_queryset(self):
+        '''Should include derived and explicit permissions.'''
+        assign_perm('training_record.view_record', self.college_admin,
+                    self.other_record)
+
+        self.assertEqual(self.filter_records(self.teacher), {self.record.id})
+        self.assertEqual(self.filter_records(self.college_admin),
+                         {self.record.id, self.other_record.id})
+        self.assertEqual(self.filter_records(self.school_admin),
+                         {self.record.id, self.other_record.id})
+        self.assertEqual(self.filter_records(mommy.make(User)), set())
+
+    @override_settings(OBJECT_PERMISSION_RESOLVER='guardian')
+    def test_filter_queryset_guardian(self):
+        '''Should only use guardian rows with the guardian resolver.'''
+        PermissionService.assign_object_permissions(self.teacher, self.record)
+
+        self.assertEqual(self.filter_records(self.college_admin),
+                         {self.record.id})
+        self.assertEqual(self.filter_records(self.other_teacher), set())
+
+
+class TestDerivedObjectPermissions(ObjectPermissionTestMixin, TestCase):
+    '''Unit tests for migrating to derived object permissions.'''
+    @staticmethod
+    def count_rows():
+        '''Return the number of guardian rows.'''
+        return (UserObjectPermission.objects.count()
+                + GroupObjectPermission.objects.count())
+
+    def test_assign_skips_derived(self):
+        '''Should not store permissions which can be derived.'''
+        with self.settings(OBJECT_PERMISSION_RESOLVER='department'):
+            count = PermissionService.assign_object_permissions(
+                self.teacher, self.record)
+            # Created by someone else, so the creator's rows are kept.
+            PermissionService.assign_object_permissions(
+                self.other_teacher, self.record)
+
+        self.assertIsNone(count)
+        self.assertEqual(set(UserObjectPermission.objects.values_list(
+            'user_id', flat=True)), {self.other_teacher.id})
+        self.assertEqual(GroupObjectPermission.objects.count(), 0)
+        self.assertTrue(self.other_teacher.has_perm(
+            'training_record.view_record', self.record))
+
+    def test_prune_and_restore(self):
+        '''Should prune derivable rows and keep exceptions.'''
+        PermissionService.assign_object_permissions(self.teacher, self.record)
+        PermissionService.assign_object_permissions(
+            self.other_teacher, self.other_record)
+        num_rows = self.count_rows()
+        assign_perm('training_record.view_record', self.college_admin,
+                    self.other_record)
+
+        count = PermissionService.prune_derived_object_permissions(
+            Record, dry_run=True)
+        self.assertEqual(count, num_rows)
+        self.assertEqual(self.count_rows(), num_rows + 1)
+
+        PermissionService.prune_derived_object_permissions(
+            Record, batch_size=1)
+        self.assertEqual(self.count_rows(), 1)
+
+        count = PermissionService.restore_derived_object_permissions(Record)
+        self.assertEqual(count, num_rows)
+        self.assertEqual(self.count_rows(), num_rows + 1)
+        self.assertTrue(self.school_admin.has_perm(
+            'training_record.view_record', self.other_record))
+
+    def test_program_and_event_rules(self):
+        '''Should derive the same permissions as guardian rows of programs
+        and events created by a user of another department.'''
+        perms = Permission.objects.filter(
+            codename__in=('change_program', 'change_campusevent'))
+        other_admin = mommy.make(User, department=self.other_college)
+        other_admin.groups.add(mommy.make(Group, name='化工学院-33-管理员'))
+        for group in Group.objects.filter(name__endswith='-管理员'):
+            group.permissions.add(*perms)
+        request = SimpleNamespace(user=self.other_teacher)
+        program = ProgramService.create_program(
+            {'name': '项目', 'department': self.college,
+             'category': Program.PROGRAM_CATEGORY_TRAINING},
+            context={'request': request})
+        event = CampusEventService.create_campus_event(
+            {'name': '活动', 'time': now(), 'location': '大连',
+             'num_hours': 1, 'num_participants': 10, 'program': program,
+             'deadline': now()}, [], context={'request': request})
+        backend = DepartmentObjectPermissionBackend()
+
+        for obj in (program, event):
+            for user in (self.college_admin, self.school_admin, other_admin):
+                stored = {
+                    f'{obj._meta.app_label}.{codename}' for codename in
+                    GuardianChecker(user).get_perms(obj)
+                }
+                with self.settings(OBJECT_PERMISSION_RESOLVER='department'):
+                    derived = backend.get_all_permissions(user, obj)
+                self.assertEqual(stored, derived)
+            self.assertTrue(self.college_admin.has_perm(
+                f'{obj._meta.app_label}.change_{obj._meta.model_name}', obj))
+
+    @override_settings(OBJECT_PERMISSION_RESOLVER='guardian')
+    def test_program_and_event_guardian_grants(self):
+        '''Should grant groups of the department of the program, instead of
+        the creator's department, permissions of programs and events.'''
+        perms = Permission.objects.filter(
+            codename__in=('change_program', 'change_campusevent'))
+        other_admins = mommy.make(Group, name='化工学院-33-管理员')
+        for group in Group.objects.filter(name__endswith='-管理员'):
+            group.permissions.add(*perms)
+        request = SimpleNamespace(user=self.other_teacher)
+        program = ProgramService.create_program(
+            {'name': '项目', 'department': self.college,
+             'category': Program.PROGRAM_CATEGORY_TRAINING},
+            context={'request': request})
+        event = CampusEventService.create_campus_event(
+            {'name': '活动', 'time': now(), 'location': '大连',
+             'num_hours': 1, 'num_participants': 10, 'program': program,
+             'deadline': now()}, [], context={'request': request})
+
+        for obj in (program, event):
+            granted_groups = set(
+                GroupObjectPermission.objects
+                .filter(object_pk=str(obj.pk),
+                        permission__content_type__model=obj._meta.model_name)
+                .values_list('group__name', flat=True)
+            )
+            self.assertEqual(granted_groups,
+                             {'创新创业学院-22-管理员', '大连理工大学-10141-管理员'})
+            self.assertNotIn(other_admins.name, granted_groups)
+
+
+class TestObjectPermissionChecker(ObjectPermissionTestMixin, TestCase):
+    '''Unit tests for ObjectPermissionChecker.'''
+    def test_prefetch_perms(self):
+        '''Should check prefetched objects without queries.'''
+        records = [self.record, self.other_record]
+        PermissionService.assign_object_permissions(self.teacher, self.record)
+        checker = ObjectPermissionChecker(
+            User.objects.get(pk=self.college_admin.pk))
+
+        # User and group rows, then group names of the user.
+        with self.assertNumQueries(3):
+            checker.prefetch_perms(records)
+        with self.assertNumQueries(0):
+            self.assertTrue(checker.has_perm('training_record.view_record',
+                                             self.record))
+            self.assertFalse(checker.has_perms(
+                ['training_record.view_record',
+                 'training_record.change_record'], self.record))
+            self.assertFalse(checker.has_perm('view_record',
+                                              self.other_record))
+            self.assertFalse(checker.has_perm('auth.view_record',
+                                              self.record))
+            self.assertFalse(checker.user.is_school_admin)
+
+    def test_not_prefetched(self):
+        '''Should query permissions of objects not prefetched.'''
+        assign_perm('training_record.view_record', self.teacher,
+                    self.other_record)
+        checker = ObjectPermissionChecker(self.teacher)
+        checker.prefetch_perms([self.record])
+
+        self.assertTrue(checker.has_perm('training_record.view_record',
+                                         self.other_record))
+
+    def test_superuser_and_inactive(self):
+        '''Should grant everything to superusers and nothing to inactive
+        users.'''
+        superuser = mommy.make(User, is_superuser=True)
+        inactive_user = mommy.make(User, is_superuser=True, is_active=False)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(ObjectPermissionChecker(superuser).has_perm(
+                'training_record.review_record', self.record))
+            self.assertFalse(ObjectPermissionChecker(inactive_user).has_perm(
+                'training_record.view_record', self.record))
+
+    @override_settings(OBJECT_PERMISSION_RESOLVER='department')
+    def test_department_resolver(self):
+        '''Should include permissions derived from departments.'''
+        checker = ObjectPermissionChecker(self.teacher)
+        checker.prefetch_perms([self.record, self.other_record])
+
+        self.assertTrue(checker.has_perm('training_record.change_record',
+                                         self.record))
+        self.assertFalse(checker.has_perm('training_record.view_record',
+                                          self.other_record))
+
+    def test_get_object_permission_checker(self):
+        '''Should share the checker between wrappers of a request.'''
+        http_request = SimpleNamespace(user=self.teacher)
+        request = SimpleNamespace(_request=http_request, user=self.teacher)
+
+        checker = get_object_permission_checker(request)
+
+        self.assertIs(get_object_permission_checker(http_request), checker)
+        self.assertIs(checker.user, self.teacher)
+        http_request.user = request.user = self.college_admin
+        self.assertIs(get_object_permission_checker(request).user,
+                      self.college_admin)
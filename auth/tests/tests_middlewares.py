@@ -98,6 +98,8 @@ class TestJWTAuthenticationMiddleware(TestCase):
 
         self.assertIsInstance(request.user, User)
         self.assertEqual(request.user.pk, user.pk)
+        self.assertEqual(request._jwt_payload,
+                         (None, mocked_decode_handler.return_value))
 
     def test_get_user_with_jwt_cached_user_set(self):
         '''Should return request._jwt_cached_user if set.'''
@@ -65,6 +65,23 @@ class TestUser(TestCase):
         self.assertTrue(user.check_department_admin(department1))
         self.assertFalse(user.check_department_admin(department2))
 
+    def test_loaded_group_names(self):
+        '''Should resolve roles by loaded names of groups.'''
+        department = mommy.make(Department, raw_department_id='11',
+                                name="创新创业学院")
+        user = mommy.make(auth.models.User)
+        user.groups.add(mommy.make(Group, name="创新创业学院-11-管理员"),
+                        mommy.make(Group, name="创新创业学院-11-专任教师"))
+
+        self.assertEqual(user.load_group_names(), {
+            "创新创业学院-11-管理员", "创新创业学院-11-专任教师"})
+
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_teacher)
+            self.assertTrue(user.is_department_admin)
+            self.assertFalse(user.is_school_admin)
+            self.assertTrue(user.check_department_admin(department))
+
 
 class TestDepartment(TestCase):
     '''Unit tests for model Department.'''
@@ -76,6 +93,51 @@ class TestDepartment(TestCase):
 
         self.assertEqual(str(department), name)
 
+    def test_path(self):
+        '''Should keep paths of departments and sub departments.'''
+        school = mommy.make(Department)
+        campus = mommy.make(Department, super_department=school)
+        college = mommy.make(Department, super_department=campus)
+        team = mommy.make(Department, super_department=college)
+
+        self.assertEqual(team.path,
+                         f'{school.id}/{campus.id}/{college.id}/{team.id}/')
+        self.assertEqual(team.ancestor_ids,
+                         [school.id, campus.id, college.id, team.id])
+
+        college.super_department = school
+        college.save()
+
+        team.refresh_from_db()
+        self.assertEqual(team.path, f'{school.id}/{college.id}/{team.id}/')
+        self.assertEqual(set(school.get_descendants()),
+                         {school, campus, college, team})
+        self.assertEqual(set(campus.get_descendants()), {campus})
+        self.assertEqual(set(team.get_ancestors()), {school, college, team})
+
+    def test_path_missing(self):
+        '''Should only include the department itself without path.'''
+        department = mommy.make(Department)
+        Department.objects.filter(id=department.id).update(path='')
+        department.refresh_from_db()
+
+        self.assertEqual(department.ancestor_ids, [department.id])
+        self.assertEqual(list(department.get_descendants()), [department])
+
+    def test_administrative_department_id(self):
+        '''Should return the department under campus.'''
+        school = mommy.make(Department)
+        campus = mommy.make(Department, super_department=school)
+        college = mommy.make(Department, super_department=campus)
+        team = mommy.make(Department, super_department=college)
+        office = mommy.make(Department, super_department=school)
+
+        self.assertEqual(school.administrative_department_id, school.id)
+        self.assertEqual(campus.administrative_department_id, campus.id)
+        self.assertEqual(office.administrative_department_id, office.id)
+        self.assertEqual(college.administrative_department_id, college.id)
+        self.assertEqual(team.administrative_department_id, college.id)
+
 
 class TestUserGroup(TestCase):
     '''Unit tests for model UserGroup.'''
@@ -229,6 +229,13 @@ class TestDjangoObjectPermissions(TestCase):
         model_cls._meta.model_name = 'FakeModel'
         cls.model_cls = model_cls
 
+    def setUp(self):
+        # Let mocked users stand for their object permission checkers.
+        patcher = patch('auth.permissions.get_object_permission_checker',
+                        side_effect=lambda request: request.user)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch('auth.permissions.DjangoObjectPermissions.get_required_permissions')
     def test_get_required_object_permission(self, mocked_get):
         '''Should call `get_required_permissions`.'''
@@ -1,13 +1,16 @@
 '''Unit tests for auth services.'''
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission, Group
+from django.contrib.contenttypes.models import ContentType
+from guardian.models import GroupObjectPermission, UserObjectPermission
 from model_mommy import mommy
 
 import auth.services as services
-from auth.models import Department
+from auth.models import Department, GroupPermission, UserGroup
 from training_event.models import CampusEvent
 
 User = get_user_model()
@@ -27,37 +30,6 @@ class TestPermissionService(TestCase):
         cls.object_fake = mommy.make(Department)
         cls.perms = Permission.objects.filter(codename__in=PERMINSSION_MAP)
 
-    def test_assign_group_permissions_user(self):
-        '''Should True if user has permissions of the related project.'''
-        user = mommy.make(User)
-        group = mommy.make(Group, name="个人权限")
-        group.permissions.add(*(perm for perm in self.perms))
-
-        # pylint: disable=W0212
-        self.permissionService._assign_group_permissions(
-            group, user, self.object)
-
-        for perms in PERMINSSION_MAP:
-            self.assertTrue(user.has_perm(perms, self.object))
-        self.assertFalse(user.has_perm('add_record', self.object))
-        self.assertFalse(user.has_perm('add_campusevent', self.object_fake))
-
-    def test_assign_group_permissions_group(self):
-        '''Should True if user has permissions of the related project.'''
-        user = mommy.make(User)
-        group = mommy.make(Group, name="创新创业学院-管理员")
-        user.groups.add(group)
-        group.permissions.add(*(perm for perm in self.perms))
-
-        # pylint: disable=W0212
-        self.permissionService._assign_group_permissions(
-            group, group, self.object)
-
-        for perms in PERMINSSION_MAP:
-            self.assertTrue(user.has_perm(perms, self.object))
-        self.assertFalse(user.has_perm('add_record', self.object))
-        self.assertFalse(user.has_perm('add_campusevent', self.object_fake))
-
     def test_assign_object_permissions(self):
         '''Should True if user has permissions of the related project.'''
         department_school = mommy.make(
@@ -101,9 +73,193 @@ class TestPermissionService(TestCase):
         self.assertFalse(
             user_school.has_perm('add_campusevent', self.object_fake))
 
+    # pylint: disable=too-many-locals
+    def test_bulk_assign_object_permissions(self):
+        '''Should assign the same permissions as one by one.'''
+        department_school = mommy.make(
+            Department, name="大连理工大学", raw_department_id='10141')
+        department_admin = mommy.make(
+            Department, name="创新创业学院",
+            raw_department_id='22',
+            super_department=department_school)
+        users = mommy.make(User, department=department_admin, _quantity=2)
+        user_without_department = mommy.make(User)
+        group = mommy.make(Group, name="个人权限")
+        group_school = mommy.make(Group, name="大连理工大学-10141-管理员")
+        group_admin = mommy.make(Group, name="创新创业学院-22-管理员")
+        for target in (group, group_admin, group_school):
+            target.permissions.add(*(perm for perm in self.perms))
+        objects = mommy.make(CampusEvent, _quantity=3)
+        pairs = list(zip(users + [user_without_department], objects))
+        ContentType.objects.get_for_model(CampusEvent)
+
+        # Departments, groups, permissions, savepoint and inserts,
+        # regardless of the number of objects and levels of departments.
+        with self.assertNumQueries(7):
+            count = self.permissionService.bulk_assign_object_permissions(
+                pairs)
+
+        self.assertEqual(count, len(self.perms) * 7)
+        for user, obj in pairs:
+            for perms in PERMINSSION_MAP:
+                self.assertTrue(user.has_perm(perms, obj))
+            self.assertFalse(user.has_perm(PERMINSSION_MAP[0], self.object))
+        expected = {
+            (group_id, obj.id)
+            for group_id in (group_admin.id, group_school.id)
+            for obj in objects[:2]
+        }
+        self.assertEqual(set(
+            GroupObjectPermission.objects
+            .values_list('group_id', 'object_pk').distinct()
+        ), {(group_id, str(obj_id)) for group_id, obj_id in expected})
+
+    def test_bulk_assign_object_permissions_existing(self):
+        '''Should skip permissions which have been assigned.'''
+        user = mommy.make(User)
+        group = mommy.make(Group, name="个人权限")
+        group.permissions.add(*(perm for perm in self.perms))
+        self.permissionService.assign_object_permissions(user, self.object)
+
+        self.permissionService.bulk_assign_object_permissions(
+            [(user, self.object)])
+
+        self.assertEqual(UserObjectPermission.objects.filter(
+            user=user).count(), len(self.perms))
+
+    def test_bulk_assign_object_permissions_empty(self):
+        '''Should do nothing if no objects.'''
+        with self.assertNumQueries(0):
+            count = self.permissionService.bulk_assign_object_permissions([])
+
+        self.assertEqual(count, 0)
+
+    def test_get_permission_map(self):
+        '''Should map departments to groups of them and super departments.'''
+        department_school = mommy.make(
+            Department, name="大连理工大学", raw_department_id='10141')
+        department_admin = mommy.make(
+            Department, name="创新创业学院",
+            raw_department_id='22',
+            super_department=department_school)
+        group = mommy.make(Group, name="个人权限")
+        group_school = mommy.make(Group, name="大连理工大学-10141-管理员")
+        group_admin = mommy.make(Group, name="创新创业学院-22-管理员")
+        group_similar = mommy.make(Group, name="创新创业学院-221-管理员")
+        group_admin.permissions.add(self.perms[0])
+
+        permission_map = self.permissionService.get_permission_map()
+
+        self.assertEqual(permission_map['personal_group_id'], group.id)
+        department_groups = permission_map['department_groups']
+        self.assertEqual(department_groups[department_school.id],
+                         [group_school.id])
+        self.assertEqual(department_groups[department_admin.id],
+                         [group_admin.id, group_school.id])
+        self.assertNotIn(group_similar.id,
+                         department_groups[department_admin.id])
+        self.assertEqual(permission_map['group_perms'], {
+            (group_admin.id, self.perms[0].content_type_id):
+                [self.perms[0].id],
+        })
+
+    def test_assign_object_permissions_no_personal_group(self):
+        '''Should raise exception if group 个人权限 doesn't exist.'''
+        with self.assertRaises(Group.DoesNotExist):
+            self.permissionService.assign_object_permissions(
+                mommy.make(User), self.object)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestPermissionMapCache(TestCase):
+    '''Unit tests for caching permission map.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = mommy.make(
+            Department, name="创新创业学院", raw_department_id='22')
+        cls.group = mommy.make(Group, name="个人权限")
+        cls.group_admin = mommy.make(Group, name="创新创业学院-22-管理员")
+        cls.perm = Permission.objects.get(codename='view_campusevent')
+        cls.group.permissions.add(cls.perm)
+        cls.user = mommy.make(User, department=cls.department)
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_assign_object_permissions_cached(self):
+        '''Should only write permissions once the map is cached.'''
+        ContentType.objects.get_for_model(CampusEvent)
+        objects = mommy.make(CampusEvent, _quantity=2)
+        services.PermissionService.assign_object_permissions(
+            self.user, objects[0])
+
+        # Savepoints and the insert only.
+        with self.assertNumQueries(5):
+            services.PermissionService.assign_object_permissions(
+                self.user, objects[1])
+
+        self.assertTrue(self.user.has_perm('view_campusevent', objects[1]))
+
+    def test_invalidated_by_group_permissions(self):
+        '''Should rebuild the map if permissions of groups change.'''
+        services.PermissionService.get_permission_map()
+
+        self.group_admin.permissions.add(self.perm)
+
+        permission_map = services.PermissionService.get_permission_map()
+        self.assertIn((self.group_admin.id, self.perm.content_type_id),
+                      permission_map['group_perms'])
+
+        GroupPermission.objects.filter(group=self.group_admin).delete()
+
+        permission_map = services.PermissionService.get_permission_map()
+        self.assertNotIn((self.group_admin.id, self.perm.content_type_id),
+                         permission_map['group_perms'])
+
+    def test_invalidated_by_groups(self):
+        '''Should rebuild the map if groups change.'''
+        services.PermissionService.get_permission_map()
+
+        group = mommy.make(Group, name="创新创业学院-22-专任教师")
+
+        permission_map = services.PermissionService.get_permission_map()
+        self.assertIn(group.id,
+                      permission_map['department_groups'][self.department.id])
+
+    def test_invalidated_by_departments(self):
+        '''Should rebuild the map if departments change.'''
+        department = mommy.make(
+            Department, name="大连理工大学", raw_department_id='10141')
+        services.PermissionService.get_permission_map()
+
+        self.department.super_department = department
+        self.department.save()
+
+        permission_map = services.PermissionService.get_permission_map()
+        self.assertIn(department.id, permission_map['department_groups'])
+
 
 class TestDepartmentService(TestCase):
     '''Unit tests for DepartmentService.'''
+    def test_rebuild_department_paths(self):
+        '''Should rebuild paths of departments changed in bulk.'''
+        school = mommy.make(Department)
+        college = mommy.make(Department, super_department=school)
+        Department.objects.filter(id=college.id).update(path='')
+
+        count = services.DepartmentService.rebuild_department_paths()
+
+        college.refresh_from_db()
+        self.assertEqual(count, 1)
+        self.assertEqual(college.path, f'{school.id}/{college.id}/')
+        self.assertEqual(
+            services.DepartmentService.rebuild_department_paths(), 0)
+
     def test_get_top_level_departments(self):
         '''Should return top level departments'''
         depart1 = mommy.make(Department, name='大连理工大学')
@@ -143,8 +299,11 @@ class TestGroupService(TestCase):
         group3 = mommy.make(Group, name="电子信息与电气工程学部-22-管理员")
         group4 = mommy.make(Group, name="创新创业学院-33-管理员")
 
-        queryset = services.GroupService.get_all_groups_by_department_id(
-            depart1.id)
+        # The department, its sub departments and groups, whatever the depth.
+        with self.assertNumQueries(3):
+            queryset = services.GroupService.get_all_groups_by_department_id(
+                depart1.id)
+            list(queryset)
 
         self.assertTrue(queryset.filter(id=group1.id).exists())
         self.assertTrue(queryset.filter(id=group2.id).exists())
@@ -189,3 +348,77 @@ class TestUserService(TestCase):
         cnt = services.UserService.get_full_time_teachers().count()
 
         self.assertEqual(cnt, num_users)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+class TestUserPrincipalCache(TestCase):
+    '''Unit tests for caching user principals.'''
+    def setUp(self):
+        cache.clear()
+        self.user = mommy.make(User)
+        self.group = mommy.make(Group, name='大连理工大学-10141-管理员')
+        self.group.permissions.add(
+            Permission.objects.get(codename='view_campusevent'))
+
+    def tearDown(self):
+        cache.clear()
+
+    def assert_cached(self, cached=True):
+        '''Load the principal and check whether it was cached.'''
+        with self.assertNumQueries(0 if cached else 4):
+            return services.UserService.get_principal(self.user.id)
+
+    def test_get_principal(self):
+        '''Should cache the user with its roles and model permissions.'''
+        self.user.groups.add(self.group)
+        self.assert_cached(False)
+
+        user = self.assert_cached()
+
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_school_admin)
+            self.assertFalse(user.is_teacher)
+            self.assertTrue(user.has_perm('training_event.view_campusevent'))
+        with self.assertRaises(User.DoesNotExist):
+            services.UserService.get_principal(-1)
+
+    def test_invalidate_user(self):
+        '''Should drop the cached user if it is changed.'''
+        self.assert_cached(False)
+        self.user.first_name = 'new name'
+        self.user.save()
+
+        self.assertEqual(self.assert_cached(False).first_name, 'new name')
+
+    def test_invalidate_memberships(self):
+        '''Should drop cached users if their groups change.'''
+        self.assert_cached(False)
+        self.user.groups.add(self.group)
+        self.assertTrue(self.assert_cached(False).is_school_admin)
+
+        self.group.user_set.remove(self.user)
+        self.assertFalse(self.assert_cached(False).is_school_admin)
+
+        UserGroup.objects.create(user=self.user, group=self.group)
+        self.assertTrue(self.assert_cached(False).is_school_admin)
+
+        self.group.user_set.clear()
+        self.assertFalse(self.assert_cached(False).is_school_admin)
+
+    def test_invalidate_groups(self):
+        '''Should drop all cached users if groups or their permissions
+        change.'''
+        self.user.groups.add(self.group)
+        self.assert_cached(False)
+        self.group.permissions.clear()
+        self.assertFalse(self.assert_cached(False).has_perm(
+            'training_event.view_campusevent'))
+
+        self.group.name = '创新创业学院-22-管理员'
+        self.group.save()
+
+        user = self.assert_cached(False)
+        self.assertFalse(user.is_school_admin)
+        self.assertTrue(user.is_department_admin)
@@ -52,29 +52,29 @@ class TestUpdateTeachersAndDepartmentsInformation(TestCase):
             dwid_to_department, department_id_to_administrative)
         mocked_prod_logger.exception.assert_not_called()
 
-    @patch('auth.tasks.Group.objects.get_or_create')
+    @patch('auth.tasks._get_super_department')
     @patch('auth.tasks.prod_logger')
     @patch('auth.models.DepartmentInformation.save', models.Model.save)
     def test_logging_if_department_update_failed(
-            self, mocked_prod_logger, mocked_get_or_create):
+            self, mocked_prod_logger, mocked_get_super_department):
         '''Should call update functions.'''
         depart = DepartmentInformation.objects.create(dwid='123', dwmc='123')
         exc = Exception('Oops')
-        mocked_get_or_create.side_effect = exc
+        mocked_get_super_department.side_effect = exc
         with self.assertRaises(Exception):
             _update_from_department_information()
 
         mocked_prod_logger.exception.assert_called_with(
             '部门信息更新失败,单位号:%s, excepiton:%s', depart.dwid, exc)
 
-    @patch('auth.tasks.User.all_objects.get_or_create')
+    @patch('auth.tasks._get_teacher_fields')
     @patch('auth.tasks.prod_logger')
     @patch('auth.models.TeacherInformation.save', models.Model.save)
     def test_logging_if_teacher_update_failed(
-            self, mocked_prod_logger, mocked_get_or_create):
+            self, mocked_prod_logger, mocked_get_teacher_fields):
         '''Should call update functions.'''
         exc = Exception('Oops')
-        mocked_get_or_create.side_effect = exc
+        mocked_get_teacher_fields.side_effect = exc
         user = TeacherInformation.objects.create(zgh='123')
         departments = [mommy.make(
             Department, raw_department_id=idx,
@@ -116,6 +116,31 @@ class TestUpdateTeachersAndDepartmentsInformation(TestCase):
                 continue
             self.assertEqual(info.dwmc, department.name)
             self.assertEqual(info.dwid, department.raw_department_id)
+            self.assertEqual(department_id_to_administrative[department.id],
+                             department)
+
+    @patch('auth.models.DepartmentInformation.save',
+           models.Model.save)
+    @patch('auth.tasks.prod_logger')
+    def test_update_department_tree(self, _):
+        '''Should update paths and administrative departments.'''
+        mommy.make(DepartmentInformation, dwid='1', dwmc='校区', lsdw='')
+        mommy.make(DepartmentInformation, dwid='2', dwmc='学院', lsdw='1')
+        mommy.make(DepartmentInformation, dwid='3', dwmc='系', lsdw='2')
+
+        dwid_to_department, department_id_to_administrative = (
+            _update_from_department_information()
+        )
+
+        campus, college, team = (dwid_to_department[dwid]
+                                 for dwid in ('1', '2', '3'))
+        self.assertEqual(
+            team.path, f'{self.dlut.id}/{campus.id}/{college.id}/{team.id}/')
+        self.assertEqual(department_id_to_administrative, {
+            campus.id: campus,
+            college.id: college,
+            team.id: college,
+        })
 
     @patch('auth.models.TeacherInformation.save',
            models.Model.save)
@@ -187,3 +212,244 @@ class TestUpdateTeachersAndDepartmentsInformation(TestCase):
             self.assertEqual(user.technical_title,
                              raw_user.get_zyjszc_display())
             self.assertEqual(user.teaching_type, raw_user.get_rjlx_display())
+
+
+@patch('auth.models.DepartmentInformation.save', models.Model.save)
+@patch('auth.tasks.prod_logger')
+class TestSyncDepartmentInformation(TestCase):
+    '''Unit tests for syncing departments from DepartmentInformation.'''
+    def setUp(self):
+        patcher = patch('auth.tasks.transaction.on_commit')
+        self.mocked_on_commit = patcher.start()
+        self.addCleanup(patcher.stop)
+        with patch('auth.models.DepartmentInformation.save',
+                   models.Model.save):
+            mommy.make(DepartmentInformation, dwid='1', dwmc='学院一',
+                       lsdw='', dwlx=Department.DEPARTMENT_TYPE_T3)
+            mommy.make(DepartmentInformation, dwid='2', dwmc='学院二',
+                       lsdw='', dwlx=Department.DEPARTMENT_TYPE_T3)
+            mommy.make(DepartmentInformation, dwid='3', dwmc='系', lsdw='1',
+                       dwlx=Department.DEPARTMENT_TYPE_T4)
+
+    def sync(self):
+        '''Run the sync and return departments by raw department id.'''
+        self.mocked_on_commit.reset_mock()
+        dwid_to_department, _ = _update_from_department_information()
+        return dwid_to_department
+
+    def test_create(self, _):
+        '''Should create departments, groups and model permissions.'''
+        dwid_to_department = self.sync()
+
+        team = Department.objects.get(raw_department_id='3')
+        self.assertEqual(team, dwid_to_department['3'])
+        self.assertEqual(team.name, '系')
+        self.assertEqual(team.department_type, Department.DEPARTMENT_TYPE_T4)
+        self.assertEqual(team.super_department.raw_department_id, '1')
+        self.assertEqual(team.path, dwid_to_department['3'].path)
+        self.assertEqual(Group.objects.filter(
+            name__startswith='系-3-').count(), 2)
+        self.assertTrue(Group.objects.get(
+            name='学院一-1-管理员').permissions.exists())
+        self.assertTrue(Group.objects.filter(
+            name='大连理工大学-10141-专任教师').exists())
+        self.mocked_on_commit.assert_called()
+
+    def test_unchanged(self, _):
+        '''Should only read if nothing changes.'''
+        self.sync()
+
+        with self.assertNumQueries(4):
+            self.sync()
+
+        self.mocked_on_commit.assert_not_called()
+
+    def test_changes(self, _):
+        '''Should move, rename and retype departments in bulk.'''
+        self.sync()
+        DepartmentInformation.objects.filter(dwid='3').update(
+            lsdw='2', dwmc='新系', dwlx=Department.DEPARTMENT_TYPE_T8)
+
+        # Load rows, update groups and departments.
+        with self.assertNumQueries(6):
+            dwid_to_department = self.sync()
+
+        team = Department.objects.get(raw_department_id='3')
+        self.assertEqual(team.name, '新系')
+        self.assertEqual(team.department_type, Department.DEPARTMENT_TYPE_T8)
+        self.assertEqual(team.super_department, dwid_to_department['2'])
+        self.assertEqual(team.path, dwid_to_department['3'].path)
+        self.assertTrue(team.path.endswith(
+            f'/{dwid_to_department["2"].id}/{team.id}/'))
+        self.assertEqual(set(Group.objects.filter(
+            name__contains='系-3-').values_list('name', flat=True)),
+                         {'新系-3-管理员', '新系-3-专任教师'})
+        self.mocked_on_commit.assert_called()
+
+    def test_administrative_departments(self, _):
+        '''Should resolve administrative departments by paths.'''
+        mommy.make(DepartmentInformation, dwid='4', dwmc='组', lsdw='3')
+
+        _, department_id_to_administrative = (
+            _update_from_department_information())
+
+        college = Department.objects.get(raw_department_id='1')
+        self.assertEqual({
+            department_id: department.raw_department_id
+            for department_id, department
+            in department_id_to_administrative.items()
+        }, {
+            college.id: '1',
+            Department.objects.get(raw_department_id='2').id: '2',
+            Department.objects.get(raw_department_id='3').id: '3',
+            Department.objects.get(raw_department_id='4').id: '3',
+        })
+
+    def test_missing_super_department(self, mocked_prod_logger):
+        '''Should put departments under DLUT if super departments are
+        missing.'''
+        mommy.make(DepartmentInformation, dwid='4', dwmc='组', lsdw='404')
+
+        dwid_to_department = self.sync()
+
+        self.assertEqual(
+            dwid_to_department['4'].super_department.raw_department_id,
+            '10141')
+        mocked_prod_logger.warning.assert_called_with(
+            '单位4的隶属单位404不存在, 将其隶属于大连理工大学')
+
+
+@patch('auth.models.TeacherInformation.save', models.Model.save)
+@patch('auth.tasks.prod_logger')
+class TestSyncTeacherInformation(TestCase):
+    '''Unit tests for syncing users from TeacherInformation in bulk.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.dlut = Department.objects.create(raw_department_id='10141',
+                                             name='大连理工大学')
+        cls.college = Department.objects.create(
+            raw_department_id='1', name='学院一', super_department=cls.dlut)
+        cls.other_college = Department.objects.create(
+            raw_department_id='2', name='学院二', super_department=cls.dlut)
+        cls.groups = {
+            department.id: Group.objects.create(
+                name=(f'{department.name}-{department.raw_department_id}'
+                      '-专任教师'))
+            for department in (cls.dlut, cls.college, cls.other_college)
+        }
+        cls.dwid_to_department = {
+            '1': cls.college,
+            '2': cls.other_college,
+        }
+        cls.department_id_to_administrative = {
+            cls.college.id: cls.college,
+            cls.other_college.id: cls.other_college,
+        }
+
+    def setUp(self):
+        patcher = patch('auth.tasks.transaction.on_commit')
+        self.mocked_on_commit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sync(self):
+        '''Run the sync with prepared departments.'''
+        self.mocked_on_commit.reset_mock()
+        return _update_from_teacher_information(
+            self.dwid_to_department, self.department_id_to_administrative)
+
+    def make_teachers(self, num, **kwargs):
+        '''Create rows of TeacherInformation.'''
+        return [mommy.make(TeacherInformation, zgh=f'3{idx:03d}',
+                           jsxm=f'name{idx}', csrq='1980-01-01', xb='1',
+                           rxsj='2019-12-01', rzzt='11', xl='14',
+                           zyjszc='061', rjlx='12', sjh='138', **kwargs)
+                for idx in range(num)]
+
+    def test_create(self, _):
+        '''Should create users with their groups.'''
+        self.make_teachers(3, xy='1')
+
+        summary = self.sync()
+
+        self.assertEqual(summary['created'], 3)
+        self.assertEqual(summary['groups_added'], 9)
+        self.mocked_on_commit.assert_called()
+        user = User.objects.get(username='3000')
+        self.assertEqual(user.department, self.college)
+        self.assertEqual(user.administrative_department, self.college)
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(set(user.groups.values_list('name', flat=True)), {
+            '个人权限', '大连理工大学-10141-专任教师', '学院一-1-专任教师'})
+
+    def test_unchanged(self, _):
+        '''Should not write anything if nothing changes.'''
+        self.make_teachers(3, xy='1')
+        self.sync()
+
+        # Ids of users are only queried again if some users are created.
+        with self.assertNumQueries(7):
+            summary = self.sync()
+
+        self.assertEqual(summary, {
+            'created': 0,
+            'updated': 0,
+            'unchanged': 3,
+            'groups_added': 0,
+            'groups_removed': 0,
+            'changed_fields': {},
+        })
+        self.mocked_on_commit.assert_not_called()
+
+    def test_constant_queries(self, _):
+        '''Should not run more queries for more teachers.'''
+        teachers = self.make_teachers(20, xy='1')
+        self.sync()
+        TeacherInformation.objects.filter(
+            zgh__in=[teacher.zgh for teacher in teachers[:10]],
+        ).update(sjh='139', xy='2')
+
+        # The same queries as unchanged, plus one update, one insert and one
+        # delete, which loads deleted rows for signals.
+        with self.assertNumQueries(11):
+            summary = self.sync()
+
+        self.assertEqual(summary['updated'], 10)
+        self.assertEqual(summary['changed_fields'], {
+            'cell_phone_number': 10,
+            'department_id': 10,
+            'administrative_department_id': 10,
+        })
+
+    def test_move(self, _):
+        '''Should update groups by differences if department changes.'''
+        teacher, = self.make_teachers(1, xy='1')
+        self.sync()
+        user = User.objects.get(username=teacher.zgh)
+        other_group = mommy.make(Group, name='其它')
+        user.groups.add(other_group)
+        TeacherInformation.objects.filter(zgh=teacher.zgh).update(xy='2')
+
+        summary = self.sync()
+
+        self.assertEqual(summary['groups_added'], 1)
+        self.assertEqual(summary['groups_removed'], 1)
+        self.assertEqual(set(user.groups.values_list('name', flat=True)), {
+            '个人权限', '大连理工大学-10141-专任教师', '学院二-2-专任教师', '其它'})
+        user.refresh_from_db()
+        self.assertEqual(user.administrative_department, self.other_college)
+
+    def test_unknown_department(self, mocked_prod_logger):
+        '''Should remove groups of users in unknown departments.'''
+        teacher, = self.make_teachers(1, xy='1')
+        self.sync()
+        TeacherInformation.objects.filter(zgh=teacher.zgh).update(xy='404')
+
+        summary = self.sync()
+
+        self.assertEqual(summary['groups_removed'], 2)
+        user = User.objects.get(username=teacher.zgh)
+        self.assertIsNone(user.department)
+        self.assertEqual(list(user.groups.values_list('name', flat=True)),
+                         ['个人权限'])
+        mocked_prod_logger.warning.assert_called_with(
+            f'职工号为{teacher.zgh}的教师使用了一个系统中不存在的学院404')
@@ -3,15 +3,18 @@ from unittest.mock import Mock, patch
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from model_mommy import mommy
 
 from auth.models import Department
 from auth.utils import (
     get_user_secret_key, jwt_response_payload_handler,
     assign_perm, remove_perm, ChoiceConverter,
-    assign_model_perms_for_department
+    assign_model_perms_for_department, assign_model_perms_for_departments,
+    ObjectPermissionRule,
+    get_object_permission_rule, build_department_paths
 )
+from training_record.models import Record, RecordContent
 
 
 class TestUtils(TestCase):
@@ -129,3 +132,61 @@ class TestChoiceConverter(TestCase):
 
         self.assertNotEqual(teachers_group.permissions.all().count(), 0)
         self.assertNotEqual(admins_group.permissions.all().count(), 0)
+
+    def test_assign_model_perms_for_departments(self):
+        '''Should assign model perms to groups of departments in bulk.'''
+        departments = mommy.make(Department, _quantity=3)
+        for department in departments:
+            for role in ('管理员', '专任教师'):
+                Group.objects.create(name=(
+                    f'{department.name}-{department.raw_department_id}'
+                    f'-{role}'))
+
+        with self.assertNumQueries(3):
+            count = assign_model_perms_for_departments(departments)
+
+        self.assertEqual(Group.permissions.through.objects.count(), count)
+        self.assertEqual(assign_model_perms_for_departments(departments),
+                         count)
+        self.assertEqual(Group.permissions.through.objects.count(), count)
+        with self.assertRaises(Group.DoesNotExist):
+            assign_model_perms_for_departments([mommy.make(Department)])
+
+
+class TestObjectPermissionRule(TestCase):
+    '''Unit tests for ObjectPermissionRule.'''
+    def test_resolve(self):
+        '''Should follow lookups to ids of the last relations.'''
+        rule = ObjectPermissionRule(owner='record__user',
+                                    department='record__user__department')
+        user = Mock(id=1, department_id=2)
+        content = Mock(record=Mock(user_id=1, user=user))
+
+        self.assertEqual(rule.get_owner_id(content), 1)
+        self.assertEqual(rule.get_department_id(content), 2)
+        self.assertIsNone(rule.get_owner_id(Mock(record=None)))
+        self.assertIsNone(ObjectPermissionRule(
+            department='department').get_owner_id(content))
+
+    def test_get_object_permission_rule(self):
+        '''Should return rules only for the department resolver.'''
+        self.assertIsNone(get_object_permission_rule(Record))
+        with override_settings(OBJECT_PERMISSION_RESOLVER='department'):
+            rule = get_object_permission_rule(RecordContent)
+            self.assertEqual(rule.owner, 'record__user')
+            self.assertIsNone(get_object_permission_rule(Department))
+
+
+class TestBuildDepartmentPaths(TestCase):
+    '''Unit tests for build_department_paths().'''
+    def test_build_department_paths(self):
+        '''Should build paths from the root.'''
+        paths = build_department_paths({3: 2, 2: 1, 1: None, 4: 1})
+
+        self.assertEqual(paths, {1: '1/', 2: '1/2/', 3: '1/2/3/', 4: '1/4/'})
+
+    def test_cycle(self):
+        '''Should not loop forever on cycles.'''
+        paths = build_department_paths({1: 2, 2: 1, 3: 1})
+
+        self.assertEqual(paths, {1: '2/1/', 2: '2/', 3: '2/1/3/'})
@@ -0,0 +1,34 @@
+'''Handlers of JWT provided by auth module.
+
+This module is imported by rest_framework_jwt before models are ready, so
+models and services are imported in functions.
+'''
+import jwt
+from rest_framework_jwt.settings import api_settings
+
+
+def jwt_decode_handler(token):
+    '''Decode and verify JWT.
+
+    The same as the default handler except that the user for the secret
+    key is got from UserService.get_principal() instead of a query, and
+    tokens of missing users are invalid.
+    '''
+    from auth.services import UserService
+    from auth.utils import get_user_secret_key
+    unverified_payload = jwt.decode(token, None, False)
+    try:
+        user = UserService.get_principal(
+            int(unverified_payload.get('user_id')))
+    except Exception:  # pylint: disable=W0703
+        raise jwt.InvalidTokenError('用户不存在')
+    return jwt.decode(
+        token,
+        api_settings.JWT_PUBLIC_KEY or get_user_secret_key(user),
+        api_settings.JWT_VERIFY,
+        options={'verify_exp': api_settings.JWT_VERIFY_EXPIRATION},
+        leeway=api_settings.JWT_LEEWAY,
+        audience=api_settings.JWT_AUDIENCE,
+        issuer=api_settings.JWT_ISSUER,
+        algorithms=[api_settings.JWT_ALGORITHM]
+    )
@@ -4,7 +4,7 @@ import os.path as osp
 
 import guardian.shortcuts
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, Permission
 
 from infra.utils import prod_logger
 
@@ -21,6 +21,36 @@ def get_user_secret_key(user):
     return secret_key
 
 
+def build_department_paths(super_department_ids):
+    '''Compute materialized paths of departments in memory.
+
+    Parameters
+    ----------
+    super_department_ids: dict
+        Map department id to id of its super department.
+
+    Returns
+    -------
+    paths: dict
+        Map department id to its path, e.g. '1/5/9/'.
+    '''
+    paths = {}
+    for department_id in super_department_ids:
+        chain = []
+        current_id = department_id
+        while current_id is not None and current_id not in paths:
+            if current_id in chain:
+                # Break cycles in broken data at the repeated department.
+                break
+            chain.append(current_id)
+            current_id = super_department_ids.get(current_id)
+        prefix = paths.get(current_id, '')
+        for chain_id in reversed(chain):
+            prefix = f'{prefix}{chain_id}/'
+            paths[chain_id] = prefix
+    return paths
+
+
 def jwt_response_payload_handler(token, user=None, request=None):
     """Returns the response data for both the login and refresh views."""
     from auth.serializers import UserSerializer
@@ -215,18 +245,142 @@ def get_model_perms():
     }
 
 
-# pylint: disable=too-many-locals
 def assign_model_perms_for_department(department):
     '''Assign default model permissions for department groups.'''
+    assign_model_perms_for_departments([department])
+
+
+# pylint: disable=too-many-locals
+def assign_model_perms_for_departments(departments):
+    '''Assign default model permissions for groups of departments in bulk.
+
+    Permissions and groups are loaded by two queries and rows of
+    Group.permissions.through are inserted at once, existing rows are
+    ignored.
+
+    Returns
+    -------
+    count: int
+        The number of rows to insert.
+    '''
     model_perms = get_model_perms()
+    perm_keys = {
+        (model_class._meta.app_label,
+         f'{perm}_{model_class._meta.model_name}')
+        for model_class, perm_pairs in model_perms.items()
+        for perms in perm_pairs.values()
+        for perm in perms
+    }
+    perm_ids = {
+        (app_label, codename): perm_id
+        for perm_id, app_label, codename in Permission.objects.filter(
+            codename__in={codename for _, codename in perm_keys},
+        ).values_list('id', 'content_type__app_label', 'codename')
+    }
+    for app_label, codename in perm_keys:
+        if (app_label, codename) not in perm_ids:
+            raise Permission.DoesNotExist(
+                f'权限{app_label}.{codename}不存在')
+    group_names = {
+        (department.id, role):
+        f'{department.name}-{department.raw_department_id}-{role}'
+        for department in departments
+        for perm_pairs in model_perms.values()
+        for role in perm_pairs
+    }
+    group_ids = dict(Group.objects.filter(
+        name__in=set(group_names.values())).values_list('name', 'id'))
+    for group_name in group_names.values():
+        if group_name not in group_ids:
+            raise Group.DoesNotExist(f'用户组{group_name}不存在')
+
+    through = Group.permissions.through
+    rows = {
+        (group_ids[group_names[(department.id, role)]],
+         perm_ids[(model_class._meta.app_label,
+                   f'{perm}_{model_class._meta.model_name}')])
+        for department in departments
+        for model_class, perm_pairs in model_perms.items()
+        for role, perms in perm_pairs.items()
+        for perm in perms
+    }
+    through.objects.bulk_create([
+        through(group_id=group_id, permission_id=permission_id)
+        for group_id, permission_id in rows
+    ], batch_size=500, ignore_conflicts=True)
+    msg = f'为{len(departments)}个单位的用户组赋予{len(rows)}个模型权限'
+    prod_logger.info(msg)
+    return len(rows)
 
-    for model_class, perm_pairs in model_perms.items():
-        for role, perms in perm_pairs.items():
-            group = Group.objects.get(name=(
-                f'{department.name}-{department.raw_department_id}-{role}'))
-            for perm in perms:
-                perm_name = (
-                    f'{model_class._meta.app_label}.'
-                    f'{perm}_{model_class._meta.model_name}'
-                )
-                assign_perm(perm_name, group)
+
+class ObjectPermissionRule:
+    '''Describe how to find the owner and department of an object.
+
+    Object permissions of the owner (perms of group 个人权限) and of groups
+    of the department and its super departments can be derived from these
+    lookups instead of being stored as guardian rows.
+
+    Parameters
+    ----------
+    owner: str
+        Lookup from the model to its owner, e.g. 'record__user'. None if
+        objects have no owner.
+    department: str
+        Lookup from the model to its department, e.g. 'user__department'.
+    '''
+    def __init__(self, owner=None, department=None):
+        self.owner = owner
+        self.department = department
+
+    @staticmethod
+    def _resolve(instance, lookup):
+        '''Follow lookup on instance, return id of the last relation.'''
+        if lookup is None:
+            return None
+        *relations, field = lookup.split('__')
+        for relation in relations:
+            instance = getattr(instance, relation, None)
+            if instance is None:
+                return None
+        return getattr(instance, f'{field}_id', None)
+
+    def get_owner_id(self, instance):
+        '''Return id of the owner of the instance.'''
+        return self._resolve(instance, self.owner)
+
+    def get_department_id(self, instance):
+        '''Return id of the department of the instance.'''
+        return self._resolve(instance, self.department)
+
+
+OBJECT_PERMISSION_RULES = {
+    'infra.notification': ObjectPermissionRule(
+        owner='recipient', department='recipient__department'),
+    # Programs and events are assigned to groups of the department of the
+    # program by ProgramService and CampusEventService, not the creator's.
+    'training_program.program': ObjectPermissionRule(
+        department='department'),
+    'training_event.campusevent': ObjectPermissionRule(
+        department='program__department'),
+    'training_event.enrollment': ObjectPermissionRule(
+        owner='user', department='user__department'),
+    'training_record.record': ObjectPermissionRule(
+        owner='user', department='user__department'),
+    'training_record.recordcontent': ObjectPermissionRule(
+        owner='record__user', department='record__user__department'),
+    'training_record.recordattachment': ObjectPermissionRule(
+        owner='record__user', department='record__user__department'),
+    'secure_file.securefile': ObjectPermissionRule(
+        owner='user', department='user__department'),
+}
+
+
+def get_object_permission_rule(model):
+    '''Return ObjectPermissionRule of the model.
+
+    None is returned if the model has no rule, or object permissions are
+    resolved by guardian rows only (settings.OBJECT_PERMISSION_RESOLVER).
+    '''
+    if settings.OBJECT_PERMISSION_RESOLVER != 'department':
+        return None
+    return OBJECT_PERMISSION_RULES.get(model._meta.label_lower)
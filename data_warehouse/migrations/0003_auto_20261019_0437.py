@@ -0,0 +1,65 @@
+# Generated by Django 2.2 on 2026-10-18 20:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tmsftt_auth', '0009_auto_20190620_1620'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('data_warehouse', '0002_auto_20190521_1102'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClosedPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, verbose_name='周期名称')),
+                ('start_time', models.DateTimeField(db_index=True, verbose_name='起始时间')),
+                ('end_time', models.DateTimeField(db_index=True, verbose_name='截止时间')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='关闭时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='快照生成时间')),
+                ('is_stale', models.BooleanField(default=False, verbose_name='快照是否已失效')),
+                ('closed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to=settings.AUTH_USER_MODEL, verbose_name='关闭人')),
+            ],
+            options={
+                'verbose_name': '已关闭统计周期',
+                'verbose_name_plural': '已关闭统计周期',
+                'ordering': ['start_time'],
+                'default_permissions': (),
+            },
+        ),
+        migrations.CreateModel(
+            name='TrainingSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('teaching_type', models.CharField(blank=True, max_length=40, null=True, verbose_name='任教类型')),
+                ('is_campus', models.BooleanField(verbose_name='是否为校内培训')),
+                ('num_records', models.PositiveIntegerField(default=0, verbose_name='培训记录数')),
+                ('num_valid_records', models.PositiveIntegerField(default=0, verbose_name='有效培训记录数')),
+                ('num_hours', models.FloatField(default=0, verbose_name='培训学时')),
+                ('workload', models.FloatField(default=0, verbose_name='工作量')),
+                ('administrative_department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='tmsftt_auth.Department', verbose_name='所属行政单位')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='data_warehouse.ClosedPeriod', verbose_name='统计周期')),
+                ('program_department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='tmsftt_auth.Department', verbose_name='培训项目开设单位')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '培训数据快照',
+                'verbose_name_plural': '培训数据快照',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='trainingsnapshot',
+            index=models.Index(fields=['period', 'administrative_department'], name='data_wareho_period__86ab5a_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trainingsnapshot',
+            unique_together={('period', 'user', 'program_department', 'is_campus')},
+        ),
+    ]
@@ -1,8 +1,13 @@
 '''Models for aggregation data.'''
 from django.db import models
+from django.db.models import signals
 from django.contrib.auth import get_user_model
 
 from auth.models import Department
+from training_event.models import CampusEvent, OffCampusEvent, EventCoefficient
+from training_record.models import (
+    Record, records_bulk_created, records_bulk_updated
+)
 
 
 class Ranking(models.Model):
@@ -36,3 +41,146 @@ class Ranking(models.Model):
     user = models.ForeignKey(get_user_model(), verbose_name='用户',
                              on_delete=models.CASCADE)
     value = models.FloatField(verbose_name='值')
+
+
+class ClosedPeriod(models.Model):
+    '''A closed statistics period whose figures are frozen into snapshots.
+
+    Once a period is closed, workload and training hours of records whose
+    event time falls in [start_time, end_time] are aggregated into
+    TrainingSnapshot rows, queries covering the period read the snapshots
+    instead of raw records. If a record in a closed period is edited later,
+    the period is marked as stale and is computed live until its snapshots
+    are rebuilt.
+    '''
+    class Meta:
+        verbose_name = '已关闭统计周期'
+        verbose_name_plural = '已关闭统计周期'
+        ordering = ['start_time']
+        default_permissions = ()
+
+    name = models.CharField(verbose_name='周期名称', max_length=64)
+    start_time = models.DateTimeField(verbose_name='起始时间', db_index=True)
+    end_time = models.DateTimeField(verbose_name='截止时间', db_index=True)
+    closed_by = models.ForeignKey(
+        get_user_model(), verbose_name='关闭人', on_delete=models.PROTECT,
+        blank=True, null=True)
+    create_time = models.DateTimeField(verbose_name='关闭时间',
+                                       auto_now_add=True)
+    update_time = models.DateTimeField(verbose_name='快照生成时间',
+                                       auto_now=True)
+    is_stale = models.BooleanField(verbose_name='快照是否已失效',
+                                   default=False)
+
+    def __str__(self):
+        return '{}({}至{})'.format(self.name, self.start_time, self.end_time)
+
+    @classmethod
+    def mark_stale(cls, *times):
+        '''Mark closed periods containing any of the times as stale.'''
+        query = models.Q()
+        for time in times:
+            if time is None:
+                continue
+            query |= models.Q(start_time__lte=time, end_time__gte=time)
+        if not query:
+            return 0
+        return cls.objects.filter(query).filter(
+            is_stale=False).update(is_stale=True)
+
+    # pylint: disable=unused-argument
+    @classmethod
+    def invalidate_by_record(cls, sender, instance, **kwargs):
+        '''Invalidate snapshots when a record in closed period changes.'''
+        event = instance.campus_event or instance.off_campus_event
+        if event is not None:
+            cls.mark_stale(event.time)
+
+    # pylint: disable=unused-argument
+    @classmethod
+    def invalidate_by_records(cls, sender, records, **kwargs):
+        '''Invalidate snapshots when records are created in bulk.'''
+        times = set()
+        for record in records:
+            event = record.campus_event or record.off_campus_event
+            if event is not None:
+                times.add(event.time)
+        cls.mark_stale(*times)
+
+    # pylint: disable=unused-argument
+    @classmethod
+    def invalidate_by_event(cls, sender, instance, **kwargs):
+        '''Invalidate snapshots when an event in closed period changes.
+
+        Both the old and the new event time are considered, since an event
+        may be moved out of (or into) a closed period.
+        '''
+        times = [instance.time]
+        if instance.pk is not None:
+            times.extend(sender.objects.filter(
+                pk=instance.pk).values_list('time', flat=True))
+        cls.mark_stale(*times)
+
+    # pylint: disable=unused-argument
+    @classmethod
+    def invalidate_by_event_coefficient(cls, sender, instance, **kwargs):
+        '''Invalidate snapshots when coefficients in closed period change.'''
+        event = instance.campus_event or instance.off_campus_event
+        if event is not None:
+            cls.mark_stale(event.time)
+
+
+class TrainingSnapshot(models.Model):
+    '''Frozen per-user training figures of a closed period.
+
+    Rows are grouped by (user, department of the program, campus or not), so
+    both the workload of teachers and the training hours of departments can
+    be aggregated from snapshots.
+    '''
+    class Meta:
+        verbose_name = '培训数据快照'
+        verbose_name_plural = '培训数据快照'
+        unique_together = (
+            ('period', 'user', 'program_department', 'is_campus'),
+        )
+        indexes = [
+            models.Index(fields=['period', 'administrative_department']),
+        ]
+        default_permissions = ()
+
+    period = models.ForeignKey(ClosedPeriod, verbose_name='统计周期',
+                               related_name='snapshots',
+                               on_delete=models.CASCADE)
+    user = models.ForeignKey(get_user_model(), verbose_name='用户',
+                             on_delete=models.CASCADE)
+    administrative_department = models.ForeignKey(
+        Department, verbose_name='所属行政单位', on_delete=models.PROTECT,
+        related_name='+', blank=True, null=True)
+    teaching_type = models.CharField(
+        verbose_name='任教类型', max_length=40, blank=True, null=True)
+    program_department = models.ForeignKey(
+        Department, verbose_name='培训项目开设单位', on_delete=models.PROTECT,
+        related_name='+', blank=True, null=True)
+    is_campus = models.BooleanField(verbose_name='是否为校内培训')
+    num_records = models.PositiveIntegerField(verbose_name='培训记录数',
+                                              default=0)
+    num_valid_records = models.PositiveIntegerField(
+        verbose_name='有效培训记录数', default=0)
+    num_hours = models.FloatField(verbose_name='培训学时', default=0)
+    workload = models.FloatField(verbose_name='工作量', default=0)
+
+    def __str__(self):
+        return '{}在{}中的培训数据快照'.format(self.user_id, self.period_id)
+
+
+# Invalidate snapshots of closed periods if related data changes.
+for _signal in (signals.post_save, signals.pre_delete):
+    _signal.connect(ClosedPeriod.invalidate_by_record, sender=Record)
+    _signal.connect(ClosedPeriod.invalidate_by_event_coefficient,
+                    sender=EventCoefficient)
+for _signal in (records_bulk_created, records_bulk_updated):
+    _signal.connect(ClosedPeriod.invalidate_by_records, sender=Record)
+for _sender in (CampusEvent, OffCampusEvent):
+    signals.pre_save.connect(ClosedPeriod.invalidate_by_event, sender=_sender)
+    signals.pre_delete.connect(ClosedPeriod.invalidate_by_event,
+                               sender=_sender)
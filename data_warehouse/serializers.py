@@ -5,6 +5,8 @@ import pytz
 from rest_framework import serializers
 from django.utils.timezone import now, localtime
 
+from data_warehouse.models import ClosedPeriod
+from data_warehouse.services.snapshot_service import SnapshotService
 from infra.mixins import HumanReadableValidationErrorMixin
 
 # pylint: disable=W0223
@@ -101,3 +103,20 @@ class TrainingSummarySerializer(BaseTableExportSerializer):
 class AttendanceSheetSerializer(BaseTableExportSerializer):
     '''Serialize parameters for user.'''
     event_id = serializers.IntegerField(required=True)
+
+
+class ClosedPeriodSerializer(serializers.ModelSerializer):
+    '''已关闭统计周期的序列化器'''
+    class Meta:
+        model = ClosedPeriod
+        fields = ('id', 'name', 'start_time', 'end_time', 'closed_by',
+                  'create_time', 'update_time', 'is_stale')
+        read_only_fields = ('closed_by', 'create_time', 'update_time',
+                            'is_stale')
+        extra_kwargs = {'name': {'required': False}}
+
+    def create(self, validated_data):
+        request = self.context['request']
+        return SnapshotService.close_period(
+            validated_data['start_time'], validated_data['end_time'],
+            user=request.user, name=validated_data.get('name'))
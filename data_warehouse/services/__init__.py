@@ -10,6 +10,8 @@ from .records_statistics_service import RecordsStatisticsService
 from .canvas_data_formater_service import CanvasDataFormater
 from .campus_event_feedback_service import CampusEventFeedbackService
 from .training_hours_statistics_service import TrainingHoursStatisticsService
+from .snapshot_service import SnapshotService
+from .bulk_personal_summary_service import BulkPersonalSummaryService
 
 from .aggregate_data_service import AggregateDataService
 
@@ -26,5 +28,7 @@ __all__ = [
     'CanvasDataFormater',
     'CampusEventFeedbackService',
     'AggregateDataService',
-    'TrainingHoursStatisticsService'
+    'TrainingHoursStatisticsService',
+    'SnapshotService',
+    'BulkPersonalSummaryService',
 ]
@@ -0,0 +1,256 @@
+'''Provide personal summaries of many users in grouped queries.'''
+from collections import defaultdict
+
+from django.db import models
+from django.db.models import functions
+from django.utils.timezone import now, localtime
+
+from auth.models import Department
+from data_warehouse.models import Ranking
+from data_warehouse.services.user_core_statistics_service import (
+    UserCoreStatisticsService
+)
+from data_warehouse.services.user_ranking_service import UserRankingService
+from training_event.models import CampusEvent, Enrollment, EventCoefficient
+from training_record.models import Record
+
+
+class BulkPersonalSummaryService:
+    '''Compute AggregateDataService.personal_summary() for many users.
+
+    Instead of issuing several queries per user, statistics of all users are
+    fetched in a handful of grouped queries and assembled in Python, the
+    returned summaries have the same structure as personal_summary().
+    '''
+    TIME_KEY_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+
+    @staticmethod
+    def normalize_time_range(start_time, end_time):
+        '''Round time range the same way as SummaryParametersSerializer.'''
+        start_time = localtime(start_time).replace(
+            minute=0, second=0, microsecond=0)
+        end_time = localtime(end_time).replace(second=0, microsecond=0)
+        return start_time, end_time
+
+    @classmethod
+    def get_personal_summaries(cls, users, start_time, end_time):
+        '''Populate overviews of training statistics for users.
+
+        Parameters
+        ----------
+        users: iterable of User
+        start_time: datetime
+            The start time of data for aggregation.
+        end_time: datetime
+            The end time of data for aggregation.
+
+        Return
+        ------
+        summaries: dict
+            Map user id to the summary, see personal_summary().
+        '''
+        users = list(users)
+        user_ids = [user.id for user in users]
+        start_time, end_time = cls.normalize_time_range(start_time, end_time)
+        time_keys = {
+            'start_time': start_time.strftime(cls.TIME_KEY_FORMAT),
+            'end_time': end_time.strftime(cls.TIME_KEY_FORMAT),
+        }
+        range_statistics = cls._get_range_statistics(
+            user_ids, start_time, end_time, time_keys)
+        monthly_statistics = cls._get_monthly_statistics(user_ids)
+        rankings = cls._get_rankings(users)
+        summaries = {}
+        for user in users:
+            summary = range_statistics[user.id]
+            summary['monthly_added_records'] = monthly_statistics[user.id]
+            summary.update(rankings[user.id])
+            summaries[user.id] = summary
+        return summaries
+
+    # pylint: disable=too-many-locals
+    @classmethod
+    def _get_range_statistics(cls, user_ids, start_time, end_time,
+                              time_keys):
+        '''Statistics of records and enrollments created in time range.'''
+        records = (
+            Record.valid_objects
+            .filter(user_id__in=user_ids)
+            .filter(create_time__gte=start_time)
+            .filter(create_time__lte=end_time)
+            .values_list('user_id', 'campus_event_id',
+                         'event_coefficient__role',
+                         'campus_event__program__name',
+                         'event_award_level', 'event_name', 'event_time')
+        )
+        enrollments = (
+            Enrollment.objects
+            .filter(user_id__in=user_ids)
+            .filter(create_time__gte=start_time)
+            .filter(create_time__lte=end_time)
+            .values_list('user_id', 'campus_event_id')
+        )
+        enrolled_events = defaultdict(list)
+        for user_id, campus_event_id in enrollments:
+            enrolled_events[user_id].append(campus_event_id)
+        enrolled_event_sets = {
+            user_id: set(events)
+            for user_id, events in enrolled_events.items()
+        }
+
+        user_records = defaultdict(list)
+        for record in records:
+            user_records[record[0]].append(record)
+        timestamp = localtime(now())
+        statistics = {}
+        for user_id in user_ids:
+            num_campus_records = 0
+            num_off_campus_records = 0
+            num_not_enrolled_events = 0
+            num_events_as_expert = 0
+            programs = defaultdict(int)
+            award_time, award_name = None, None
+            enrolled = enrolled_event_sets.get(user_id, set())
+            for (_, campus_event_id, role, program_name, award_level,
+                 event_name, event_time) in user_records[user_id]:
+                if campus_event_id is None:
+                    num_off_campus_records += 1
+                else:
+                    num_campus_records += 1
+                    programs[program_name] += 1
+                    if (award_level > CampusEvent.AWARD_LEVEL_NONE
+                            and (award_time is None
+                                 or event_time > award_time)):
+                        award_time, award_name = event_time, event_name
+                if campus_event_id not in enrolled:
+                    num_not_enrolled_events += 1
+                if role == EventCoefficient.ROLE_EXPERT:
+                    num_events_as_expert += 1
+            statistics[user_id] = {
+                'programs_statistics': dict(
+                    timestamp=timestamp, **time_keys,
+                    data=[{'name': key, 'value': value}
+                          for key, value in programs.items()],
+                    programs=list(programs.keys()),
+                ),
+                'events_statistics': dict(
+                    timestamp=timestamp, **time_keys,
+                    num_enrolled_events=(len(enrolled_events[user_id])
+                                         + num_not_enrolled_events),
+                    num_completed_events=num_campus_records,
+                    num_events_as_expert=num_events_as_expert,
+                ),
+                'records_statistics': dict(
+                    timestamp=timestamp, **time_keys,
+                    **cls._get_records_ratio(num_campus_records,
+                                             num_off_campus_records),
+                ),
+                'competition_award_info': dict(
+                    timestamp=timestamp, **time_keys,
+                    data=(dict(zip(('competition', 'level', 'award'),
+                                   award_name.split('|')))
+                          if award_name else None),
+                ),
+            }
+        return statistics
+
+    @staticmethod
+    def _get_records_ratio(num_campus_records, num_off_campus_records):
+        '''Same as UserCoreStatisticsService.get_records_statistics().'''
+        total_records = num_campus_records + num_off_campus_records
+        campus_records_ratio = (
+            num_campus_records / total_records if total_records else 0
+        )
+        off_campus_records_ratio = (
+            1 - campus_records_ratio if total_records else 0
+        )
+        return {
+            'num_campus_records': num_campus_records,
+            'num_off_campus_records': num_off_campus_records,
+            'campus_records_ratio': f'{campus_records_ratio:.0%}',
+            'off_campus_records_ratio': f'{off_campus_records_ratio:.0%}',
+        }
+
+    @staticmethod
+    def _get_monthly_statistics(user_ids):
+        '''Monthly added records of last 12 months.'''
+        start_time, months = (
+            UserCoreStatisticsService.get_monthly_statistics_range())
+        format_time = UserCoreStatisticsService.format_month
+        monthly_records = defaultdict(dict)
+        for item in (
+                Record.valid_objects
+                .filter(user_id__in=user_ids)
+                .filter(create_time__gte=start_time)
+                .annotate(month=functions.TruncMonth('create_time'))
+                .values('user_id', 'month')
+                .annotate(
+                    campus_count=models.Count('campus_event'),
+                    off_campus_count=models.Count('off_campus_event'))
+                .order_by()):
+            monthly_records[item['user_id']][format_time(item['month'])] = (
+                item)
+        timestamp = localtime(now())
+        statistics = {}
+        for user_id in user_ids:
+            records = monthly_records[user_id]
+            statistics[user_id] = {
+                'timestamp': timestamp,
+                'months': months,
+                'campus_data': [
+                    records.get(x, {'campus_count': 0})['campus_count']
+                    for x in months],
+                'off_campus_data': [
+                    records.get(x, {'off_campus_count': 0})[
+                        'off_campus_count']
+                    for x in months],
+            }
+        return statistics
+
+    @staticmethod
+    def _get_rankings(users):
+        '''Rankings by total training hours in department and school.'''
+        ranking_type = Ranking.RANKING_BY_TOTAL_TRAINING_HOURS
+        dlut_department_id = Department.objects.filter(
+            name='大连理工大学').values_list('id', flat=True).first()
+        rankings = {
+            (user_id, department_id): ranking
+            for user_id, department_id, ranking in (
+                Ranking.objects
+                .filter(ranking_type=ranking_type)
+                .filter(user_id__in=[user.id for user in users])
+                .values_list('user_id', 'department_id', 'ranking'))
+        }
+        department_ids = {department_id for _, department_id in rankings}
+        totals = dict(
+            Ranking.objects
+            .filter(ranking_type=ranking_type)
+            .filter(department_id__in=department_ids)
+            .values('department_id')
+            .annotate(total=models.Count('id'))
+            .order_by()
+            .values_list('department_id', 'total')
+        )
+
+        def get_ranking(user_id, department_id):
+            ranking = rankings.get((user_id, department_id))
+            if ranking is None:
+                return '暂无数据'
+            return UserRankingService.format_ranking(
+                ranking, totals[department_id])
+
+        timestamp = localtime(now())
+        return {
+            user.id: {
+                'ranking_in_department': {
+                    'timestamp': timestamp,
+                    'ranking': get_ranking(
+                        user.id, user.administrative_department_id),
+                },
+                'ranking_in_school': {
+                    'timestamp': timestamp,
+                    'ranking': get_ranking(user.id, dlut_department_id),
+                },
+            }
+            for user in users
+        }
@@ -157,6 +157,42 @@ class CoverageStatisticsService:
             )
         return data
 
+    @staticmethod
+    def get_department_ids(user, department_id=None):
+        '''返回用户有权查询的部门ID
+
+        Parameters
+        ----
+        user: User
+            执行此操作的用户
+
+        department_id: int
+            需要查询的部门，非校级管理员必须给此参数，校级管理员为此参数None则返回所有院系。
+
+        Return
+        ------
+
+        list or QuerySet
+            部门ID
+        '''
+        if user is None or not (user.is_department_admin or user
+                                .is_school_admin):
+            raise BadRequest('你不是管理员，无权操作。')
+
+        if department_id is not None:
+            department = Department.objects.filter(id=department_id)
+            if not department:
+                raise BadRequest('部门不存在。')
+            if not (user.is_school_admin or user.check_department_admin(
+                    department[0])):
+                raise BadRequest('你不是该院系的管理员，无权操作。')
+            return [department_id]
+        if not user.is_school_admin:
+            raise BadRequest('你不是校级管理员，必须指定部门ID。')
+        departments = DepartmentService.get_top_level_departments()
+        dlut = Department.objects.filter(name='大连理工大学')
+        return departments.union(dlut).values_list('id', flat=True)
+
     # pylint: disable=R0914
     @staticmethod
     def get_training_records(user, program_id=None, department_id=None,
@@ -186,26 +222,8 @@ class CoverageStatisticsService:
         QuerySet
             包含Record的查询集
         '''
-        if user is None or not (user.is_department_admin or user
-                                .is_school_admin):
-            raise BadRequest('你不是管理员，无权操作。')
-
-        if department_id is not None:
-            department = Department.objects.filter(id=department_id)
-            if not department:
-                raise BadRequest('部门不存在。')
-            if not (user.is_school_admin or user.check_department_admin(
-                    department[0])):
-                raise BadRequest('你不是该院系的管理员，无权操作。')
-            department_ids = [department_id]
-        else:
-            if user.is_school_admin:
-                departments = DepartmentService.get_top_level_departments()
-                dlut = Department.objects.filter(name='大连理工大学')
-                department_ids = departments.union(dlut).values_list(
-                    'id', flat=True)
-            else:
-                raise BadRequest('你不是校级管理员，必须指定部门ID。')
+        department_ids = CoverageStatisticsService.get_department_ids(
+            user, department_id)
         if end_time is None:
             end_time = now()
         if start_time is None:
@@ -223,7 +241,8 @@ class CoverageStatisticsService:
         else:
             off_campus_event_record_ids = (
                 Record.objects
-                .filter(off_campus_event__time__range=(start_time, end_time))
+                .filter(event_kind=Record.EVENT_KIND_OFF_CAMPUS,
+                        event_time__range=(start_time, end_time))
                 .filter(user__administrative_department_id__in=department_ids)
                 .values_list('id', flat=True)
             )
@@ -232,9 +251,9 @@ class CoverageStatisticsService:
                     department_id__in=department_ids).values_list(
                         'id', flat=True))
         campus_event_record_ids = Record.objects.filter(
-            campus_event__isnull=False,
+            event_kind=Record.EVENT_KIND_CAMPUS,
             campus_event__program_id__in=valid_program_ids,
-            campus_event__time__range=(start_time, end_time)
+            event_time__range=(start_time, end_time)
             ).values_list('id', flat=True)
         record_ids = campus_event_record_ids.union(off_campus_event_record_ids)
         # Because QuerySet after union only supports limit operations such as
@@ -164,12 +164,12 @@ class RecordsStatisticsService:
                 user__teaching_type__in=('专任教师', '实验技术')
             )
         campus_records = queryset.filter(
-            campus_event__isnull=False,
-            campus_event__time__range=(start_time, end_time)
+            event_kind=Record.EVENT_KIND_CAMPUS,
+            event_time__range=(start_time, end_time)
             )
         off_campus_records = queryset.filter(
-            off_campus_event__isnull=False,
-            off_campus_event__time__range=(start_time, end_time)
+            event_kind=Record.EVENT_KIND_OFF_CAMPUS,
+            event_time__range=(start_time, end_time)
             )
         departments = Department.objects.filter(id=department_id)
         if not departments:
@@ -0,0 +1,185 @@
+'''Provide services of closed-period snapshots.'''
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from data_warehouse.models import ClosedPeriod, TrainingSnapshot
+from infra.exceptions import BadRequest
+from training_record.models import Record
+
+
+class SnapshotService:
+    '''Freeze training figures of closed periods into snapshots.
+
+    Workload and training hours of a closed period never change, so they
+    are aggregated once into TrainingSnapshot rows. Queries covering closed
+    periods read the snapshots and only compute the remaining (open) time
+    ranges from raw records.
+    '''
+    TIME_RESOLUTION = timedelta(microseconds=1)
+
+    @staticmethod
+    def get_default_time_range(start_time=None, end_time=None):
+        '''Fill the default time range the same way as statistics services.'''
+        if end_time is None:
+            end_time = now()
+        if start_time is None:
+            start_time = end_time.replace(month=1, day=1, hour=0, minute=0,
+                                          second=0)
+        return start_time, end_time
+
+    @classmethod
+    @transaction.atomic()
+    def close_period(cls, start_time, end_time, user=None, name=None):
+        '''Close a period and generate its snapshots.
+
+        Parameters
+        ----------
+        start_time: datetime
+            周期起始时间（包含）
+        end_time: datetime
+            周期截止时间（包含）
+        user: User, optional
+            关闭周期的管理员，定时任务关闭时为None
+        name: str, optional
+            周期名称，默认根据起止时间生成
+
+        Returns
+        -------
+        period: ClosedPeriod
+        '''
+        if start_time >= end_time:
+            raise BadRequest('统计周期的起始时间必须早于截止时间')
+        if ClosedPeriod.objects.filter(
+                start_time__lte=end_time, end_time__gte=start_time).exists():
+            raise BadRequest('统计周期与已关闭周期重叠')
+        if name is None:
+            name = '{:%Y-%m-%d}至{:%Y-%m-%d}'.format(start_time, end_time)
+        period = ClosedPeriod.objects.create(
+            name=name, start_time=start_time, end_time=end_time,
+            closed_by=user)
+        cls.rebuild_period(period)
+        return period
+
+    @staticmethod
+    def _aggregate_records(records, is_campus, snapshots):
+        '''Accumulate records into snapshots keyed by user and department.'''
+        for record in records:
+            user = record.user
+            if is_campus:
+                department_id = record.campus_event.program.department_id
+                num_hours = record.campus_event.num_hours
+            else:
+                department_id = None
+                num_hours = 0
+            key = (user.id, department_id)
+            snapshot = snapshots.get(key)
+            if snapshot is None:
+                snapshot = snapshots[key] = TrainingSnapshot(
+                    user_id=user.id,
+                    administrative_department_id=(
+                        user.administrative_department_id),
+                    teaching_type=user.teaching_type,
+                    program_department_id=department_id,
+                    is_campus=is_campus,
+                )
+            snapshot.num_records += 1
+            snapshot.num_hours += num_hours
+            if is_campus or (
+                    record.status == Record.STATUS_SCHOOL_ADMIN_APPROVED):
+                snapshot.num_valid_records += 1
+                snapshot.workload += (
+                    record.event_coefficient.calculate_event_workload(record)
+                )
+
+    @classmethod
+    @transaction.atomic()
+    def rebuild_period(cls, period):
+        '''(Re)generate snapshots of the closed period.'''
+        period = ClosedPeriod.objects.select_for_update().get(pk=period.pk)
+        period.snapshots.all().delete()
+        time_range = (period.start_time, period.end_time)
+        campus_records = (
+            Record.objects
+            .select_related('user', 'event_coefficient',
+                            'campus_event__program')
+            .filter(event_kind=Record.EVENT_KIND_CAMPUS,
+                    event_time__range=time_range)
+        )
+        off_campus_records = (
+            Record.objects
+            .select_related('user', 'event_coefficient', 'off_campus_event')
+            .filter(event_kind=Record.EVENT_KIND_OFF_CAMPUS,
+                    event_time__range=time_range)
+        )
+        campus_snapshots = {}
+        off_campus_snapshots = {}
+        cls._aggregate_records(campus_records, True, campus_snapshots)
+        cls._aggregate_records(off_campus_records, False,
+                               off_campus_snapshots)
+        snapshots = list(campus_snapshots.values())
+        snapshots.extend(off_campus_snapshots.values())
+        for snapshot in snapshots:
+            snapshot.period = period
+        TrainingSnapshot.objects.bulk_create(snapshots, batch_size=500)
+        period.is_stale = False
+        period.save()
+        return period
+
+    @classmethod
+    def rebuild_stale_periods(cls):
+        '''Rebuild snapshots of all stale periods.'''
+        periods = ClosedPeriod.objects.filter(is_stale=True)
+        for period in periods:
+            cls.rebuild_period(period)
+        return len(periods)
+
+    @classmethod
+    def split_time_range(cls, start_time, end_time):
+        '''Split time range into closed periods and live time ranges.
+
+        Only up-to-date periods lying entirely within [start_time, end_time]
+        are used, stale periods and the rest of the range are computed live.
+
+        Returns
+        -------
+        periods: list of ClosedPeriod
+        live_ranges: list of (datetime, datetime)
+            Inclusive time ranges which should be computed from records.
+        '''
+        periods = list(ClosedPeriod.objects.filter(
+            start_time__gte=start_time, end_time__lte=end_time,
+            is_stale=False).order_by('start_time'))
+        live_ranges = []
+        cursor = start_time
+        for period in periods:
+            if period.start_time > cursor:
+                live_ranges.append(
+                    (cursor, period.start_time - cls.TIME_RESOLUTION))
+            cursor = period.end_time + cls.TIME_RESOLUTION
+        if cursor <= end_time:
+            live_ranges.append((cursor, end_time))
+        return periods, live_ranges
+
+    @staticmethod
+    def get_snapshots(periods):
+        '''Return snapshots of the closed periods.'''
+        return TrainingSnapshot.objects.filter(period__in=periods)
+
+    @classmethod
+    def get_training_hours_snapshots(cls, periods, department_ids):
+        '''Return snapshots counted by training hours statistics.
+
+        Mirror CoverageStatisticsService.get_training_records(): campus
+        records of programs in departments and off-campus records of users
+        in departments, only full-time teachers are included.
+        '''
+        return (
+            cls.get_snapshots(periods)
+            .filter(Q(program_department_id__in=department_ids)
+                    | Q(is_campus=False,
+                        administrative_department_id__in=department_ids))
+            .filter(teaching_type__in=('专任教师', '实验技术'))
+        )
@@ -487,6 +487,8 @@ class TableExportService:
             worksheet.write(ptr_r, 4, item.user.cell_phone_number, style_value)
             worksheet.write(ptr_r, 5, item.user.email, style_value)
             worksheet.write(ptr_r, 6, item.user.technical_title, style_value)
+            if item.is_signed:
+                worksheet.write(ptr_r, 8, '已签到', style_value)
             ptr_r += 1
         # 写入数据
         TableExportService.__write_timestamp(worksheet, ptr_r, 0)
@@ -3,6 +3,8 @@ from django.db.models import (Count, Sum, F)
 from data_warehouse.services.coverage_statistics_service import (
     CoverageStatisticsService
 )
+from data_warehouse.services.snapshot_service import SnapshotService
+from auth.models import Department
 from auth.services import UserService
 
 
@@ -38,6 +40,13 @@ class TrainingHoursStatisticsService:
         department_id = None
         if user.is_department_admin:
             department_id = user.administrative_department.id
+        start_time, end_time = SnapshotService.get_default_time_range(
+            start_time, end_time)
+        periods, live_ranges = SnapshotService.split_time_range(
+            start_time, end_time)
+        if periods:
+            return TrainingHoursStatisticsService._merge_training_hours_data(
+                user, department_id, periods, live_ranges)
         records = CoverageStatisticsService.get_training_records(
             user, department_id=department_id,
             start_time=start_time, end_time=end_time)
@@ -70,3 +79,61 @@ class TrainingHoursStatisticsService:
                 }
             )
         return data
+
+    # pylint: disable=too-many-locals
+    @staticmethod
+    def _merge_training_hours_data(user, department_id, periods,
+                                   live_ranges):
+        '''合并已关闭周期的快照数据与其余时间段的实时数据
+
+        Returns
+        ------
+        list of dict
+            与get_training_hours_data的返回值相同
+        '''
+        department_ids = list(CoverageStatisticsService.get_department_ids(
+            user, department_id))
+        t3_department_names = dict(Department.objects.filter(
+            department_type='T3').values_list('id', 'name'))
+        total_hours = {}
+        coveraged_users = {}
+
+        def accumulate(department_name, user_id, num_hours):
+            total_hours.setdefault(department_name, 0)
+            total_hours[department_name] += num_hours or 0
+            coveraged_users.setdefault(department_name, set()).add(user_id)
+
+        snapshots = (
+            SnapshotService.get_training_hours_snapshots(
+                periods, department_ids)
+            .filter(administrative_department_id__in=t3_department_names)
+            .values_list('administrative_department_id', 'user_id',
+                         'num_hours')
+        )
+        for administrative_department_id, user_id, num_hours in snapshots:
+            accumulate(t3_department_names[administrative_department_id],
+                       user_id, num_hours)
+        for start_time, end_time in live_ranges:
+            records = (
+                CoverageStatisticsService.get_training_records(
+                    user, department_id=department_id,
+                    start_time=start_time, end_time=end_time)
+                .filter(user__administrative_department__department_type='T3')
+                .values_list('user__administrative_department__name',
+                             'user_id', 'campus_event__num_hours')
+            )
+            for department_name, user_id, num_hours in records:
+                accumulate(department_name, user_id, num_hours)
+        data = []
+        for department_name, users in coveraged_users.items():
+            data.append(
+                {
+                    'department': department_name,
+                    'total_hours': total_hours[department_name],
+                    'total_coveraged_users': len(users),
+                    'total_users': UserService.get_full_time_teachers().filter(
+                        administrative_department__name=department_name
+                    ).count()
+                }
+            )
+        return data
@@ -1,5 +1,4 @@
 '''Service for export records'''
-from django.db.models import Q
 from training_record.models import Record
 
 
@@ -10,16 +9,9 @@ class TrainingRecordService:
                     event_location, start_time, end_time):
         '''get matched records'''
         return Record.objects.filter(
-            Q(user=user),
-            (
-                Q(off_campus_event__name__startswith=event_name) &
-                Q(off_campus_event__location__startswith=event_location) &
-                Q(off_campus_event__time__gte=start_time) &
-                Q(off_campus_event__time__lte=end_time)
-            ) | (
-                Q(campus_event__name__startswith=event_name) &
-                Q(campus_event__location__startswith=event_location) &
-                Q(campus_event__time__gte=start_time) &
-                Q(campus_event__time__lte=end_time)
-            )
+            user=user,
+            event_name__startswith=event_name,
+            event_location__startswith=event_location,
+            event_time__gte=start_time,
+            event_time__lte=end_time,
         )
@@ -7,7 +7,7 @@ from django.db import models
 from django.db.models import functions
 from django.utils.timezone import now, localtime
 
-from training_event.models import Enrollment, EventCoefficient
+from training_event.models import CampusEvent, Enrollment, EventCoefficient
 from training_record.models import Record
 
 
@@ -57,11 +57,12 @@ class UserCoreStatisticsService:
         competition_award_info = (
             Record.valid_objects
             .filter(user=user)
-            .filter(campus_event__name__regex=r'(校|市|省|国家)级(.*奖)')
+            .filter(event_kind=Record.EVENT_KIND_CAMPUS)
+            .filter(event_award_level__gt=CampusEvent.AWARD_LEVEL_NONE)
             .filter(create_time__gte=start_time)
             .filter(create_time__lte=end_time)
-            .order_by('-campus_event__time')
-            .values_list('campus_event__name', flat=True)
+            .order_by('-event_time')
+            .values_list('event_name', flat=True)
             .first()
         )
         if competition_award_info:
@@ -81,6 +82,24 @@ class UserCoreStatisticsService:
         cache.set(cache_key, res, 8 * 3600)  # Cache for 8 hours
         return res
 
+    @staticmethod
+    def format_month(dt_instance):
+        '''Format month labels of monthly statistics.'''
+        return dt_instance.strftime('%Y年%m月')
+
+    @staticmethod
+    def get_monthly_statistics_range():
+        '''Return the start time and month labels of last 12 months.'''
+        current_time = now().replace(day=30)
+        start_time = current_time.replace(year=current_time.year-1, day=1,
+                                          hour=0, minute=0, second=0)
+        months = []
+        tmp_time = start_time
+        while tmp_time <= current_time:
+            months.append(UserCoreStatisticsService.format_month(tmp_time))
+            tmp_time += timedelta(days=31)
+        return start_time, months
+
     @staticmethod
     def get_monthly_added_records_statistics(
             user, context=None):  # pylint: disable=unused-argument
@@ -111,12 +130,9 @@ class UserCoreStatisticsService:
         cached_value = cache.get(cache_key)
         if cached_value:
             return cached_value
-        current_time = now().replace(day=30)
-        start_time = current_time.replace(year=current_time.year-1, day=1,
-                                          hour=0, minute=0, second=0)
-
-        def format_time(dt_instance):
-            return dt_instance.strftime('%Y年%m月')
+        start_time, months = (
+            UserCoreStatisticsService.get_monthly_statistics_range())
+        format_time = UserCoreStatisticsService.format_month
 
         monthly_records = {format_time(x['month']): x for x in (
             Record.valid_objects
@@ -133,11 +149,6 @@ class UserCoreStatisticsService:
                 off_campus_count=models.Count('off_campus_event'))
             .values('month', 'campus_count', 'off_campus_count')
         )}
-        months = []
-        tmp_time = start_time
-        while tmp_time <= current_time:
-            months.append(format_time(tmp_time))
-            tmp_time += timedelta(days=31)
         campus_data = [
             monthly_records.get(x, {'campus_count': 0})['campus_count']
             for x in months]
@@ -30,11 +30,15 @@ class UserRankingService:
             Ranking.objects
             .filter(ranking_type=ranking_type)
             .filter(department_id=department_id)
-            .count() + 1e-5
+            .count()
         )
-        ranking = cls.round_ranking_float(ranking / total)
-        ranking = f'前 {ranking:.0%}'
-        return ranking
+        return cls.format_ranking(ranking, total)
+
+    @classmethod
+    def format_ranking(cls, ranking, total):
+        '''Human-readable string for ranking among total users.'''
+        ranking = cls.round_ranking_float(ranking / (total + 1e-5))
+        return f'前 {ranking:.0%}'
 
     @classmethod
     def get_total_training_hours_ranking_in_department(
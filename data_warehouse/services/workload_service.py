@@ -3,10 +3,10 @@ from itertools import chain
 import tempfile
 
 import xlwt
-from django.utils.timezone import now
 
 from training_record.models import Record
 from auth.models import User
+from data_warehouse.services.snapshot_service import SnapshotService
 
 
 class WorkloadCalculationService:
@@ -41,25 +41,50 @@ class WorkloadCalculationService:
             key 为学部老师
             values 为该老师在规定查询时间段内的工时
         """
-        if end_time is None:
-            end_time = now()
-        if start_time is None:
-            start_time = end_time.replace(month=1, day=1, hour=0, minute=0,
-                                          second=0)
+        start_time, end_time = SnapshotService.get_default_time_range(
+            start_time, end_time)
         if teachers is None:
             teachers = User.objects.exclude(
                 administrative_department__isnull=True)
             if administrative_department is not None:
                 teachers = teachers.filter(
                     administrative_department=administrative_department)
+        # Closed periods are read from snapshots, only the remaining time
+        # ranges are computed from records.
+        periods, live_ranges = SnapshotService.split_time_range(
+            start_time, end_time)
+        result = {}
+        if periods:
+            snapshots = (
+                SnapshotService.get_snapshots(periods)
+                .filter(user__in=teachers, num_valid_records__gt=0)
+                .values_list('user_id', 'workload')
+            )
+            workloads = {}
+            for user_id, workload in snapshots:
+                workloads.setdefault(user_id, 0)
+                workloads[user_id] += workload
+            users = User.objects.select_related(
+                'administrative_department').in_bulk(list(workloads))
+            for user_id, workload in workloads.items():
+                result[users[user_id]] = workload
+        for live_start_time, live_end_time in live_ranges:
+            WorkloadCalculationService._calculate_workload_from_records(
+                teachers, live_start_time, live_end_time, result)
+        return result
+
+    @staticmethod
+    def _calculate_workload_from_records(teachers, start_time, end_time,
+                                         result):
+        '''Accumulate workload of valid records in time range into result.'''
         campus_records = (
             Record.valid_objects
             .select_related('event_coefficient', 'user',
                             'user__administrative_department')
             .filter(user__in=teachers,
-                    campus_event__isnull=False,
-                    campus_event__time__gte=start_time,
-                    campus_event__time__lte=end_time)
+                    event_kind=Record.EVENT_KIND_CAMPUS,
+                    event_time__gte=start_time,
+                    event_time__lte=end_time)
         )
 
         off_campus_records = (
@@ -67,18 +92,16 @@ class WorkloadCalculationService:
             .select_related('event_coefficient', 'user',
                             'user__administrative_department')
             .filter(user__in=teachers,
-                    off_campus_event__isnull=False,
-                    off_campus_event__time__gte=start_time,
-                    off_campus_event__time__lte=end_time)
+                    event_kind=Record.EVENT_KIND_OFF_CAMPUS,
+                    event_time__gte=start_time,
+                    event_time__lte=end_time)
         )
-        result = {}
         for record in chain(campus_records, off_campus_records):
             user = record.user
             result.setdefault(user, 0)
             result[user] += (
                 record.event_coefficient.calculate_event_workload(record)
             )
-
         return result
 
     @staticmethod
@@ -1,22 +1,23 @@
 '''Celery tasks.'''
-import smtplib
+from datetime import timedelta
 
 from celery import shared_task
-from django.db import transaction
+from django.db import DatabaseError, transaction
 from django.utils.timezone import now, localtime
-from django.template.loader import render_to_string
-from django.core.mail import send_mass_mail
+from django.template.loader import get_template
+from django.utils.dateparse import parse_datetime
 from django.contrib.sites.models import Site
-from tqdm import tqdm
 
 from auth.services import UserService
 
+from data_warehouse.models import ClosedPeriod
 from data_warehouse.services import (
-    UserRankingService, AggregateDataService,
+    UserRankingService, AggregateDataService, SnapshotService,
+    BulkPersonalSummaryService,
 )
 from infra.utils import prod_logger
-from infra.services import SOAPMSGService, SOAPSMSService
-from training_event.models import CampusEvent, Enrollment
+from infra.services import OutboxService
+from training_event.models import Enrollment
 
 
 @shared_task
@@ -26,7 +27,29 @@ def generate_user_rankings():
     UserRankingService.generate_user_rankings()
 
 
-def check_user_activity(user, start_time, end_time):
+@shared_task
+def close_last_year_period():
+    '''Close the statistics period of last year and freeze its figures.'''
+    this_year = localtime(now()).replace(month=1, day=1, hour=0, minute=0,
+                                         second=0, microsecond=0)
+    start_time = this_year.replace(year=this_year.year-1)
+    end_time = this_year - SnapshotService.TIME_RESOLUTION
+    if ClosedPeriod.objects.filter(start_time__lte=end_time,
+                                   end_time__gte=start_time).exists():
+        msg = f'{start_time.year}年统计周期已关闭，跳过'
+        prod_logger.info(msg)
+        return
+    SnapshotService.close_period(start_time, end_time,
+                                 name=f'{start_time.year}年度')
+
+
+@shared_task
+def rebuild_stale_snapshots():
+    '''Rebuild snapshots of closed periods whose records were edited.'''
+    SnapshotService.rebuild_stale_periods()
+
+
+def check_user_activity(user, start_time, end_time, data=None):
     '''
     Return whether the user is an active participant along
     with his/her statistics.
@@ -39,6 +62,10 @@ def check_user_activity(user, start_time, end_time):
         The start time of data for aggregation.
     end_time: datetime
         The end time of data for aggregation.
+    data: dict, optional
+        Pre-computed statistics of the user, see
+        BulkPersonalSummaryService.get_personal_summaries(). If None, the
+        statistics will be computed by AggregateDataService.
 
     Return
     ------
@@ -47,18 +74,130 @@ def check_user_activity(user, start_time, end_time):
     statistics: dict
         Detailed statistics about the user.
     '''
-    context = {
-        'user': user,
-        'start_time': start_time.strftime('%Y-%m-%dT%H:%M'),
-        'end_time': end_time.strftime('%Y-%m-%dT%H:%M'),
-    }
-    data = AggregateDataService.personal_summary(context)
+    if data is None:
+        context = {
+            'user': user,
+            'start_time': start_time.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': end_time.strftime('%Y-%m-%dT%H:%M'),
+        }
+        data = AggregateDataService.personal_summary(context)
     # TODO: Replace with more reasonable settings
     return True, data
 
 
+INACTIVE_USERS_CHUNK_SIZE = 200
+
+
+def get_annual_report_time_range():
+    '''Return the time range of the annual report.'''
+    end_time = now()
+    start_time = end_time.replace(year=end_time.year-1)
+    return start_time, end_time
+
+
+def build_mails_for_inactive_users(user_ids, start_time, end_time,
+                                   skip_users=()):
+    '''Build annual report mails for inactive users among user_ids.
+
+    Statistics of all users are computed in bulk, so the number of queries
+    does not grow with the number of users.
+    '''
+    skip_users = set(skip_users)
+    users = list(
+        UserService.get_full_time_teachers()
+        .filter(id__in=user_ids)
+        .order_by('id')
+    )
+    summaries = BulkPersonalSummaryService.get_personal_summaries(
+        users, start_time, end_time)
+    template = get_template('mail_template_for_inactive_user.html')
+    site = Site.objects.get_current()
+    mails = []
+    for user in users:
+        is_active, data = check_user_activity(
+            user, start_time, end_time, data=summaries[user.id])
+        if is_active:
+            continue
+        if user.id in skip_users:
+            msg = (
+                f'{user.first_name}({user.username}, {user.email})'
+                f'未满足活跃用户条件，但由于其id出现在忽略用户列表中，'
+                f'将不会向其发送年度报告邮件'
+            )
+            prod_logger.info(msg)
+            continue
+        msg = template.render({
+            'site': site,
+            'user': user,
+            'year_of_the_data': start_time.year,
+            'data': data,
+        })
+        mails.append((
+            '大连理工大学专任教师教学培训管理系统年度报告',
+            msg,
+            'TMSFTT',
+            [user.email],
+        ))
+    return mails
+
+
+def chunk_user_ids(users, chunk_size=INACTIVE_USERS_CHUNK_SIZE):
+    '''Yield ids of users in chunks.'''
+    user_ids = list(users.order_by('id').values_list('id', flat=True))
+    for idx in range(0, len(user_ids), chunk_size):
+        yield user_ids[idx:idx + chunk_size]
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=5 * 60)
+def send_mail_to_inactive_users_chunk(self, user_ids, start_time, end_time,
+                                      skip_users=None):
+    '''Enqueue annual report mails of a chunk of users into the outbox.
+
+    Mails are delivered and retried one by one by the outbox, so a failed
+    mail never causes other mails of the chunk to be sent again. The chunk
+    is retried only if its mails can't be enqueued, in which case none of
+    them were.
+
+    Parameters
+    ----------
+    user_ids: list
+        The ids of the users in this chunk.
+    start_time: str
+        The start time of data for aggregation, in ISO 8601 format.
+    end_time: str
+        The end time of data for aggregation, in ISO 8601 format.
+    skip_users: list
+        The ids of the users which should be ignored when sending mails.
+    '''
+    mails = build_mails_for_inactive_users(
+        user_ids, parse_datetime(start_time), parse_datetime(end_time),
+        skip_users or ())
+    try:
+        with transaction.atomic():
+            OutboxService.enqueue_mails(mails)
+    except DatabaseError as exc:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=exc)
+        msg = (
+            f'系统在为{len(user_ids)}位教师发送年度报告邮件时发生错误，'
+            f'已重试{self.max_retries}次，错误信息为：{exc}'
+        )
+        prod_logger.error(msg)
+
+
 @shared_task
-def send_mail_to_inactive_users(skip_users=None):
+def send_mail_to_inactive_users_in_department(department_id, start_time,
+                                              end_time, skip_users=None):
+    '''Split users in the department into chunks and send mails.'''
+    users = UserService.get_full_time_teachers().filter(
+        administrative_department_id=department_id)
+    for user_ids in chunk_user_ids(users):
+        send_mail_to_inactive_users_chunk.delay(
+            user_ids, start_time, end_time, skip_users)
+
+
+@shared_task
+def send_mail_to_inactive_users(skip_users=None, fan_out=False):
     '''Send emails to inactive users to encourage them to be active.
 
     Parameters
@@ -66,115 +205,139 @@ def send_mail_to_inactive_users(skip_users=None):
     skip_users: list
         The ids of the users which should be ignored when sending mails.
         Default: None.
+    fan_out: bool
+        Whether to dispatch the work to celery workers by department, every
+        department is split into chunks which are retried independently.
+        Default: False, all mails are enqueued into the outbox in this task
+        chunk by chunk.
     '''
     if skip_users is None:
         skip_users = []
-    skip_users = set(skip_users)
-    end_time = now()
-    start_time = end_time.replace(year=end_time.year-1)
-
+    start_time, end_time = get_annual_report_time_range()
     users = UserService.get_full_time_teachers()
-    mails = []
 
-    for user in tqdm(users):
-        is_active, data = check_user_activity(user, start_time, end_time)
-        if not is_active:
-            if user.id in skip_users:
-                msg = (
-                    f'{user.first_name}({user.username}, {user.email})'
-                    f'未满足活跃用户条件，但由于其id出现在忽略用户列表中，'
-                    f'将不会向其发送年度报告邮件'
-                )
-                prod_logger.info(msg)
-                continue
-            msg = render_to_string(
-                'mail_template_for_inactive_user.html',
-                context={
-                    'site': Site.objects.get_current(),
-                    'user': user,
-                    'year_of_the_data': start_time.year,
-                    'data': data,
-                }
-            )
-            mail = (
-                '大连理工大学专任教师教学培训管理系统年度报告',
-                msg,
-                'TMSFTT',
-                [user.email],
-            )
-            mails.append(mail)
-    try:
-        send_mass_mail(mails, fail_silently=False)
-    except smtplib.SMTPException as exc:
-        msg = (
-            '系统在为每位教师发送年度报告邮件时发生错误，'
-            f'部分邮件可能未成功发送，错误信息为：{exc}'
+    if fan_out:
+        department_ids = (
+            users.order_by()
+            .values_list('administrative_department_id', flat=True)
+            .distinct()
         )
-        prod_logger.error(msg)
+        for department_id in department_ids:
+            send_mail_to_inactive_users_in_department.delay(
+                department_id, start_time.isoformat(), end_time.isoformat(),
+                list(skip_users))
+        return
 
+    for user_ids in chunk_user_ids(users):
+        mails = build_mails_for_inactive_users(
+            user_ids, start_time, end_time, skip_users)
+        try:
+            with transaction.atomic():
+                OutboxService.enqueue_mails(mails)
+        except DatabaseError as exc:
+            msg = (
+                f'系统在为{len(user_ids)}位教师发送年度报告邮件时发生错误，'
+                f'这些邮件未能加入发送队列，错误信息为：{exc}'
+            )
+            prod_logger.error(msg)
 
-# pylint: disable=too-many-locals
-@shared_task
-def send_mail_to_users_with_events_next_day():
-    '''send mail to users who will attend events tomorrow'''
-    current_time = localtime(now())
-    start_time = current_time.replace(day=current_time.day+1,
-                                      hour=0, minute=0, second=0)
-    end_time = current_time.replace(day=current_time.day+2,
-                                    hour=0, minute=0, second=0)
 
-    events = CampusEvent.objects.filter(time__gte=start_time,
-                                        time__lt=end_time)
-    enrollments = []
-    for event in events:
-        enrollments.extend(Enrollment.objects.filter(campus_event=event))
+EVENT_REMINDER_BATCH_SIZE = 200
 
+
+def build_event_reminders(enrollments):
+    '''Build mails, SMSes and portal messages for a batch of enrollments.'''
     mails = []
     smses = []
     msges = []
     for enrollment in enrollments:
         user = enrollment.user
+        event = enrollment.campus_event
         msg = ('老师，您好！{}定于{}月{}日(星期{})，在{}，如期组织{}活动。'
                '清您准时参加，谢谢！').format(
-                   enrollment.campus_event.program.department,
-                   enrollment.campus_event.time.month,
-                   enrollment.campus_event.time.day,
-                   enrollment.campus_event.time.weekday(),
-                   enrollment.campus_event.location,
-                   enrollment.campus_event)
-        mail = (
+                   event.program.department,
+                   event.time.month,
+                   event.time.day,
+                   event.time.weekday(),
+                   event.location,
+                   event)
+        mails.append((
             '培训活动提醒',
             msg,
             'TMSFTT',
             [user.email],
-        )
-        mails.append(mail)
-        sms = {
+        ))
+        smses.append({
             'user_phone_number': user.cell_phone_number,
             'sms_info': msg,
-        }
-        smses.append(sms)
-        msg_info = {
+        })
+        msges.append({
             'user_username': user.username,
             'msg_title': '培训活动提醒',
             'msg_info': msg,
-        }
-        msges.append(msg_info)
-    try:
-        send_mass_mail(mails, fail_silently=False)
-    except smtplib.SMTPException as exc:
-        msg = (
-            '系统在提醒教师参加活动时发生错误，'
-            f'部分邮件可能未成功发送，错误信息为：{exc}'
-        )
-        prod_logger.error(msg)
+        })
+    return mails, smses, msges
+
 
+def dispatch_event_reminders(enrollments, stats):
+    '''Enqueue reminders of a batch into the outbox.'''
+    mails, smses, msges = build_event_reminders(enrollments)
     try:
-        SOAPSMSService.send_sms(smses)
-        SOAPMSGService.send_msg(msges)
-    except Exception as exc:
+        with transaction.atomic():
+            OutboxService.enqueue_mails(mails)
+            OutboxService.enqueue_smses(smses)
+            OutboxService.enqueue_msges(msges)
+    except Exception as exc:  # pylint: disable=broad-except
+        stats['failed'] += len(enrollments)
         msg = (
-            '系统在提醒教师参加活动时发生错误，'
-            f'部分信息可能未成功发送，错误信息为：{exc}'
+            f'系统在提醒教师参加活动时发生错误，{len(enrollments)}位教师的'
+            f'提醒可能未成功发送，错误信息为：{exc}'
         )
         prod_logger.error(msg)
+    else:
+        stats['queued'] += len(enrollments)
+
+
+@shared_task
+def send_mail_to_users_with_events_next_day(
+        batch_size=EVENT_REMINDER_BATCH_SIZE):
+    '''send mail to users who will attend events tomorrow
+
+    Enrollments are streamed from a single joined query, and reminders are
+    built and enqueued into the outbox in bounded batches, so time and
+    memory usage stay flat no matter how many enrollments there are.
+
+    Return
+    ------
+    stats: dict
+        The number of queued and failed reminders.
+    '''
+    current_time = localtime(now())
+    start_time = (current_time + timedelta(days=1)).replace(
+        hour=0, minute=0, second=0)
+    end_time = start_time + timedelta(days=1)
+
+    enrollments = (
+        Enrollment.objects
+        .filter(campus_event__time__gte=start_time,
+                campus_event__time__lt=end_time)
+        .select_related('user', 'campus_event__program__department')
+        .only('user__email', 'user__cell_phone_number', 'user__username',
+              'campus_event__name', 'campus_event__time',
+              'campus_event__location',
+              'campus_event__program__department__name')
+        .order_by('id')
+        .iterator(chunk_size=batch_size)
+    )
+    stats = {'queued': 0, 'failed': 0}
+    batch = []
+    for enrollment in enrollments:
+        batch.append(enrollment)
+        if len(batch) >= batch_size:
+            dispatch_event_reminders(batch, stats)
+            batch = []
+    if batch:
+        dispatch_event_reminders(batch, stats)
+    msg = f'活动提醒发送完毕：{stats}'
+    prod_logger.info(msg)
+    return stats
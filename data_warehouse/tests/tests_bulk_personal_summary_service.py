@@ -0,0 +1,100 @@
+'''Unit tests for bulk personal summary services.'''
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now, localtime
+from model_mommy import mommy
+
+from auth.models import Department
+from data_warehouse.models import Ranking
+from data_warehouse.services import (
+    AggregateDataService, BulkPersonalSummaryService
+)
+from training_event.models import CampusEvent, Enrollment, EventCoefficient
+from training_record.models import Record
+
+
+User = get_user_model()
+
+
+class TestBulkPersonalSummaryService(TestCase):
+    '''Test services provided by BulkPersonalSummaryService.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.dlut = mommy.make(Department, name='大连理工大学')
+        cls.department = mommy.make(Department, department_type='T3')
+        cls.users = mommy.make(User, administrative_department=cls.department,
+                               teaching_type='专任教师', _quantity=4)
+        award_event = mommy.make(
+            CampusEvent, name='大学生竞赛|省级|一等奖', time=now())
+        events = [award_event] + mommy.make(CampusEvent, _quantity=2)
+        for idx, user in enumerate(cls.users[:3]):
+            for event in events[idx:]:
+                mommy.make(Enrollment, user=user, campus_event=event)
+                mommy.make(
+                    Record, user=user, campus_event=event,
+                    event_coefficient__role=(
+                        EventCoefficient.ROLE_EXPERT if idx == 0
+                        else EventCoefficient.ROLE_PARTICIPATOR))
+            mommy.make(Record, user=user, off_campus_event__time=now(),
+                       status=Record.STATUS_SCHOOL_ADMIN_APPROVED)
+        for ranking, user in enumerate(cls.users[:3], 1):
+            for department in (cls.department, cls.dlut):
+                mommy.make(
+                    Ranking, user=user, department=department,
+                    ranking=ranking, value=0,
+                    ranking_type=Ranking.RANKING_BY_TOTAL_TRAINING_HOURS)
+
+    def get_expected_summary(self, user, start_time, end_time):
+        '''Compute summary of the user by AggregateDataService.'''
+        return AggregateDataService.personal_summary({
+            'user': user,
+            'start_time': start_time.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': end_time.strftime('%Y-%m-%dT%H:%M'),
+        })
+
+    @staticmethod
+    def strip_timestamps(summary):
+        '''Remove timestamps which differ between calls.'''
+        return {
+            key: {k: v for k, v in value.items() if k != 'timestamp'}
+            for key, value in summary.items()
+        }
+
+    @patch('data_warehouse.services.user_core_statistics_service.cache')
+    @patch('data_warehouse.services.user_ranking_service.cache')
+    def test_get_personal_summaries(self, mocked_cache, mocked_core_cache):
+        '''Should return the same summaries as personal_summary().'''
+        mocked_cache.get.return_value = None
+        mocked_core_cache.get.return_value = None
+        end_time = localtime(now()) + timedelta(days=1)
+        start_time = end_time - timedelta(days=365)
+
+        summaries = BulkPersonalSummaryService.get_personal_summaries(
+            self.users, start_time, end_time)
+
+        self.assertEqual(set(summaries), {user.id for user in self.users})
+        for user in self.users:
+            self.assertEqual(
+                self.strip_timestamps(summaries[user.id]),
+                self.strip_timestamps(
+                    self.get_expected_summary(user, start_time, end_time)))
+        award = summaries[self.users[0].id]['competition_award_info']
+        self.assertEqual(award['data']['level'], '省级')
+
+    def test_get_personal_summaries_constant_queries(self):
+        '''Should not issue more queries for more users.'''
+        end_time = now() + timedelta(days=1)
+        start_time = end_time - timedelta(days=365)
+        with CaptureQueriesContext(connection) as context:
+            BulkPersonalSummaryService.get_personal_summaries(
+                self.users[:1], start_time, end_time)
+        num_queries = len(context.captured_queries)
+
+        with self.assertNumQueries(num_queries):
+            BulkPersonalSummaryService.get_personal_summaries(
+                self.users, start_time, end_time)
@@ -0,0 +1,289 @@
+'''Unit tests for snapshot services.'''
+from datetime import timedelta
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from django.contrib.auth.models import Group
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.timezone import now, localtime
+from model_mommy import mommy
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from auth.models import Department, User, UserGroup
+from data_warehouse.models import ClosedPeriod, TrainingSnapshot
+from data_warehouse.services.coverage_statistics_service import (
+    CoverageStatisticsService
+)
+from data_warehouse.services.snapshot_service import SnapshotService
+from data_warehouse.services.training_hours_statistics_service import (
+    TrainingHoursStatisticsService
+)
+from data_warehouse.services.workload_service import (
+    WorkloadCalculationService
+)
+from data_warehouse.tasks import (
+    close_last_year_period, rebuild_stale_snapshots
+)
+from infra.exceptions import BadRequest
+from training_event.models import CampusEvent, EventCoefficient, OffCampusEvent
+from training_record.models import Record
+
+
+class TestSnapshotService(TestCase):
+    '''Test services provided by SnapshotService.'''
+    NUM_HOURS = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.end_time = now()
+        cls.start_time = cls.end_time - timedelta(days=100)
+        cls.closed_start_time = cls.start_time + timedelta(days=10)
+        cls.closed_end_time = cls.start_time + timedelta(days=20)
+        cls.department = mommy.make(Department, department_type='T3')
+        cls.user = mommy.make(User, administrative_department=cls.department,
+                              teaching_type='专任教师')
+        cls.closed_event = mommy.make(
+            CampusEvent, num_hours=cls.NUM_HOURS,
+            program__department=cls.department,
+            time=cls.closed_start_time + timedelta(days=1))
+        cls.open_event = mommy.make(
+            CampusEvent, num_hours=cls.NUM_HOURS,
+            program__department=cls.department,
+            time=cls.closed_end_time + timedelta(days=1))
+        cls.off_campus_event = mommy.make(
+            OffCampusEvent, num_hours=cls.NUM_HOURS,
+            time=cls.closed_start_time + timedelta(days=2))
+        for event in (cls.closed_event, cls.open_event):
+            coefficient = mommy.make(
+                EventCoefficient, campus_event=event, coefficient=1,
+                hours_option=EventCoefficient.ROUND_METHOD_CEIL,
+                workload_option=EventCoefficient.ROUND_METHOD_CEIL)
+            mommy.make(Record, campus_event=event, user=cls.user,
+                       event_coefficient=coefficient)
+        coefficient = mommy.make(
+            EventCoefficient, off_campus_event=cls.off_campus_event,
+            coefficient=1,
+            hours_option=EventCoefficient.ROUND_METHOD_CEIL,
+            workload_option=EventCoefficient.ROUND_METHOD_CEIL)
+        cls.off_campus_record = mommy.make(
+            Record, off_campus_event=cls.off_campus_event, user=cls.user,
+            event_coefficient=coefficient,
+            status=Record.STATUS_SCHOOL_ADMIN_APPROVED)
+
+    def close_period(self):
+        '''Close the period containing closed_event.'''
+        return SnapshotService.close_period(
+            self.closed_start_time, self.closed_end_time)
+
+    def test_close_period(self):
+        '''Should freeze records of the period into snapshots.'''
+        period = self.close_period()
+
+        self.assertFalse(period.is_stale)
+        campus_snapshot = TrainingSnapshot.objects.get(
+            period=period, is_campus=True)
+        self.assertEqual(campus_snapshot.user, self.user)
+        self.assertEqual(campus_snapshot.program_department, self.department)
+        self.assertEqual(campus_snapshot.administrative_department,
+                         self.department)
+        self.assertEqual(campus_snapshot.num_records, 1)
+        self.assertEqual(campus_snapshot.num_hours, self.NUM_HOURS)
+        self.assertEqual(campus_snapshot.workload, self.NUM_HOURS)
+        off_campus_snapshot = TrainingSnapshot.objects.get(
+            period=period, is_campus=False)
+        self.assertIsNone(off_campus_snapshot.program_department)
+        self.assertEqual(off_campus_snapshot.num_valid_records, 1)
+        self.assertEqual(off_campus_snapshot.num_hours, 0)
+
+    def test_close_period_overlapped(self):
+        '''Should raise BadRequest if periods overlap.'''
+        self.close_period()
+
+        with self.assertRaisesMessage(BadRequest, '统计周期与已关闭周期重叠'):
+            SnapshotService.close_period(
+                self.closed_end_time - timedelta(days=1), self.end_time)
+
+    def test_close_period_invalid_range(self):
+        '''Should raise BadRequest if start_time is after end_time.'''
+        with self.assertRaises(BadRequest):
+            SnapshotService.close_period(self.end_time, self.start_time)
+
+    def test_split_time_range(self):
+        '''Should split time range into periods and live ranges.'''
+        period = self.close_period()
+
+        periods, live_ranges = SnapshotService.split_time_range(
+            self.start_time, self.end_time)
+
+        self.assertEqual(periods, [period])
+        self.assertEqual(live_ranges, [
+            (self.start_time,
+             self.closed_start_time - SnapshotService.TIME_RESOLUTION),
+            (self.closed_end_time + SnapshotService.TIME_RESOLUTION,
+             self.end_time),
+        ])
+
+    def test_split_time_range_partial_period(self):
+        '''Should compute periods not inside the range live.'''
+        self.close_period()
+        start_time = self.closed_start_time + timedelta(days=1)
+
+        periods, live_ranges = SnapshotService.split_time_range(
+            start_time, self.end_time)
+
+        self.assertEqual(periods, [])
+        self.assertEqual(live_ranges, [(start_time, self.end_time)])
+
+    def test_invalidate_by_record(self):
+        '''Should mark period as stale if its records change.'''
+        period = self.close_period()
+
+        self.off_campus_record.status = Record.STATUS_CLOSED
+        self.off_campus_record.save()
+
+        period.refresh_from_db()
+        self.assertTrue(period.is_stale)
+        periods, _ = SnapshotService.split_time_range(
+            self.start_time, self.end_time)
+        self.assertEqual(periods, [])
+
+    def test_invalidate_by_event_moved_out(self):
+        '''Should mark period as stale if an event is moved out of it.'''
+        period = self.close_period()
+
+        self.closed_event.time = self.end_time
+        self.closed_event.save()
+
+        period.refresh_from_db()
+        self.assertTrue(period.is_stale)
+
+    def test_record_out_of_period_not_invalidate(self):
+        '''Should keep period up-to-date if other records change.'''
+        period = self.close_period()
+
+        Record.objects.get(campus_event=self.open_event).save()
+
+        period.refresh_from_db()
+        self.assertFalse(period.is_stale)
+
+    def test_rebuild_stale_periods(self):
+        '''Should rebuild snapshots of stale periods.'''
+        period = self.close_period()
+        self.off_campus_record.status = Record.STATUS_CLOSED
+        self.off_campus_record.save()
+
+        self.assertEqual(SnapshotService.rebuild_stale_periods(), 1)
+
+        period.refresh_from_db()
+        self.assertFalse(period.is_stale)
+        off_campus_snapshot = TrainingSnapshot.objects.get(
+            period=period, is_campus=False)
+        self.assertEqual(off_campus_snapshot.num_valid_records, 0)
+        self.assertEqual(off_campus_snapshot.workload, 0)
+
+    def test_workload_uses_snapshots(self):
+        '''Should merge snapshots with live workload.'''
+        expected = WorkloadCalculationService.calculate_workload_by_query(
+            administrative_department=self.department,
+            start_time=self.start_time, end_time=self.end_time)
+        self.close_period()
+        # Update the event without signals, the snapshots should be used.
+        CampusEvent.objects.filter(pk=self.closed_event.pk).update(
+            num_hours=self.NUM_HOURS * 2)
+
+        result = WorkloadCalculationService.calculate_workload_by_query(
+            administrative_department=self.department,
+            start_time=self.start_time, end_time=self.end_time)
+
+        self.assertEqual(result, expected)
+
+    def test_training_hours_uses_snapshots(self):
+        '''Should merge snapshots with live training hours.'''
+        user = MagicMock()
+        type(user).is_school_admin = PropertyMock(return_value=False)
+        type(user).is_department_admin = PropertyMock(return_value=True)
+        type(user.administrative_department).id = PropertyMock(
+            return_value=self.department.id)
+        user.check_department_admin.return_value = True
+        expected = TrainingHoursStatisticsService.get_training_hours_data(
+            user, self.start_time, self.end_time)
+        self.close_period()
+
+        with patch('data_warehouse.services.training_hours_statistics_service'
+                   '.CoverageStatisticsService.get_training_records',
+                   wraps=CoverageStatisticsService.get_training_records
+                   ) as mocked_get_records:
+            data = TrainingHoursStatisticsService.get_training_hours_data(
+                user, self.start_time, self.end_time)
+
+        self.assertEqual(mocked_get_records.call_count, 2)
+        self.assertEqual(data, expected)
+        self.assertEqual(data[0]['total_hours'], self.NUM_HOURS * 2)
+        self.assertEqual(data[0]['total_coveraged_users'], 1)
+
+
+class TestSnapshotTasks(TestCase):
+    '''Test celery tasks of snapshots.'''
+    def test_close_last_year_period(self):
+        '''Should close last year only once.'''
+        close_last_year_period()
+        close_last_year_period()
+
+        period = ClosedPeriod.objects.get()
+        self.assertEqual(localtime(period.start_time).year,
+                         localtime(now()).year - 1)
+
+    @patch('data_warehouse.tasks.SnapshotService.rebuild_stale_periods')
+    def test_rebuild_stale_snapshots(self, mocked_rebuild):
+        '''Should call SnapshotService.rebuild_stale_periods().'''
+        rebuild_stale_snapshots()
+
+        mocked_rebuild.assert_called()
+
+
+class TestClosedPeriodViewSet(APITestCase):
+    '''Unit tests for ClosedPeriodViewSet.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = mommy.make(User)
+        group = mommy.make(Group, name='大连理工大学-10141-管理员')
+        mommy.make(UserGroup, user=cls.user, group=group)
+
+    def test_create_period(self):
+        '''Should close period.'''
+        self.client.force_authenticate(self.user)
+        end_time = now()
+        data = {
+            'start_time': end_time - timedelta(days=30),
+            'end_time': end_time,
+            'name': '测试周期',
+        }
+
+        response = self.client.post(reverse('closed-periods-list'), data,
+                                    format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['closed_by'], self.user.id)
+        self.assertEqual(ClosedPeriod.objects.get().name, '测试周期')
+
+    def test_rebuild_period(self):
+        '''Should rebuild snapshots of period.'''
+        self.client.force_authenticate(self.user)
+        period = mommy.make(ClosedPeriod, is_stale=True,
+                            start_time=now() - timedelta(days=1),
+                            end_time=now())
+
+        response = self.client.post(
+            reverse('closed-periods-rebuild', args=(period.pk,)))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['is_stale'])
+
+    def test_non_school_admin(self):
+        '''Should deny non school admins.'''
+        self.client.force_authenticate(mommy.make(User))
+
+        response = self.client.get(reverse('closed-periods-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -378,3 +378,20 @@ class TestTableExportServices(TestCase):
         self.assertEqual(sheet.cell_value(3, 4), '123456789')
         self.assertEqual(sheet.cell_value(3, 5), 'a@a.com')
         self.assertEqual(sheet.cell_value(3, 6), '教授')
+
+    def test_export_attendance_sheet_signed(self):
+        '''Should mark signed users in the attendance sheet.'''
+        event = mommy.make(CampusEvent, num_participants=10)
+        enrollments = [
+            mommy.make(Enrollment, campus_event=event, is_signed=is_signed,
+                       user=mommy.make(User, department=mommy.make(
+                           Department)))
+            for is_signed in (True, False)
+        ]
+
+        file_path = TableExportService.export_attendance_sheet(enrollments)
+
+        sheet = xlrd.open_workbook(file_path).sheet_by_name(
+            TableExportService.ATTENDANCE_SHEET_NAME)
+        self.assertEqual(sheet.cell_value(3, 8), '已签到')
+        self.assertEqual(sheet.cell_value(4, 8), '')
@@ -1,15 +1,21 @@
 '''Unit tests for data_warehouse celery tasks.'''
+from datetime import timedelta
 from unittest.mock import patch
 
 from model_mommy import mommy
+from django.db import DatabaseError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now, localtime
 
-from auth.models import User
+from auth.models import User, Department
 from data_warehouse.tasks import (
     generate_user_rankings, send_mail_to_inactive_users,
-    send_mail_to_users_with_events_next_day
+    send_mail_to_users_with_events_next_day,
+    send_mail_to_inactive_users_in_department,
+    send_mail_to_inactive_users_chunk,
 )
+from infra.models import OutboxMessage
 from training_event.models import CampusEvent, Enrollment
 
 
@@ -24,10 +30,9 @@ class TestTasks(TestCase):
 
     @patch('data_warehouse.tasks.AggregateDataService.personal_summary',
            lambda _: {})
-    @patch('data_warehouse.tasks.send_mass_mail')
     @patch('data_warehouse.tasks.check_user_activity')
-    def test_send_mail_to_inactive_users(self, mocked_check, mocked_send_mail):
-        '''Should check users' activities and send mails'''
+    def test_send_mail_to_inactive_users(self, mocked_check):
+        '''Should check users' activities and enqueue mails'''
         num_users = 20
         users = mommy.make(
             User,
@@ -37,19 +42,15 @@ class TestTasks(TestCase):
         mocked_check.side_effect = [(False, {}) for _ in range(num_users)]
 
         send_mail_to_inactive_users()
-        mocked_send_mail.assert_called()
-        (mails,), kwargs = mocked_send_mail.call_args
-        fail_silently = kwargs['fail_silently']
-        self.assertEqual(len(mails), len(users))
-        self.assertFalse(fail_silently)
+
+        self.assertEqual(OutboxMessage.objects.filter(
+            channel=OutboxMessage.CHANNEL_MAIL).count(), len(users))
 
     @patch('data_warehouse.tasks.AggregateDataService.personal_summary',
            lambda _: {})
-    @patch('data_warehouse.tasks.send_mass_mail')
     @patch('data_warehouse.tasks.check_user_activity')
-    def test_send_mail_to_inactive_users_skip_users(
-            self, mocked_check, mocked_send_mail):
-        '''Should check users' activities and send mails (skip users)'''
+    def test_send_mail_to_inactive_users_skip_users(self, mocked_check):
+        '''Should check users' activities and enqueue mails (skip users)'''
         num_users = 20
         num_active_users = 10
         users = mommy.make(
@@ -62,24 +63,124 @@ class TestTasks(TestCase):
             (i < num_active_users, {}) for i in range(num_users)]
 
         send_mail_to_inactive_users(skip_users=skip_users)
-        mocked_send_mail.assert_called()
-        (mails,), kwargs = mocked_send_mail.call_args
-        fail_silently = kwargs['fail_silently']
-        self.assertEqual(len(mails), len(users) - len(skip_users))
-        self.assertFalse(fail_silently)
-
-    @patch('infra.services.SOAPSMSService.send_sms')
-    @patch('infra.services.SOAPMSGService.send_msg')
-    @patch('data_warehouse.tasks.send_mass_mail')
-    def test_send_mail_to_users_with_events_next_day(
-            self, mocked_send_mail, mocked_send_msg, mocked_send_sms):
+
+        self.assertEqual(OutboxMessage.objects.filter(
+            channel=OutboxMessage.CHANNEL_MAIL).count(),
+                         len(users) - len(skip_users))
+
+    @patch('data_warehouse.tasks.INACTIVE_USERS_CHUNK_SIZE', 8)
+    @patch('data_warehouse.tasks.chunk_user_ids.__defaults__', (8,))
+    @patch('data_warehouse.tasks.OutboxService.enqueue_mails')
+    @patch('data_warehouse.tasks.check_user_activity')
+    def test_send_mail_to_inactive_users_in_chunks(
+            self, mocked_check, mocked_enqueue):
+        '''Should enqueue mails chunk by chunk.'''
+        num_users = 20
+        mommy.make(User, teaching_type='专任教师', _quantity=num_users)
+        mocked_check.side_effect = [(False, {}) for _ in range(num_users)]
+
+        send_mail_to_inactive_users()
+
+        self.assertEqual(mocked_enqueue.call_count, 3)
+        num_mails = sum(len(args[0]) for args, _ in
+                        mocked_enqueue.call_args_list)
+        self.assertEqual(num_mails, num_users)
+
+    @patch('data_warehouse.tasks.INACTIVE_USERS_CHUNK_SIZE', 8)
+    @patch('data_warehouse.tasks.chunk_user_ids.__defaults__', (8,))
+    @patch('data_warehouse.tasks.OutboxService.enqueue_mails')
+    @patch('data_warehouse.tasks.check_user_activity')
+    def test_send_mail_to_inactive_users_enqueue_failed(
+            self, mocked_check, mocked_enqueue):
+        '''Should keep enqueuing other chunks if a chunk fails.'''
+        num_users = 20
+        mommy.make(User, teaching_type='专任教师', _quantity=num_users)
+        mocked_check.side_effect = [(False, {}) for _ in range(num_users)]
+        mocked_enqueue.side_effect = [DatabaseError(), None, None]
+
+        send_mail_to_inactive_users()
+
+        self.assertEqual(mocked_enqueue.call_count, 3)
+
+    @patch('data_warehouse.tasks.send_mail_to_inactive_users_in_department'
+           '.delay')
+    def test_send_mail_to_inactive_users_fan_out(self, mocked_delay):
+        '''Should dispatch tasks by department.'''
+        departments = mommy.make(Department, _quantity=3)
+        for department in departments:
+            mommy.make(User, teaching_type='专任教师',
+                       administrative_department=department, _quantity=2)
+
+        send_mail_to_inactive_users(skip_users=[1], fan_out=True)
+
+        self.assertEqual(mocked_delay.call_count, len(departments))
+        self.assertEqual(
+            {args[0] for args, _ in mocked_delay.call_args_list},
+            {department.id for department in departments})
+
+    @patch('data_warehouse.tasks.send_mail_to_inactive_users_chunk.delay')
+    def test_send_mail_to_inactive_users_in_department(self, mocked_delay):
+        '''Should dispatch chunks of users in department.'''
+        department = mommy.make(Department)
+        users = mommy.make(User, teaching_type='专任教师',
+                           administrative_department=department, _quantity=3)
+        mommy.make(User, teaching_type='专任教师')
+
+        send_mail_to_inactive_users_in_department(
+            department.id, now().isoformat(), now().isoformat())
+
+        mocked_delay.assert_called_once()
+        (user_ids, *_), _ = mocked_delay.call_args
+        self.assertEqual(user_ids, [user.id for user in users])
+
+    @patch('data_warehouse.tasks.check_user_activity')
+    def test_send_mail_to_inactive_users_chunk(self, mocked_check):
+        '''Should enqueue mails of the chunk into the outbox.'''
+        users = mommy.make(User, teaching_type='专任教师', _quantity=2)
+        mocked_check.return_value = (False, {})
+        end_time = now()
+        start_time = end_time.replace(year=end_time.year-1)
+
+        # pylint: disable=no-value-for-parameter
+        send_mail_to_inactive_users_chunk(
+            [user.id for user in users], start_time.isoformat(),
+            end_time.isoformat())
+
+        self.assertEqual(OutboxMessage.objects.filter(
+            channel=OutboxMessage.CHANNEL_MAIL).count(), len(users))
+
+    @patch('data_warehouse.tasks.send_mail_to_inactive_users_chunk.retry')
+    @patch('data_warehouse.tasks.OutboxService.enqueue_mails')
+    @patch('data_warehouse.tasks.check_user_activity')
+    def test_send_mail_to_inactive_users_chunk_retry(
+            self, mocked_check, mocked_enqueue, mocked_retry):
+        '''Should retry the chunk if mails can't be enqueued.'''
+        users = mommy.make(User, teaching_type='专任教师', _quantity=2)
+        mocked_check.return_value = (False, {})
+        mocked_enqueue.side_effect = DatabaseError()
+        mocked_retry.return_value = RuntimeError()
+        end_time = now()
+        start_time = end_time.replace(year=end_time.year-1)
+
+        with self.assertRaises(RuntimeError):
+            # pylint: disable=no-value-for-parameter
+            send_mail_to_inactive_users_chunk(
+                [user.id for user in users], start_time.isoformat(),
+                end_time.isoformat())
+
+        mocked_retry.assert_called()
+        (mails,), _ = mocked_enqueue.call_args
+        self.assertEqual(len(mails), len(users))
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_send_mail_to_users_with_events_next_day(self):
         '''should send mail to users who will attend events tomorrow'''
         current_time = localtime(now())
         event0 = mommy.make(CampusEvent,
-                            time=current_time.replace(day=current_time.day+1),
+                            time=current_time + timedelta(days=1),
                             name='0')
         event1 = mommy.make(CampusEvent,
-                            time=current_time.replace(day=current_time.day+1),
+                            time=current_time + timedelta(days=1),
                             name='1')
 
         for _ in range(10):
@@ -87,11 +188,43 @@ class TestTasks(TestCase):
         for _ in range(10):
             mommy.make(Enrollment, campus_event=event1, user=mommy.make(User))
 
-        send_mail_to_users_with_events_next_day()
-        mocked_send_mail.assert_called()
-        mocked_send_msg.assert_called()
-        mocked_send_sms.assert_called()
-        (mails,), kwargs = mocked_send_mail.call_args
-        fail_silently = kwargs['fail_silently']
-        self.assertEqual(len(mails), 20)
-        self.assertFalse(fail_silently)
+        stats = send_mail_to_users_with_events_next_day()
+
+        self.assertEqual(stats, {'queued': 20, 'failed': 0})
+        for channel, _ in OutboxMessage.CHANNEL_CHOICES:
+            self.assertEqual(
+                OutboxMessage.objects.filter(channel=channel).count(), 20)
+
+    def test_send_mail_to_users_with_events_next_day_in_batches(self):
+        '''Should enqueue reminders in bounded batches, constant queries.'''
+        tomorrow = localtime(now()) + timedelta(days=1)
+        event = mommy.make(CampusEvent, time=tomorrow)
+        mommy.make(CampusEvent, time=tomorrow + timedelta(days=1))
+        mommy.make(Enrollment, campus_event=event, _quantity=5)
+
+        with CaptureQueriesContext(connection) as context:
+            send_mail_to_users_with_events_next_day(batch_size=20)
+        num_queries = len(context.captured_queries)
+        mommy.make(Enrollment, campus_event=event, _quantity=10)
+        with self.assertNumQueries(num_queries):
+            stats = send_mail_to_users_with_events_next_day(batch_size=20)
+
+        self.assertEqual(stats, {'queued': 15, 'failed': 0})
+        messages = OutboxMessage.objects.filter(
+            channel=OutboxMessage.CHANNEL_MAIL)
+        self.assertEqual(messages.count(), 5 + 15)
+
+    @patch('data_warehouse.tasks.OutboxService.enqueue_smses')
+    def test_send_mail_to_users_with_events_next_day_failures(
+            self, mocked_enqueue_smses):
+        '''Should count failures per batch and keep going.'''
+        event = mommy.make(CampusEvent,
+                           time=localtime(now()) + timedelta(days=1))
+        mommy.make(Enrollment, campus_event=event, _quantity=5)
+        mocked_enqueue_smses.side_effect = [None, Exception(), None]
+
+        stats = send_mail_to_users_with_events_next_day(batch_size=2)
+
+        self.assertEqual(stats, {'queued': 3, 'failed': 2})
+        self.assertEqual(OutboxMessage.objects.filter(
+            channel=OutboxMessage.CHANNEL_MAIL).count(), 3)
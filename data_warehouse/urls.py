@@ -6,4 +6,7 @@ router = routers.SimpleRouter()
 router.register(r'aggregate-data',
                 views.AggregateDataViewSet,
                 base_name='aggregate-data')
+router.register(r'closed-periods',
+                views.ClosedPeriodViewSet,
+                base_name='closed-periods')
 urlpatterns = router.urls
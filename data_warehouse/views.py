@@ -2,7 +2,7 @@
 import os
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework import status, viewsets
+from rest_framework import mixins, status, viewsets
 
 from data_warehouse.services.aggregate_data_service import (
     AggregateDataService
@@ -11,8 +11,11 @@ from data_warehouse.services.canvas_options_service import (
     CanvasOptionsService
 )
 from data_warehouse.serializers import (
-    BaseTableExportSerializer
+    BaseTableExportSerializer, ClosedPeriodSerializer
 )
+from data_warehouse.services.snapshot_service import SnapshotService
+from data_warehouse.models import ClosedPeriod
+from auth.permissions import SchoolAdminOnlyPermission
 from infra.exceptions import BadRequest
 from secure_file.models import SecureFile
 
@@ -82,3 +85,20 @@ class AggregateDataViewSet(viewsets.ViewSet):
         serializer = serializer_cls(data=params)
         serializer.is_valid(raise_exception=True)
         return serializer.validated_data
+
+
+class ClosedPeriodViewSet(mixins.ListModelMixin,
+                          mixins.CreateModelMixin,
+                          mixins.DestroyModelMixin,
+                          viewsets.GenericViewSet):
+    '''Create API views for closing statistics periods.'''
+    queryset = ClosedPeriod.objects.select_related('closed_by').all()
+    serializer_class = ClosedPeriodSerializer
+    permission_classes = (SchoolAdminOnlyPermission,)
+
+    @action(detail=True, methods=['POST'])
+    def rebuild(self, request, pk=None):  # pylint: disable=invalid-name
+        '''Regenerate snapshots of the period.'''
+        period = SnapshotService.rebuild_period(self.get_object())
+        serializer = self.get_serializer(period)
+        return Response(serializer.data, status=status.HTTP_200_OK)
@@ -2,7 +2,7 @@
 from django.contrib import admin
 from guardian.admin import GuardedModelAdmin
 
-from infra.models import OperationLog, Notification
+from infra.models import OperationLog, Notification, OutboxMessage
 
 
 class OperationLogAdmin(GuardedModelAdmin):
@@ -13,9 +13,14 @@ class NotificationAdmin(GuardedModelAdmin):
     '''Define how to register model Notification in console.'''
 
 
+class OutboxMessageAdmin(GuardedModelAdmin):
+    '''Define how to register model OutboxMessage in console.'''
+
+
 REGISTER_ITEMS = [
     (OperationLog, OperationLogAdmin),
     (Notification, NotificationAdmin),
+    (OutboxMessage, OutboxMessageAdmin),
 ]
 for model_class, admin_class in REGISTER_ITEMS:
     admin.site.register(model_class, admin_class)
@@ -1,44 +1,30 @@
 '''Backends provided by infra module.'''
-import base64
-import hashlib
 import json
 import re
 
 from django.conf import settings
 from django.core.mail.backends.base import BaseEmailBackend
-from zeep import Client
-from zeep.cache import InMemoryCache
-from zeep.transports import Transport
 
 from infra.exceptions import InternalServerError, BadRequest
+from infra.soap import SOAPClientRegistry
 from infra.utils import prod_logger
 
 
 class SOAPEmailBackend(BaseEmailBackend):
     '''Provide Email service via web service.'''
     def send_messages(self, email_messages):
-        transport = Transport(cache=InMemoryCache())
         try:
-            client = Client(
-                f'{settings.SOAP_BASE_URL}/EmailService?wsdl',
-                transport=transport
-            )
+            client = SOAPClientRegistry.get_client('EmailService')
         except Exception:
             prod_logger.warning('获取WSDL失败，邮件服务暂时不可用')
             raise InternalServerError('邮件服务暂时不可用')
 
-        # According to the protocol, we need encrypt our secret_key with
-        # SHA-1 and encode with base64
-        sha1 = hashlib.sha1()
-        sha1.update(settings.SOAP_AUTH_SECRET_KEY.encode())
-        secret_key = base64.b64encode(sha1.digest())
-
         default_payload = {
             # Auth-related
             'tp_name': settings.SOAP_AUTH_TP_NAME,
             'sys_id': settings.SOAP_AUTH_SYS_ID,
             'module_id': settings.SOAP_AUTH_MODULE_ID,
-            'secret_key': secret_key.decode(),
+            'secret_key': SOAPClientRegistry.get_secret_key(),
             'interface_method': 'email',
 
             # Business-related
@@ -53,28 +39,37 @@ class SOAPEmailBackend(BaseEmailBackend):
             'receipt_id': '0',
             'send_sys_id': '1',
         }
+        payloads = []
         for message in email_messages:
             payload = default_payload.copy()
             payload['recieve_person_info'] = self.format_recipients(message.to)
             payload['emial_title'] = message.subject
             payload['email_info'] = message.body
-            email_info = json.dumps(payload)
-            try:
-                resp = client.service.saveEmailInfo(email_info)
-                resp = json.loads(resp)
-                if resp['result'] is False:
-                    raise Exception(resp['msg'])
-            except Exception as err:
-                msg = f'邮件发送失败, 失败原因: {err}'
-                prod_logger.warning(msg)
-                raise InternalServerError('邮件发送失败')
-            else:
-                msg = (
-                    f'邮件发送成功, 收件人: {message.to}, '
-                    f'标题: {message.subject}, '
-                    f'消息ID: {resp["msg_id"]}'
-                )
-                prod_logger.info(msg)
+            payloads.append((message, json.dumps(payload)))
+
+        def send(item):
+            message, email_info = item
+            resp = client.service.saveEmailInfo(email_info)
+            resp = json.loads(resp)
+            if resp['result'] is False:
+                raise Exception(resp['msg'])
+            msg = (
+                f'邮件发送成功, 收件人: {message.to}, '
+                f'标题: {message.subject}, '
+                f'消息ID: {resp["msg_id"]}'
+            )
+            prod_logger.info(msg)
+
+        num_sent = 0
+        for _, err in SOAPClientRegistry.map(send, payloads):
+            if err is None:
+                num_sent += 1
+                continue
+            msg = f'邮件发送失败, 失败原因: {err}'
+            prod_logger.warning(msg)
+        if num_sent < len(payloads):
+            raise InternalServerError('邮件发送失败')
+        return num_sent
 
     @staticmethod
     def recipient_is_email(recipient):
@@ -0,0 +1,201 @@
+'''Read rows of uploaded Excel files.
+
+Both .xlsx and .xls files are supported. The first sheet of .xlsx files is
+parsed as a stream, rows are yielded one by one and dropped afterwards, so
+large sheets can be read without holding the whole workbook in memory.
+Cell values have the same types as xlrd's: numbers are float, text is str
+and empty cells are ''.
+'''
+import io
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+import xlrd
+
+
+XLSX_MAGIC = b'PK\x03\x04'
+XLS_MAGIC = b'\xd0\xcf\x11\xe0'
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = ('{http://schemas.openxmlformats.org/officeDocument/2006/'
+          'relationships}')
+NS_PACKAGE_REL = ('{http://schemas.openxmlformats.org/package/2006/'
+                  'relationships}')
+CELL_REFERENCE_PATTERN = re.compile(r'([A-Z]+)(\d+)')
+
+
+class InvalidExcelFile(ValueError):
+    '''Raised if the file is neither .xlsx nor .xls.'''
+
+
+def open_excel_file(file):
+    '''Return a seekable binary file object of the upload.
+
+    Parameters
+    ----------
+    file: bytes or file-like object
+        Raw content, or an uploaded file (which is kept on disk if large).
+    '''
+    if isinstance(file, (bytes, bytearray)):
+        return io.BytesIO(file)
+    if not hasattr(file, 'read') or not hasattr(file, 'seek'):
+        raise InvalidExcelFile('无效的表格')
+    file.seek(0)
+    return file
+
+
+def iter_excel_rows(file):
+    '''Iterate rows of the first sheet of an Excel file.
+
+    Parameters
+    ----------
+    file: bytes or file-like object
+
+    Yields
+    ------
+    row: list
+        Values of cells in the row, missing rows are yielded as [].
+    '''
+    file = open_excel_file(file)
+    magic = file.read(4)
+    file.seek(0)
+    if magic == XLSX_MAGIC:
+        return _iter_xlsx_rows(file)
+    if magic == XLS_MAGIC:
+        return _iter_xls_rows(file)
+    raise InvalidExcelFile('无效的表格')
+
+
+def _iter_xls_rows(file):
+    '''Iterate rows of .xls file by xlrd.
+
+    Sheets of .xls files are loaded on demand, only the first one is read.
+    '''
+    if hasattr(file, 'temporary_file_path'):
+        workbook = xlrd.open_workbook(file.temporary_file_path(),
+                                      on_demand=True)
+    else:
+        workbook = xlrd.open_workbook(file_contents=file.read(),
+                                      on_demand=True)
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for index in range(sheet.nrows):
+            yield sheet.row_values(index)
+    finally:
+        workbook.release_resources()
+
+
+def _get_first_sheet_path(archive):
+    '''Resolve the path of the first worksheet in the .xlsx archive.'''
+    with archive.open('xl/workbook.xml') as workbook:
+        for _, element in iterparse(workbook):
+            if element.tag == f'{NS_MAIN}sheet':
+                rel_id = element.get(f'{NS_REL}id')
+                break
+        else:
+            raise InvalidExcelFile('无效的表格')
+    with archive.open('xl/_rels/workbook.xml.rels') as rels:
+        for _, element in iterparse(rels):
+            if (element.tag == f'{NS_PACKAGE_REL}Relationship'
+                    and element.get('Id') == rel_id):
+                target = element.get('Target')
+                break
+        else:
+            raise InvalidExcelFile('无效的表格')
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join('xl', target))
+
+
+def _read_shared_strings(archive):
+    '''Read the shared strings table of the .xlsx archive.'''
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as shared_strings:
+        for _, element in iterparse(shared_strings):
+            if element.tag == f'{NS_MAIN}si':
+                # Rich text is split into runs, phonetic hints are skipped.
+                texts = []
+                for child in element:
+                    if child.tag == f'{NS_MAIN}t':
+                        texts.append(child.text or '')
+                    elif child.tag == f'{NS_MAIN}r':
+                        texts.append(child.findtext(f'{NS_MAIN}t') or '')
+                strings.append(''.join(texts))
+                element.clear()
+    return strings
+
+
+def _get_column_index(reference):
+    '''Convert cell reference like "AB12" to zero-based column index.'''
+    match = CELL_REFERENCE_PATTERN.match(reference or '')
+    if match is None:
+        return None
+    index = 0
+    for char in match.group(1):
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index - 1
+
+
+def _read_cell_value(cell, shared_strings):
+    '''Convert <c> element to the value xlrd would return.'''
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        return ''.join(node.text or ''
+                       for node in cell.iter(f'{NS_MAIN}t'))
+    value = cell.findtext(f'{NS_MAIN}v')
+    if value is None:
+        return ''
+    if cell_type == 's':
+        return shared_strings[int(value)]
+    if cell_type == 'b':
+        return value == '1'
+    if cell_type in ('str', 'e'):
+        return value if cell_type == 'str' else ''
+    return float(value)
+
+
+def _iter_xlsx_rows(file):
+    '''Iterate rows of the first sheet of .xlsx file as a stream.'''
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise InvalidExcelFile('无效的表格')
+    with archive:
+        shared_strings = _read_shared_strings(archive)
+        sheet_path = _get_first_sheet_path(archive)
+        next_row_index = 0
+        sheet_data = None
+        with archive.open(sheet_path) as sheet:
+            for event, element in iterparse(sheet, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == f'{NS_MAIN}sheetData':
+                        sheet_data = element
+                    continue
+                if element.tag != f'{NS_MAIN}row':
+                    continue
+                row_index = int(element.get('r', next_row_index + 1)) - 1
+                while next_row_index < row_index:
+                    yield []
+                    next_row_index += 1
+                row = []
+                for cell in element.iter(f'{NS_MAIN}c'):
+                    col_index = _get_column_index(cell.get('r'))
+                    if col_index is None:
+                        col_index = len(row)
+                    row.extend([''] * (col_index - len(row)))
+                    row.append(_read_cell_value(cell, shared_strings))
+                # Drop parsed rows so memory doesn't grow with the sheet.
+                if sheet_data is not None:
+                    sheet_data.clear()
+                next_row_index += 1
+                yield row
+
+
+def get_cell_value(row, col_index):
+    '''Return value of the cell in row, '' if the cell is missing.'''
+    if col_index < len(row):
+        return row[col_index]
+    return ''
@@ -0,0 +1,43 @@
+# Generated by Django 2.2 on 2026-10-18 20:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('infra', '0002_auto_20190521_1102'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='最近修改时间')),
+                ('channel', models.PositiveSmallIntegerField(choices=[(0, '邮件'), (1, '短信'), (2, '门户信息')], verbose_name='发送渠道')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, '待发送'), (1, '发送中'), (2, '已发送'), (3, '发送失败')], default=0, verbose_name='发送状态')),
+                ('payload', models.TextField(verbose_name='消息内容')),
+                ('num_attempts', models.PositiveSmallIntegerField(default=0, verbose_name='尝试次数')),
+                ('next_attempt_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='下次发送时间')),
+                ('claim_token', models.CharField(blank=True, max_length=32, verbose_name='发送批次标识')),
+                ('last_error', models.CharField(blank=True, max_length=512, verbose_name='最近错误信息')),
+                ('sent_time', models.DateTimeField(blank=True, null=True, verbose_name='发送成功时间')),
+            ],
+            options={
+                'verbose_name': '待发送消息',
+                'verbose_name_plural': '待发送消息',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'channel', 'next_attempt_time'], name='infra_outbo_status_7869b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['channel', 'sent_time'], name='infra_outbo_channel_6fefec_idx'),
+        ),
+    ]
@@ -1,6 +1,10 @@
 '''Define ORM models for infra module.'''
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import signals
+from django.utils.timezone import now
+
+from infra.utils import bump_model_version
 
 
 User = get_user_model()
@@ -87,3 +91,69 @@ class Notification(models.Model):
         return '由{}于{}发送给{}的通知({})'.format(
             self.sender_id, self.time, self.recipient_id,
             '已读' if self.read_time else '未读')
+
+
+class OutboxMessage(models.Model):
+    '''OutboxMessage is an email, SMS or portal message to be delivered.
+
+    Messages are written in the same transaction as the business change, and
+    are delivered later by celery workers, so requests don't wait for the
+    SOAP gateway and no message is lost if the gateway is down.
+    '''
+    CHANNEL_MAIL = 0
+    CHANNEL_SMS = 1
+    CHANNEL_MSG = 2
+    CHANNEL_CHOICES = (
+        (CHANNEL_MAIL, '邮件'),
+        (CHANNEL_SMS, '短信'),
+        (CHANNEL_MSG, '门户信息'),
+    )
+    STATUS_PENDING = 0
+    STATUS_SENDING = 1
+    STATUS_SENT = 2
+    STATUS_DEAD = 3
+    STATUS_CHOICES = (
+        (STATUS_PENDING, '待发送'),
+        (STATUS_SENDING, '发送中'),
+        (STATUS_SENT, '已发送'),
+        (STATUS_DEAD, '发送失败'),
+    )
+
+    class Meta:
+        verbose_name = '待发送消息'
+        verbose_name_plural = '待发送消息'
+        default_permissions = ()
+        indexes = [
+            models.Index(fields=['status', 'channel', 'next_attempt_time']),
+            models.Index(fields=['channel', 'sent_time']),
+        ]
+
+    create_time = models.DateTimeField(verbose_name='创建时间',
+                                       auto_now_add=True)
+    update_time = models.DateTimeField(verbose_name='最近修改时间',
+                                       auto_now=True)
+    channel = models.PositiveSmallIntegerField(
+        verbose_name='发送渠道', choices=CHANNEL_CHOICES)
+    status = models.PositiveSmallIntegerField(
+        verbose_name='发送状态', choices=STATUS_CHOICES,
+        default=STATUS_PENDING)
+    payload = models.TextField(verbose_name='消息内容')
+    num_attempts = models.PositiveSmallIntegerField(verbose_name='尝试次数',
+                                                    default=0)
+    next_attempt_time = models.DateTimeField(verbose_name='下次发送时间',
+                                             default=now)
+    claim_token = models.CharField(verbose_name='发送批次标识',
+                                   max_length=32, blank=True)
+    last_error = models.CharField(verbose_name='最近错误信息',
+                                  max_length=512, blank=True)
+    sent_time = models.DateTimeField(verbose_name='发送成功时间',
+                                     blank=True, null=True)
+
+    def __str__(self):
+        return '{}({}, {})'.format(self.get_channel_display(), self.id,
+                                   self.get_status_display())
+
+
+# Keep data versions of all models for caches computed from them.
+for _signal in (signals.post_save, signals.post_delete, signals.m2m_changed):
+    _signal.connect(bump_model_version)
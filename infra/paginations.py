@@ -1,28 +1,336 @@
 '''Provide pagination classes for infra module.'''
+import base64
+import binascii
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db import connections
+from django.db.models import Q, QuerySet
 from rest_framework import pagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from infra.utils import positive_int
+from infra.utils import get_model_version, positive_int
 from infra.exceptions import BadRequest
 
 
+COUNT_CACHE_KEY_FORMAT = 'infra:count:{label}:{version}:{digest}'
+COUNT_CACHE_TIMEOUT = 300
+ESTIMATED_COUNT_CAP = 1000
+
+
+def get_cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    '''Count objects of the queryset, reuse counts of the same query.
+
+    Counts are keyed by the compiled SQL and params of the queryset, which
+    normalizes its filters, and by the data version of its model, so saving
+    or deleting objects of the model expires them. Changes of other tables
+    the query joins are picked up after the timeout.
+    '''
+    queryset = queryset.order_by()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    digest = hashlib.md5(f'{sql}{params!r}'.encode()).hexdigest()
+    key = COUNT_CACHE_KEY_FORMAT.format(
+        label=queryset.model._meta.label_lower,
+        version=get_model_version(queryset.model), digest=digest)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def get_table_rows(model, using='default'):
+    '''Return the number of rows of the table of the model estimated by
+    table statistics of MySQL, None on other databases.'''
+    connection = connections[using]
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+            [model._meta.db_table])
+        row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def get_estimated_count(queryset, cap=ESTIMATED_COUNT_CAP):
+    '''Return a tuple (count, exact) without counting every object.
+
+    Unfiltered querysets of large tables are estimated by table statistics,
+    others are counted up to cap.
+    '''
+    query = queryset.query
+    if not query.where and not query.distinct and not query.combinator:
+        rows = get_table_rows(queryset.model, queryset.db)
+        if rows is not None and rows > cap:
+            return rows, False
+    return count_up_to(queryset, cap)
+
+
+def count_up_to(queryset, cap):
+    '''Count objects of the queryset, but stop counting at cap.
+
+    Return a tuple (count, exact), exact is False if there are more than cap
+    objects, in which case count is cap.
+    '''
+    count = queryset.order_by()[:cap + 1].count()
+    if count > cap:
+        return cap, False
+    return count, True
+
+
+class KeysetPagination(pagination.BasePagination):
+    '''Paginate by values of ordering fields of the first or last object.
+
+    Pages are fetched by `WHERE (f1, f2) < (v1, v2) ORDER BY f1, f2 LIMIT n`
+    instead of OFFSET, so deep pages cost the same as the first one, and no
+    COUNT(*) is run unless `count=estimate` is given, in which case the
+    count is estimated by get_estimated_count(). The position is encoded in
+    an opaque `cursor` param of `next` and `previous` links.
+
+    `ordering` must end with a unique field, such as ('-create_time', '-id'),
+    and none of the fields can be null.
+    '''
+    # pylint: disable=abstract-method,too-many-instance-attributes
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    count_query_param = 'count'
+    default_limit = pagination.api_settings.PAGE_SIZE
+    max_limit = 200
+    estimated_count_cap = ESTIMATED_COUNT_CAP
+    invalid_cursor_message = '无效的分页游标'
+
+    def __init__(self, ordering=('-id',)):
+        self.ordering = tuple(ordering)
+        self.limit = None
+        self.base_url = None
+        self.values = None
+        self.reverse = False
+        self.has_next = False
+        self.has_previous = False
+        self.first_values = None
+        self.last_values = None
+        self.count = None
+        self.count_exact = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        '''Return a page of objects after or before the cursor.'''
+        self.limit = self.get_limit(request)
+        self.base_url = request.build_absolute_uri()
+        self.values, self.reverse = self.decode_cursor(request)
+
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count, self.count_exact = get_estimated_count(
+                queryset, self.estimated_count_cap)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(self._invert(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.values is not None:
+            self.values = self.to_python_values(queryset, self.values)
+            queryset = queryset.filter(
+                self.get_keyset_condition(ordering, self.values))
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if self.reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.values is not None
+
+        if results:
+            self.first_values = self.get_values(results[0])
+            self.last_values = self.get_values(results[-1])
+        return results
+
+    def get_paginated_response(self, data):
+        '''Return links of next and previous pages with the results.'''
+        fields = [
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]
+        if self.count is not None:
+            fields[:0] = [('count', self.count),
+                          ('count_exact', self.count_exact)]
+        return Response(OrderedDict(fields))
+
+    def get_limit(self, request):
+        '''Get limit, fall back to PAGE_SIZE.'''
+        try:
+            return positive_int(
+                request.query_params[self.limit_query_param],
+                strict=True,
+                cutoff=self.max_limit
+            )
+        except (KeyError, ValueError):
+            return self.default_limit
+
+    def get_next_link(self):
+        '''Return link to the page after the last object.'''
+        if not self.has_next or self.last_values is None:
+            return None
+        return self.encode_cursor(self.last_values, reverse=False)
+
+    def get_previous_link(self):
+        '''Return link to the page before the first object.'''
+        if not self.has_previous:
+            return None
+        if self.first_values is None:
+            # Nothing is left after the cursor, go back to the first page.
+            return replace_query_param(self.base_url,
+                                       self.cursor_query_param, '')
+        return self.encode_cursor(self.first_values, reverse=True)
+
+    def get_values(self, obj):
+        '''Return values of ordering fields of the object.'''
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def get_keyset_condition(self, ordering, values):
+        '''Return Q matching objects after values in ordering.'''
+        condition = Q()
+        for idx in reversed(range(len(ordering))):
+            field = ordering[idx].lstrip('-')
+            lookup = 'lt' if ordering[idx].startswith('-') else 'gt'
+            equals = {ordering[prev].lstrip('-'): values[prev]
+                      for prev in range(idx)}
+            condition |= Q(**equals, **{f'{field}__{lookup}': values[idx]})
+        return condition
+
+    def encode_cursor(self, values, reverse):
+        '''Return URL of the page after (or before if reverse) values.'''
+        position = {
+            'v': [value.isoformat() if isinstance(value, datetime) else value
+                  for value in values],
+            'r': reverse,
+        }
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(position).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   cursor)
+
+    def decode_cursor(self, request):
+        '''Return values and direction of the cursor of the request.'''
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            position = json.loads(
+                base64.urlsafe_b64decode(cursor.encode()).decode())
+            values, reverse = position['v'], bool(position['r'])
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise BadRequest(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise BadRequest(self.invalid_cursor_message)
+        return values, reverse
+
+    def to_python_values(self, queryset, values):
+        '''Convert values of the cursor by types of ordering fields.'''
+        query = queryset.query
+        try:
+            values = [
+                (query.annotations[name].output_field
+                 if name in query.annotations
+                 else queryset.model._meta.get_field(name)).to_python(value)
+                for name, value in zip(
+                    (field.lstrip('-') for field in self.ordering), values)
+            ]
+        except (ValidationError, ValueError, TypeError):
+            raise BadRequest(self.invalid_cursor_message)
+        if any(value is None for value in values):
+            raise BadRequest(self.invalid_cursor_message)
+        return values
+
+    @staticmethod
+    def _invert(field):
+        '''Invert direction of the ordering field.'''
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
 class LimitOffsetPagination(pagination.LimitOffsetPagination):
     '''
     This class is almost identical to
     `rest_frame.pagination.LimitOffsetPagination`, but we allow api consumers
     to disable pagination temporarily by using `limit=-1`.
+
+    Views can support KeysetPagination by mapping actions to orderings in
+    `keyset_orderings`, api consumers then opt in by passing a `cursor`
+    param, which is empty for the first page. Requests with `limit`/`offset`
+    are paginated as before.
+
+    Example
+    -------
+    class MyViewSet(viewsets.ModelViewSet):
+        keyset_orderings = {
+            'list': ('-create_time', '-id'),
+        }
     '''
     max_limit = 200
+    count_query_param = 'count'
+    estimated_count_cap = ESTIMATED_COUNT_CAP
+
+    def __init__(self):
+        self.keyset_pagination = None
+        self.estimate_count = False
+        self.count_exact = True
 
     def paginate_queryset(self, queryset, request, view=None):
         '''
         If there are too many objects in the queryset while api consumer
         requires no pagination, we don't allow return without pagination.
         '''
+        ordering = getattr(view, 'keyset_orderings', {}).get(
+            getattr(view, 'action', None))
+        if ordering and (KeysetPagination.cursor_query_param
+                         in request.query_params):
+            self.keyset_pagination = KeysetPagination(ordering)
+            return self.keyset_pagination.paginate_queryset(
+                queryset, request, view)
+
+        self.estimate_count = request is not None and (
+            request.query_params.get(self.count_query_param) == 'estimate')
         paginated = super().paginate_queryset(queryset, request, view)
         if paginated is None and self.count > self.max_limit:
             raise BadRequest('不分页前提下查询集合中对象数量超出允许范围')
         return paginated
 
+    def get_paginated_response(self, data):
+        '''Return response of keyset pagination if it's used.'''
+        if self.keyset_pagination is not None:
+            return self.keyset_pagination.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('count_exact', self.count_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_count(self, queryset):
+        '''Return the cached or estimated count of the queryset.'''
+        if not isinstance(queryset, QuerySet):
+            return super().get_count(queryset)
+        if self.estimate_count:
+            count, self.count_exact = get_estimated_count(
+                queryset, self.estimated_count_cap)
+            return count
+        self.count_exact = True
+        return get_cached_count(queryset)
+
     def get_limit(self, request):
         '''Get limit, return None if limit param is '-1'.'''
         if self.limit_query_param:
@@ -1,17 +1,17 @@
 '''Provide services of infra module.'''
-import base64
 import json
-import hashlib
+import uuid
+from datetime import timedelta
+from functools import partial
 
 from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
 from django.utils.timezone import now
 from django.contrib.auth import get_user_model
-from zeep import Client
-from zeep.cache import InMemoryCache
-from zeep.transports import Transport
 
-from infra.models import Notification
-from infra.utils import prod_logger
+from infra.models import Notification, OutboxMessage
+from infra.soap import SOAPClientRegistry
+from infra.utils import bulk_create_with_pks, prod_logger
 from infra.exceptions import InternalServerError
 
 
@@ -65,6 +65,35 @@ class NotificationService:  # pylint: disable=R0903
         from auth.services import PermissionService
         PermissionService.assign_object_permissions(recipient, notification)
 
+    @staticmethod
+    def send_system_notifications(recipients, content):
+        '''Send the same system notification to many users in bulk.
+
+        Parameters
+        ------------
+        recipients: list of User
+            The users to receive the notification.
+        content: str
+            The content of the notification.
+
+        Returns
+        -------
+        notifications: list of Notification
+        '''
+        recipients = list(recipients)
+        if not recipients:
+            return []
+        sender = NotificationService._get_notification_robot()
+        notifications = bulk_create_with_pks(Notification.objects, [
+            Notification(sender=sender, recipient=recipient, content=content)
+            for recipient in recipients
+        ], ('recipient_id',), sender=sender, content=content)
+        from auth.services import PermissionService
+        PermissionService.bulk_assign_object_permissions(
+            (notification.recipient, notification)
+            for notification in notifications)
+        return notifications
+
 
 class SOAPSMSService:
     '''Provide service for sending sms.'''
@@ -72,6 +101,9 @@ class SOAPSMSService:
     def send_sms(smses):
         '''Send sms to user.
 
+        SMSes are sent concurrently by the shared SOAP client, if any of them
+        fails, InternalServerError is raised after all SMSes are tried.
+
         Parameters
         ------------
         SMSes: list of dict,
@@ -80,28 +112,18 @@ class SOAPSMSService:
                 'sms_info': String,
             }
         '''
-        transport = Transport(cache=InMemoryCache())
         try:
-            client = Client(
-                f'{settings.SOAP_BASE_URL}/SmsService?wsdl',
-                transport=transport
-            )
+            client = SOAPClientRegistry.get_client('SmsService')
         except Exception:
             prod_logger.warning('获取WSDL失败，短信服务暂时不可用')
             raise InternalServerError('短信服务暂时不可用')
 
-        # According to the protocol, we need encrypt our secret_key with
-        # SHA-1 and encode with base64
-        sha1 = hashlib.sha1()
-        sha1.update(settings.SOAP_AUTH_SECRET_KEY.encode())
-        secret_key = base64.b64encode(sha1.digest())
-
         default_payload = {
             # Auth-related
             'tp_name': settings.SOAP_AUTH_TP_NAME,
             'sys_id': settings.SOAP_AUTH_SYS_ID,
             'module_id': 'sms',
-            'secret_key': secret_key.decode(),
+            'secret_key': SOAPClientRegistry.get_secret_key(),
             'interface_method': 'sms',
 
             # Business-related
@@ -116,7 +138,7 @@ class SOAPSMSService:
             'send_sys_id': '1',
         }
 
-        for sms in smses:
+        def send(sms):
             phone_number = sms.get('user_phone_number')
             sms_info = sms.get('sms_info')
             payload = default_payload.copy()
@@ -124,21 +146,24 @@ class SOAPSMSService:
             payload['person_info'] = phone_number
             payload['sms_info'] = sms_info
             sms_info = json.dumps(payload)
-            try:
-                resp = client.service.saveSmsInfo(sms_info)
-                resp = json.loads(resp)
-                if resp['result'] is False:
-                    raise Exception(resp['msg'])
-            except Exception as err:
+            resp = client.service.saveSmsInfo(sms_info)
+            resp = json.loads(resp)
+            if resp['result'] is False:
+                raise Exception(resp['msg'])
+            msg = (
+                f'短信发送成功, 收件人: {phone_number}, '
+                f'消息ID: {resp["msg_id"]}'
+            )
+            prod_logger.info(msg)
+
+        failed = False
+        for _, err in SOAPClientRegistry.map(send, smses):
+            if err is not None:
+                failed = True
                 msg = f'短信发送失败, 失败原因: {err}'
                 prod_logger.warning(msg)
-                raise InternalServerError('短信发送失败')
-            else:
-                msg = (
-                    f'短信发送成功, 收件人: {phone_number}, '
-                    f'消息ID: {resp["msg_id"]}'
-                )
-                prod_logger.info(msg)
+        if failed:
+            raise InternalServerError('短信发送失败')
 
 
 class SOAPMSGService:
@@ -147,6 +172,10 @@ class SOAPMSGService:
     def send_msg(msges):
         '''Send msg to user.
 
+        Messages are sent concurrently by the shared SOAP client, if any of
+        them fails, InternalServerError is raised after all messages are
+        tried.
+
         Parameters
         ------------
         SMSes: list of dict,
@@ -156,28 +185,18 @@ class SOAPMSGService:
                 'msg_info': String,
             }
         '''
-        transport = Transport(cache=InMemoryCache())
         try:
-            client = Client(
-                f'{settings.SOAP_BASE_URL}/MsgService?wsdl',
-                transport=transport
-            )
+            client = SOAPClientRegistry.get_client('MsgService')
         except Exception:
             prod_logger.warning('获取WSDL失败，门户信息服务暂时不可用')
             raise InternalServerError('门户信息服务暂时不可用')
 
-        # According to the protocol, we need encrypt our secret_key with
-        # SHA-1 and encode with base64
-        sha1 = hashlib.sha1()
-        sha1.update(settings.SOAP_AUTH_SECRET_KEY.encode())
-        secret_key = base64.b64encode(sha1.digest())
-
         default_payload = {
             # Auth-related
             'tp_name': settings.SOAP_AUTH_TP_NAME,
             'sys_id': settings.SOAP_AUTH_SYS_ID,
             'module_id': 'msg',
-            'secret_key': secret_key.decode(),
+            'secret_key': SOAPClientRegistry.get_secret_key(),
             'interface_method': 'msg',
 
             # Business-related
@@ -193,7 +212,7 @@ class SOAPMSGService:
             'send_sys_id': '1',
         }
 
-        for msg in msges:
+        def send(msg):
             username = msg.get('user_username')
             msg_title = msg.get('msg_title')
             msg_info = msg.get('msg_info')
@@ -203,18 +222,235 @@ class SOAPMSGService:
             payload['msg_title'] = msg_title
             payload['msg_info'] = msg_info
             msg_info = json.dumps(payload)
-            try:
-                resp = client.service.saveMsgInfo(msg_info)
-                resp = json.loads(resp)
-                if resp['result'] is False:
-                    raise Exception(resp['msg'])
-            except Exception as err:
+            resp = client.service.saveMsgInfo(msg_info)
+            resp = json.loads(resp)
+            if resp['result'] is False:
+                raise Exception(resp['msg'])
+            msg = (
+                f'门户信息发送成功, 收件人: {username}, '
+                f'消息ID: {resp["msg_id"]}'
+            )
+            prod_logger.info(msg)
+
+        failed = False
+        for _, err in SOAPClientRegistry.map(send, msges):
+            if err is not None:
+                failed = True
                 msg = f'门户信息发送失败, 失败原因: {err}'
                 prod_logger.warning(msg)
-                raise InternalServerError('门户信息发送失败')
-            else:
-                msg = (
-                    f'门户信息发送成功, 收件人: {username}, '
-                    f'消息ID: {resp["msg_id"]}'
-                )
-                prod_logger.info(msg)
+        if failed:
+            raise InternalServerError('门户信息发送失败')
+
+
+class OutboxService:
+    '''Provide services for the notification outbox.
+
+    Emails, SMSes and portal messages are enqueued as OutboxMessage rows in
+    the caller's transaction, and drained by celery workers in batches. Every
+    message is delivered and tracked individually, failed messages are
+    retried with exponential backoff and dead-lettered after MAX_ATTEMPTS.
+    '''
+    MAX_ATTEMPTS = 5
+    RETRY_BACKOFF = timedelta(minutes=1)
+    MAX_RETRY_BACKOFF = timedelta(hours=6)
+    # Messages stuck in sending (e.g. worker crashed) are sent again.
+    SENDING_TIMEOUT = timedelta(minutes=10)
+    # Max number of messages sent per minute w.r.t channels.
+    RATE_LIMITS = {
+        OutboxMessage.CHANNEL_MAIL: 600,
+        OutboxMessage.CHANNEL_SMS: 300,
+        OutboxMessage.CHANNEL_MSG: 600,
+    }
+
+    @staticmethod
+    def _enqueue(channel, payloads):
+        messages = [
+            OutboxMessage(channel=channel, payload=json.dumps(payload))
+            for payload in payloads
+        ]
+        return OutboxMessage.objects.bulk_create(messages, batch_size=500)
+
+    @classmethod
+    def enqueue_mails(cls, mails):
+        '''Enqueue mails.
+
+        Parameters
+        ------------
+        mails: list of tuple,
+            (subject, message, from_email, recipient_list), the same as
+            django.core.mail.send_mass_mail().
+        '''
+        return cls._enqueue(OutboxMessage.CHANNEL_MAIL, (
+            {
+                'subject': subject,
+                'message': message,
+                'from_email': from_email,
+                'recipient_list': list(recipient_list),
+            } for subject, message, from_email, recipient_list in mails
+        ))
+
+    @classmethod
+    def enqueue_smses(cls, smses):
+        '''Enqueue SMSes, see SOAPSMSService.send_sms().'''
+        return cls._enqueue(OutboxMessage.CHANNEL_SMS, smses)
+
+    @classmethod
+    def enqueue_msges(cls, msges):
+        '''Enqueue portal messages, see SOAPMSGService.send_msg().'''
+        return cls._enqueue(OutboxMessage.CHANNEL_MSG, msges)
+
+    @classmethod
+    def get_quota(cls, channel):
+        '''Return the number of messages allowed to be sent now.'''
+        num_recently_sent = OutboxMessage.objects.filter(
+            channel=channel,
+            sent_time__gte=now() - timedelta(minutes=1)).count()
+        return max(0, cls.RATE_LIMITS[channel] - num_recently_sent)
+
+    @classmethod
+    def claim_messages(cls, channel, limit):
+        '''Claim pending messages of the channel for this worker.
+
+        Messages are claimed by a conditional update, so concurrent workers
+        never send the same message twice. Messages stuck in sending count as
+        failed attempts, so they are retried with backoff and dead-lettered
+        after MAX_ATTEMPTS like other failed messages.
+        '''
+        current_time = now()
+        stale_token = uuid.uuid4().hex
+        OutboxMessage.objects.filter(
+            channel=channel, status=OutboxMessage.STATUS_SENDING,
+            update_time__lt=current_time - cls.SENDING_TIMEOUT,
+        ).update(claim_token=stale_token, update_time=current_time)
+        for message in OutboxMessage.objects.filter(
+                claim_token=stale_token, status=OutboxMessage.STATUS_SENDING):
+            cls.mark_failed(message, TimeoutError('发送超时'))
+        ids = list(
+            OutboxMessage.objects
+            .filter(channel=channel, status=OutboxMessage.STATUS_PENDING,
+                    next_attempt_time__lte=current_time)
+            .order_by('next_attempt_time', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        claim_token = uuid.uuid4().hex
+        OutboxMessage.objects.filter(
+            id__in=ids, status=OutboxMessage.STATUS_PENDING,
+        ).update(status=OutboxMessage.STATUS_SENDING,
+                 claim_token=claim_token, update_time=current_time)
+        return list(OutboxMessage.objects.filter(
+            claim_token=claim_token, status=OutboxMessage.STATUS_SENDING,
+        ).order_by('id'))
+
+    @staticmethod
+    def deliver(message, connection=None):
+        '''Deliver a single message, raise exception on failure.
+
+        Mails are sent by the connection if provided, or a new one otherwise.
+        '''
+        payload = json.loads(message.payload)
+        if message.channel == OutboxMessage.CHANNEL_MAIL:
+            EmailMessage(
+                payload['subject'], payload['message'],
+                payload['from_email'], payload['recipient_list'],
+                connection=connection,
+            ).send(fail_silently=False)
+        elif message.channel == OutboxMessage.CHANNEL_SMS:
+            SOAPSMSService.send_sms([payload])
+        else:
+            SOAPMSGService.send_msg([payload])
+
+    @classmethod
+    def mark_failed(cls, message, exc):
+        '''Schedule a retry with backoff, or dead-letter the message.'''
+        message.num_attempts += 1
+        message.last_error = str(exc)[:512]
+        if message.num_attempts >= cls.MAX_ATTEMPTS:
+            message.status = OutboxMessage.STATUS_DEAD
+            msg = (
+                f'{message.get_channel_display()}({message.id})'
+                f'发送{message.num_attempts}次均失败，已停止发送，'
+                f'错误信息为：{message.last_error}'
+            )
+            prod_logger.error(msg)
+        else:
+            message.status = OutboxMessage.STATUS_PENDING
+            backoff = min(
+                cls.RETRY_BACKOFF * 2 ** (message.num_attempts - 1),
+                cls.MAX_RETRY_BACKOFF)
+            message.next_attempt_time = now() + backoff
+        message.save(update_fields=[
+            'num_attempts', 'last_error', 'status', 'next_attempt_time',
+            'update_time'])
+
+    @classmethod
+    def drain(cls, batch_size=100):
+        '''Deliver pending messages of all channels batch by batch.
+
+        Every channel stops when there are no more due messages or its rate
+        limit is reached.
+
+        Return
+        ------
+        stats: dict
+            The number of sent and failed messages w.r.t channel names.
+        '''
+        stats = {}
+        for channel, channel_name in OutboxMessage.CHANNEL_CHOICES:
+            stats[channel_name] = channel_stats = {'sent': 0, 'failed': 0}
+            while True:
+                limit = min(batch_size, cls.get_quota(channel))
+                messages = cls.claim_messages(channel, limit) if limit else []
+                if not messages:
+                    break
+                # Messages are sent concurrently, while their status is
+                # saved in this thread.
+                results = cls.deliver_batch(channel, messages)
+                for message, (_, exc) in zip(messages, results):
+                    if exc is None:
+                        cls.mark_sent(message)
+                        channel_stats['sent'] += 1
+                    else:
+                        cls.mark_failed(message, exc)
+                        channel_stats['failed'] += 1
+        return stats
+
+    @classmethod
+    def deliver_batch(cls, channel, messages):
+        '''Deliver messages concurrently, see SOAPClientRegistry.map().
+
+        Mails of a batch share one connection to the mail server instead of
+        opening one for every mail.
+        '''
+        if channel != OutboxMessage.CHANNEL_MAIL:
+            return SOAPClientRegistry.map(cls.deliver, messages)
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as exc:  # pylint: disable=broad-except
+            return [(None, exc)] * len(messages)
+        try:
+            return SOAPClientRegistry.map(
+                partial(cls.deliver, connection=connection), messages)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def mark_sent(message):
+        '''Record the message as sent.'''
+        message.status = OutboxMessage.STATUS_SENT
+        message.num_attempts += 1
+        message.sent_time = now()
+        message.save(update_fields=[
+            'status', 'num_attempts', 'sent_time', 'update_time'])
+
+    @staticmethod
+    def requeue_dead_messages(message_ids=None):
+        '''Requeue dead-lettered messages, e.g. after the gateway recovers.'''
+        messages = OutboxMessage.objects.filter(
+            status=OutboxMessage.STATUS_DEAD)
+        if message_ids is not None:
+            messages = messages.filter(id__in=message_ids)
+        return messages.update(status=OutboxMessage.STATUS_PENDING,
+                               num_attempts=0, next_attempt_time=now())
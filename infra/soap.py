@@ -0,0 +1,136 @@
+'''Provide SOAP clients shared within the process.'''
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from zeep import Client
+from zeep.cache import SqliteCache
+from zeep.transports import Transport
+
+
+_worker = threading.local()  # pylint: disable=invalid-name
+
+
+@lru_cache(maxsize=4)
+def _hash_secret_key(secret_key):
+    # According to the protocol, we need encrypt our secret_key with
+    # SHA-1 and encode with base64
+    sha1 = hashlib.sha1()
+    sha1.update(secret_key.encode())
+    return base64.b64encode(sha1.digest()).decode()
+
+
+class SOAPClientRegistry:
+    '''Registry of SOAP clients and the thread pool to send messages.
+
+    Clients are created once per process (a forked worker gets its own ones)
+    and reused. Their WSDL files are cached on disk, so restarting a process
+    doesn't fetch and parse them again, and HTTP connections are kept alive
+    by the shared session.
+    '''
+    _lock = threading.Lock()
+    _pid = None
+    _clients = {}
+    _executor = None
+
+    @classmethod
+    def _check_process(cls):
+        '''Drop clients and threads inherited from the parent process.'''
+        if cls._pid != os.getpid():
+            cls._pid = os.getpid()
+            cls._clients = {}
+            cls._executor = None
+
+    @staticmethod
+    def create_client(wsdl):
+        '''Create a SOAP client with on-disk WSDL cache and keep-alive.'''
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=settings.SOAP_MAX_WORKERS)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        transport = Transport(
+            cache=SqliteCache(path=settings.SOAP_WSDL_CACHE_PATH,
+                              timeout=settings.SOAP_WSDL_CACHE_TIMEOUT),
+            session=session,
+            operation_timeout=settings.SOAP_OPERATION_TIMEOUT,
+        )
+        return Client(wsdl, transport=transport)
+
+    @classmethod
+    def get_client(cls, service_name):
+        '''Return the shared client of the service, e.g. SmsService.'''
+        wsdl = f'{settings.SOAP_BASE_URL}/{service_name}?wsdl'
+        with cls._lock:
+            cls._check_process()
+            client = cls._clients.get(wsdl)
+            if client is None:
+                client = cls._clients[wsdl] = cls.create_client(wsdl)
+        return client
+
+    @classmethod
+    def clear(cls):
+        '''Drop all shared clients.'''
+        with cls._lock:
+            cls._clients = {}
+
+    @staticmethod
+    def get_secret_key():
+        '''Return the encrypted secret key for SOAP requests.'''
+        return _hash_secret_key(settings.SOAP_AUTH_SECRET_KEY)
+
+    @classmethod
+    def get_executor(cls):
+        '''Return the bounded thread pool shared in the process.'''
+        with cls._lock:
+            cls._check_process()
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=settings.SOAP_MAX_WORKERS,
+                    thread_name_prefix='soap')
+        return cls._executor
+
+    @staticmethod
+    def _run_in_worker(func, item):
+        _worker.active = True
+        try:
+            return func(item)
+        finally:
+            _worker.active = False
+
+    @classmethod
+    def map(cls, func, items):
+        '''Call func on items concurrently.
+
+        Return
+        ------
+        results: list of tuple
+            (result, exception) w.r.t items, exception is None if the call
+            succeeded.
+        '''
+        results = []
+        if getattr(_worker, 'active', False):
+            # Called from a pool thread (e.g. the outbox sends SMSes which
+            # are sent by the pool again), waiting for the same bounded pool
+            # may dead-lock, so run in the current thread instead.
+            for item in items:
+                try:
+                    results.append((func(item), None))
+                except Exception as exc:  # pylint: disable=broad-except
+                    results.append((None, exc))
+            return results
+        executor = cls.get_executor()
+        futures = [executor.submit(cls._run_in_worker, func, item)
+                   for item in items]
+        for future in futures:
+            try:
+                results.append((future.result(), None))
+            except Exception as exc:  # pylint: disable=broad-except
+                results.append((None, exc))
+        return results
@@ -0,0 +1,14 @@
+'''Celery tasks.'''
+from celery import shared_task
+
+from infra.services import OutboxService
+from infra.utils import prod_logger
+
+
+@shared_task
+def drain_outbox():
+    '''Deliver pending emails, SMSes and portal messages.'''
+    stats = OutboxService.drain()
+    msg = f'待发送消息处理完毕：{stats}'
+    prod_logger.info(msg)
+    return stats
@@ -1,5 +1,5 @@
 '''Unit tests for infra backends.'''
-from unittest.mock import patch, Mock
+from unittest.mock import patch
 
 from django.core.mail import EmailMessage
 from django.test import TestCase
@@ -52,10 +52,8 @@ class TestSOAPEmailBackend(TestCase):
 
         self.assertEqual(res, f'||||{recipients[0]}^@^||||{recipients[1]}')
 
-    @patch('infra.backends.InMemoryCache', Mock())
-    @patch('infra.backends.Transport', Mock())
     @patch('infra.backends.prod_logger')
-    @patch('infra.backends.Client')
+    @patch('infra.backends.SOAPClientRegistry.get_client')
     def test_send_messages_wsdl_fail(self, mocked_client, mocked_logger):
         '''Should raise exception if failed to create SOAP client.'''
 
@@ -66,10 +64,8 @@ class TestSOAPEmailBackend(TestCase):
 
         mocked_logger.warning.assert_called()
 
-    @patch('infra.backends.InMemoryCache', Mock())
-    @patch('infra.backends.Transport', Mock())
     @patch('infra.backends.prod_logger')
-    @patch('infra.backends.Client')
+    @patch('infra.backends.SOAPClientRegistry.get_client')
     def test_send_messages_send_fail(self, mocked_client, mocked_logger):
         '''Should raise exception if failed to send email.'''
 
@@ -82,10 +78,8 @@ class TestSOAPEmailBackend(TestCase):
         msg = '邮件发送失败, 失败原因: Unknown'
         mocked_logger.warning.assert_called_with(msg)
 
-    @patch('infra.backends.InMemoryCache', Mock())
-    @patch('infra.backends.Transport', Mock())
     @patch('infra.backends.prod_logger')
-    @patch('infra.backends.Client')
+    @patch('infra.backends.SOAPClientRegistry.get_client')
     def test_send_messages_send_succeed(self, mocked_client, mocked_logger):
         '''Should send email via SOAP client.'''
 
@@ -99,10 +93,8 @@ class TestSOAPEmailBackend(TestCase):
         msg = "邮件发送成功, 收件人: ['a@c.com', 'a@b.com'], 标题: a, 消息ID: 123"
         mocked_logger.info.assert_called_with(msg)
 
-    @patch('infra.backends.InMemoryCache', Mock())
-    @patch('infra.backends.Transport', Mock())
     @patch('infra.backends.prod_logger')
-    @patch('infra.backends.Client')
+    @patch('infra.backends.SOAPClientRegistry.get_client')
     def test_send_messages_service_fail(self, mocked_client, mocked_logger):
         '''Should send email via SOAP client.'''
 
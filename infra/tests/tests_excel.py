@@ -0,0 +1,131 @@
+'''Unit tests for reading Excel files.'''
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+import xlwt
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+
+from infra.excel import InvalidExcelFile, get_cell_value, iter_excel_rows
+
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels"
+ ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+</Types>'''
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="sheet1" sheetId="1" r:id="rId7"/></sheets>
+</workbook>'''
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8"?>
+<Relationships
+ xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId7" Target="worksheets/first.xml"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>
+</Relationships>'''
+SHARED_STRINGS = '''<?xml version="1.0" encoding="UTF-8"?>
+<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<si><t>参与</t></si>
+<si><r><t>rich </t></r><r><t>text</t></r></si>
+</sst>'''
+
+
+def make_xlsx(rows):
+    '''Build a minimal .xlsx file.
+
+    rows: dict
+        Map row number (starts from 1) to list of (reference, xml) of cells.
+    '''
+    sheet_rows = ''.join(
+        '<row r="{}">{}</row>'.format(row_number, ''.join(
+            '<c r="{}"{}</c>'.format(reference, cell)
+            for reference, cell in cells))
+        for row_number, cells in sorted(rows.items()))
+    sheet = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/'
+        'spreadsheetml/2006/main"><sheetData>{}</sheetData></worksheet>'
+    ).format(sheet_rows)
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('xl/workbook.xml', WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        archive.writestr('xl/sharedStrings.xml', SHARED_STRINGS)
+        archive.writestr('xl/worksheets/first.xml', sheet)
+    return output.getvalue()
+
+
+def number_cell(reference, value):
+    '''Numeric cell.'''
+    return (reference, '><v>{}</v>'.format(value))
+
+
+def inline_string_cell(reference, value):
+    '''Inline string cell.'''
+    return (reference, ' t="inlineStr"><is><t>{}</t></is>'.format(
+        escape(value)))
+
+
+def shared_string_cell(reference, index):
+    '''Shared string cell.'''
+    return (reference, ' t="s"><v>{}</v>'.format(index))
+
+
+class TestIterExcelRows(TestCase):
+    '''Unit tests for iter_excel_rows().'''
+    def test_xlsx(self):
+        '''Should read rows of .xlsx file in order, filling gaps.'''
+        excel = make_xlsx({
+            1: [number_cell('B1', 12)],
+            4: [inline_string_cell('C4', 'abc'),
+                shared_string_cell('H4', 0),
+                number_cell('I4', 6)],
+            5: [shared_string_cell('A5', 1)],
+        })
+
+        rows = list(iter_excel_rows(excel))
+
+        self.assertEqual(rows, [
+            ['', 12.0],
+            [],
+            [],
+            ['', '', 'abc', '', '', '', '', '参与', 6.0],
+            ['rich text'],
+        ])
+
+    def test_xlsx_uploaded_file(self):
+        '''Should read uploaded file without reading it into memory.'''
+        upload = SimpleUploadedFile(
+            'a.xlsx', make_xlsx({1: [number_cell('A1', 1)]}))
+        upload.read()
+
+        self.assertEqual(list(iter_excel_rows(upload)), [[1.0]])
+
+    def test_xls(self):
+        '''Should read rows of .xls file.'''
+        work_book = xlwt.Workbook()
+        sheet = work_book.add_sheet('sheet1')
+        sheet.write(0, 1, 12)
+        sheet.write(2, 0, 'abc')
+        output = io.BytesIO()
+        work_book.save(output)
+
+        rows = list(iter_excel_rows(output.getvalue()))
+
+        self.assertEqual(rows, [['', 12.0], ['', ''], ['abc', '']])
+
+    def test_invalid_file(self):
+        '''Should raise InvalidExcelFile for other files.'''
+        for excel in (b'some numbers', 123, b'PK\x03\x04broken'):
+            with self.assertRaises(InvalidExcelFile):
+                list(iter_excel_rows(excel))
+
+    def test_get_cell_value(self):
+        '''Should return '' for missing cells.'''
+        self.assertEqual(get_cell_value([1, 2], 1), 2)
+        self.assertEqual(get_cell_value([1, 2], 5), '')
@@ -1,10 +1,20 @@
 '''Unit tests for infra pagination classes.'''
-from unittest.mock import patch, Mock
+import base64
+import json
+from types import SimpleNamespace
+from unittest.mock import ANY, MagicMock, Mock, patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from model_mommy import mommy
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
 import infra.paginations as paginations
 import infra.exceptions as exceptions
+from infra.models import Notification
 
 
 class TestLimitOffsetPagination(TestCase):
@@ -71,3 +81,209 @@ class TestLimitOffsetPagination(TestCase):
         res = self.pagination.get_limit(request)
 
         self.assertIsNone(res)
+
+
+class TestKeysetPagination(TestCase):
+    '''Unit tests for KeysetPagination.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.notifications = mommy.make(Notification, _quantity=7)
+        # Ties of time are broken by id.
+        Notification.objects.filter(
+            id__in=[obj.id for obj in cls.notifications[2:5]]).update(
+                time=now())
+        cls.ids = list(Notification.objects.order_by(
+            '-time', '-id').values_list('id', flat=True))
+
+    @staticmethod
+    def paginate(url, **params):
+        '''Return ids of a page and the paginator.'''
+        request = Request(APIRequestFactory().get(url, params))
+        paginator = paginations.KeysetPagination(('-time', '-id'))
+        page = paginator.paginate_queryset(Notification.objects.all(),
+                                           request)
+        return [obj.id for obj in page], paginator
+
+    def test_forward(self):
+        '''Should walk through all objects without duplicates.'''
+        ids = []
+        url = '/api/notifications/?cursor=&limit=3'
+        while url:
+            page, paginator = self.paginate(url)
+            ids.extend(page)
+            url = paginator.get_next_link()
+
+        self.assertEqual(ids, self.ids)
+        self.assertIsNotNone(paginator.get_previous_link())
+
+    def test_backward(self):
+        '''Should return the previous pages before the cursor.'''
+        first_page, paginator = self.paginate('/api/', cursor='', limit=3)
+        self.assertIsNone(paginator.get_previous_link())
+        second_page, paginator = self.paginate(paginator.get_next_link())
+        _, paginator = self.paginate(paginator.get_next_link())
+
+        page, paginator = self.paginate(paginator.get_previous_link())
+        self.assertEqual(page, second_page)
+        page, paginator = self.paginate(paginator.get_previous_link())
+        self.assertEqual(page, first_page)
+        self.assertIsNone(paginator.get_previous_link())
+        self.assertIsNotNone(paginator.get_next_link())
+
+    def test_no_count(self):
+        '''Should not count objects unless estimate is required.'''
+        with self.assertNumQueries(1):
+            _, paginator = self.paginate('/api/', cursor='')
+
+        response = paginator.get_paginated_response([])
+
+        self.assertEqual(list(response.data),
+                         ['next', 'previous', 'results'])
+
+    @patch('infra.paginations.get_table_rows', Mock(return_value=None))
+    def test_estimated_count(self):
+        '''Should count objects up to the cap.'''
+        _, paginator = self.paginate('/api/', cursor='', count='estimate')
+        self.assertEqual(paginator.get_paginated_response([]).data['count'],
+                         7)
+
+        with patch.object(paginations.KeysetPagination,
+                          'estimated_count_cap', 5):
+            _, paginator = self.paginate('/api/', cursor='',
+                                         count='estimate')
+        data = paginator.get_paginated_response([]).data
+
+        self.assertEqual((data['count'], data['count_exact']), (5, False))
+
+    def test_invalid_cursor(self):
+        '''Should raise BadRequest for invalid cursors.'''
+        for cursor in ('invalid', 'e30=', 'eyJ2IjogWzFdLCAiciI6IGZhbHNlfQ=='):
+            with self.assertRaises(exceptions.BadRequest):
+                self.paginate('/api/', cursor=cursor)
+
+    def test_tampered_cursor(self):
+        '''Should raise BadRequest for values of wrong types.'''
+        for values in (['notadate', 'x'], [None, 1], [[], {}],
+                       [now().isoformat(), 'x']):
+            cursor = base64.urlsafe_b64encode(json.dumps(
+                {'v': values, 'r': False}).encode()).decode()
+            with self.assertRaises(exceptions.BadRequest):
+                self.paginate('/api/', cursor=cursor)
+
+    def test_annotated_cursor(self):
+        '''Should convert values by output fields of annotations.'''
+        paginator = paginations.KeysetPagination(('-priority', '-id'))
+        queryset = Notification.objects.annotate(priority=F('id'))
+
+        self.assertEqual(paginator.to_python_values(queryset, ['3', 2]),
+                         [3, 2])
+        with self.assertRaises(exceptions.BadRequest):
+            paginator.to_python_values(queryset, ['x', 2])
+
+    def test_limit_offset_pagination(self):
+        '''Should be used by LimitOffsetPagination for cursor requests.'''
+        view = SimpleNamespace(action='list',
+                               keyset_orderings={'list': ('-time', '-id')})
+        factory = APIRequestFactory()
+
+        paginator = paginations.LimitOffsetPagination()
+        page = paginator.paginate_queryset(
+            Notification.objects.all(),
+            Request(factory.get('/api/', {'cursor': '', 'limit': 2})), view)
+        self.assertEqual([obj.id for obj in page], self.ids[:2])
+        self.assertNotIn('count', paginator.get_paginated_response([]).data)
+
+        paginator = paginations.LimitOffsetPagination()
+        page = paginator.paginate_queryset(
+            Notification.objects.order_by('id'),
+            Request(factory.get('/api/', {'offset': 1, 'limit': 2})), view)
+        self.assertEqual([obj.id for obj in page], sorted(self.ids)[1:3])
+        self.assertEqual(paginator.get_paginated_response([]).data['count'],
+                         7)
+
+    def test_count_up_to(self):
+        '''Should stop counting at the cap.'''
+        queryset = Notification.objects.all()
+
+        self.assertEqual(paginations.count_up_to(queryset, 10), (7, True))
+        self.assertEqual(paginations.count_up_to(queryset, 7), (7, True))
+        self.assertEqual(paginations.count_up_to(queryset, 3), (3, False))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class TestCounts(TestCase):
+    '''Unit tests for cached and estimated counts.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.notifications = mommy.make(Notification, _quantity=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_cached_count(self):
+        '''Should reuse counts of the same query until objects change.'''
+        queryset = Notification.objects.filter(
+            id__in=[obj.id for obj in self.notifications]).order_by('-id')
+        self.assertEqual(paginations.get_cached_count(queryset), 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(paginations.get_cached_count(
+                queryset.order_by('time')), 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(paginations.get_cached_count(
+                queryset.filter(read_time=None)), 3)
+
+        self.notifications[0].delete()
+        self.assertEqual(paginations.get_cached_count(queryset), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(paginations.get_cached_count(
+                Notification.objects.none()), 0)
+
+    @patch('infra.paginations.get_table_rows')
+    def test_get_estimated_count(self, mocked_get_table_rows):
+        '''Should estimate unfiltered counts by table statistics.'''
+        mocked_get_table_rows.return_value = 5000
+        self.assertEqual(paginations.get_estimated_count(
+            Notification.objects.all(), cap=2), (5000, False))
+        self.assertEqual(paginations.get_estimated_count(
+            Notification.objects.filter(read_time=None), cap=2), (2, False))
+
+        mocked_get_table_rows.return_value = None
+        self.assertEqual(paginations.get_estimated_count(
+            Notification.objects.all(), cap=2), (2, False))
+        self.assertEqual(paginations.get_estimated_count(
+            Notification.objects.all()), (3, True))
+
+    def test_get_table_rows(self):
+        '''Should only read table statistics of MySQL.'''
+        connection = MagicMock(vendor='sqlite')
+        with patch('infra.paginations.connections',
+                   {'default': connection}):
+            self.assertIsNone(paginations.get_table_rows(Notification))
+        connection.cursor.assert_not_called()
+
+        connection.vendor = 'mysql'
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (5000,)
+        with patch('infra.paginations.connections',
+                   {'default': connection}):
+            self.assertEqual(paginations.get_table_rows(Notification), 5000)
+        cursor.execute.assert_called_with(
+            ANY, [Notification._meta.db_table])
+
+    @patch('infra.paginations.get_table_rows', Mock(return_value=None))
+    def test_paginated_response(self):
+        '''Should tell whether the count is exact.'''
+        factory = APIRequestFactory()
+        for params, expected in (({}, (3, True)),
+                                 ({'count': 'estimate'}, (2, False))):
+            paginator = paginations.LimitOffsetPagination()
+            paginator.estimated_count_cap = 2
+            paginator.paginate_queryset(
+                Notification.objects.order_by('id'),
+                Request(factory.get('/api/', {'limit': 1, **params})))
+            data = paginator.get_paginated_response([]).data
+
+            self.assertEqual((data['count'], data['count_exact']), expected)
@@ -1,13 +1,17 @@
 '''Unit tests for infra services.'''
+import json
 from unittest.mock import patch, call, Mock
 
+from django.core import mail as django_mail
 from django.test import TestCase
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from model_mommy import mommy
 
-from infra.services import NotificationService
-from infra.models import Notification
+from infra.exceptions import InternalServerError
+from infra.services import NotificationService, OutboxService
+from infra.models import Notification, OutboxMessage
 
 
 User = get_user_model()
@@ -85,3 +89,192 @@ class TestNotificationService(TestCase):
 
         count = Notification.objects.filter(recipient=user).count()
         self.assertEqual(count, 0)
+
+    def test_send_system_notifications(self):
+        '''Should send notifications for users in bulk.'''
+        users = mommy.make(User, _quantity=3)
+        content = 'Hello World!'
+
+        notifications = self.service.send_system_notifications(users, content)
+
+        self.assertEqual(len(notifications), 3)
+        self.assertEqual({x.recipient_id for x in notifications},
+                         {user.id for user in users})
+        self.assertEqual(Notification.objects.filter(
+            recipient__in=users, content=content).count(), 3)
+
+    def test_send_system_notifications_permissions(self):
+        '''Should assign object permissions to recipients.'''
+        users = mommy.make(User, _quantity=2)
+        with patch('auth.services.PermissionService'
+                   '.bulk_assign_object_permissions') as mocked_assign:
+            notifications = self.service.send_system_notifications(
+                users, 'Hello World!')
+
+        pairs = list(mocked_assign.call_args[0][0])
+        self.assertEqual(
+            pairs, [(x.recipient, x) for x in notifications])
+
+    def test_send_system_notifications_empty(self):
+        '''Should do nothing if no recipients.'''
+        with self.assertNumQueries(0):
+            notifications = self.service.send_system_notifications(
+                [], 'Hello World!')
+
+        self.assertEqual(notifications, [])
+
+
+class TestOutboxService(TestCase):
+    '''Unit tests for OutboxService.'''
+    def setUp(self):
+        self.mails = [('subject', f'message{idx}', 'TMSFTT', ['a@b.com'])
+                      for idx in range(3)]
+        self.smses = [{'user_phone_number': '123', 'sms_info': 'info'}]
+        self.msges = [{'user_username': 'user', 'msg_title': 'title',
+                       'msg_info': 'info'}]
+
+    def enqueue_all(self):
+        '''Enqueue all kinds of messages.'''
+        OutboxService.enqueue_mails(self.mails)
+        OutboxService.enqueue_smses(self.smses)
+        OutboxService.enqueue_msges(self.msges)
+
+    def test_enqueue(self):
+        '''Should create pending messages.'''
+        self.enqueue_all()
+
+        messages = OutboxMessage.objects.filter(
+            status=OutboxMessage.STATUS_PENDING)
+        self.assertEqual(messages.count(), 5)
+        mail = messages.filter(channel=OutboxMessage.CHANNEL_MAIL).first()
+        self.assertEqual(json.loads(mail.payload)['recipient_list'],
+                         ['a@b.com'])
+
+    @patch('infra.services.SOAPMSGService.send_msg')
+    @patch('infra.services.SOAPSMSService.send_sms')
+    def test_drain(self, mocked_send_sms, mocked_send_msg):
+        '''Should deliver every message individually.'''
+        self.enqueue_all()
+
+        stats = OutboxService.drain(batch_size=2)
+
+        self.assertEqual(stats['邮件'], {'sent': 3, 'failed': 0})
+        self.assertEqual(len(django_mail.outbox), 3)
+        mocked_send_sms.assert_called_once_with(self.smses)
+        mocked_send_msg.assert_called_once_with(self.msges)
+        self.assertFalse(OutboxMessage.objects.exclude(
+            status=OutboxMessage.STATUS_SENT).exists())
+
+    @patch('infra.services.SOAPMSGService.send_msg')
+    @patch('infra.services.SOAPSMSService.send_sms')
+    def test_drain_retry_with_backoff(self, mocked_send_sms, _):
+        '''Should keep sending other messages and retry failed ones.'''
+        self.smses.append({'user_phone_number': '456', 'sms_info': 'info'})
+        self.enqueue_all()
+        mocked_send_sms.side_effect = [InternalServerError('短信发送失败'), None]
+
+        stats = OutboxService.drain()
+
+        self.assertEqual(stats['短信'], {'sent': 1, 'failed': 1})
+        failed = OutboxMessage.objects.get(
+            status=OutboxMessage.STATUS_PENDING)
+        self.assertEqual(failed.num_attempts, 1)
+        self.assertEqual(failed.last_error, '短信发送失败')
+        self.assertGreater(failed.next_attempt_time, timezone.now())
+        # Not due yet.
+        self.assertEqual(OutboxService.drain()['短信'],
+                         {'sent': 0, 'failed': 0})
+
+    @patch('infra.services.SOAPSMSService.send_sms')
+    def test_drain_dead_letter(self, mocked_send_sms):
+        '''Should dead-letter messages failed too many times.'''
+        OutboxService.enqueue_smses(self.smses)
+        mocked_send_sms.side_effect = InternalServerError('短信发送失败')
+
+        for _ in range(OutboxService.MAX_ATTEMPTS):
+            OutboxMessage.objects.update(next_attempt_time=timezone.now())
+            OutboxService.drain()
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.STATUS_DEAD)
+        self.assertEqual(message.num_attempts, OutboxService.MAX_ATTEMPTS)
+
+        OutboxService.requeue_dead_messages()
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.STATUS_PENDING)
+        self.assertEqual(message.num_attempts, 0)
+
+    def test_drain_mails_share_connection(self):
+        '''Should open one connection for every batch of mails.'''
+        OutboxService.enqueue_mails(self.mails)
+
+        with patch('infra.services.get_connection',
+                   wraps=django_mail.get_connection) as mocked_connection:
+            stats = OutboxService.drain(batch_size=2)
+
+        self.assertEqual(stats['邮件'], {'sent': 3, 'failed': 0})
+        self.assertEqual(mocked_connection.call_count, 2)
+        self.assertEqual(len(django_mail.outbox), 3)
+
+    @patch('infra.services.get_connection')
+    def test_drain_mail_connection_failed(self, mocked_connection):
+        '''Should retry mails if the mail server is unavailable.'''
+        OutboxService.enqueue_mails(self.mails)
+        mocked_connection.return_value.open.side_effect = OSError('连接失败')
+
+        stats = OutboxService.drain()
+
+        self.assertEqual(stats['邮件'], {'sent': 0, 'failed': 3})
+        self.assertEqual(OutboxMessage.objects.filter(
+            status=OutboxMessage.STATUS_PENDING, num_attempts=1,
+            last_error='连接失败').count(), 3)
+
+    def test_drain_rate_limit(self):
+        '''Should not send more messages than the rate limit.'''
+        self.enqueue_all()
+
+        with patch.dict(OutboxService.RATE_LIMITS,
+                        {OutboxMessage.CHANNEL_MAIL: 2}):
+            stats = OutboxService.drain(batch_size=1)
+            self.assertEqual(stats['邮件'], {'sent': 2, 'failed': 0})
+            self.assertEqual(OutboxService.drain()['邮件']['sent'], 0)
+        self.assertEqual(len(django_mail.outbox), 2)
+
+    def test_claim_messages(self):
+        '''Should not claim messages twice, reclaim stuck messages.'''
+        OutboxService.enqueue_mails(self.mails)
+
+        claimed = OutboxService.claim_messages(OutboxMessage.CHANNEL_MAIL, 2)
+        self.assertEqual(len(claimed), 2)
+        claimed_again = OutboxService.claim_messages(
+            OutboxMessage.CHANNEL_MAIL, 10)
+        self.assertEqual(len(claimed_again), 1)
+
+        OutboxMessage.objects.update(
+            update_time=timezone.now() - OutboxService.SENDING_TIMEOUT * 2)
+        claimed = OutboxService.claim_messages(OutboxMessage.CHANNEL_MAIL, 10)
+        self.assertEqual(len(claimed), 0)
+        for message in OutboxMessage.objects.all():
+            self.assertEqual(message.status, OutboxMessage.STATUS_PENDING)
+            self.assertEqual(message.num_attempts, 1)
+            self.assertEqual(message.last_error, '发送超时')
+            self.assertGreater(message.next_attempt_time, timezone.now())
+
+        OutboxMessage.objects.update(next_attempt_time=timezone.now())
+        claimed = OutboxService.claim_messages(OutboxMessage.CHANNEL_MAIL, 10)
+        self.assertEqual(len(claimed), 3)
+
+    def test_claim_messages_dead_letter_stuck(self):
+        '''Should dead-letter messages stuck in sending too many times.'''
+        OutboxService.enqueue_mails(self.mails[:1])
+        OutboxMessage.objects.update(
+            status=OutboxMessage.STATUS_SENDING,
+            num_attempts=OutboxService.MAX_ATTEMPTS - 1,
+            update_time=timezone.now() - OutboxService.SENDING_TIMEOUT * 2)
+
+        claimed = OutboxService.claim_messages(OutboxMessage.CHANNEL_MAIL, 10)
+
+        self.assertEqual(claimed, [])
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.status, OutboxMessage.STATUS_DEAD)
+        self.assertEqual(message.num_attempts, OutboxService.MAX_ATTEMPTS)
@@ -0,0 +1,182 @@
+'''Unit tests for shared SOAP clients.'''
+import json
+from unittest.mock import patch, Mock
+
+from django.test import TestCase, override_settings
+
+from infra.exceptions import InternalServerError
+from infra.services import SOAPSMSService, SOAPMSGService
+from infra.soap import SOAPClientRegistry
+
+
+@override_settings(SOAP_BASE_URL='http://soap.test')
+class TestSOAPClientRegistry(TestCase):
+    '''Unit tests for SOAPClientRegistry.'''
+    def setUp(self):
+        SOAPClientRegistry.clear()
+
+    def tearDown(self):
+        SOAPClientRegistry.clear()
+
+    @patch('infra.soap.SOAPClientRegistry.create_client')
+    def test_get_client_reused(self, mocked_create_client):
+        '''Should create client once per service.'''
+        mocked_create_client.side_effect = lambda wsdl: Mock()
+
+        client = SOAPClientRegistry.get_client('SmsService')
+
+        self.assertIs(SOAPClientRegistry.get_client('SmsService'), client)
+        self.assertIsNot(SOAPClientRegistry.get_client('MsgService'), client)
+        mocked_create_client.assert_any_call(
+            'http://soap.test/SmsService?wsdl')
+        self.assertEqual(mocked_create_client.call_count, 2)
+
+    @patch('infra.soap.os.getpid')
+    @patch('infra.soap.SOAPClientRegistry.create_client')
+    def test_get_client_forked(self, mocked_create_client, mocked_getpid):
+        '''Should not reuse clients created in parent process.'''
+        mocked_create_client.side_effect = lambda wsdl: Mock()
+        mocked_getpid.return_value = 1
+        client = SOAPClientRegistry.get_client('SmsService')
+
+        mocked_getpid.return_value = 2
+
+        self.assertIsNot(SOAPClientRegistry.get_client('SmsService'), client)
+
+    @patch('infra.soap.SqliteCache')
+    @patch('infra.soap.Client')
+    def test_create_client(self, mocked_client, mocked_cache):
+        '''Should create client with persistent cache and timeout.'''
+        with self.settings(SOAP_WSDL_CACHE_PATH='/tmp/wsdl.db',
+                           SOAP_OPERATION_TIMEOUT=3):
+            SOAPClientRegistry.create_client('http://soap.test/a?wsdl')
+
+        mocked_cache.assert_called_with(path='/tmp/wsdl.db', timeout=24 * 3600)
+        transport = mocked_client.call_args[1]['transport']
+        self.assertEqual(transport.operation_timeout, 3)
+
+    @override_settings(SOAP_AUTH_SECRET_KEY='secret')
+    def test_get_secret_key(self):
+        '''Should return SHA-1 digest encoded by base64.'''
+        self.assertEqual(SOAPClientRegistry.get_secret_key(),
+                         '5en6G6MezRroT3XKqkdPOmY/BfQ=')
+
+    def test_map(self):
+        '''Should return results and exceptions in order.'''
+        def func(item):
+            if item % 2:
+                raise ValueError(item)
+            return item * 2
+
+        results = SOAPClientRegistry.map(func, range(4))
+
+        self.assertEqual([x[0] for x in results], [0, None, 4, None])
+        self.assertIsNone(results[0][1])
+        self.assertIsInstance(results[1][1], ValueError)
+
+    def test_map_nested(self):
+        '''Should not dead-lock if called from pool threads.'''
+        with self.settings(SOAP_MAX_WORKERS=1):
+            with patch.object(SOAPClientRegistry, '_executor', None):
+                results = SOAPClientRegistry.map(
+                    lambda x: SOAPClientRegistry.map(abs, [x, -x]), [1, 2])
+
+        self.assertEqual(results, [([(1, None), (1, None)], None),
+                                   ([(2, None), (2, None)], None)])
+
+
+class TestSOAPSMSService(TestCase):
+    '''Unit tests for SOAPSMSService.'''
+    @patch('infra.services.prod_logger')
+    @patch('infra.services.SOAPClientRegistry.get_client')
+    def test_send_sms_wsdl_fail(self, mocked_get_client, mocked_logger):
+        '''Should raise exception if failed to create SOAP client.'''
+        mocked_get_client.side_effect = Exception()
+
+        with self.assertRaisesMessage(InternalServerError, '短信服务暂时不可用'):
+            SOAPSMSService.send_sms([])
+
+        mocked_logger.warning.assert_called()
+
+    @patch('infra.services.prod_logger')
+    @patch('infra.services.SOAPClientRegistry.get_client')
+    def test_send_sms(self, mocked_get_client, mocked_logger):
+        '''Should send every sms via shared client.'''
+        service = mocked_get_client.return_value.service
+        service.saveSmsInfo.return_value = (
+            '{"result":true,"msg":"success","msg_id":"1"}')
+        smses = [{'user_phone_number': f'1380000000{idx}', 'sms_info': 'a'}
+                 for idx in range(3)]
+
+        SOAPSMSService.send_sms(smses)
+
+        self.assertEqual(service.saveSmsInfo.call_count, 3)
+        phone_numbers = {
+            json.loads(args[0])['person_info']
+            for args, _ in service.saveSmsInfo.call_args_list
+        }
+        self.assertEqual(phone_numbers,
+                         {f'||||1380000000{idx}' for idx in range(3)})
+        self.assertEqual(mocked_logger.info.call_count, 3)
+
+    @patch('infra.services.prod_logger')
+    @patch('infra.services.SOAPClientRegistry.get_client')
+    def test_send_sms_partial_fail(self, mocked_get_client, mocked_logger):
+        '''Should try all smses and raise exception if any fails.'''
+        service = mocked_get_client.return_value.service
+        service.saveSmsInfo.side_effect = [
+            '{"result":true,"msg":"success","msg_id":"1"}',
+            '{"result":false,"msg":"failed reason","msg_id":"2"}',
+        ]
+        smses = [{'user_phone_number': '1', 'sms_info': 'a'}] * 2
+
+        with self.assertRaisesMessage(InternalServerError, '短信发送失败'):
+            SOAPSMSService.send_sms(smses)
+
+        self.assertEqual(service.saveSmsInfo.call_count, 2)
+        mocked_logger.warning.assert_called_with(
+            '短信发送失败, 失败原因: failed reason')
+
+
+class TestSOAPMSGService(TestCase):
+    '''Unit tests for SOAPMSGService.'''
+    @patch('infra.services.prod_logger')
+    @patch('infra.services.SOAPClientRegistry.get_client')
+    def test_send_msg_wsdl_fail(self, mocked_get_client, mocked_logger):
+        '''Should raise exception if failed to create SOAP client.'''
+        mocked_get_client.side_effect = Exception()
+
+        with self.assertRaisesMessage(InternalServerError, '门户信息服务暂时不可用'):
+            SOAPMSGService.send_msg([])
+
+        mocked_logger.warning.assert_called()
+
+    @patch('infra.services.prod_logger')
+    @patch('infra.services.SOAPClientRegistry.get_client')
+    def test_send_msg(self, mocked_get_client, mocked_logger):
+        '''Should send message via shared client.'''
+        service = mocked_get_client.return_value.service
+        service.saveMsgInfo.return_value = (
+            '{"result":true,"msg":"success","msg_id":"1"}')
+
+        SOAPMSGService.send_msg([{'user_username': 'abc', 'msg_title': 't',
+                                  'msg_info': 'i'}])
+
+        payload = json.loads(service.saveMsgInfo.call_args[0][0])
+        self.assertEqual(payload['recieve_person_info'], '|abc||')
+        self.assertEqual(payload['msg_title'], 't')
+        mocked_logger.info.assert_called_with(
+            '门户信息发送成功, 收件人: |abc||, 消息ID: 1')
+
+    @patch('infra.services.prod_logger')
+    @patch('infra.services.SOAPClientRegistry.get_client')
+    def test_send_msg_fail(self, mocked_get_client, mocked_logger):
+        '''Should raise exception if failed to send message.'''
+        service = mocked_get_client.return_value.service
+        service.saveMsgInfo.side_effect = Exception('Unknown')
+
+        with self.assertRaisesMessage(InternalServerError, '门户信息发送失败'):
+            SOAPMSGService.send_msg([{'user_username': 'abc'}])
+
+        mocked_logger.warning.assert_called_with(
+            '门户信息发送失败, 失败原因: Unknown')
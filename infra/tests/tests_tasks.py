@@ -0,0 +1,16 @@
+'''Unit tests for infra celery tasks.'''
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from infra.tasks import drain_outbox
+
+
+class TestTasks(TestCase):
+    '''Test celery tasks.'''
+    @patch('infra.tasks.OutboxService')
+    def test_drain_outbox(self, mocked_service):
+        '''Should call OutboxService.drain().'''
+        drain_outbox()
+
+        mocked_service.drain.assert_called()
@@ -3,9 +3,14 @@ import random
 import string
 from unittest.mock import Mock, patch
 
-from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from model_mommy import mommy
 
 import infra.utils as utils
+from infra.models import Notification
+from auth.models import User
 
 
 class TestPositiveInt(TestCase):
@@ -45,6 +50,72 @@ class TestPositiveInt(TestCase):
         self.assertEqual(ret, expected)
 
 
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class TestModelVersion(TestCase):
+    '''Unit tests for get_model_version().'''
+    def setUp(self):
+        cache.clear()
+
+    def test_save_and_delete(self):
+        '''Should change the version if objects are saved or deleted.'''
+        version = utils.get_model_version(Notification)
+        self.assertEqual(utils.get_model_version(Notification), version)
+
+        notification = mommy.make(Notification)
+        saved_version = utils.get_model_version(Notification)
+        self.assertNotEqual(saved_version, version)
+
+        notification.delete()
+        self.assertNotEqual(utils.get_model_version(Notification),
+                            saved_version)
+
+    def test_m2m_changed(self):
+        '''Should change versions of both sides of m2m relations.'''
+        user = mommy.make(User)
+        group = mommy.make(Group)
+        versions = [utils.get_model_version(model) for model in (User, Group)]
+
+        user.groups.add(group)
+
+        for model, version in zip((User, Group), versions):
+            self.assertNotEqual(utils.get_model_version(model), version)
+
+
+class TestBulkCreateWithPks(TestCase):
+    '''Unit tests for bulk_create_with_pks().'''
+    def test_bulk_create_with_pks(self):
+        '''Should set primary keys of created objects in order.'''
+        sender, recipient, other_recipient = mommy.make(User, _quantity=3)
+        existing = mommy.make(Notification, sender=sender,
+                              recipient=recipient, content='通知')
+        notifications = [
+            Notification(sender=sender, recipient=user, content='通知')
+            for user in (recipient, other_recipient, recipient)
+        ]
+
+        created = utils.bulk_create_with_pks(
+            Notification.objects, notifications, ('recipient_id',),
+            sender=sender, content='通知')
+
+        self.assertIs(created[0], notifications[0])
+        self.assertEqual(
+            [notification.pk for notification in created],
+            list(Notification.objects.exclude(pk=existing.pk)
+                 .order_by('pk').values_list('pk', flat=True)))
+        for notification in created:
+            self.assertEqual(
+                Notification.objects.get(pk=notification.pk).recipient_id,
+                notification.recipient_id)
+
+    def test_bulk_create_with_pks_empty(self):
+        '''Should not query if nothing is created.'''
+        with self.assertNumQueries(0):
+            self.assertEqual(utils.bulk_create_with_pks(
+                Notification.objects, [], ('recipient_id',)), [])
+
+
 class TestFormatFileSize(TestCase):
     '''Unit tests for format_file_size().'''
 
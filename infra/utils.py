@@ -1,10 +1,13 @@
 '''Provide useful utilities shared among modules.'''
 import logging
 import base64
+import uuid
+from collections import defaultdict
 from urllib.parse import urlunsplit
 
 from Crypto import Random, Cipher, Hash
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.sites.shortcuts import get_current_site
 from rest_framework.renderers import BrowsableAPIRenderer
 
@@ -12,6 +15,8 @@ from rest_framework.renderers import BrowsableAPIRenderer
 dev_logger = logging.getLogger('django')  # pylint: disable=invalid-name
 prod_logger = logging.getLogger('django.prod')  # pylint: disable=invalid-name
 
+MODEL_VERSION_CACHE_KEY_FORMAT = 'infra:model-version:{label}'
+
 
 def positive_int(integer_string, strict=False, cutoff=None):
     '''Cast a string to a strictly positive integer.'''
@@ -23,6 +28,75 @@ def positive_int(integer_string, strict=False, cutoff=None):
     return ret
 
 
+def get_model_version(model):
+    '''Return the data version of the model.
+
+    The version changes whenever objects of the model are saved or deleted
+    (see bump_model_version()) and whenever the cache is cleared, so it can
+    be part of keys of values computed from the model.
+    '''
+    key = MODEL_VERSION_CACHE_KEY_FORMAT.format(label=model._meta.label_lower)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_model_version(sender, **kwargs):
+    '''Change data versions of the sender, connected to model signals.
+
+    For m2m_changed, models on both sides of the relation are bumped too.
+    '''
+    action = kwargs.get('action')
+    if action is not None and not action.startswith('post_'):
+        return
+    models = {sender}
+    if action is not None:
+        models.update((kwargs['model'], type(kwargs['instance'])))
+    cache.set_many({
+        MODEL_VERSION_CACHE_KEY_FORMAT.format(
+            label=model._meta.label_lower): uuid.uuid4().hex
+        for model in models
+    }, None)
+
+
+def bulk_create_with_pks(manager, objs, key_fields, batch_size=500,
+                         **lookups):
+    '''Create objects by bulk_create() and set their primary keys.
+
+    Primary keys are not set by bulk_create() on MySQL, so created objects
+    are looked up by values of key_fields (attribute names, e.g.
+    ('campus_event_id', 'user_id')) and lookups narrowing down the query.
+    If several objects share a key, the newest rows are assigned to them in
+    the order they were created.
+
+    Returns
+    -------
+    objs: list
+        The given objects, with primary keys set.
+    '''
+    objs = manager.bulk_create(objs, batch_size=batch_size)
+    if not objs or objs[0].pk is not None:
+        return objs
+
+    def get_key(obj):
+        return tuple(getattr(obj, field) for field in key_fields)
+
+    keys = [get_key(obj) for obj in objs]
+    filters = {
+        f'{field}__in': {key[idx] for key in keys}
+        for idx, field in enumerate(key_fields)
+    }
+    pks = defaultdict(list)
+    for obj_pk, *key in (manager.filter(**filters, **lookups)
+                         .order_by('pk').values_list('pk', *key_fields)):
+        pks[tuple(key)].append(obj_pk)
+    for obj, key in zip(reversed(objs), reversed(keys)):
+        obj.pk = pks[key].pop()
+    return objs
+
+
 def format_file_size(size_in_bytes):
     '''Format human-readable file size.'''
     if size_in_bytes < 0 or size_in_bytes >= 1024**6:
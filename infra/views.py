@@ -3,8 +3,8 @@ from django.utils.timezone import now
 from django.core.cache import cache
 from rest_framework import viewsets, decorators, status
 from rest_framework.response import Response
-from rest_framework_guardian import filters
 
+import auth.filters
 import auth.permissions
 import infra.models
 import infra.serializers
@@ -20,7 +20,12 @@ class NotificationViewSet(DRFCacheMixin, viewsets.ReadOnlyModelViewSet):
         .all().order_by('-time')
     )
     serializer_class = infra.serializers.NotificationSerializer
-    filter_backends = (filters.DjangoObjectPermissionsFilter,)
+    keyset_orderings = {
+        'list': ('-time', '-id'),
+        'read': ('-time', '-id'),
+        'unread': ('-time', '-id'),
+    }
+    filter_backends = (auth.filters.ObjectPermissionsFilter,)
     permission_classes = (
         auth.permissions.DjangoObjectPermissions,
     )
@@ -0,0 +1,148 @@
+'''Benchmark list views with the guardian and department resolvers.
+
+A throw-away test database is filled with a department tree, users and
+training records whose object permissions are assigned as in production.
+Record lists are then filtered by ObjectPermissionsFilter for a teacher, a
+department admin and the school admin, first with guardian rows only, then
+with derivable rows pruned and OBJECT_PERMISSION_RESOLVER = 'department'.
+
+Usage:
+    python scripts/benchmark_object_permissions.py --departments 30 \
+        --users 20 --events 20
+'''
+# pylint: disable=wrong-import-position,ungrouped-imports,invalid-name
+# pylint: disable=missing-docstring,too-many-locals
+import argparse
+import statistics
+import sys
+import os
+import time
+from types import SimpleNamespace
+
+import django
+
+sys.path.insert(0, os.path.abspath('.'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'TMSFTT.settings_dev')
+django.setup()
+
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
+from guardian.models import GroupObjectPermission, UserObjectPermission
+from model_mommy import mommy
+
+from auth.filters import ObjectPermissionsFilter
+from auth.models import Department, User
+from auth.services import PermissionService
+from training_event.models import CampusEvent, EventCoefficient
+from training_record.models import Record
+
+
+RECORD_PERMS = ('view_record', 'change_record', 'review_record')
+
+
+def make_groups(department, perms):
+    prefix = f'{department.name}-{department.raw_department_id}'
+    admin = Group.objects.create(name=f'{prefix}-管理员')
+    admin.permissions.add(*perms)
+    Group.objects.create(name=f'{prefix}-专任教师')
+    return admin
+
+
+def populate(num_departments, num_users, num_events):
+    perms = list(Permission.objects.filter(
+        content_type__app_label='training_record', codename__in=RECORD_PERMS))
+    personal, _ = Group.objects.get_or_create(name='个人权限')
+    personal.permissions.add(*perms)
+    school = Department.objects.create(name='大连理工大学',
+                                       raw_department_id='10141')
+    school_admin_group = make_groups(school, perms)
+    departments = [
+        Department.objects.create(name=f'学院{idx}',
+                                  raw_department_id=f'9{idx:04d}',
+                                  super_department=school)
+        for idx in range(num_departments)
+    ]
+    department_admin_groups = [make_groups(department, perms)
+                               for department in departments]
+    User.objects.bulk_create([
+        User(username=f'bench{idx}', department=departments[
+            idx % num_departments])
+        for idx in range(num_departments * num_users)
+    ])
+    users = list(User.objects.filter(username__startswith='bench'))
+    events = mommy.make(CampusEvent, _quantity=num_events)
+    coefficients = [mommy.make(EventCoefficient, campus_event=event)
+                    for event in events]
+    Record.objects.bulk_create([
+        Record(user=user, campus_event=event, event_coefficient=coefficient)
+        for user in users
+        for event, coefficient in zip(events, coefficients)
+    ], batch_size=500)
+    records = Record.objects.select_related('user')
+    PermissionService.bulk_assign_object_permissions(
+        (record.user, record) for record in records)
+
+    school_admin = User.objects.create(username='bench-school-admin')
+    school_admin.groups.add(school_admin_group)
+    department_admin = User.objects.create(username='bench-department-admin')
+    department_admin.groups.add(department_admin_groups[0])
+    return {
+        'teacher': users[0],
+        'department admin': department_admin,
+        'school admin': school_admin,
+    }
+
+
+def measure(user, repeat):
+    '''Return median milliseconds to filter, count and fetch a page.'''
+    request = SimpleNamespace(user=User.objects.get(pk=user.pk))
+    timings = []
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        queryset = ObjectPermissionsFilter().filter_queryset(
+            request, Record.objects.all(), None)
+        count = queryset.count()
+        list(queryset.order_by('-pk')[:10])
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), count
+
+
+def report(resolver, users, repeat):
+    num_rows = (UserObjectPermission.objects.count()
+                + GroupObjectPermission.objects.count())
+    print(f'[{resolver}] guardian rows: {num_rows}')
+    for name, user in users.items():
+        milliseconds, count = measure(user, repeat)
+        print(f'    {name:<18}{count:>8} records{milliseconds:>10.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--departments', type=int, default=30)
+    parser.add_argument('--users', type=int, default=20,
+                        help='Users in each department.')
+    parser.add_argument('--events', type=int, default=20,
+                        help='Records of each user.')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        settings.OBJECT_PERMISSION_RESOLVER = 'guardian'
+        cache.clear()
+        users = populate(args.departments, args.users, args.events)
+        report('guardian', users, args.repeat)
+
+        settings.OBJECT_PERMISSION_RESOLVER = 'department'
+        PermissionService.prune_derived_object_permissions(Record)
+        report('department', users, args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
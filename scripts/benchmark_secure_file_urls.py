@@ -0,0 +1,108 @@
+'''Benchmark encrypted and signed download urls of secure files.
+
+A throw-away test database is filled with SecureFile rows. For each scheme,
+urls of a page of files are generated as SecureFileField does for a list
+response, then urls are resolved to files as SecuredFileDownloadView does,
+by file path for encrypted urls and by primary key for signed urls.
+
+Usage:
+    python scripts/benchmark_secure_file_urls.py --files 10000 --page 20
+'''
+# pylint: disable=wrong-import-position,ungrouped-imports,invalid-name
+# pylint: disable=missing-docstring
+import argparse
+import statistics
+import sys
+import os
+import time
+
+import django
+
+sys.path.insert(0, os.path.abspath('.'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'TMSFTT.settings_dev')
+django.setup()
+
+from django.apps import apps
+from django.db import connection
+
+from auth.models import User
+from secure_file.models import SecureFile
+from secure_file.utils import (
+    decrypt_file_download_url, encrypt_file_download_url,
+    sign_file_download_url, verify_file_download_url
+)
+
+
+def populate(num_files):
+    user = User.objects.create(username='bench')
+    SecureFile.objects.bulk_create([
+        SecureFile(user=user, path=f'secure-files/2019/06/01/bench{idx}.xls')
+        for idx in range(num_files)
+    ], batch_size=500)
+    return list(SecureFile.objects.order_by('-id'))
+
+
+def encrypt_urls(files):
+    return [encrypt_file_download_url(SecureFile, 'path', item.path.name,
+                                      'view_securefile')
+            for item in files]
+
+
+def sign_urls(files):
+    return [sign_file_download_url(SecureFile, item.pk, 'path',
+                                   'view_securefile')
+            for item in files]
+
+
+def resolve_encrypted(url):
+    model_name, field_name, path, _ = decrypt_file_download_url(url)
+    return apps.get_model(model_name).objects.get(**{field_name: path})
+
+
+def resolve_signed(url):
+    model_name, object_pk, _, _ = verify_file_download_url(url)
+    return apps.get_model(model_name).objects.get(pk=object_pk)
+
+
+def measure(func, args, repeat):
+    '''Return median milliseconds of calling func on each of args.'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for arg in args:
+            func(arg)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def report(name, files, generate, resolve, repeat):
+    page_ms = measure(generate, [files], repeat)
+    tokens = [url.rpartition('/')[2] for url in generate(files)]
+    resolve_ms = measure(resolve, tokens, repeat) / len(tokens)
+    print(f'[{name}] url length: {len(tokens[0])}')
+    print(f'    generate page of {len(files)}{page_ms:>12.3f} ms')
+    print(f'    resolve one url{resolve_ms:>17.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--page', type=int, default=20,
+                        help='Files of a page of a list response.')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        files = populate(args.files)
+        page = files[len(files) // 2:len(files) // 2 + args.page]
+        report('encrypted', page, encrypt_urls, resolve_encrypted,
+               args.repeat)
+        report('signed', page, sign_urls, resolve_signed, args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
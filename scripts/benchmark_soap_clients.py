@@ -0,0 +1,112 @@
+'''Benchmark sending SMSes through SOAP clients.
+
+Compare creating a SOAP client per call (the old behaviour) with the shared
+clients of SOAPClientRegistry sending concurrently. A local stub server is
+started unless --base-url is given.
+
+Usage:
+    python scripts/benchmark_soap_clients.py -n 200 --latency 0.05 \
+        --failure-rate 0.05
+'''
+# pylint: disable=wrong-import-position,ungrouped-imports,invalid-name
+# pylint: disable=missing-docstring
+import argparse
+import json
+import sys
+import os
+import threading
+import time
+
+import django
+
+sys.path.insert(0, os.path.abspath('.'))
+sys.path.insert(0, os.path.abspath('scripts'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'TMSFTT.settings_dev')
+django.setup()
+
+from django.conf import settings
+from zeep import Client
+from zeep.cache import InMemoryCache
+from zeep.transports import Transport
+
+from infra.services import SOAPSMSService
+from infra.soap import SOAPClientRegistry
+from soap_stub_server import create_server
+
+
+def make_smses(num):
+    return [{'user_phone_number': f'138{idx:08d}', 'sms_info': '测试短信'}
+            for idx in range(num)]
+
+
+def send_with_new_clients(smses):
+    '''Create a client for every SMS and send them one by one.'''
+    num_failed = 0
+    for sms in smses:
+        try:
+            client = Client(f'{settings.SOAP_BASE_URL}/SmsService?wsdl',
+                            transport=Transport(cache=InMemoryCache()))
+            resp = client.service.saveSmsInfo(json.dumps(sms))
+            if json.loads(resp)['result'] is False:
+                num_failed += 1
+        except Exception:  # pylint: disable=broad-except
+            num_failed += 1
+    return num_failed
+
+
+def send_with_shared_clients(smses, batch_size):
+    '''Send SMSes in batches with SOAPSMSService.'''
+    num_failed = 0
+    for idx in range(0, len(smses), batch_size):
+        batch = smses[idx:idx + batch_size]
+        results = SOAPClientRegistry.map(
+            lambda sms: SOAPSMSService.send_sms([sms]), batch)
+        num_failed += sum(1 for _, exc in results if exc is not None)
+    return num_failed
+
+
+def report(name, num, seconds, num_failed):
+    print(f'{name:<16}{num / seconds:>10.1f} msgs/sec'
+          f'{num_failed:>8} failed{seconds:>10.2f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--num', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--base-url', default=None,
+                        help='Use running SOAP services instead of stub.')
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url is None:
+        server = create_server(port=0, latency=args.latency,
+                               failure_rate=args.failure_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        settings.SOAP_BASE_URL = f'http://127.0.0.1:{server.server_port}'
+    else:
+        settings.SOAP_BASE_URL = args.base_url
+
+    smses = make_smses(args.num)
+    print(f'Sending {args.num} SMSes to {settings.SOAP_BASE_URL}, '
+          f'{settings.SOAP_MAX_WORKERS} workers')
+    start = time.perf_counter()
+    num_failed = send_with_new_clients(smses)
+    report('client per call', args.num, time.perf_counter() - start,
+           num_failed)
+
+    SOAPClientRegistry.clear()
+    start = time.perf_counter()
+    num_failed = send_with_shared_clients(smses, args.batch_size)
+    report('shared clients', args.num, time.perf_counter() - start,
+           num_failed)
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -131,7 +131,8 @@ def make_programs():
             category=category) for name in names]
         programs.extend(_programs)
         for program in _programs:
-            PermissionService.assign_object_permissions(admin, program)
+            PermissionService.assign_object_permissions(
+                admin, program, department=program.department)
     cached_programs = programs
     return programs
 
@@ -216,7 +217,8 @@ def read_workload_content(
                 category=Program.PROGRAM_CATEGORY_CHOICES_MAP[program_category]
             )
             PermissionService.assign_object_permissions(
-                dlut_admin, programs[program_key])
+                dlut_admin, programs[program_key],
+                department=dlut_department)
         program = programs[program_key]
         event_key = (program_key, event_name, event_time)
         manual_now.return_value = event_time
@@ -234,7 +236,7 @@ def read_workload_content(
                 reviewed=True,
             )
             PermissionService.assign_object_permissions(
-                dlut_admin, events[event_key])
+                dlut_admin, events[event_key], department=dlut_department)
         event = events[event_key]
         try:
             Enrollment.objects.create(user=user, campus_event=event)
@@ -0,0 +1,56 @@
+'''Migrate object permissions between the guardian and department resolvers.
+
+Before setting OBJECT_PERMISSION_RESOLVER to 'department', prune guardian
+rows which DepartmentObjectPermissionBackend can derive. Before switching
+back to 'guardian', restore them.
+
+Usage:
+    python scripts/migrate_object_permissions.py prune --dry-run
+    python scripts/migrate_object_permissions.py prune
+    python scripts/migrate_object_permissions.py restore \
+        --model training_record.record
+'''
+# pylint: disable=wrong-import-position,ungrouped-imports,invalid-name
+# pylint: disable=missing-docstring
+import argparse
+import sys
+import os
+
+import django
+
+sys.path.insert(0, os.path.abspath('.'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'TMSFTT.settings_dev')
+django.setup()
+
+from django.apps import apps
+from django.db import transaction
+
+from auth.services import PermissionService
+from auth.utils import OBJECT_PERMISSION_RULES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=('prune', 'restore'))
+    parser.add_argument('--model', action='append',
+                        choices=sorted(OBJECT_PERMISSION_RULES),
+                        help='Only migrate these models.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only count rows to prune.')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    for label in args.model or sorted(OBJECT_PERMISSION_RULES):
+        model = apps.get_model(label)
+        with transaction.atomic():
+            if args.action == 'prune':
+                count = PermissionService.prune_derived_object_permissions(
+                    model, dry_run=args.dry_run, batch_size=args.batch_size)
+            else:
+                count = PermissionService.restore_derived_object_permissions(
+                    model, batch_size=args.batch_size)
+        print(f'{label:<36}{args.action:>8}{count:>12}')
+
+
+if __name__ == '__main__':
+    main()
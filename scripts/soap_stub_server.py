@@ -0,0 +1,200 @@
+'''Local stand-in of the school SOAP message services.
+
+Serve SmsService, MsgService and EmailService with the same operations as
+the production ones, so that clients can be benchmarked and failures can be
+reproduced without touching real services.
+
+Usage:
+    python scripts/soap_stub_server.py --port 8008 --latency 0.05 \
+        --failure-rate 0.1
+
+Then set SOAP_BASE_URL to http://127.0.0.1:8008 .
+'''
+# pylint: disable=invalid-name
+import argparse
+import json
+import random
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from xml.sax.saxutils import escape, unescape
+
+
+NAMESPACE = 'http://webservice.stub/'
+OPERATIONS = {
+    'SmsService': 'saveSmsInfo',
+    'MsgService': 'saveMsgInfo',
+    'EmailService': 'saveEmailInfo',
+}
+
+WSDL_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/"
+             xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+             xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+             xmlns:tns="{namespace}"
+             targetNamespace="{namespace}" name="{service}">
+  <types>
+    <xsd:schema targetNamespace="{namespace}" elementFormDefault="unqualified">
+      <xsd:element name="{operation}">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="arg0" type="xsd:string" minOccurs="0"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+      <xsd:element name="{operation}Response">
+        <xsd:complexType>
+          <xsd:sequence>
+            <xsd:element name="return" type="xsd:string" minOccurs="0"/>
+          </xsd:sequence>
+        </xsd:complexType>
+      </xsd:element>
+    </xsd:schema>
+  </types>
+  <message name="{operation}">
+    <part name="parameters" element="tns:{operation}"/>
+  </message>
+  <message name="{operation}Response">
+    <part name="parameters" element="tns:{operation}Response"/>
+  </message>
+  <portType name="{service}PortType">
+    <operation name="{operation}">
+      <input message="tns:{operation}"/>
+      <output message="tns:{operation}Response"/>
+    </operation>
+  </portType>
+  <binding name="{service}Binding" type="tns:{service}PortType">
+    <soap:binding style="document"
+                  transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="{operation}">
+      <soap:operation soapAction=""/>
+      <input><soap:body use="literal"/></input>
+      <output><soap:body use="literal"/></output>
+    </operation>
+  </binding>
+  <service name="{service}">
+    <port name="{service}Port" binding="tns:{service}Binding">
+      <soap:address location="{location}"/>
+    </port>
+  </service>
+</definitions>
+'''
+
+RESPONSE_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">
+  <S:Body>
+    <ns2:{operation}Response xmlns:ns2="{namespace}">
+      <return>{result}</return>
+    </ns2:{operation}Response>
+  </S:Body>
+</S:Envelope>
+'''
+
+ARG_PATTERN = re.compile(r'<arg0>(.*)</arg0>', re.S)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    '''HTTP server handling each request in a thread.'''
+    daemon_threads = True
+
+
+class SOAPStubHandler(BaseHTTPRequestHandler):
+    '''Serve WSDL files and SOAP requests of the stub services.'''
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+    failure_rate = 0
+    verbose = False
+
+    def get_service(self):
+        '''Return the service name in request path.'''
+        return self.path.split('?')[0].strip('/')
+
+    def send_content(self, status, content, content_type):
+        '''Send response with content.'''
+        content = content.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''Serve WSDL of the service.'''
+        service = self.get_service()
+        if service not in OPERATIONS:
+            self.send_content(404, 'Not Found', 'text/plain')
+            return
+        location = f'http://{self.headers["Host"]}/{service}'
+        wsdl = WSDL_TEMPLATE.format(namespace=NAMESPACE, service=service,
+                                    operation=OPERATIONS[service],
+                                    location=location)
+        self.send_content(200, wsdl, 'text/xml; charset=utf-8')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        '''Handle SOAP request, reply with JSON result like real services.'''
+        service = self.get_service()
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode()
+        if service not in OPERATIONS:
+            self.send_content(404, 'Not Found', 'text/plain')
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        match = ARG_PATTERN.search(body)
+        try:
+            json.loads(unescape(match.group(1)))
+        except (AttributeError, ValueError):
+            result = {'result': False, 'msg': '参数格式错误'}
+        else:
+            if random.random() < self.failure_rate:
+                result = {'result': False, 'msg': '模拟发送失败'}
+            else:
+                result = {'result': True, 'msg': '成功',
+                          'msg_id': uuid.uuid4().hex}
+        response = RESPONSE_TEMPLATE.format(
+            namespace=NAMESPACE, operation=OPERATIONS[service],
+            result=escape(json.dumps(result, ensure_ascii=False)))
+        self.send_content(200, response, 'text/xml; charset=utf-8')
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(host='127.0.0.1', port=8008, latency=0, failure_rate=0,
+                  verbose=False):
+    '''Create the stub server, port 0 means a random free port.'''
+    handler = type('Handler', (SOAPStubHandler,), {
+        'latency': latency,
+        'failure_rate': failure_rate,
+        'verbose': verbose,
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    '''Run the stub server until interrupted.'''
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds to wait before replying.')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='Ratio of requests replied with failures.')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = create_server(args.host, args.port, args.latency,
+                           args.failure_rate, args.verbose)
+    print(f'Serving SOAP stub on http://{args.host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@
 import os.path as osp
 from rest_framework import fields
 
-from secure_file.utils import get_full_encrypted_file_download_url
+from secure_file.utils import get_full_signed_file_download_url
 
 
 class SecureFileField(fields.FileField):
@@ -12,7 +12,7 @@ class SecureFileField(fields.FileField):
     The FileField is encoded into:
       {
           'name': <file name>,
-          'url': <encrypted download path>,
+          'url': <signed download path>,
       }
     '''
     def __init__(self, *args, perm_name=None, **kwargs):
@@ -22,9 +22,9 @@ class SecureFileField(fields.FileField):
     def to_representation(self, value):
         if not value:
             return None
-        url = get_full_encrypted_file_download_url(
-            self.context['request'], value.field.model, self.source,
-            value.name, self.perm_name
+        url = get_full_signed_file_download_url(
+            self.context['request'], value.field.model, value.instance.pk,
+            self.source, self.perm_name
         )
         return {
             'name': osp.basename(value.name),
@@ -6,7 +6,7 @@ from rest_framework import response, status
 
 from auth.services import PermissionService
 from secure_file.utils import (
-    get_full_encrypted_file_download_url, get_full_plain_file_download_url)
+    get_full_signed_file_download_url, get_full_plain_file_download_url)
 
 
 User = get_user_model()
@@ -84,8 +84,8 @@ class SecureFile(FileFromPathMixin, models.Model):
             The json response contains only one key named 'url', this full url
             points to the real file created.
         '''
-        url = get_full_encrypted_file_download_url(
-            request, type(self), 'path', self.path.name, 'view_securefile'
+        url = get_full_signed_file_download_url(
+            request, type(self), self.pk, 'path', 'view_securefile'
         )
         return response.Response({'url': url}, status=status.HTTP_201_CREATED)
 
@@ -7,9 +7,9 @@ import secure_file.fields as fields
 
 class TestSecureFileField(TestCase):
     '''Unit tests for SecureFileField.'''
-    @patch('secure_file.fields.get_full_encrypted_file_download_url')
+    @patch('secure_file.fields.get_full_signed_file_download_url')
     def test_to_representation(self, mocked_get_url):
-        '''Should encrypt file path.'''
+        '''Should sign file url.'''
         name = 'path/to/file/abccc.ccc'
         expected_url = 'expected-url'
         perm_name = 'perm_name'
@@ -27,7 +27,7 @@ class TestSecureFileField(TestCase):
         representation = field.to_representation(value)
 
         mocked_get_url.assert_called_with(
-            request, value.field.model, field.source, value.name,
+            request, value.field.model, value.instance.pk, field.source,
             field.perm_name
         )
         self.assertDictEqual(
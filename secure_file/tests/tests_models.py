@@ -39,20 +39,17 @@ class TestSecureFileModels(TestCase):
         mocked_assign.assert_called_with(self.user, secure_file)
         self.assertEqual(secure_file.path.read(), content)
 
-    @patch('secure_file.models.get_full_encrypted_file_download_url')
+    @patch('secure_file.models.get_full_signed_file_download_url')
     def test_generate_download_response(self, mocked_get_url):
         '''Should generate response for redirecting to download.'''
-        secure_file = SecureFile()
-        secure_file.path = Mock()
-        path = 'path/to/file'
-        secure_file.path.name = path
+        secure_file = SecureFile(pk=123)
         expected_url = Mock()
         mocked_get_url.return_value = expected_url
         request = Mock()
         resp = secure_file.generate_download_response(request)
 
         mocked_get_url.assert_called_with(
-            request, SecureFile, 'path', path, 'view_securefile'
+            request, SecureFile, 123, 'path', 'view_securefile'
         )
 
         self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
@@ -1,14 +1,19 @@
 '''Unit tests for secure_file utils.'''
 import os.path as osp
+import tempfile
 from collections import OrderedDict
+from types import SimpleNamespace
 from unittest.mock import Mock, patch
 from urllib.parse import urlencode
 
-from django.test import TestCase
-from django.http import HttpResponse
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import RequestFactory, TestCase
+from django.http import FileResponse, HttpResponse
 from rest_framework import exceptions
 
 from secure_file import SECURE_FILE_PREFIX, INSECURE_FILE_PREFIX
+from secure_file.models import SecureFile
 import secure_file.utils as utils
 
 
@@ -106,30 +111,16 @@ class TestSecureFileUtils(TestCase):
 
         mocked_get_full_url.assert_called_with(request, expected_path)
 
-    @patch('secure_file.utils.settings.DEBUG', True)
-    def test_populate_file_content_debug_mode(self):
-        '''Should read data directly in debug mode.'''
-        resp = Mock()
-        field_file = Mock()
-        content = 'abccc'
-        field_file.read.return_value = content
-
-        utils.populate_file_content(resp, field_file)
-
-        self.assertEqual(resp.content, content)
-
-    @patch('secure_file.utils.settings.DEBUG', True)
-    @patch('secure_file.utils.dev_logger')
-    def test_populate_file_content_debug_mode_fail(self, _):
-        '''Should raise NotFound error.'''
-        resp = Mock()
-        field_file = Mock()
-        field_file.read.side_effect = Exception
-
-        with self.assertRaises(exceptions.NotFound):
-            utils.populate_file_content(resp, field_file)
+    def test_get_download_backend(self):
+        '''Should stream files in debug mode unless configured.'''
+        with self.settings(SECURE_FILE_DOWNLOAD_BACKEND=None):
+            with patch('secure_file.utils.settings.DEBUG', True):
+                self.assertEqual(utils.get_download_backend(), 'stream')
+            with patch('secure_file.utils.settings.DEBUG', False):
+                self.assertEqual(utils.get_download_backend(), 'x-accel')
+        with self.settings(SECURE_FILE_DOWNLOAD_BACKEND='x-sendfile'):
+            self.assertEqual(utils.get_download_backend(), 'x-sendfile')
 
-    @patch('secure_file.utils.settings.DEBUG', False)
     def test_populate_file_content_prod_mode(self):
         '''Should set X-Accel-Redirect header.'''
         resp = {}
@@ -141,6 +132,18 @@ class TestSecureFileUtils(TestCase):
 
         self.assertEqual(resp['X-Accel-Redirect'], expected_path)
 
+    def test_populate_file_content_x_sendfile(self):
+        '''Should set X-Sendfile header.'''
+        resp = {}
+        field_file = Mock()
+        field_file.path = '/protected-files/path/to/file'
+
+        utils.populate_file_content(resp, field_file, 'x-sendfile')
+
+        self.assertEqual(resp['X-Sendfile'], field_file.path)
+
+    @patch('secure_file.utils.get_download_backend',
+           Mock(return_value='x-accel'))
     @patch('secure_file.utils.prod_logger.info')
     @patch('secure_file.utils.infer_content_type')
     @patch('secure_file.utils.populate_file_content')
@@ -160,5 +163,165 @@ class TestSecureFileUtils(TestCase):
         self.assertEqual(resp['Content-Disposition'],
                          expected_content_disposition)
         mocked_infer_content_type.assert_called_with('file.abc')
-        mocked_populate_file_content.assert_called_with(resp, field_file)
+        mocked_populate_file_content.assert_called_with(
+            resp, field_file, 'x-accel')
         mocked_info.assert_called()
+
+    @patch('secure_file.utils.get_download_backend',
+           Mock(return_value='x-sendfile'))
+    @patch('secure_file.utils.stream_file_response')
+    def test_generate_download_response_no_local_path(self, mocked_stream):
+        '''Should stream files which have no local path.'''
+        mocked_stream.return_value = HttpResponse()
+        field_file = Mock()
+        field_file.name = 'path/to/file.csv'
+        field_file.storage.path.side_effect = NotImplementedError
+        request = Mock()
+
+        resp = utils.generate_download_response(request, field_file,
+                                                logging=False)
+
+        self.assertIs(resp, mocked_stream.return_value)
+        mocked_stream.assert_called_with(request, field_file, 'text/csv')
+
+
+class TestSignedFileDownloadUrl(TestCase):
+    '''Unit tests for signed file download urls.'''
+    def sign(self, **kwargs):
+        '''Return token of a signed url of a SecureFile.'''
+        path = utils.sign_file_download_url(
+            SecureFile, 12, 'path', **kwargs)
+        self.assertTrue(path.startswith(f'{SECURE_FILE_PREFIX}/'))
+        return path[len(SECURE_FILE_PREFIX) + 1:]
+
+    def test_sign_and_verify(self):
+        '''Should verify arguments signed in the url.'''
+        token = self.sign(perm_name='view_recordattachment')
+
+        self.assertTrue(utils.is_signed_file_download_url(token))
+        self.assertEqual(
+            utils.verify_file_download_url(token),
+            ('secure_file.SecureFile', '12', 'path', 'view_recordattachment'))
+        self.assertEqual(utils.verify_file_download_url(self.sign())[3],
+                         'view_securefile')
+
+    def test_stable_within_hour(self):
+        '''Should generate the same url within the hour.'''
+        with patch('secure_file.utils.time.time', return_value=7200.5):
+            token = self.sign(max_age=60)
+        with patch('secure_file.utils.time.time', return_value=10700):
+            self.assertEqual(self.sign(max_age=60), token)
+            self.assertEqual(utils.verify_file_download_url(token)[1], '12')
+        with patch('secure_file.utils.time.time', return_value=10801):
+            with self.assertRaisesMessage(ValueError, '链接已过期'):
+                utils.verify_file_download_url(token)
+
+    def test_tampered(self):
+        '''Should reject tampered or malformed urls.'''
+        payload, signature = self.sign().split('.')
+        other_payload = utils.sign_file_download_url(
+            SecureFile, 13, 'path').rpartition('/')[2].split('.')[0]
+
+        for token in (f'{other_payload}.{signature}',
+                      f'{payload}.{signature[:-2]}',
+                      f'{payload}.!!', '.', 'abc.def'):
+            with self.assertRaisesMessage(ValueError, '签名无效'):
+                utils.verify_file_download_url(token)
+
+    def test_legacy_urls(self):
+        '''Should tell signed urls from encrypted urls.'''
+        # <encrypted_text>|<iv>|<fp> in URL-safe base64, see encrypt().
+        encrypted_url = 'ZW5jcnlwdGVk|aXY=|ZnA-_w=='
+
+        self.assertFalse(utils.is_signed_file_download_url(encrypted_url))
+
+
+class TestStreamFileResponse(TestCase):
+    '''Unit tests for streaming files.'''
+    content = b'0123456789'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        storage = FileSystemStorage(location=self.directory.name)
+        name = storage.save('a.txt', ContentFile(self.content))
+        self.field_file = SimpleNamespace(storage=storage, name=name)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        '''Return response of a GET request with headers.'''
+        request = self.factory.get('/', **headers)
+        return utils.stream_file_response(request, self.field_file,
+                                          'text/plain')
+
+    def test_whole_file(self):
+        '''Should stream the whole file with validators.'''
+        with patch('secure_file.utils.STREAM_CHUNK_SIZE', 3):
+            resp = self.get()
+
+        self.assertIsInstance(resp, FileResponse)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b''.join(resp.streaming_content), self.content)
+        self.assertEqual(resp['Content-Length'], '10')
+        self.assertEqual(resp['Accept-Ranges'], 'bytes')
+        self.assertTrue(resp['ETag'].endswith('-a"'))
+        resp.close()
+
+    def test_ranges(self):
+        '''Should send a single range of bytes.'''
+        for header, content, content_range in (
+                ('bytes=2-5', b'2345', 'bytes 2-5/10'),
+                ('bytes=7-', b'789', 'bytes 7-9/10'),
+                ('bytes=-3', b'789', 'bytes 7-9/10'),
+                ('bytes=8-100', b'89', 'bytes 8-9/10')):
+            with patch('secure_file.utils.STREAM_CHUNK_SIZE', 3):
+                resp = self.get(HTTP_RANGE=header)
+
+            self.assertEqual(resp.status_code, 206)
+            self.assertEqual(b''.join(resp.streaming_content), content)
+            self.assertEqual(resp['Content-Length'], str(len(content)))
+            self.assertEqual(resp['Content-Range'], content_range)
+
+    def test_ignored_ranges(self):
+        '''Should send the whole file for invalid or stale ranges.'''
+        for headers in ({'HTTP_RANGE': 'bytes=0-1,4-5'},
+                        {'HTTP_RANGE': 'bytes=5-2'},
+                        {'HTTP_RANGE': 'lines=1-2'},
+                        {'HTTP_RANGE': 'bytes=0-1', 'HTTP_IF_RANGE': '"x"'}):
+            resp = self.get(**headers)
+            self.assertEqual(resp.status_code, 200)
+            resp.close()
+
+        etag = self.get()['ETag']
+        resp = self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+        self.assertEqual(resp.status_code, 206)
+
+    def test_range_not_satisfiable(self):
+        '''Should answer 416 for ranges beyond the file.'''
+        for header in ('bytes=10-', 'bytes=-0'):
+            resp = self.get(HTTP_RANGE=header)
+
+            self.assertEqual(resp.status_code, 416)
+            self.assertEqual(resp['Content-Range'], 'bytes */10')
+
+    def test_conditional_requests(self):
+        '''Should answer 304 or 412 by validators of the file.'''
+        resp = self.get()
+        resp.close()
+
+        for headers, status_code in (
+                ({'HTTP_IF_NONE_MATCH': resp['ETag']}, 304),
+                ({'HTTP_IF_MODIFIED_SINCE': resp['Last-Modified']}, 304),
+                ({'HTTP_IF_NONE_MATCH': '"other"'}, 200),
+                ({'HTTP_IF_MATCH': '"other"'}, 412)):
+            resp = self.get(**headers)
+            self.assertEqual(resp.status_code, status_code)
+            resp.close()
+
+    @patch('secure_file.utils.dev_logger')
+    def test_missing_file(self, _):
+        '''Should raise NotFound error.'''
+        self.field_file.name = 'missing.txt'
+
+        with self.assertRaises(exceptions.NotFound):
+            self.get()
@@ -1,13 +1,19 @@
 '''Unit tests for secure_file views.'''
+import tempfile
 from unittest.mock import patch, Mock
 
+from django.core.files.base import ContentFile
 from django.test import TestCase
 from rest_framework import exceptions
+from rest_framework.test import APITestCase
 from model_mommy import mommy
 
+from auth.models import User
+from auth.utils import assign_perm
 from infra.exceptions import BadRequest
 import secure_file.views as views
 import secure_file.models as models
+from secure_file.utils import sign_file_download_url
 
 
 class TestInSecuredFileDownloadView(TestCase):
@@ -174,6 +180,50 @@ class TestSecuredFileDownloadView(TestCase):
         )
 
 
+class TestSignedFileDownloadView(TestCase):
+    '''Unit tests for SecuredFileDownloadView with signed urls.'''
+    def setUp(self):
+        self.view = views.SecuredFileDownloadView()
+        self.request = Mock()
+        self.secure_file = mommy.make(models.SecureFile,
+                                      path='secure-files/a.txt')
+
+    def get_token(self, object_pk=None, perm_name=None):
+        '''Sign url of the SecureFile.'''
+        path = sign_file_download_url(
+            models.SecureFile, object_pk or self.secure_file.pk, 'path',
+            perm_name)
+        return path.rpartition('/')[2]
+
+    @patch('secure_file.views.decrypt_file_download_url')
+    @patch('secure_file.views.generate_download_response')
+    def test_get_succeed(self, mocked_generate, mocked_decrypt):
+        '''Should look the file up by primary key.'''
+        self.request.user.has_perm.return_value = True
+
+        with self.assertNumQueries(1):
+            res = self.view.get(self.request, self.get_token())
+
+        self.assertIs(res, mocked_generate.return_value)
+        mocked_decrypt.assert_not_called()
+        field_file = mocked_generate.call_args[0][1]
+        self.assertEqual(field_file.name, 'secure-files/a.txt')
+        self.request.user.has_perm.assert_called_with(
+            'view_securefile', self.secure_file)
+
+    @patch('secure_file.views.dev_logger')
+    @patch('secure_file.views.prod_logger')
+    def test_get_not_found(self, _, __):
+        '''Should raise NotFound() for invalid urls or permissions.'''
+        self.request.user.has_perm.return_value = False
+        empty_file = mommy.make(models.SecureFile)
+        for token in (self.get_token(), self.get_token()[:-1],
+                      self.get_token(object_pk=-1),
+                      self.get_token(object_pk=empty_file.pk)):
+            with self.assertRaises(exceptions.NotFound):
+                self.view.get(self.request, token)
+
+
 class TestInSecureFileViewSet(TestCase):
     '''Unit tests for InSecureFileViewSet.'''
     def setUp(self):
@@ -211,3 +261,36 @@ class TestInSecureFileViewSet(TestCase):
             request.user, uploaded_file.name, uploaded_file
         )
         mocked_generate.assert_called_with(request)
+
+
+class TestSecuredFileDownload(APITestCase):
+    '''Download files by signed urls end to end.'''
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=directory.name,
+                                       SECURE_FILE_DOWNLOAD_BACKEND='stream')
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = mommy.make(User)
+        self.secure_file = models.SecureFile(user=self.user)
+        self.secure_file.path.save('a.txt', ContentFile(b'0123456789'))
+        assign_perm('secure_file.view_securefile', self.user,
+                    self.secure_file)
+        self.client.force_authenticate(self.user)
+        self.url = '/' + sign_file_download_url(
+            models.SecureFile, self.secure_file.pk, 'path')
+
+    def test_download(self):
+        '''Should stream the file or a range of it.'''
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=a.txt')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=3-4')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'34')
@@ -1,11 +1,18 @@
 '''Provide utility functions for secure_file module.'''
+import base64
+import binascii
 import os.path as osp
+import re
+import time
 from urllib.parse import urlencode, urlsplit, parse_qs, quote
 from collections import OrderedDict
 
 from django.conf import settings
-from django.http import HttpResponse
-from rest_framework import exceptions
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import exceptions, status
 
 from infra.utils import prod_logger, dev_logger, encrypt, decrypt, get_full_url
 from secure_file import SECURE_FILE_PREFIX, INSECURE_FILE_PREFIX
@@ -82,6 +89,117 @@ def decrypt_file_download_url(encrypted_url):
     return model_name, field_name, path, perm_name
 
 
+SIGNATURE_SALT = 'secure_file.utils.sign_file_download_url'
+SIGNATURE_LENGTH = 16
+EXPIRES_ROUNDING = 3600
+DEFAULT_PERM_NAME = 'view_securefile'
+
+
+def _b64encode(data):
+    '''Encode bytes in URL-safe base64 without padding.'''
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    '''Decode URL-safe base64 text which may have no padding.'''
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload):
+    '''Return HMAC of the payload keyed by SECRET_KEY.'''
+    return salted_hmac(SIGNATURE_SALT, payload).digest()[:SIGNATURE_LENGTH]
+
+
+def is_signed_file_download_url(url):
+    '''Check whether the url is signed by sign_file_download_url().
+
+    Signed urls look like `<payload>.<signature>`, while urls encrypted by
+    encrypt_file_download_url() never contain dots.
+    '''
+    return '.' in url
+
+
+def sign_file_download_url(model_class, object_pk, field_name,
+                           perm_name=None, max_age=None):
+    '''Sign file download url.
+
+    Unlike encrypt_file_download_url(), the url is not encrypted but signed
+    by HMAC, which is much cheaper, and the file is looked up by the primary
+    key of its object instead of its path. The url expires after max_age
+    seconds, rounded up to the hour, so the url of a file stays the same
+    within the hour.
+
+    Parameters
+    ----------
+    model_class: models.Model
+        The class of the model owning the `FileField` for the file.
+    object_pk: int
+        The primary key of the object owning the file.
+    field_name: str
+        The name of the `FileField` on `model_class`.
+    perm_name: str
+        The name of the permission, the corresponding permission will be
+        checked during file download request.
+    max_age: int
+        Seconds before the url expires. Default:
+        settings.SECURE_FILE_URL_MAX_AGE
+
+    Return
+    ------
+    signed_file_url: string
+        Signed file download url. Access this URL with appropriate
+        permissions will be responded with the real file data.
+    '''
+    if max_age is None:
+        max_age = settings.SECURE_FILE_URL_MAX_AGE
+    expires = -(-(int(time.time()) + max_age) // EXPIRES_ROUNDING) * (
+        EXPIRES_ROUNDING)
+    payload = ':'.join([
+        model_class._meta.label, str(object_pk), field_name,
+        perm_name or DEFAULT_PERM_NAME, str(expires),
+    ]).encode()
+    token = f'{_b64encode(payload)}.{_b64encode(_sign(payload))}'
+    return osp.join(SECURE_FILE_PREFIX, token)
+
+
+def verify_file_download_url(signed_url):
+    '''Verify signed url and return necessary arguments from it.
+
+    Paramter
+    --------
+    signed_url: str
+        The token part of the url signed by sign_file_download_url().
+
+    Returns
+    -------
+    model_name: str
+        The name of the model to which the file related.
+    object_pk: str
+        The primary key of the object owning the file.
+    field_name: str
+        The name of the FileField on the model.
+    perm_name: str
+        The object permission needed to download the file.
+    '''
+    payload, _, signature = signed_url.partition('.')
+    try:
+        payload = _b64decode(payload)
+        signature = _b64decode(signature)
+    except (binascii.Error, ValueError):
+        raise ValueError('签名无效')
+    if not constant_time_compare(signature, _sign(payload)):
+        raise ValueError('签名无效')
+    try:
+        (model_name, object_pk, field_name,
+         perm_name, expires) = payload.decode().split(':')
+        expires = int(expires)
+    except ValueError:
+        raise ValueError('参数无效')
+    if expires < time.time():
+        raise ValueError('链接已过期')
+    return model_name, object_pk, field_name, perm_name
+
+
 def get_full_plain_file_download_url(request, path):
     '''
     A helper function for generating full URL for downloading insecure files.
@@ -120,6 +238,17 @@ def get_full_encrypted_file_download_url(
     return get_full_url(request, encrypted_url)
 
 
+def get_full_signed_file_download_url(
+        request, model_class, object_pk, field_name, perm_name=None):
+    '''
+    A helper function for generating full URL for downloading file with a
+    signed url, see sign_file_download_url().
+    '''
+    signed_url = sign_file_download_url(
+        model_class, object_pk, field_name, perm_name)
+    return get_full_url(request, signed_url)
+
+
 def infer_content_type(fname):
     '''Infer content type from extension name.'''
     content_types = {
@@ -135,26 +264,162 @@ def infer_content_type(fname):
     return content_types.get(ext, 'text/plain')
 
 
-def populate_file_content(resp, field_file):
-    '''Populate file content for HTTP response.
+DOWNLOAD_BACKEND_STREAM = 'stream'
+DOWNLOAD_BACKEND_X_ACCEL = 'x-accel'
+DOWNLOAD_BACKEND_X_SENDFILE = 'x-sendfile'
+STREAM_CHUNK_SIZE = 64 * 1024
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(ValueError):
+    '''Raised if the requested byte range is out of the file.'''
+
+
+def get_download_backend():
+    '''Return the backend sending files of download responses.
+
+    See settings.SECURE_FILE_DOWNLOAD_BACKEND.
+    '''
+    backend = getattr(settings, 'SECURE_FILE_DOWNLOAD_BACKEND', None)
+    if backend is None:
+        return (DOWNLOAD_BACKEND_STREAM if settings.DEBUG
+                else DOWNLOAD_BACKEND_X_ACCEL)
+    return backend
+
+
+def has_local_path(field_file):
+    '''Check whether the storage of the file has local paths.'''
+    try:
+        field_file.storage.path(field_file.name)
+    except NotImplementedError:
+        return False
+    return True
+
+
+def populate_file_content(resp, field_file, backend=DOWNLOAD_BACKEND_X_ACCEL):
+    '''Ask the web server to send the file for HTTP response.
 
-    If settings.DEBUG is False, then we ask Nginx to serve the file.
+    The web server handles range and conditional requests itself.
     '''
-    if settings.DEBUG:
-        try:
-            resp.content = field_file.read()
-        except Exception as exc:
-            msg = f'读取文件失败: {exc}'
-            dev_logger.info(msg)
-            raise exceptions.NotFound()
+    if backend == DOWNLOAD_BACKEND_X_SENDFILE:
+        resp['X-Sendfile'] = field_file.path
     else:
         resp['X-Accel-Redirect'] = (
             f'/protected-files/{quote(field_file.name)}'
         )
 
 
+def get_byte_range(request, size, etag, last_modified):
+    '''Return (first, last) positions of the byte range of the request.
+
+    None is returned if the whole file should be sent, that is, if there
+    is no Range header, the header has more than one range or is invalid,
+    or the file has changed since If-Range.
+
+    Raises
+    ------
+    RangeNotSatisfiable
+        If the range starts beyond the end of the file.
+    '''
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and (
+            parse_http_date_safe(if_range) != last_modified):
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        if last and int(last) < first:
+            return None
+        last = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # bytes=-N requests the last N bytes.
+        if int(last) == 0:
+            raise RangeNotSatisfiable()
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable()
+    return first, last
+
+
+def iter_file_range(file, first, length, chunk_size=STREAM_CHUNK_SIZE):
+    '''Read length bytes from position first of the file in chunks.
+
+    The file is closed once the range has been read.
+    '''
+    try:
+        file.seek(first)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def stream_file_response(request, field_file, content_type):
+    '''Return a response streaming the file in chunks.
+
+    The file is never read into memory as a whole. Responses have ETag and
+    Last-Modified headers, conditional requests are answered by 304 or 412
+    and a single byte range of Range header is answered by 206.
+    '''
+    storage, name = field_file.storage, field_file.name
+    try:
+        size = storage.size(name)
+        last_modified = int(storage.get_modified_time(name).timestamp())
+        etag = f'"{last_modified:x}-{size:x}"'
+        resp = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if resp is None:
+            byte_range = get_byte_range(request, size, etag, last_modified)
+            file = storage.open(name, 'rb')
+    except RangeNotSatisfiable:
+        resp = HttpResponse(
+            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        resp['Content-Range'] = f'bytes */{size}'
+        return resp
+    except Exception as exc:
+        msg = f'读取文件失败: {exc}'
+        dev_logger.info(msg)
+        raise exceptions.NotFound()
+
+    if resp is None and byte_range is None:
+        # FileResponse lets the WSGI server send the file by sendfile().
+        resp = FileResponse(file, content_type=content_type)
+        resp.block_size = STREAM_CHUNK_SIZE
+        resp['Content-Length'] = size
+    elif resp is None:
+        first, last = byte_range
+        resp = StreamingHttpResponse(
+            iter_file_range(file, first, last - first + 1),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type=content_type)
+        resp['Content-Length'] = last - first + 1
+        resp['Content-Range'] = f'bytes {first}-{last}/{size}'
+    resp['Accept-Ranges'] = 'bytes'
+    resp['ETag'] = etag
+    resp['Last-Modified'] = http_date(last_modified)
+    resp['Cache-Control'] = 'private'
+    return resp
+
+
 def generate_download_response(request, field_file, logging=True):
-    '''Serve file from `field_file` for request.'''
+    '''Serve file from `field_file` for request.
+
+    Files are sent by the backend of get_download_backend(), and are never
+    buffered in the worker. Files which have no local path are streamed
+    for the X-Sendfile backend.
+    '''
     basename = osp.basename(field_file.name)
     if logging:
         msg = (
@@ -163,9 +428,17 @@ def generate_download_response(request, field_file, logging=True):
             f'请求下载文件: {field_file.name}'
         )
         prod_logger.info(msg)
-    resp = HttpResponse(content_type=infer_content_type(basename))
+    content_type = infer_content_type(basename)
+    backend = get_download_backend()
+    if (backend == DOWNLOAD_BACKEND_X_SENDFILE
+            and not has_local_path(field_file)):
+        backend = DOWNLOAD_BACKEND_STREAM
+    if backend == DOWNLOAD_BACKEND_STREAM:
+        resp = stream_file_response(request, field_file, content_type)
+    else:
+        resp = HttpResponse(content_type=content_type)
+        populate_file_content(resp, field_file, backend)
     resp['Content-Disposition'] = (
         f'attachment; filename={quote(basename)}'
     )
-    populate_file_content(resp, field_file)
     return resp
@@ -1,10 +1,12 @@
 '''Provide views for secure_file module.'''
+from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import get_object_or_404
 from django.apps import apps
 from rest_framework import views, viewsets, exceptions
 
 from secure_file.utils import (
-    generate_download_response, decrypt_file_download_url
+    generate_download_response, decrypt_file_download_url,
+    is_signed_file_download_url, verify_file_download_url
 )
 from secure_file.models import InSecureFile
 from infra.exceptions import BadRequest
@@ -30,7 +32,9 @@ class SecuredFileDownloadView(views.APIView):
 
     This type of secured url is implicitly generated by SecureFileField() of a
     serializer, or explicitly generated by
-    SecureFile.generate_download_response().
+    SecureFile.generate_download_response(). Urls are signed by
+    sign_file_download_url(), urls encrypted by encrypt_file_download_url()
+    are still accepted.
     '''
     # pylint: disable=too-many-arguments
     def _verify_validity(self, request, model_name,
@@ -54,8 +58,46 @@ class SecuredFileDownloadView(views.APIView):
             raise exceptions.NotFound()
         return real_file
 
+    def _verify_signed_validity(self, request, model_name, object_pk,
+                                field_name, perm_name):
+        '''Verify validity of the request with a signed url.'''
+        try:
+            model_class = apps.get_model(model_name)
+            instance = model_class.objects.get(pk=object_pk)
+        except (LookupError, ValueError, ObjectDoesNotExist):
+            msg = f'文件对象无效: {model_name}({object_pk})'
+            dev_logger.info(msg)
+            raise exceptions.NotFound()
+        real_file = getattr(instance, field_name, None)
+        if not real_file:
+            msg = f'文件字段无效: {model_name}({object_pk}).{field_name}'
+            dev_logger.info(msg)
+            raise exceptions.NotFound()
+        if not request.user.has_perm(perm_name, instance):
+            # If user has no permission, we simply return 404
+            msg = (
+                f'用户 {request.user.first_name}'
+                f'(用户名: {request.user.username}) '
+                f'尝试访问无权限文件: {real_file.name}'
+            )
+            prod_logger.info(msg)
+            raise exceptions.NotFound()
+        return real_file
+
     def get(self, request, encrypted_url):
         '''Decrypt, verify download request and redirect to download.'''
+        if is_signed_file_download_url(encrypted_url):
+            try:
+                (model_name, object_pk,
+                 field_name, perm_name) = verify_file_download_url(
+                     encrypted_url)
+            except ValueError as exc:
+                msg = f'签名链接校验失败: {exc}'
+                dev_logger.info(msg)
+                raise exceptions.NotFound()
+            field_file = self._verify_signed_validity(
+                request, model_name, object_pk, field_name, perm_name)
+            return generate_download_response(request, field_file)
         try:
             (model_name, field_name,
              path, perm_name) = decrypt_file_download_url(encrypted_url)
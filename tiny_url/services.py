@@ -21,7 +21,42 @@ class TinyURLService:
         tiny_url = TinyURL.objects.filter(url=long_url)
         if tiny_url:
             return tiny_url[0]
+        tiny_url = TinyURLService._generate_short_url()
+        return TinyURL.objects.create(url=long_url, short_url=tiny_url)
+
+    @staticmethod
+    def _generate_short_url():
         base62 = ('0123456789abcdefghijklmnopqrstuv'
                   'wxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
-        tiny_url = ''.join(random.choice(base62) for _ in range(6))
-        return TinyURL.objects.create(url=long_url, short_url=tiny_url)
+        return ''.join(random.choice(base62) for _ in range(6))
+
+    @staticmethod
+    def generate_tiny_urls(long_urls):
+        '''generate tiny urls for many long urls in bulk.
+
+        Parameters
+        ----------
+        long_urls: list of string
+
+        Returns
+        -------
+        tiny_urls: dict
+            Map long url to TinyURL.
+        '''
+        tiny_urls = {x.url: x for x in TinyURL.objects.filter(
+            url__in=long_urls)}
+        missing_urls = [x for x in dict.fromkeys(long_urls)
+                        if x not in tiny_urls]
+        short_urls = set()
+        while len(short_urls) < len(missing_urls):
+            while len(short_urls) < len(missing_urls):
+                short_urls.add(TinyURLService._generate_short_url())
+            short_urls -= set(TinyURL.objects.filter(
+                short_url__in=short_urls).values_list('short_url', flat=True))
+        TinyURL.objects.bulk_create([
+            TinyURL(url=url, short_url=short_url)
+            for url, short_url in zip(missing_urls, short_urls)
+        ], batch_size=500)
+        tiny_urls.update({x.url: x for x in TinyURL.objects.filter(
+            url__in=missing_urls)})
+        return tiny_urls
@@ -1,27 +1,53 @@
 ''' Provide filters used in filtering logic. '''
+import django_filters
 from django_filters import rest_framework as filters
 
 from training_event.models import OffCampusEvent
 from training_event.models import CampusEvent
+from training_event.services import EventSearchService
 
 
-class OffCampusEventFilter(filters.FilterSet):
+# pylint: disable=unused-argument
+class EventNameFilterSet(filters.FilterSet):
+    '''Filter events by names with EventSearchService.'''
+    search = django_filters.CharFilter(label='活动名称搜索',
+                                       method='filter_search')
+
+    def filter_search(self, queryset, name, value):
+        '''Filter events containing the value, ranked by relevance.'''
+        return EventSearchService.search(queryset, value)
+
+    def filter_name_startswith(self, queryset, name, value):
+        '''Filter events whose names start with the value.'''
+        return EventSearchService.filter_by_name(queryset, value,
+                                                 'startswith')
+
+    def filter_name_icontains(self, queryset, name, value):
+        '''Filter events whose names contain the value.'''
+        return EventSearchService.filter_by_name(queryset, value)
+
+
+class OffCampusEventFilter(EventNameFilterSet):
     '''Provide required information about filtering OffCampusEvent.'''
+    name__startswith = django_filters.CharFilter(
+        label='活动名称', method='filter_name_startswith')
+
     class Meta:
         model = OffCampusEvent
         fields = {
-            'name': ['startswith'],
             'id': ['in'],
         }
 
 
-class CampusEventFilter(filters.FilterSet):
+class CampusEventFilter(EventNameFilterSet):
     '''Provide required information about filtering CampusEvent.'''
+    name__icontains = django_filters.CharFilter(
+        label='活动名称', method='filter_name_icontains')
+
     class Meta:
         model = CampusEvent
         fields = {
             'program': ['exact'],
             'id': ['in'],
             'reviewed': ['exact'],
-            'name': ['icontains'],
         }
@@ -0,0 +1,89 @@
+# Generated by Django 2.2 on 2026-10-18 22:01
+
+import re
+
+from django.db import migrations, models
+
+
+AWARD_LEVEL_PATTERN = re.compile(r'(校|市|省|国家)级(.*奖)')
+AWARD_LEVELS = {'校': 1, '市': 2, '省': 3, '国家': 4}
+BATCH_SIZE = 1000
+
+
+def get_grams(name):
+    name = ''.join(name.lower().split())
+    grams = set(name)
+    grams.update(name[idx:idx + 2] for idx in range(len(name) - 1))
+    return grams
+
+
+def index_events(apps, schema_editor):
+    EventNameGram = apps.get_model('training_event', 'EventNameGram')
+    for model_name, kind in (('CampusEvent', 0), ('OffCampusEvent', 1)):
+        Event = apps.get_model('training_event', model_name)
+        events, grams = [], []
+
+        def flush():
+            Event.objects.bulk_update(events, ['award_level'],
+                                      batch_size=BATCH_SIZE)
+            EventNameGram.objects.bulk_create(grams, batch_size=BATCH_SIZE,
+                                              ignore_conflicts=True)
+            events.clear()
+            grams.clear()
+
+        for idx, event in enumerate(
+                Event.objects.only('id', 'name').iterator(
+                    chunk_size=BATCH_SIZE), 1):
+            match = AWARD_LEVEL_PATTERN.search(event.name)
+            if match is not None:
+                event.award_level = AWARD_LEVELS[match.group(1)]
+                events.append(event)
+            grams.extend(
+                EventNameGram(gram=gram, event_kind=kind, event_id=event.id)
+                for gram in get_grams(event.name))
+            if idx % BATCH_SIZE == 0:
+                flush()
+        flush()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training_event', '0006_auto_20190613_1439'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventNameGram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2, verbose_name='字符片段')),
+                ('event_kind', models.PositiveSmallIntegerField(choices=[(0, '校内培训'), (1, '校外培训')], verbose_name='活动类型')),
+                ('event_id', models.PositiveIntegerField(verbose_name='活动ID')),
+            ],
+            options={
+                'verbose_name': '活动名称索引',
+                'verbose_name_plural': '活动名称索引',
+                'default_permissions': (),
+            },
+        ),
+        migrations.AddField(
+            model_name='campusevent',
+            name='award_level',
+            field=models.PositiveSmallIntegerField(choices=[(0, '无'), (1, '校级'), (2, '市级'), (3, '省级'), (4, '国家级')], db_index=True, default=0, editable=False, verbose_name='获奖级别'),
+        ),
+        migrations.AddField(
+            model_name='offcampusevent',
+            name='award_level',
+            field=models.PositiveSmallIntegerField(choices=[(0, '无'), (1, '校级'), (2, '市级'), (3, '省级'), (4, '国家级')], db_index=True, default=0, editable=False, verbose_name='获奖级别'),
+        ),
+        migrations.AddIndex(
+            model_name='eventnamegram',
+            index=models.Index(fields=['event_kind', 'event_id'], name='event_name_gram_event_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventnamegram',
+            unique_together={('gram', 'event_kind', 'event_id')},
+        ),
+        migrations.RunPython(index_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 22:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training_event', '0007_event_award_level_and_name_grams'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enrollment',
+            name='is_signed',
+            field=models.BooleanField(default=False, verbose_name='是否签到'),
+        ),
+    ]
@@ -1,14 +1,32 @@
 '''Define ORM models for training_event module.'''
 import math
+import re
 
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.contrib.auth import get_user_model
 
 from training_program.models import Program
 
 
+AWARD_LEVEL_PATTERN = re.compile(r'(校|市|省|国家)级(.*奖)')
+
+
 class AbstractEvent(models.Model):
     '''Abstract class for all events.'''
+    AWARD_LEVEL_NONE = 0
+    AWARD_LEVEL_SCHOOL = 1
+    AWARD_LEVEL_CITY = 2
+    AWARD_LEVEL_PROVINCE = 3
+    AWARD_LEVEL_NATION = 4
+    AWARD_LEVEL_CHOICES = (
+        (AWARD_LEVEL_NONE, '无'),
+        (AWARD_LEVEL_SCHOOL, '校级'),
+        (AWARD_LEVEL_CITY, '市级'),
+        (AWARD_LEVEL_PROVINCE, '省级'),
+        (AWARD_LEVEL_NATION, '国家级'),
+    )
+
     class Meta:
         abstract = True
 
@@ -21,10 +39,28 @@ class AbstractEvent(models.Model):
     location = models.CharField(verbose_name='活动地点', max_length=64)
     num_hours = models.FloatField(verbose_name='活动学时')
     num_participants = models.PositiveIntegerField(verbose_name='活动人数')
+    award_level = models.PositiveSmallIntegerField(
+        verbose_name='获奖级别', choices=AWARD_LEVEL_CHOICES,
+        default=AWARD_LEVEL_NONE, db_index=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def get_award_level(cls, name):
+        '''Return award level of events named like 讲课竞赛|省级|一等奖.'''
+        match = AWARD_LEVEL_PATTERN.search(name)
+        if match is None:
+            return cls.AWARD_LEVEL_NONE
+        levels = {label: level for level, label in cls.AWARD_LEVEL_CHOICES}
+        return levels[f'{match.group(1)}级']
+
+    # pylint:disable=unused-argument
+    @classmethod
+    def update_award_level(cls, sender, instance, **kwargs):
+        '''Classify the award level before saving the event.'''
+        instance.award_level = cls.get_award_level(instance.name)
+
 
 class CampusEvent(AbstractEvent):
     '''Events that are held inside campus.'''
@@ -58,6 +94,91 @@ class OffCampusEvent(AbstractEvent):
         default_permissions = ()
 
 
+class EventNameGram(models.Model):
+    '''Inverted index from character n-grams of event names to events.
+
+    Names are indexed by single characters and pairs of adjacent characters,
+    ignoring case and whitespace, so names containing any text can be found
+    by looking up the n-grams of the text, which works for Chinese names
+    without word segmentation. See EventSearchService.
+    '''
+    EVENT_KIND_CAMPUS = 0
+    EVENT_KIND_OFF_CAMPUS = 1
+    EVENT_KIND_CHOICES = (
+        (EVENT_KIND_CAMPUS, '校内培训'),
+        (EVENT_KIND_OFF_CAMPUS, '校外培训'),
+    )
+
+    class Meta:
+        verbose_name = '活动名称索引'
+        verbose_name_plural = '活动名称索引'
+        default_permissions = ()
+        unique_together = (('gram', 'event_kind', 'event_id'),)
+        indexes = (
+            models.Index(fields=('event_kind', 'event_id'),
+                         name='event_name_gram_event_idx'),
+        )
+
+    gram = models.CharField(verbose_name='字符片段', max_length=2)
+    event_kind = models.PositiveSmallIntegerField(
+        verbose_name='活动类型', choices=EVENT_KIND_CHOICES)
+    event_id = models.PositiveIntegerField(verbose_name='活动ID')
+
+    def __str__(self):
+        return '{}({}-{})'.format(self.gram, self.event_kind, self.event_id)
+
+    @staticmethod
+    def normalize(text):
+        '''Lower the text and remove whitespace.'''
+        return ''.join(text.lower().split())
+
+    @classmethod
+    def get_grams(cls, name):
+        '''Return n-grams of the name to be indexed.'''
+        name = cls.normalize(name)
+        grams = set(name)
+        grams.update(name[idx:idx + 2] for idx in range(len(name) - 1))
+        return grams
+
+    @classmethod
+    def get_query_grams(cls, text):
+        '''Return n-grams which names containing the text must have.'''
+        text = cls.normalize(text)
+        if len(text) < 2:
+            return {text} if text else set()
+        return {text[idx:idx + 2] for idx in range(len(text) - 1)}
+
+    @classmethod
+    def get_event_kind(cls, model):
+        '''Return event kind of the event model.'''
+        if issubclass(model, CampusEvent):
+            return cls.EVENT_KIND_CAMPUS
+        return cls.EVENT_KIND_OFF_CAMPUS
+
+    # pylint:disable=unused-argument
+    @classmethod
+    def index_event(cls, sender, instance, **kwargs):
+        '''Update n-grams of the saved event.'''
+        kind = cls.get_event_kind(sender)
+        rows = cls.objects.filter(event_kind=kind, event_id=instance.pk)
+        existing = set(rows.values_list('gram', flat=True))
+        grams = cls.get_grams(instance.name)
+        if existing - grams:
+            rows.filter(gram__in=existing - grams).delete()
+        # Some databases compare different characters as equal.
+        cls.objects.bulk_create([
+            cls(gram=gram, event_kind=kind, event_id=instance.pk)
+            for gram in grams - existing
+        ], ignore_conflicts=True)
+
+    # pylint:disable=unused-argument
+    @classmethod
+    def unindex_event(cls, sender, instance, **kwargs):
+        '''Delete n-grams of the deleted event.'''
+        cls.objects.filter(event_kind=cls.get_event_kind(sender),
+                           event_id=instance.pk).delete()
+
+
 class Enrollment(models.Model):
     '''Enrollment holds information about the event that the user enrolled.'''
     ENROLL_METHOD_WEB = 0
@@ -93,6 +214,7 @@ class Enrollment(models.Model):
     enroll_method = models.PositiveSmallIntegerField(
         verbose_name='报名渠道', choices=ENROLL_METHOD_CHOICES,
         default=ENROLL_METHOD_WEB)
+    is_signed = models.BooleanField(verbose_name='是否签到', default=False)
 
     def __str__(self):
         return '{} 报名 {} 的记录'.format(self.user_id, self.campus_event_id)
@@ -180,3 +302,9 @@ class EventCoefficient(models.Model):
         if option == EventCoefficient.ROUND_METHOD_DEFAULT:
             return round(value)
         return value
+
+
+for _sender in (CampusEvent, OffCampusEvent):
+    pre_save.connect(AbstractEvent.update_award_level, sender=_sender)
+    post_save.connect(EventNameGram.index_event, sender=_sender)
+    post_delete.connect(EventNameGram.unindex_event, sender=_sender)
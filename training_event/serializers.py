@@ -1,4 +1,5 @@
 '''Define how to serialize our models.'''
+from django.db import models
 from django.utils.timezone import now
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
@@ -31,6 +32,34 @@ class EventCoefficientSerializer(HumanReadableValidationErrorMixin,
                   'hours_option_str', 'workload_option_str', 'role_str')
 
 
+def load_enrollment_ids(context, events):
+    '''Look up enrollments of the request user in the events.
+
+    Ids of enrollments (None if not enrolled) are kept in the serializer
+    context by ids of events, so events are looked up at most once while
+    serializing a response. Return the ids of all events looked up.
+    '''
+    enrollment_ids = context.setdefault('enrollment_ids', {})
+    request = context.get('request')
+    event_ids = [event.id for event in events
+                 if event is not None and event.id not in enrollment_ids]
+    if request is not None and event_ids:
+        enrollment_ids.update(EnrollmentService.get_user_enrollment_id(
+            event_ids, request.user))
+    return enrollment_ids
+
+
+class CampusEventListSerializer(serializers.ListSerializer):
+    '''Look up enrollments of the request user in a page of events in one
+    query.'''
+    # pylint: disable=abstract-method
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        iterable = list(iterable)
+        load_enrollment_ids(self.context, iterable)
+        return super().to_representation(iterable)
+
+
 class ReadOnlyCampusEventSerializer(HumanReadableValidationErrorMixin,
                                     serializers.ModelSerializer):
     '''Indicate how to serialize Campus Event instance for reading.'''
@@ -49,6 +78,7 @@ class ReadOnlyCampusEventSerializer(HumanReadableValidationErrorMixin,
                   'enrollment_id', 'num_hours', 'num_enrolled',
                   'num_participants', 'program', 'program_detail',
                   'coefficients', 'deadline', 'description')
+        list_serializer_class = CampusEventListSerializer
 
     def get_expired(self, obj):
         '''Get event expired status.'''
@@ -56,37 +86,11 @@ class ReadOnlyCampusEventSerializer(HumanReadableValidationErrorMixin,
 
     def get_enrolled(self, obj):
         '''Get event enrollments status.'''
-        key = 'enrolled_cache'
-        user = self.context['request'].user
-        if key not in self.context:
-            if not isinstance(self.instance, list):
-                instances = [self.instance]
-            else:
-                instances = self.instance
-            res = EnrollmentService.get_user_enrollment_status(
-                instances, user
-            )
-            self.context[key] = res
-        else:
-            res = self.context[key]
-        return res.get(obj.id, None)
+        return self.get_enrollment_id(obj) is not None
 
     def get_enrollment_id(self, obj):
         '''Get event enrollments id.'''
-        key = 'enrollment_cache'
-        user = self.context['request'].user
-        if key not in self.context:
-            if not isinstance(self.instance, list):
-                instances = [self.instance]
-            else:
-                instances = self.instance
-            res = EnrollmentService.get_user_enrollment_id(
-                instances, user
-            )
-            self.context[key] = res
-        else:
-            res = self.context[key]
-        return res.get(obj.id, None)
+        return load_enrollment_ids(self.context, [obj]).get(obj.id)
 
 
 class BasicReadOnlyCampusEventSerializer(ReadOnlyCampusEventSerializer):
@@ -170,6 +174,7 @@ class EnrollmentSerailizer(HumanReadableValidationErrorMixin,
     class Meta:
         model = training_event.models.Enrollment
         fields = '__all__'
+        read_only_fields = ('is_signed',)
 
     def create(self, validated_data):
         return EnrollmentService.create_enrollment(validated_data)
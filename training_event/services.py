@@ -1,10 +1,20 @@
 '''Provide services of training event module.'''
 from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Length
 from django.utils.timezone import now
-from infra.utils import prod_logger
-from infra.exceptions import BadRequest
-from training_event.models import CampusEvent, Enrollment, EventCoefficient
+from auth.models import User
 from auth.services import PermissionService
+from drf_cache.utils import invalidate_all_caches
+from infra.excel import iter_excel_rows, get_cell_value
+from infra.utils import (
+    bulk_create_with_pks, bump_model_version, positive_int, prod_logger
+)
+from infra.exceptions import BadRequest
+from infra.services import NotificationService
+from training_event.models import (
+    CampusEvent, Enrollment, EventCoefficient, EventNameGram
+)
 
 
 class CampusEventService:
@@ -39,8 +49,11 @@ class CampusEventService:
         '''
         with transaction.atomic():
             campus_event = CampusEvent.objects.create(**validated_data)
+            # Groups of the department of the program manage the event, the
+            # same as auth.utils.OBJECT_PERMISSION_RULES derives.
             PermissionService.assign_object_permissions(
-                context['request'].user, campus_event)
+                context['request'].user, campus_event,
+                department=campus_event.program.department)
             for coefficient in coefficients:
                 EventCoefficient.objects.create(campus_event=campus_event,
                                                 **coefficient)
@@ -101,12 +114,15 @@ class CampusEventService:
 
 class EnrollmentService:
     '''Provide services for Enrollment.'''
+    BATCH_MAX_USERNAMES = 500
+
     @staticmethod
     def create_enrollment(enrollment_data):
         '''Create a enrollment for specific campus event.
 
-        This action is atomic, will fail if there are no more heads counts for
-        the campus event or duplicated enrollments are created.
+        This action will fail if there are no more heads counts for the
+        campus event or duplicated enrollments are created, in which case
+        the reserved seat is given back.
 
         Parametsers
         ----------
@@ -118,23 +134,241 @@ class EnrollmentService:
         -------
         enrollment: Enrollment
         '''
-        with transaction.atomic():
-            # Lock the event until the end of the transaction
-            event = CampusEvent.objects.select_for_update().get(
-                id=enrollment_data['campus_event'].id)
+        event_id = enrollment_data['campus_event'].id
+        # Reserve a seat by a conditional UPDATE in its own transaction, so
+        # the row of the event is only locked by this statement instead of
+        # the whole transaction creating the enrollment, and no more than
+        # num_participants seats can be reserved.
+        reserved = CampusEvent.objects.filter(
+            id=event_id, deadline__gte=now(),
+            num_enrolled__lt=F('num_participants'),
+        ).update(num_enrolled=F('num_enrolled') + 1)
+        if not reserved:
+            event = CampusEvent.objects.get(id=event_id)
             if now() > event.deadline:
                 raise BadRequest('报名时间已过')
-            if event.num_enrolled >= event.num_participants:
-                raise BadRequest('报名人数已满')
+            raise BadRequest('报名人数已满')
 
-            enrollment = Enrollment.objects.create(**enrollment_data)
-            # Update the number of enrolled participants
-            event.num_enrolled += 1
-            event.save()
-            PermissionService.assign_object_permissions(
-                enrollment_data['user'], enrollment)
+        try:
+            with transaction.atomic():
+                enrollment = Enrollment.objects.create(**enrollment_data)
+                PermissionService.assign_object_permissions(
+                    enrollment_data['user'], enrollment)
+        except Exception:
+            EnrollmentService._release_seat(event_id)
+            raise
+        return enrollment
+
+    @staticmethod
+    def _release_seat(event_id, count=1):
+        '''Give back seats reserved by create_enrollment() or
+        bulk_create_enrollments().'''
+        CampusEvent.objects.filter(
+            id=event_id, num_enrolled__gte=count,
+        ).update(num_enrolled=F('num_enrolled') - count)
+
+    @staticmethod
+    def _reserve_seats(event_id, count):
+        '''Reserve up to count seats of the event, return the number of
+        seats reserved.
+
+        Seats are reserved by a conditional UPDATE, the same as
+        create_enrollment(), so capacity is checked once for the whole batch.
+        If fewer seats are left, the remaining ones are reserved instead.
+        '''
+        while count > 0:
+            reserved = CampusEvent.objects.filter(
+                id=event_id,
+                num_enrolled__lte=F('num_participants') - count,
+            ).update(num_enrolled=F('num_enrolled') + count)
+            if reserved:
+                return count
+            # Other enrollments took seats meanwhile, retry with those left.
+            event = CampusEvent.objects.get(id=event_id)
+            count = min(count - 1, event.num_participants - event.num_enrolled)
+        return 0
+
+    @staticmethod
+    def read_usernames(file):
+        '''Read usernames in the first column of an uploaded Excel file.
+
+        Empty cells and a header cell `工号` are skipped.
+        '''
+        usernames = []
+        try:
+            for row in iter_excel_rows(file):
+                val = get_cell_value(row, 0)
+                if isinstance(val, float):
+                    val = f'{int(val)}'
+                val = val.strip() if isinstance(val, str) else ''
+                if val and val != '工号':
+                    usernames.append(val)
+        except Exception:
+            raise BadRequest('无效的表格')
+        return usernames
+
+    @classmethod
+    def _get_admin_event(cls, event_id, usernames, admin, action):
+        '''Validate a batch of usernames and return the campus event the
+        admin can manage.'''
+        if not isinstance(usernames, list) or not all(
+                isinstance(username, str) for username in usernames):
+            raise BadRequest('参数有误')
+        if not usernames:
+            raise BadRequest('请提供用户列表')
+        if len(usernames) > cls.BATCH_MAX_USERNAMES:
+            raise BadRequest(f'每次最多处理{cls.BATCH_MAX_USERNAMES}名用户')
+        try:
+            event_id = positive_int(event_id, strict=True)
+        except (TypeError, ValueError):
+            raise BadRequest('未找到对应培训活动')
+        event = CampusEvent.objects.filter(id=event_id).first()
+        if event is None:
+            raise BadRequest('未找到对应培训活动')
+        if not admin.has_perm('training_event.change_campusevent', event):
+            msg = (
+                f'用户 {admin.username}({admin.first_name}) '
+                f'为不具有权限的校内培训活动 {event.id} {action}失败。'
+            )
+            prod_logger.info(msg)
+            raise BadRequest(f'您无权为该活动{action}')
+        return event
+
+    # pylint: disable=too-many-locals
+    @classmethod
+    def bulk_create_enrollments(cls, event_id, usernames, admin):
+        '''Enroll many users in a campus event for an admin.
+
+        Users are fetched in one query, seats are reserved for all of them
+        at once and enrollments are created by bulk_create(). Deadlines
+        are not checked for admins, but capacity is. If there are fewer
+        seats than users, users are enrolled in the given order until the
+        event is full.
+
+        Parameters
+        ----------
+        event_id: int
+        usernames: list of str
+        admin: User
+            The admin who must be able to change the event.
+
+        Returns
+        -------
+        results: list of dict
+            {'username': str, 'success': True, 'enrollment_id': int} or
+            {'username': str, 'success': False, 'message': str} for each
+            username in the given order.
+        '''
+        event = cls._get_admin_event(event_id, usernames, admin, '导入报名')
+        if not event.reviewed:
+            raise BadRequest('不能报名未经审核的培训活动')
+        users = {
+            user.username: user for user in
+            User.objects.filter(username__in=set(usernames))
+        }
+        enrolled_user_ids = set(
+            Enrollment.objects
+            .filter(campus_event=event, user__in=users.values())
+            .values_list('user_id', flat=True)
+        )
+        results = {}
+        new_users = []
+        for username in usernames:
+            if username in results:
+                continue
+            user = users.get(username)
+            if user is None:
+                results[username] = '用户不存在'
+            elif user.id in enrolled_user_ids:
+                results[username] = '该用户已报名'
+            else:
+                results[username] = None
+                new_users.append(user)
+
+        num_reserved = cls._reserve_seats(event.id, len(new_users))
+        for user in new_users[num_reserved:]:
+            results[user.username] = '报名人数已满'
+        new_users = new_users[:num_reserved]
+        enrollments = []
+        if new_users:
+            try:
+                with transaction.atomic():
+                    enrollments = cls._bulk_create_enrollments(
+                        event, new_users)
+            except Exception:
+                cls._release_seat(event.id, num_reserved)
+                raise
+            NotificationService.send_system_notifications(
+                new_users, f'管理员已为您报名校内培训活动{event.name}')
+            msg = (f'管理员{admin}为{len(new_users)}名用户导入了'
+                   f'{event.name}({event.id})活动的报名')
+            prod_logger.info(msg)
+
+        enrollment_ids = {
+            enrollment.user_id: enrollment.id for enrollment in enrollments
+        }
+        return [
+            {'username': username, 'success': True,
+             'enrollment_id': enrollment_ids[users[username].id]}
+            if results[username] is None else
+            {'username': username, 'success': False,
+             'message': results[username]}
+            for username in results
+        ]
+
+    @staticmethod
+    def _bulk_create_enrollments(event, users):
+        '''Create enrollments of users and their permissions.'''
+        enrollments = bulk_create_with_pks(Enrollment.objects, [
+            Enrollment(campus_event=event, user=user,
+                       enroll_method=Enrollment.ENROLL_METHOD_IMPORT)
+            for user in users
+        ], ('campus_event_id', 'user_id'))
+        PermissionService.bulk_assign_object_permissions(
+            (enrollment.user, enrollment) for enrollment in enrollments)
+        bump_model_version(Enrollment)
+        transaction.on_commit(invalidate_all_caches)
+        return enrollments
+
+    @classmethod
+    def mark_attendance(cls, event_id, usernames, admin, is_signed=True):
+        '''Mark enrolled users of a campus event as signed in or not.
 
-            return enrollment
+        The enrollments are updated by one UPDATE, their marks are written
+        to the 签到 column of the sheet of export_attendance_sheet(), so
+        the sheet can be imported as records afterwards.
+
+        Returns
+        -------
+        results: list of dict
+            {'username': str, 'success': True} or
+            {'username': str, 'success': False, 'message': str} for each
+            username in the given order.
+        '''
+        event = cls._get_admin_event(event_id, usernames, admin, '登记签到')
+        enrollment_ids = dict(
+            Enrollment.objects
+            .filter(campus_event=event, user__username__in=set(usernames))
+            .values_list('user__username', 'id')
+        )
+        if enrollment_ids:
+            Enrollment.objects.filter(
+                id__in=enrollment_ids.values()).update(is_signed=is_signed)
+            bump_model_version(Enrollment)
+            transaction.on_commit(invalidate_all_caches)
+            msg = (f'管理员{admin}为{len(enrollment_ids)}名用户登记了'
+                   f'{event.name}({event.id})活动的签到')
+            prod_logger.info(msg)
+        results = {}
+        for username in usernames:
+            if username in enrollment_ids:
+                results[username] = {'username': username, 'success': True}
+            else:
+                results.setdefault(username, {
+                    'username': username, 'success': False,
+                    'message': '该用户未报名',
+                })
+        return list(results.values())
 
     @staticmethod
     def delete_enrollment(instance):
@@ -145,13 +379,10 @@ class EnrollmentService:
             删除的enrollment对象
         """
         with transaction.atomic():
-            # Lock the event until the end of the transaction
-            event = CampusEvent.objects.select_for_update().get(
-                id=instance.campus_event_id
-            )
-            event.num_enrolled -= 1
-            event.save()
             instance.delete()
+            # Release the seat at last, so the row of the event is only
+            # locked until the commit right after it.
+            EnrollmentService._release_seat(instance.campus_event_id)
 
     @staticmethod
     def get_user_enrollment_status(events, user):
@@ -226,3 +457,61 @@ class EnrollmentService:
             campus_event_id=event_id).select_related(
                 'user__department', 'campus_event'
             )
+
+
+class EventSearchService:
+    '''Search events by text in their names with EventNameGram.
+
+    Events having every n-gram of the text are looked up by the index first,
+    so LIKE '%text%' is only evaluated on these candidates instead of
+    scanning names of all events.
+    '''
+    @staticmethod
+    def filter_by_name(queryset, text, lookup='icontains'):
+        '''Filter events of the queryset whose names match the text.
+
+        Parameters
+        ----------
+        queryset: QuerySet
+            A queryset of CampusEvent or OffCampusEvent.
+        text: str
+            The text to search for.
+        lookup: str
+            A lookup on names implied by `icontains`, such as `istartswith`,
+            which is checked on candidates. Default: icontains
+        '''
+        text = text.strip()
+        grams = EventNameGram.get_query_grams(text)
+        if not grams:
+            return queryset
+        candidates = (
+            EventNameGram.objects
+            .filter(event_kind=EventNameGram.get_event_kind(queryset.model),
+                    gram__in=grams)
+            .values('event_id')
+            .annotate(num_grams=Count('gram'))
+            .filter(num_grams=len(grams))
+            .values('event_id')
+        )
+        return queryset.filter(pk__in=candidates,
+                               **{f'name__{lookup}': text})
+
+    @staticmethod
+    def search(queryset, text):
+        '''Filter events whose names contain the text, ranked by relevance.
+
+        Events named exactly the text come first, then those whose names
+        start with the text, then the others, shorter names and later
+        events first.
+        '''
+        text = text.strip()
+        return (
+            EventSearchService.filter_by_name(queryset, text)
+            .annotate(
+                search_rank=Case(
+                    When(name__iexact=text, then=Value(2)),
+                    When(name__istartswith=text, then=Value(1)),
+                    default=Value(0), output_field=IntegerField()),
+                name_length=Length('name'))
+            .order_by('-search_rank', 'name_length', '-time', '-id')
+        )
@@ -3,10 +3,11 @@ import math
 from unittest.mock import patch
 
 from django.test import TestCase
+from model_mommy import mommy
 
 from training_record.models import Record
 from training_event.models import (
-    CampusEvent, OffCampusEvent, Enrollment, EventCoefficient)
+    CampusEvent, OffCampusEvent, Enrollment, EventCoefficient, EventNameGram)
 
 
 class TestCampusEvent(TestCase):
@@ -18,6 +19,20 @@ class TestCampusEvent(TestCase):
 
         self.assertEqual(str(campus_event), name)
 
+    def test_award_level(self):
+        '''Should classify award levels when saving events.'''
+        for name, level in (('讲课竞赛|国家级|一等奖', CampusEvent.AWARD_LEVEL_NATION),
+                            ('讲课竞赛|校级|优秀奖', CampusEvent.AWARD_LEVEL_SCHOOL),
+                            ('省级教学研讨会', CampusEvent.AWARD_LEVEL_NONE)):
+            event = mommy.make(CampusEvent, name=name)
+            self.assertEqual(event.award_level, level)
+
+        event.name = '讲课竞赛|市级|二等奖'
+        event.save()
+
+        event.refresh_from_db()
+        self.assertEqual(event.award_level, CampusEvent.AWARD_LEVEL_CITY)
+
 
 class TestOffCampusEvent(TestCase):
     '''Unit tests for model OffCampusEvent.'''
@@ -29,6 +44,42 @@ class TestOffCampusEvent(TestCase):
         self.assertEqual(str(off_campus_event), name)
 
 
+class TestEventNameGram(TestCase):
+    '''Unit tests for model EventNameGram.'''
+    @staticmethod
+    def get_grams(event):
+        '''Return indexed n-grams of the event.'''
+        return set(EventNameGram.objects.filter(
+            event_kind=EventNameGram.get_event_kind(type(event)),
+            event_id=event.id).values_list('gram', flat=True))
+
+    def test_get_grams(self):
+        '''Should split names into characters and pairs of characters.'''
+        self.assertEqual(EventNameGram.get_grams('教学 AI'),
+                         {'教', '学', 'a', 'i', '教学', '学a', 'ai'})
+        self.assertEqual(EventNameGram.get_query_grams('教学 AI'),
+                         {'教学', '学a', 'ai'})
+        self.assertEqual(EventNameGram.get_query_grams('教'), {'教'})
+        self.assertEqual(EventNameGram.get_query_grams(' '), set())
+
+    def test_index_event(self):
+        '''Should keep n-grams of events up to date.'''
+        campus_event = mommy.make(CampusEvent, name='教学')
+        off_campus_event = mommy.make(OffCampusEvent, name='教学')
+        self.assertEqual(self.get_grams(campus_event), {'教', '学', '教学'})
+        self.assertEqual(self.get_grams(off_campus_event),
+                         {'教', '学', '教学'})
+
+        campus_event.name = '教研'
+        campus_event.save()
+        self.assertEqual(self.get_grams(campus_event), {'教', '研', '教研'})
+
+        campus_event.delete()
+        self.assertEqual(self.get_grams(campus_event), set())
+        self.assertEqual(self.get_grams(off_campus_event),
+                         {'教', '学', '教学'})
+
+
 class TestEnrollment(TestCase):
     '''Unit tests for model Enrollment.'''
     def test_str(self):
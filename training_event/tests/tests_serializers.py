@@ -12,7 +12,7 @@ from training_event.serializers import (
     EnrollmentSerailizer,
     CampusEventSerializer,
     ReadOnlyCampusEventSerializer)
-from training_event.models import CampusEvent
+from training_event.models import CampusEvent, Enrollment
 from training_program.models import Program
 import auth.models
 
@@ -127,6 +127,22 @@ class TestCampusEventSerializer(TestCase):
         data = serializer.data
         self.assertIn('enrollment_id', data[0])
 
+    def test_get_enrollment_once(self):
+        '''Should look up enrollments once for both fields.'''
+        user = mommy.make(auth.models.User)
+        event = mommy.make(CampusEvent)
+        enrollment = mommy.make(Enrollment, user=user, campus_event=event)
+        request = Mock()
+        request.user = user
+
+        # Enrollments and coefficients.
+        with self.assertNumQueries(2):
+            data = ReadOnlyCampusEventSerializer(
+                event, context={'request': request}).data
+
+        self.assertTrue(data['enrolled'])
+        self.assertEqual(data['enrollment_id'], enrollment.id)
+
     @patch('training_event.serializers.CampusEventService')
     def test_update(self, mocked_service):
         '''should update event and coefficient.'''
@@ -1,13 +1,26 @@
 '''Unit tests for training_event services.'''
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import xlwt
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.utils.timezone import now
-from django.test import TestCase
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
 from django.http import HttpRequest
 from model_mommy import mommy
 from infra.exceptions import BadRequest
-from training_event.models import CampusEvent, Enrollment, EventCoefficient
-from training_event.services import EnrollmentService, CampusEventService
+from infra.utils import dev_logger
+from training_event.models import (
+    CampusEvent, Enrollment, EventCoefficient, OffCampusEvent
+)
+from training_event.services import (
+    EnrollmentService, CampusEventService, EventSearchService
+)
 from training_program.models import Program
 from auth.models import Department
 from auth.utils import assign_perm
@@ -127,6 +140,19 @@ class TestEnrollmentService(TestCase):
 
         self.assertEqual(count, 1)
 
+    def test_create_enrollment_reserve_seat(self):
+        '''Should reserve a seat, and give it back if creating fails.'''
+        self.event.num_participants = 10
+        self.event.deadline = now().replace(year=2028)
+        self.event.save()
+
+        EnrollmentService.create_enrollment(self.data)
+        with self.assertRaises(IntegrityError):
+            EnrollmentService.create_enrollment(self.data)
+
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.num_enrolled, 1)
+
     def test_get_user_enrollment_status(self):
         '''Should get user enrollment status.'''
         events = [mommy.make(CampusEvent) for _ in range(10)]
@@ -166,6 +192,8 @@ class TestEnrollmentService(TestCase):
                                 user=self.user, campus_event=self.event)
         EnrollmentService.delete_enrollment(enrollment)
         self.assertEqual(Enrollment.objects.count(), 0)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.num_enrolled, 1)
 
     def test_get_enrollments(self):
         '''Should get matched enrollments'''
@@ -178,3 +206,220 @@ class TestEnrollmentService(TestCase):
         count = EnrollmentService.get_enrollments(
             1, context={'user': user}).count()
         self.assertEqual(count, 1)
+
+
+class TestEnrollmentBulkImport(TestCase):
+    '''Test bulk enrollment and attendance of EnrollmentService.'''
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.get_or_create(username='notification-robot')
+        assign_perm('training_event.view_enrollment',
+                    mommy.make(Group, name='个人权限'))
+        cls.admin = mommy.make(User)
+        cls.users = [mommy.make(User, username=f'teacher{idx}')
+                     for idx in range(4)]
+
+    def setUp(self):
+        self.event = mommy.make(CampusEvent, num_participants=3,
+                                reviewed=True)
+        assign_perm('training_event.change_campusevent', self.admin,
+                    self.event)
+
+    def test_bulk_create_enrollments(self):
+        '''Should enroll users until the event is full.'''
+        mommy.make(Enrollment, user=self.users[0], campus_event=self.event)
+        CampusEvent.objects.filter(id=self.event.id).update(num_enrolled=1)
+        usernames = ['teacher0', 'teacher1', 'nobody', 'teacher2',
+                     'teacher1', 'teacher3']
+
+        results = EnrollmentService.bulk_create_enrollments(
+            self.event.id, usernames, self.admin)
+
+        enrollments = dict(Enrollment.objects.filter(
+            campus_event=self.event).values_list('user__username', 'id'))
+        self.assertEqual(results, [
+            {'username': 'teacher0', 'success': False,
+             'message': '该用户已报名'},
+            {'username': 'teacher1', 'success': True,
+             'enrollment_id': enrollments['teacher1']},
+            {'username': 'nobody', 'success': False, 'message': '用户不存在'},
+            {'username': 'teacher2', 'success': True,
+             'enrollment_id': enrollments['teacher2']},
+            {'username': 'teacher3', 'success': False,
+             'message': '报名人数已满'},
+        ])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.num_enrolled, 3)
+        self.assertEqual(
+            set(Enrollment.objects.filter(
+                campus_event=self.event, user__username='teacher1',
+            ).values_list('enroll_method', flat=True)),
+            {Enrollment.ENROLL_METHOD_IMPORT})
+        self.assertTrue(self.users[1].has_perm(
+            'training_event.view_enrollment',
+            Enrollment.objects.get(id=enrollments['teacher1'])))
+
+    def test_bulk_create_enrollments_release_seats(self):
+        '''Should give back seats if creating enrollments fails.'''
+        with patch('training_event.services.PermissionService'
+                   '.bulk_assign_object_permissions',
+                   side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                EnrollmentService.bulk_create_enrollments(
+                    self.event.id, ['teacher0', 'teacher1'], self.admin)
+
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.num_enrolled, 0)
+        self.assertFalse(Enrollment.objects.exists())
+
+    def test_bulk_create_enrollments_bad_request(self):
+        '''Should check usernames, the event and permissions.'''
+        other_event = mommy.make(CampusEvent, reviewed=True)
+        unreviewed_event = mommy.make(CampusEvent)
+        assign_perm('training_event.change_campusevent', self.admin,
+                    unreviewed_event)
+        cases = (
+            (self.event.id, 'teacher0', '参数有误'),
+            (self.event.id, [], '请提供用户列表'),
+            (self.event.id, ['teacher0'] * 501, '每次最多处理500名用户'),
+            (-1, ['teacher0'], '未找到对应培训活动'),
+            ('abc', ['teacher0'], '未找到对应培训活动'),
+            (None, ['teacher0'], '未找到对应培训活动'),
+            (other_event.id, ['teacher0'], '您无权为该活动导入报名'),
+            (unreviewed_event.id, ['teacher0'], '不能报名未经审核的培训活动'),
+        )
+        for event_id, usernames, message in cases:
+            with self.assertRaisesMessage(BadRequest, message):
+                EnrollmentService.bulk_create_enrollments(
+                    event_id, usernames, self.admin)
+
+    def test_mark_attendance(self):
+        '''Should mark enrolled users as signed in.'''
+        for user in self.users[:2]:
+            mommy.make(Enrollment, user=user, campus_event=self.event)
+
+        # The event and permissions of the admin, then the enrollments are
+        # looked up and updated at once.
+        with self.assertNumQueries(5):
+            results = EnrollmentService.mark_attendance(
+                self.event.id, ['teacher0', 'teacher2'], self.admin)
+
+        self.assertEqual(results, [
+            {'username': 'teacher0', 'success': True},
+            {'username': 'teacher2', 'success': False,
+             'message': '该用户未报名'},
+        ])
+        self.assertEqual(
+            dict(Enrollment.objects.values_list('user__username',
+                                                'is_signed')),
+            {'teacher0': True, 'teacher1': False})
+
+        EnrollmentService.mark_attendance(
+            self.event.id, ['teacher0'], self.admin, is_signed=False)
+        self.assertFalse(Enrollment.objects.filter(is_signed=True).exists())
+
+    def test_read_usernames(self):
+        '''Should read usernames in the first column.'''
+        workbook = xlwt.Workbook()
+        sheet = workbook.add_sheet('用户')
+        for row, value in enumerate(['工号', 'teacher0', 201581108.0, '',
+                                     ' teacher1 ']):
+            sheet.write(row, 0, value)
+        content = io.BytesIO()
+        workbook.save(content)
+
+        self.assertEqual(
+            EnrollmentService.read_usernames(content.getvalue()),
+            ['teacher0', '201581108', 'teacher1'])
+        with self.assertRaisesMessage(BadRequest, '无效的表格'):
+            EnrollmentService.read_usernames(b'invalid')
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class TestEnrollmentConcurrency(TransactionTestCase):
+    '''Load test of EnrollmentService with concurrent sign-ups.
+
+    SQLite serializes writers, so this only runs on databases with row
+    locks, such as MySQL used by CI.
+    '''
+    num_participants = 20
+    num_users = 100
+    num_workers = 16
+
+    def enroll(self, event, user):
+        '''Enroll the user in a thread, return whether it succeeded.'''
+        try:
+            EnrollmentService.create_enrollment(
+                {'campus_event': event, 'user': user})
+            return True
+        except BadRequest:
+            return False
+        finally:
+            connection.close()
+
+    def test_no_overbooking(self):
+        '''Should never enroll more users than num_participants.'''
+        mommy.make(Group, name='个人权限')
+        event = mommy.make(CampusEvent, num_participants=self.num_participants,
+                           deadline=now().replace(year=2099))
+        users = mommy.make(User, _quantity=self.num_users)
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(self.num_workers) as executor:
+            results = list(executor.map(
+                lambda user: self.enroll(event, user), users))
+        elapsed = time.monotonic() - start
+
+        event.refresh_from_db()
+        self.assertEqual(sum(results), self.num_participants)
+        self.assertEqual(event.num_enrolled, self.num_participants)
+        self.assertEqual(Enrollment.objects.filter(
+            campus_event=event).count(), self.num_participants)
+        msg = (
+            f'{self.num_users} sign-ups by {self.num_workers} workers: '
+            f'{self.num_users / elapsed:.1f} requests/s'
+        )
+        dev_logger.info(msg)
+
+
+class TestEventSearchService(TestCase):
+    '''Test services provided by EventSearchService.'''
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = {
+            name: mommy.make(CampusEvent, name=name)
+            for name in ('教学能力提升培训', '青年教师教学竞赛', '教学', '教师培训')
+        }
+        mommy.make(OffCampusEvent, name='教学研讨会')
+
+    def test_filter_by_name(self):
+        '''Should filter events whose names match the text.'''
+        queryset = CampusEvent.objects.all()
+
+        self.assertEqual(
+            set(EventSearchService.filter_by_name(queryset, '教学')),
+            {self.events['教学能力提升培训'], self.events['青年教师教学竞赛'],
+             self.events['教学']})
+        self.assertEqual(
+            set(EventSearchService.filter_by_name(queryset, '教学',
+                                                  'startswith')),
+            {self.events['教学能力提升培训'], self.events['教学']})
+        self.assertEqual(
+            set(EventSearchService.filter_by_name(queryset, '师')),
+            {self.events['青年教师教学竞赛'], self.events['教师培训']})
+        # Having every n-gram isn't enough.
+        self.assertFalse(
+            EventSearchService.filter_by_name(queryset, '学教').exists())
+        self.assertEqual(
+            EventSearchService.filter_by_name(queryset, ' ').count(), 4)
+
+    def test_search(self):
+        '''Should rank exact and prefix matches first.'''
+        events = EventSearchService.search(CampusEvent.objects.all(), '教学')
+
+        self.assertEqual(
+            [event.name for event in events],
+            ['教学', '教学能力提升培训', '青年教师教学竞赛'])
+        self.assertEqual(list(EventSearchService.search(
+            OffCampusEvent.objects.all(), '研讨').values_list(
+                'name', flat=True)), ['教学研讨会'])
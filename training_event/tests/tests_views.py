@@ -1,6 +1,12 @@
 '''Unit tests for training_event views.'''
+import io
+
+import xlwt
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.timezone import now
 from model_mommy import mommy
@@ -104,6 +110,40 @@ class TestCampusEventViewSet(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def count_list_queries(self, num_events):
+        '''Return number of queries to list a page of num_events, half of
+        which the user enrolled in.'''
+        training_event.models.CampusEvent.objects.all().delete()
+        events = mommy.make(training_event.models.CampusEvent,
+                            _quantity=num_events)
+        enrollment_ids = {}
+        for idx, event in enumerate(events):
+            PermissionService.assign_object_permissions(self.user, event)
+            if idx % 2 == 0:
+                enrollment_ids[event.id] = mommy.make(
+                    training_event.models.Enrollment, user=self.user,
+                    campus_event=event).id
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('campusevent-list'),
+                                       {'limit': num_events})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), num_events)
+        for event in response.data['results']:
+            self.assertEqual(event['enrollment_id'],
+                             enrollment_ids.get(event['id']))
+            self.assertEqual(event['enrolled'], event['id'] in enrollment_ids)
+        return len(context.captured_queries)
+
+    def test_list_campus_event_constant_queries(self):
+        '''Should look up enrollments of a page of events in one query.'''
+        # Warm up permissions cached on the user.
+        self.count_list_queries(1)
+
+        self.assertEqual(self.count_list_queries(3),
+                         self.count_list_queries(12))
+
     def test_delete_campus_event(self):
         '''CampusEvent should be deleted by DELETE request.'''
         campus_event = mommy.make(training_event.models.CampusEvent)
@@ -224,6 +264,23 @@ class TestOffCampusEventViewSet(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_search_off_campus_event(self):
+        '''OffCampusEvents should be searched by names.'''
+        for name in ('教学研讨会', '研讨会', '其他'):
+            mommy.make(training_event.models.OffCampusEvent, name=name)
+        url = reverse('offcampusevent-list')
+
+        response = self.client.get(url, {'search': '研讨'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([event['name'] for event in response.data['results']],
+                         ['研讨会', '教学研讨会'])
+
+        response = self.client.get(url, {'name__startswith': '研讨'})
+
+        self.assertEqual([event['name'] for event in response.data['results']],
+                         ['研讨会'])
+
 
 class TestEnrollmentViewSet(APITestCase):
     '''Unit tests for Enrollment view.'''
@@ -285,6 +342,69 @@ class TestEnrollmentViewSet(APITestCase):
         self.assertEqual(response.status_code,
                          status.HTTP_404_NOT_FOUND)
 
+    def test_bulk_enroll(self):
+        '''Should enroll users in the request for admins.'''
+        User.objects.get_or_create(username='notification-robot')
+        admin = mommy.make(User)
+        event = mommy.make(training_event.models.CampusEvent,
+                           num_participants=10, reviewed=True)
+        assign_perm('training_event.view_enrollment', admin)
+        assign_perm('training_event.change_campusevent', admin, event)
+        mommy.make(User, username='teacher')
+        self.client.force_authenticate(admin)
+        url = reverse('enrollment-bulk-enroll')
+
+        response = self.client.post(url, {
+            'campus_event': event.id, 'usernames': ['teacher', 'nobody'],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['success'] for result in response.data],
+                         [True, False])
+        self.assertEqual(
+            training_event.models.Enrollment.objects.get().user.username,
+            'teacher')
+
+    def test_bulk_enroll_bad_event(self):
+        '''Should return 400 if the event id is not a number.'''
+        admin = mommy.make(User)
+        assign_perm('training_event.view_enrollment', admin)
+        self.client.force_authenticate(admin)
+        url = reverse('enrollment-bulk-enroll')
+
+        response = self.client.post(url, {
+            'campus_event': 'abc', 'usernames': ['teacher'],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_mark_attendance(self):
+        '''Should mark users in the uploaded sheet as signed in.'''
+        admin = mommy.make(User)
+        event = mommy.make(training_event.models.CampusEvent)
+        assign_perm('training_event.view_enrollment', admin)
+        assign_perm('training_event.change_campusevent', admin, event)
+        enrollment = mommy.make(training_event.models.Enrollment,
+                                campus_event=event,
+                                user=mommy.make(User, username='teacher'))
+        workbook = xlwt.Workbook()
+        workbook.add_sheet('签到').write(0, 0, 'teacher')
+        content = io.BytesIO()
+        workbook.save(content)
+        self.client.force_authenticate(admin)
+        url = reverse('enrollment-mark-attendance')
+
+        response = self.client.post(url, {
+            'campus_event': event.id,
+            'file': SimpleUploadedFile('签到.xls', content.getvalue()),
+        }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data,
+                         [{'username': 'teacher', 'success': True}])
+        enrollment.refresh_from_db()
+        self.assertTrue(enrollment.is_signed)
+
 
 class TestEventCoefficientRoundChoicesViewSet(APITestCase):
     '''Unit tests for EventCoefficientRoundChoicesViewSet'''
@@ -3,8 +3,8 @@ import django_filters
 from django.core.cache import cache
 from rest_framework import mixins, viewsets, views, status, decorators
 from rest_framework.response import Response
-from rest_framework_guardian import filters
 
+import auth.filters
 import auth.permissions
 from training_event.services import EnrollmentService, CampusEventService
 from training_event.models import (
@@ -40,7 +40,7 @@ class CampusEventViewSet(DRFCacheMixin,
     }
     serializer_class = ReadOnlyCampusEventSerializer
     filter_class = training_event.filters.CampusEventFilter
-    filter_backends = (filters.DjangoObjectPermissionsFilter,
+    filter_backends = (auth.filters.ObjectPermissionsFilter,
                        django_filters.rest_framework.DjangoFilterBackend,)
     permission_classes = (
         auth.permissions.DjangoObjectPermissions,
@@ -84,6 +84,8 @@ class EnrollmentViewSet(DRFCacheMixin,
     filter_fields = ('campus_event',)
     perms_map = {
         'event_enrollments': ['training_event.view_enrollment'],
+        'bulk_enroll': ['training_event.view_enrollment'],
+        'mark_attendance': ['training_event.view_enrollment'],
     }
 
     def perform_destroy(self, instance):
@@ -100,6 +102,33 @@ class EnrollmentViewSet(DRFCacheMixin,
         data = EnrollmentReadOnlySerailizer(enrollments, many=True).data
         return Response(data)
 
+    @staticmethod
+    def _get_usernames(request):
+        '''Read usernames from the uploaded sheet or the request body.'''
+        excel = request.FILES.get('file')
+        if excel is not None:
+            return EnrollmentService.read_usernames(excel)
+        return request.data.get('usernames')
+
+    @decorators.action(methods=['POST'], detail=False,
+                       url_path='bulk-enroll')
+    def bulk_enroll(self, request):
+        '''Enroll many users in a campus event, return result of each.'''
+        results = EnrollmentService.bulk_create_enrollments(
+            request.data.get('campus_event'), self._get_usernames(request),
+            request.user)
+        return Response(results, status=status.HTTP_200_OK)
+
+    @decorators.action(methods=['POST'], detail=False,
+                       url_path='mark-attendance')
+    def mark_attendance(self, request):
+        '''Mark enrolled users as signed in, return result of each.'''
+        results = EnrollmentService.mark_attendance(
+            request.data.get('campus_event'), self._get_usernames(request),
+            request.user, is_signed=request.data.get('is_signed') not in (
+                False, 'false', '0'))
+        return Response(results, status=status.HTTP_200_OK)
+
 
 class RoundChoicesView(views.APIView):
     '''Create API view for get round choices of event coefficient.'''
@@ -33,8 +33,11 @@ class ProgramService:
             msg = (f'用户{user}创建了培训机构为'
                    + f'{program.department}的培训项目{program.name}')
             prod_logger.info(msg)
+            # Groups of the department of the program manage it, the same
+            # as auth.utils.OBJECT_PERMISSION_RULES derives.
             PermissionService.assign_object_permissions(
-                context['request'].user, program)
+                context['request'].user, program,
+                department=program.department)
             return program
 
     @staticmethod
@@ -69,8 +72,8 @@ class ProgramService:
     @staticmethod
     def get_grouped_programs_by_department(user):
         '''group all programs by department'''
-        admin_departments = user.groups.filter(
-            name__endswith='-管理员').values_list('name', flat=True)
+        admin_departments = [name for name in user.get_group_names()
+                             if name.endswith('-管理员')]
         if not admin_departments:
             return []
         admin_departments = set(
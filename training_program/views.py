@@ -4,8 +4,8 @@ from django.core.cache import cache
 from rest_framework.decorators import action
 from rest_framework import views, viewsets, status
 from rest_framework.response import Response
-from rest_framework_guardian import filters
 
+import auth.filters
 import auth.permissions
 import training_program.filters
 import training_program.models
@@ -30,7 +30,7 @@ class ProgramViewSet(DRFCacheMixin,
         'update': training_program.serializers.ProgramSerializer,
     }
     serializer_class = training_program.serializers.ReadOnlyProgramSerializer
-    filter_backends = (filters.DjangoObjectPermissionsFilter,
+    filter_backends = (auth.filters.ObjectPermissionsFilter,
                        django_filters.rest_framework.DjangoFilterBackend,)
     permission_classes = (
         auth.permissions.DjangoObjectPermissions,
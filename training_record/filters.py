@@ -1,7 +1,6 @@
 ''' Provide filters used in filtering logic. '''
 import django_filters
 from django_filters import rest_framework as filters
-from django.db.models import Q
 
 from training_record.models import Record, RecordContent, RecordAttachment
 
@@ -20,27 +19,19 @@ class RecordFilter(filters.FilterSet):
 
     def filter_event_name(self, queryset, name, value):
         '''Filter event name'''
-        return queryset.filter(
-            Q(off_campus_event__name__startswith=value) |
-            Q(campus_event__name__startswith=value))
+        return queryset.filter(event_name__startswith=value)
 
     def filter_event_location(self, queryset, name, value):
         '''Filter event location'''
-        return queryset.filter(
-            Q(off_campus_event__location__startswith=value) |
-            Q(campus_event__location__startswith=value))
+        return queryset.filter(event_location__startswith=value)
 
     def filter_start_time(self, queryset, name, value):
         '''Filter event name'''
-        return queryset.filter(
-            Q(off_campus_event__time__gte=value) |
-            Q(campus_event__time__gte=value))
+        return queryset.filter(event_time__gte=value)
 
     def filter_end_time(self, queryset, name, value):
         '''Filter event name'''
-        return queryset.filter(
-            Q(off_campus_event__time__lte=value) |
-            Q(campus_event__time__lte=value))
+        return queryset.filter(event_time__lte=value)
 
     class Meta:
         model = Record
@@ -0,0 +1,74 @@
+# Generated by Django 2.2 on 2026-10-18 21:54
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+EVENT_FIELDS = {
+    'event_name': 'name',
+    'event_location': 'location',
+    'event_time': 'time',
+    'event_hours': 'num_hours',
+}
+
+
+def fill_event_fields(apps, schema_editor):
+    Record = apps.get_model('training_record', 'Record')
+    for event_field, model_name, kind in (
+            ('campus_event', 'CampusEvent', 0),
+            ('off_campus_event', 'OffCampusEvent', 1)):
+        Event = apps.get_model('training_event', model_name)
+        events = Event.objects.filter(pk=OuterRef(f'{event_field}_id'))
+        Record.objects.filter(**{f'{event_field}__isnull': False}).update(
+            event_kind=kind,
+            **{field: Subquery(events.values(source)[:1])
+               for field, source in EVENT_FIELDS.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training_event', '0006_auto_20190613_1439'),
+        ('training_record', '0006_auto_20190709_0919'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='event_hours',
+            field=models.FloatField(editable=False, null=True, verbose_name='培训活动学时'),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='event_kind',
+            field=models.PositiveSmallIntegerField(choices=[(0, '校内培训'), (1, '校外培训')], editable=False, null=True, verbose_name='培训活动类型'),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='event_location',
+            field=models.CharField(default='', editable=False, max_length=64, verbose_name='培训活动地点'),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='event_name',
+            field=models.CharField(default='', editable=False, max_length=64, verbose_name='培训活动名称'),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='event_time',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='培训活动时间'),
+        ),
+        migrations.RunPython(fill_event_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['user', 'event_time'], name='record_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['user', 'event_name'], name='record_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['status', 'event_kind', 'event_time'], name='record_status_kind_time_idx'),
+        ),
+    ]
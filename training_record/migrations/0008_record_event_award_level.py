@@ -0,0 +1,32 @@
+# Generated by Django 2.2 on 2026-10-18 22:01
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_event_award_level(apps, schema_editor):
+    Record = apps.get_model('training_record', 'Record')
+    for event_field, model_name in (('campus_event', 'CampusEvent'),
+                                    ('off_campus_event', 'OffCampusEvent')):
+        Event = apps.get_model('training_event', model_name)
+        events = Event.objects.filter(pk=OuterRef(f'{event_field}_id'))
+        Record.objects.filter(**{f'{event_field}__isnull': False}).update(
+            event_award_level=Subquery(events.values('award_level')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training_event', '0007_event_award_level_and_name_grams'),
+        ('training_record', '0007_record_event_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='event_award_level',
+            field=models.PositiveSmallIntegerField(choices=[(0, '无'), (1, '校级'), (2, '市级'), (3, '省级'), (4, '国家级')], default=0, editable=False, verbose_name='培训活动获奖级别'),
+        ),
+        migrations.RunPython(fill_event_award_level,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+# status: priority, see Record.DEPARTMENT_REVIEW_PRIORITIES and
+# Record.SCHOOL_REVIEW_PRIORITIES.
+REVIEW_PRIORITIES = {
+    'department_review_priority': {1: 3, 6: 2, 2: 1},
+    'school_review_priority': {2: 3, 7: 2, 3: 1},
+}
+
+
+def fill_review_priorities(apps, schema_editor):
+    Record = apps.get_model('training_record', 'Record')
+    records = Record.objects.filter(campus_event__isnull=True)
+    for field, priorities in REVIEW_PRIORITIES.items():
+        for status, priority in priorities.items():
+            records.filter(status=status).update(**{field: priority})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('training_record', '0008_record_event_award_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='record',
+            name='department_review_priority',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='院系审核优先级'),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='school_review_priority',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='学校审核优先级'),
+        ),
+        migrations.RunPython(fill_review_priorities,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['department_review_priority', 'create_time'], name='record_department_review_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['school_review_priority', 'create_time'], name='record_school_review_idx'),
+        ),
+    ]
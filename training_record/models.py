@@ -1,8 +1,10 @@
 '''Define ORM models for training_record module.'''
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import Signal
 
+from infra.utils import bump_model_version
 from training_event.models import CampusEvent, OffCampusEvent, EventCoefficient
 from training_record.utils import infer_attachment_type
 
@@ -43,11 +45,51 @@ class Record(models.Model):
         (STATUS_SCHOOL_ADMIN_REJECTED, '学校管理员审核不通过'),
         (STATUS_CLOSED, '状态关闭')
     )
+    EVENT_KIND_CAMPUS = 0
+    EVENT_KIND_OFF_CAMPUS = 1
+    EVENT_KIND_CHOICES = (
+        (EVENT_KIND_CAMPUS, '校内培训'),
+        (EVENT_KIND_OFF_CAMPUS, '校外培训'),
+    )
+    # Priorities of off-campus records in review queues of admins, higher
+    # ones are reviewed first. Records not in a queue have no priority.
+    DEPARTMENT_REVIEW_PRIORITIES = {
+        STATUS_SUBMITTED: 3,
+        STATUS_DEPARTMENT_ADMIN_REJECTED: 2,
+        STATUS_DEPARTMENT_ADMIN_APPROVED: 1,
+    }
+    SCHOOL_REVIEW_PRIORITIES = {
+        STATUS_DEPARTMENT_ADMIN_APPROVED: 3,
+        STATUS_SCHOOL_ADMIN_REJECTED: 2,
+        STATUS_SCHOOL_ADMIN_APPROVED: 1,
+    }
+    # Fields copied from the event, so records can be filtered by them
+    # without joining both event tables.
+    EVENT_FIELDS = {
+        'event_name': 'name',
+        'event_location': 'location',
+        'event_time': 'time',
+        'event_hours': 'num_hours',
+        'event_award_level': 'award_level',
+    }
 
     class Meta:
         verbose_name = '培训记录'
         verbose_name_plural = '培训记录'
         unique_together = (('user', 'campus_event'),)
+        indexes = (
+            models.Index(fields=('user', 'event_time'),
+                         name='record_user_time_idx'),
+            models.Index(fields=('user', 'event_name'),
+                         name='record_user_name_idx'),
+            models.Index(fields=('status', 'event_kind', 'event_time'),
+                         name='record_status_kind_time_idx'),
+            models.Index(fields=('department_review_priority',
+                                 'create_time'),
+                         name='record_department_review_idx'),
+            models.Index(fields=('school_review_priority', 'create_time'),
+                         name='record_school_review_idx'),
+        )
         default_permissions = ()
         permissions = (
             ('add_record', '允许添加培训记录'),
@@ -78,6 +120,26 @@ class Record(models.Model):
                                           verbose_name='培训活动系数',
                                           related_name='records',
                                           on_delete=models.CASCADE)
+    event_kind = models.PositiveSmallIntegerField(
+        verbose_name='培训活动类型', choices=EVENT_KIND_CHOICES, null=True,
+        editable=False)
+    event_name = models.CharField(verbose_name='培训活动名称', max_length=64,
+                                  default='', editable=False)
+    event_location = models.CharField(verbose_name='培训活动地点',
+                                      max_length=64, default='',
+                                      editable=False)
+    event_time = models.DateTimeField(verbose_name='培训活动时间', null=True,
+                                      editable=False)
+    event_hours = models.FloatField(verbose_name='培训活动学时', null=True,
+                                    editable=False)
+    event_award_level = models.PositiveSmallIntegerField(
+        verbose_name='培训活动获奖级别',
+        choices=CampusEvent.AWARD_LEVEL_CHOICES,
+        default=CampusEvent.AWARD_LEVEL_NONE, editable=False)
+    department_review_priority = models.PositiveSmallIntegerField(
+        verbose_name='院系审核优先级', null=True, editable=False)
+    school_review_priority = models.PositiveSmallIntegerField(
+        verbose_name='学校审核优先级', null=True, editable=False)
     objects = models.Manager()
     valid_objects = ValidRecordManager()
 
@@ -85,6 +147,54 @@ class Record(models.Model):
         return '{}({})'.format(
             self.user_id, self.campus_event_id or self.off_campus_event_id)
 
+    def copy_event_fields(self):
+        '''Copy fields of the event into event_* fields.'''
+        if self.campus_event_id is not None:
+            event, self.event_kind = self.campus_event, self.EVENT_KIND_CAMPUS
+        elif self.off_campus_event_id is not None:
+            event = self.off_campus_event
+            self.event_kind = self.EVENT_KIND_OFF_CAMPUS
+        else:
+            return
+        for field, event_field in self.EVENT_FIELDS.items():
+            setattr(self, field, getattr(event, event_field))
+
+    def update_review_priorities(self):
+        '''Set priorities in review queues by the status.'''
+        if self.campus_event_id is not None:
+            self.department_review_priority = None
+            self.school_review_priority = None
+            return
+        self.department_review_priority = (
+            self.DEPARTMENT_REVIEW_PRIORITIES.get(self.status))
+        self.school_review_priority = (
+            self.SCHOOL_REVIEW_PRIORITIES.get(self.status))
+
+    # pylint:disable=unused-argument
+    @classmethod
+    def sync_event_fields(cls, sender, instance, **kwargs):
+        '''Copy fields of the event before saving the record.'''
+        instance.copy_event_fields()
+
+    # pylint:disable=unused-argument
+    @classmethod
+    def sync_review_priorities(cls, sender, instance, **kwargs):
+        '''Update priorities in review queues before saving the record.'''
+        instance.update_review_priorities()
+
+    # pylint:disable=unused-argument
+    @classmethod
+    def update_event_fields(cls, sender, instance, created, **kwargs):
+        '''Copy fields of the saved event into records of the event.'''
+        if created:
+            return
+        lookup = ('campus_event' if isinstance(instance, CampusEvent)
+                  else 'off_campus_event')
+        cls.objects.filter(**{lookup: instance}).update(**{
+            field: getattr(instance, event_field)
+            for field, event_field in cls.EVENT_FIELDS.items()
+        })
+
     @classmethod
     def check_event_set(cls, sender, instance, **kwargs):
         '''Check campus_event or off_campus_event has been set.'''
@@ -95,6 +205,18 @@ class Record(models.Model):
 
 # Connect to pre_save signal, so the check will happen before saving to db.
 pre_save.connect(Record.check_event_set, sender=Record)
+pre_save.connect(Record.sync_event_fields, sender=Record)
+pre_save.connect(Record.sync_review_priorities, sender=Record)
+for _sender in (CampusEvent, OffCampusEvent):
+    post_save.connect(Record.update_event_fields, sender=_sender)
+
+# Records created by bulk_create() or updated by bulk_update() don't send
+# post_save signals, so these signals are sent instead with the records.
+# pylint: disable=invalid-name
+records_bulk_created = Signal(providing_args=['records'])
+records_bulk_updated = Signal(providing_args=['records'])
+for _signal in (records_bulk_created, records_bulk_updated):
+    _signal.connect(bump_model_version, sender=Record)
 
 
 class RecordContent(models.Model):
@@ -1,12 +1,15 @@
 '''Define how to serialize our models.'''
 import os.path as osp
 
+from django.db import models
 from rest_framework import serializers
 from rest_framework_bulk import (
     BulkListSerializer,
     BulkSerializerMixin,
 )
 
+from auth.backends import get_object_permission_checker
+from auth.serializers import ObjectPermissionListSerializer
 from infra.utils import format_file_size
 from infra.mixins import HumanReadableValidationErrorMixin
 from training_record.models import (
@@ -24,7 +27,8 @@ from training_record.services import RecordService, CampusEventFeedbackService
 from secure_file.fields import SecureFileField
 from training_event.models import EventCoefficient
 from training_event.serializers import (
-    BasicReadOnlyCampusEventSerializer, OffCampusEventSerializer
+    BasicReadOnlyCampusEventSerializer, OffCampusEventSerializer,
+    load_enrollment_ids
 )
 
 
@@ -69,6 +73,18 @@ class CampusEventFeedbackSerializer(HumanReadableValidationErrorMixin,
         return data
 
 
+class ReadOnlyRecordListSerializer(ObjectPermissionListSerializer):
+    '''Also look up enrollments of the request user in campus events of
+    listed records in one query.'''
+    # pylint: disable=abstract-method
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        iterable = list(iterable)
+        load_enrollment_ids(self.context,
+                            [record.campus_event for record in iterable])
+        return super().to_representation(iterable)
+
+
 class ReadOnlyRecordSerializer(HumanReadableValidationErrorMixin,
                                serializers.ModelSerializer):
     '''Indicate how to serialize Record instance for reading.'''
@@ -94,14 +110,25 @@ class ReadOnlyRecordSerializer(HumanReadableValidationErrorMixin,
                   'off_campus_event', 'user', 'status', 'contents',
                   'attachments', 'status_str', 'feedback', 'role', 'role_str',
                   'allow_actions_from_user', 'allow_actions_from_admin')
+        list_serializer_class = ReadOnlyRecordListSerializer
 
     def get_allow_actions_from_user(self, obj):
         '''Get status of whether ordinary user can edit record or not.'''
-        return is_user_allowed_operating(self.context['request'].user, obj)
+        request = self.context['request']
+        return (
+            is_user_allowed_operating(request.user, obj)
+            and get_object_permission_checker(request).has_perm(
+                'training_record.change_record', obj)
+        )
 
     def get_allow_actions_from_admin(self, obj):
         '''Get status of whether department admin can review or not.'''
-        return is_admin_allowed_operating(self.context['request'].user, obj)
+        request = self.context['request']
+        return (
+            is_admin_allowed_operating(request.user, obj)
+            and get_object_permission_checker(request).has_perm(
+                'training_record.review_record', obj)
+        )
 
     def get_user(self, obj):
         '''Serialize necessary information about user.'''
@@ -1,23 +1,23 @@
 '''Provide services of training record module.'''
-import tempfile
-import smtplib
-import xlrd
+import itertools
 
 from django.db import transaction, IntegrityError
 from django.contrib.auth import get_user_model
 from django.utils.timezone import now, localtime
-from django.core.mail import send_mass_mail
 
+from auth.backends import ObjectPermissionChecker
 from auth.services import PermissionService
-from infra.utils import prod_logger
+from drf_cache.utils import invalidate_all_caches
+from infra.utils import bulk_create_with_pks, bump_model_version, prod_logger
 from infra.services import (
     NotificationService,
-    SOAPMSGService,
-    SOAPSMSService)
+    OutboxService)
 from infra.exceptions import BadRequest
+from infra.excel import iter_excel_rows, get_cell_value
 from training_record.models import (
     Record, RecordContent, RecordAttachment,
-    CampusEventFeedback, StatusChangeLog
+    CampusEventFeedback, StatusChangeLog, records_bulk_created,
+    records_bulk_updated
 )
 from training_record.utils import is_admin_allowed_operating
 from training_event.models import OffCampusEvent, CampusEvent, EventCoefficient
@@ -29,6 +29,26 @@ User = get_user_model()
 
 class RecordService:
     '''Provide services for Record.'''
+    # action: (required permission, post status, reviewer or None if the
+    # action isn't a review)
+    BATCH_ACTIONS = {
+        'department_admin_approve': (
+            'training_record.review_record',
+            Record.STATUS_DEPARTMENT_ADMIN_APPROVED, '院系管理员'),
+        'department_admin_reject': (
+            'training_record.review_record',
+            Record.STATUS_DEPARTMENT_ADMIN_REJECTED, '院系管理员'),
+        'school_admin_approve': (
+            'training_record.review_record',
+            Record.STATUS_SCHOOL_ADMIN_APPROVED, '学校管理员'),
+        'school_admin_reject': (
+            'training_record.review_record',
+            Record.STATUS_SCHOOL_ADMIN_REJECTED, '学校管理员'),
+        'close': (
+            'training_record.change_record', Record.STATUS_CLOSED, None),
+    }
+    BATCH_MAX_RECORDS = 500
+
     @staticmethod
     def create_off_campus_record_from_raw_data(data):
         '''Create a training record of off-campus training event.
@@ -74,23 +94,21 @@ class RecordService:
                 user=user,
                 event_coefficient=event_coefficient,
             )
-            PermissionService.assign_object_permissions(user, record)
+            instances = [record]
 
             for content in contents:
-                record_content = RecordContent.objects.create(
+                instances.append(RecordContent.objects.create(
                     record=record,
                     **content
-                )
-                PermissionService.assign_object_permissions(
-                    user, record_content)
+                ))
 
             for attachment in attachments:
-                record_attachment = RecordAttachment.objects.create(
+                instances.append(RecordAttachment.objects.create(
                     record=record,
                     path=attachment,
-                )
-                PermissionService.assign_object_permissions(
-                    user, record_attachment)
+                ))
+            PermissionService.bulk_assign_object_permissions(
+                (user, instance) for instance in instances)
             msg = (f'用户{user}创建了其参加'
                    + f'{off_campus_event.name}'
                    + f'({off_campus_event.id})活动的培训记录')
@@ -160,13 +178,12 @@ class RecordService:
             record.event_coefficient.save()
 
             # add attachments
+            instances = []
             for attachment in attachments:
-                record_attachment = RecordAttachment.objects.create(
+                instances.append(RecordAttachment.objects.create(
                     record=record,
                     path=attachment,
-                )
-                PermissionService.assign_object_permissions(
-                    user, record_attachment)
+                ))
 
             if RecordAttachment.objects.filter(record=record).count() > 3:
                 raise BadRequest('最多允许上传3个附件')
@@ -175,12 +192,12 @@ class RecordService:
             # they have been changed or not.
             record.contents.all().delete()
             for content in contents:
-                record_content = RecordContent.objects.create(
+                instances.append(RecordContent.objects.create(
                     record=record,
                     **content
-                )
-                PermissionService.assign_object_permissions(
-                    user, record_content)
+                ))
+            PermissionService.bulk_assign_object_permissions(
+                (user, instance) for instance in instances)
             # reset status
             pre_status = record.status
             record.status = Record.STATUS_SUBMITTED
@@ -200,18 +217,19 @@ class RecordService:
             prod_logger.info(msg)
         return record
 
-    # pylint: disable=too-many-locals
-    # pylint: disable=too-many-branches
-    # pylint: disable=too-many-statements
-    @staticmethod
-    def create_campus_records_from_excel(file, context):
+    @classmethod
+    def create_campus_records_from_excel(cls, file, context):
         '''Create training records of campus training event.
 
+        All rows are validated before any record is created, records and
+        related objects are then created in bulk, messages are delivered
+        later by celery workers.
+
         Parameters
         ----------
-        file: InMemoryFile
-            This file should have full information needed to create a
-            Record of campus-event.
+        file: bytes or UploadedFile
+            This .xls or .xlsx file should have full information needed to
+            create a Record of campus-event.
             The first line should be the id of each campus-event.
             For each campus-event, the id of its participant should be
             below its id.
@@ -220,142 +238,209 @@ class RecordService:
         -------
         count of records
         '''
-
-        records = set()
-        users = set()
-        mails = []  # mail: 邮件内容
-        smses = []  # sms: 短信内容
-        msges = []  # msg_info: 门户消息
-        base_url = 'http://ctfdpeixun.dlut.edu.cn/tiny/'
-
         try:
-            # get information
-            tup = tempfile.mkstemp()
-            with open(tup[0], 'wb') as work_book:
-                work_book.write(file)
-            # open excel and get the first sheet
-            sheet = xlrd.open_workbook(tup[1]).sheet_by_index(0)
-
             with transaction.atomic():
-                # get event from sheet
-                event_id = int(sheet.cell(0, 1).value)
-                try:
-                    campus_event = CampusEvent.objects.get(pk=event_id)
-                except Exception:
-                    raise BadRequest('编号为{}的活动不存在'.format(event_id))
-
-                if not campus_event.reviewed:
-                    raise BadRequest('培训活动还未经学校管理员审核')
-
-                admin = context['user']
-                if not admin.has_perm(
-                        'training_event.change_campusevent', campus_event):
-                    raise BadRequest('您没有为对应培训活动创建培训记录的权限')
-
-                # get coefficient from sheet
-                coefficients = {
-                    x.get_role_display(): x
-                    for x in EventCoefficient.objects.filter(
-                        campus_event_id=event_id)
-                }
-
-                # process the info of users
-                for index in range(3, sheet.nrows):
-                    isSigned = sheet.cell(index, 8).value
-                    if not isSigned:
-                        continue
-                    val = sheet.cell(index, 2).value
-                    if isinstance(val, str):
-                        username = val
-                    else:
-                        username = f'{int(val)}'
-
-                    try:
-                        user = User.objects.get(username=username)
-                    except Exception:
-                        raise BadRequest('第{}行，用户名为{}的用户不存在'.format(
-                            index + 1, username))
-
-                    if user in users:
-                        raise BadRequest('第{}行，用户名为{}的用户重复'.format(
-                            index + 1, username))
-                    users.add(user)
-
-                    role_str = sheet.cell(index, 7).value
-                    event_coefficient = coefficients.get(role_str, None)
-                    if event_coefficient is None:
-                        raise BadRequest('第{}行，不存在的参与形式'.format(
-                            index + 1))
-                    try:
-                        record = Record.objects.create(
-                            campus_event=campus_event, user=user,
-                            status=Record.STATUS_FEEDBACK_REQUIRED,
-                            event_coefficient=event_coefficient)
-                    except IntegrityError:
-                        raise BadRequest('第{}行，已经存在用户名为{}的用户参加该活动的培训记录'.format(
-                            index + 1, username))
-
-                    PermissionService.assign_object_permissions(user, record)
-                    records.add(record)
-
-                    msg = (f'管理员{admin}创建了用户{user}参加'
-                           + f'{campus_event.name}({campus_event.id})活动的培训记录')
-                    prod_logger.info(msg)
-
-                    msg = '您有一条新的校内培训记录'
-                    NotificationService.send_system_notification(user, msg)
-
-                    tiny_url = TinyURLService.generate_tiny_url(
-                        'records/{}'.format(record.id))
-                    url = base_url + tiny_url.short_url
-                    msg = ('老师，您好！您参加{}活动的培训记录已录入教学培训管理系统，'
-                           '提醒您及时登录系统填写培训反馈。'
-                           '谢谢！'
-                           '网页链接: {}').format(campus_event.name, url)
-                    mail = (
-                        '培训记录已录入',
-                        msg,
-                        'TMSFTT',
-                        [user.email],
-                    )
-                    mails.append(mail)
-                    sms = {
-                        'user_phone_number': user.cell_phone_number,
-                        'sms_info': msg,
-                    }
-                    smses.append(sms)
-                    msg_info = {
-                        'user_username': user.username,
-                        'msg_title': '培训活动提醒',
-                        'msg_info': msg,
-                    }
-                    msges.append(msg_info)
+                campus_event, records, errors = (
+                    cls._parse_campus_records_excel(file, context))
+                if errors:
+                    raise BadRequest('\n'.join(x['message'] for x in errors))
+                records = cls._bulk_create_campus_records(
+                    campus_event, records, context['user'])
 
         except Exception as exc:
             if isinstance(exc, (BadRequest, IntegrityError)):
                 raise
             raise BadRequest('无效的表格')
 
-        try:
-            send_mass_mail(mails, fail_silently=False)
-        except smtplib.SMTPException as exc:
-            msg = (
-                '系统在提醒教师参加活动时发生错误，'
-                f'部分邮件可能未成功发送，错误信息为：{exc}'
-            )
-            prod_logger.error(msg)
+        return len(records)
+
+    @classmethod
+    def validate_campus_records_excel(cls, file, context):
+        '''Validate training records of campus training event (dry-run).
+
+        The file is checked the same way as create_campus_records_from_excel()
+        but nothing is written.
 
+        Returns
+        -------
+        report: dict
+            {
+                'campus_event': int, the id of the campus event,
+                'num_records': int, the number of valid rows,
+                'errors': list of {'row': int, 'message': str},
+            }
+        '''
         try:
-            SOAPSMSService.send_sms(smses)
-            SOAPMSGService.send_msg(msges)
+            campus_event, records, errors = cls._parse_campus_records_excel(
+                file, context)
         except Exception as exc:
-            msg = (
-                '系统在提醒教师参加活动时发生错误，'
-                f'部分信息可能未成功发送，错误信息为：{exc}'
-            )
-            prod_logger.error(msg)
+            if isinstance(exc, BadRequest):
+                raise
+            raise BadRequest('无效的表格')
+        return {
+            'campus_event': campus_event.id,
+            'num_records': len(records),
+            'errors': errors,
+        }
 
-        return len(records)
+    @classmethod
+    def _parse_campus_records_excel(cls, file, context):
+        '''Read the file in one pass and validate all rows.
+
+        Returns
+        -------
+        campus_event: CampusEvent
+        records: list of unsaved Record
+        errors: list of dict
+            {'row': row number, 'message': error message}
+        '''
+        rows = iter_excel_rows(file)
+        # get event from sheet
+        event_id = int(get_cell_value(next(rows, []), 1))
+        try:
+            campus_event = CampusEvent.objects.get(pk=event_id)
+        except Exception:
+            raise BadRequest('编号为{}的活动不存在'.format(event_id))
+
+        if not campus_event.reviewed:
+            raise BadRequest('培训活动还未经学校管理员审核')
+
+        admin = context['user']
+        if not admin.has_perm(
+                'training_event.change_campusevent', campus_event):
+            raise BadRequest('您没有为对应培训活动创建培训记录的权限')
+
+        # get coefficient from sheet
+        coefficients = {
+            x.get_role_display(): x
+            for x in EventCoefficient.objects.filter(
+                campus_event_id=event_id)
+        }
+
+        # Participants start from the 4th row.
+        rows = cls._read_campus_record_rows(itertools.islice(rows, 2, None))
+        records, errors = cls._build_campus_records(
+            campus_event, coefficients, rows)
+        return campus_event, records, errors
+
+    @staticmethod
+    def _read_campus_record_rows(rows):
+        '''Read (row number, username, role) of signed participants.'''
+        signed_rows = []
+        for row_number, row in enumerate(rows, 4):
+            is_signed = get_cell_value(row, 8)
+            if not is_signed:
+                continue
+            val = get_cell_value(row, 2)
+            if isinstance(val, str):
+                username = val
+            else:
+                username = f'{int(val)}'
+            signed_rows.append((row_number, username, get_cell_value(row, 7)))
+        return signed_rows
+
+    @staticmethod
+    def _build_campus_records(campus_event, coefficients, rows):
+        '''Validate all rows and build unsaved records.
+
+        Users and existing records are fetched in one query each, errors of
+        all rows are reported together.
+        '''
+        users = {
+            user.username: user for user in User.objects.filter(
+                username__in={username for _, username, _ in rows})
+        }
+        existing_usernames = set(
+            Record.objects
+            .filter(campus_event=campus_event, user__in=users.values())
+            .values_list('user__username', flat=True)
+        )
+        errors = []
+        records = []
+        usernames = set()
+        for row_number, username, role_str in rows:
+            user = users.get(username)
+            if user is None:
+                msg = '第{}行，用户名为{}的用户不存在'.format(row_number, username)
+            elif username in usernames:
+                msg = '第{}行，用户名为{}的用户重复'.format(row_number, username)
+            elif coefficients.get(role_str, None) is None:
+                msg = '第{}行，不存在的参与形式'.format(row_number)
+            elif username in existing_usernames:
+                msg = '第{}行，已经存在用户名为{}的用户参加该活动的培训记录'.format(
+                    row_number, username)
+            else:
+                msg = None
+            if user is not None:
+                usernames.add(username)
+            if msg is not None:
+                errors.append({'row': row_number, 'message': msg})
+                continue
+            record = Record(
+                campus_event=campus_event, user=user,
+                status=Record.STATUS_FEEDBACK_REQUIRED,
+                event_coefficient=coefficients[role_str])
+            # bulk_create() doesn't send pre_save signals.
+            record.copy_event_fields()
+            records.append(record)
+        return records, errors
+
+    @staticmethod
+    def _bulk_create_campus_records(campus_event, records, admin):
+        '''Create records, permissions, notifications and messages.'''
+        base_url = 'http://ctfdpeixun.dlut.edu.cn/tiny/'
+        records = bulk_create_with_pks(Record.objects, records,
+                                       ('campus_event_id', 'user_id'))
+        records_bulk_created.send(sender=Record, records=records)
+        transaction.on_commit(invalidate_all_caches)
+
+        PermissionService.bulk_assign_object_permissions(
+            (record.user, record) for record in records)
+        NotificationService.send_system_notifications(
+            [record.user for record in records], '您有一条新的校内培训记录')
+        tiny_urls = TinyURLService.generate_tiny_urls(
+            ['records/{}'.format(record.id) for record in records])
+
+        mails = []  # mail: 邮件内容
+        smses = []  # sms: 短信内容
+        msges = []  # msg_info: 门户消息
+        for record in records:
+            user = record.user
+            msg = (f'管理员{admin}创建了用户{user}参加'
+                   + f'{campus_event.name}({campus_event.id})活动的培训记录')
+            prod_logger.info(msg)
+
+            tiny_url = tiny_urls['records/{}'.format(record.id)]
+            url = base_url + tiny_url.short_url
+            msg = ('老师，您好！您参加{}活动的培训记录已录入教学培训管理系统，'
+                   '提醒您及时登录系统填写培训反馈。'
+                   '谢谢！'
+                   '网页链接: {}').format(campus_event.name, url)
+            mail = (
+                '培训记录已录入',
+                msg,
+                'TMSFTT',
+                [user.email],
+            )
+            mails.append(mail)
+            sms = {
+                'user_phone_number': user.cell_phone_number,
+                'sms_info': msg,
+            }
+            smses.append(sms)
+            msg_info = {
+                'user_username': user.username,
+                'msg_title': '培训活动提醒',
+                'msg_info': msg,
+            }
+            msges.append(msg_info)
+
+        # Messages are delivered by celery workers once the records
+        # are committed.
+        OutboxService.enqueue_mails(mails)
+        OutboxService.enqueue_smses(smses)
+        OutboxService.enqueue_msges(msges)
+        return records
 
     @staticmethod
     def department_admin_review(record_id, is_approved, user):
@@ -497,6 +582,112 @@ class RecordService:
             NotificationService.send_system_notification(record.user, msg)
         return record
 
+    @classmethod
+    def batch_change_records_status(cls, record_ids, action, user):
+        '''Apply the same review or close action to many records.
+
+        This is the bulk counterpart of department_admin_review(),
+        school_admin_review() and close_record(). Records are locked by one
+        query, permissions are checked on prefetched object permissions,
+        and records and status change logs are written in bulk. Records
+        which can't be changed are skipped and reported, others are
+        changed in one transaction. Owners of changed records are notified
+        in bulk.
+
+        Parameters
+        ----------
+        record_ids: list of number
+            Which records' status should be changed.
+        action: str
+            One of the keys of BATCH_ACTIONS.
+        user: User
+            Who reviewed or closed the records.
+
+        Returns
+        -------
+        results: list of dict
+            Result for each id in record_ids, e.g.
+            {'id': 1, 'success': True, 'status': 2} or
+            {'id': 2, 'success': False, 'message': '无此培训记录'}
+        '''
+        if action not in cls.BATCH_ACTIONS:
+            raise BadRequest('无效的操作')
+        perm, post_status, reviewer = cls.BATCH_ACTIONS[action]
+        is_review = reviewer is not None
+        if (not isinstance(record_ids, list) or not record_ids
+                or not all(isinstance(record_id, int)
+                           for record_id in record_ids)):
+            raise BadRequest('请提供培训记录ID列表')
+        if len(record_ids) > cls.BATCH_MAX_RECORDS:
+            raise BadRequest(
+                f'一次最多处理{cls.BATCH_MAX_RECORDS}条培训记录')
+        if not user.has_perm(perm):
+            raise BadRequest('无权更改')
+
+        errors = {}
+        with transaction.atomic():
+            # Related objects are prefetched by separate queries, so only
+            # rows of records are locked.
+            records = list(
+                Record.objects
+                .select_for_update()
+                .filter(pk__in=set(record_ids))
+                .prefetch_related('user', 'campus_event', 'off_campus_event')
+                .order_by('id')
+            )
+            checker = ObjectPermissionChecker(user)
+            checker.prefetch_perms(records)
+            changed = []
+            for record in records:
+                if is_review and record.campus_event_id is not None:
+                    errors[record.id] = '无此培训记录'
+                elif not checker.has_perm(perm, record) or (
+                        is_review
+                        and not is_admin_allowed_operating(user, record)):
+                    errors[record.id] = '无权更改'
+                else:
+                    changed.append(record)
+
+            time = now()
+            logs = []
+            for record in changed:
+                logs.append(StatusChangeLog(
+                    record=record, pre_status=record.status,
+                    post_status=post_status, time=time, user=user))
+                record.status = post_status
+                record.update_time = time
+                record.update_review_priorities()
+            if changed:
+                Record.objects.bulk_update(
+                    changed, ['status', 'update_time',
+                              'department_review_priority',
+                              'school_review_priority'], batch_size=500)
+                StatusChangeLog.objects.bulk_create(logs, batch_size=500)
+                records_bulk_updated.send(sender=Record, records=changed)
+                bump_model_version(StatusChangeLog)
+                transaction.on_commit(invalidate_all_caches)
+
+                status_display = changed[0].get_status_display()
+                if is_review:
+                    msg = (f'您有一条培训记录已被{reviewer}审核，'
+                           f'当前状态：{status_display}')
+                else:
+                    msg = '您有一条培训记录已被关闭，该记录将无法再进行后续流程。'
+                NotificationService.send_system_notifications(
+                    [record.user for record in changed], msg)
+                msg = (f'用户 {user} 将{len(changed)}条培训记录的状态'
+                       f'批量更改为 {status_display}')
+                prod_logger.info(msg)
+
+        found = {record.id for record in records}
+        return [
+            {'id': record_id, 'success': True, 'status': post_status}
+            if record_id in found and record_id not in errors else
+            {'id': record_id, 'success': False,
+             'message': errors.get(record_id, '无此培训记录')}
+            for record_id in record_ids
+        ]
+
     @staticmethod
     def get_number_of_records_without_feedback(user):
         '''Get the number of records which requiring feedback'''
@@ -3,7 +3,9 @@ from unittest.mock import Mock
 
 from django.test import TestCase
 from django.utils.timezone import now
+from model_mommy import mommy
 
+from training_event.models import CampusEvent, OffCampusEvent
 from training_record.models import (
     Record, RecordContent, RecordAttachment,
     StatusChangeLog, CampusEventFeedback,
@@ -61,6 +63,76 @@ class TestRecord(TestCase):
                 self.assertIsNone(Record.check_event_set(None, instance))
 
 
+class TestRecordEventFields(TestCase):
+    '''Unit tests for event fields copied into Record.'''
+    def assert_event_fields(self, record, event, kind):
+        '''Check event fields of the record in database.'''
+        record = Record.objects.get(pk=record.pk)
+        self.assertEqual(
+            (record.event_kind, record.event_name, record.event_location,
+             record.event_time, record.event_hours),
+            (kind, event.name, event.location, event.time, event.num_hours))
+
+    def test_copy_on_save(self):
+        '''Should copy fields of the event when records are saved.'''
+        campus_event = mommy.make(CampusEvent)
+        off_campus_event = mommy.make(OffCampusEvent)
+
+        campus_record = mommy.make(Record, campus_event=campus_event)
+        off_campus_record = mommy.make(Record,
+                                       off_campus_event=off_campus_event)
+
+        self.assert_event_fields(campus_record, campus_event,
+                                 Record.EVENT_KIND_CAMPUS)
+        self.assert_event_fields(off_campus_record, off_campus_event,
+                                 Record.EVENT_KIND_OFF_CAMPUS)
+
+    def test_update_on_event_save(self):
+        '''Should update records when their event is changed.'''
+        campus_event = mommy.make(CampusEvent, name='旧名称')
+        records = mommy.make(Record, campus_event=campus_event, _quantity=2)
+        off_campus_event = mommy.make(OffCampusEvent)
+        off_campus_record = mommy.make(Record,
+                                       off_campus_event=off_campus_event)
+
+        campus_event.name = '新名称'
+        campus_event.num_hours = 12.5
+        campus_event.save()
+        off_campus_event.location = '新地点'
+        off_campus_event.save()
+
+        for record in records:
+            self.assert_event_fields(record, campus_event,
+                                     Record.EVENT_KIND_CAMPUS)
+        self.assert_event_fields(off_campus_record, off_campus_event,
+                                 Record.EVENT_KIND_OFF_CAMPUS)
+
+
+class TestRecordReviewPriorities(TestCase):
+    '''Unit tests for priorities of records in review queues.'''
+    def test_update_on_save(self):
+        '''Should update priorities when the status changes.'''
+        record = mommy.make(Record, off_campus_event=mommy.make(
+            OffCampusEvent), status=Record.STATUS_SUBMITTED)
+        campus_record = mommy.make(Record, campus_event=mommy.make(
+            CampusEvent), status=Record.STATUS_SUBMITTED)
+
+        for status, priorities in (
+                (Record.STATUS_SUBMITTED, (3, None)),
+                (Record.STATUS_DEPARTMENT_ADMIN_APPROVED, (1, 3)),
+                (Record.STATUS_SCHOOL_ADMIN_REJECTED, (None, 2)),
+                (Record.STATUS_CLOSED, (None, None))):
+            record.status = status
+            record.save()
+            record.refresh_from_db()
+            self.assertEqual((record.department_review_priority,
+                              record.school_review_priority), priorities)
+        self.assertEqual(Record.objects.filter(
+            pk=campus_record.pk,
+            department_review_priority__isnull=True,
+            school_review_priority__isnull=True).count(), 1)
+
+
 class TestRecordContent(TestCase):
     '''Unit tests for model RecordContent.'''
     def test_str(self):
@@ -4,16 +4,26 @@ import tempfile
 from unittest.mock import Mock, patch
 import xlwt
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import (
+    InMemoryUploadedFile, SimpleUploadedFile)
 from model_mommy import mommy
 
 from auth.utils import assign_perm
+from drf_cache.utils import invalidate_all_caches
 from infra.exceptions import BadRequest
+from infra.models import Notification, OutboxMessage
+from infra.tests.tests_excel import (
+    make_xlsx, number_cell, inline_string_cell)
+from tiny_url.models import TinyURL
 from training_record.models import (
-    RecordContent, RecordAttachment, CampusEventFeedback, Record)
+    RecordContent, RecordAttachment, CampusEventFeedback, Record,
+    StatusChangeLog, records_bulk_created, records_bulk_updated)
 from training_record.services import RecordService, CampusEventFeedbackService
 from training_event.models import CampusEvent, OffCampusEvent, EventCoefficient
 
@@ -288,7 +298,7 @@ class TestRecordService(TestCase):
             RecordService.create_campus_records_from_excel(excel, context)
 
     @patch('training_record.services.NotificationService'
-           '.send_system_notification')
+           '.send_system_notifications')
     @patch('infra.services.SOAPSMSService.send_sms')
     @patch('infra.services.SOAPMSGService.send_msg')
     def test_create_campus_records(self,
@@ -318,9 +328,176 @@ class TestRecordService(TestCase):
             excel = work_book.read()
 
         count = RecordService.create_campus_records_from_excel(excel, context)
-        mocked_send_msg.assert_called()
-        mocked_send_sms.assert_called()
+        mocked_send_msg.assert_not_called()
+        mocked_send_sms.assert_not_called()
+        self.assertEqual(count, 1)
+        for channel, _ in OutboxMessage.CHANNEL_CHOICES:
+            self.assertEqual(
+                OutboxMessage.objects.filter(channel=channel).count(), 1)
+
+    def make_campus_records_excel(self, rows):
+        '''Build excel of (username, role) rows for the campus event.'''
+        tup = tempfile.mkstemp()
+        work_book = xlwt.Workbook()
+        sheet = work_book.add_sheet(u'sheet1', cell_overwrite_ok=True)
+        sheet.write(0, 1, self.campus_event.id)
+        for index, (username, role) in enumerate(rows, 3):
+            sheet.write(index, 2, username)
+            sheet.write(index, 7, role)
+            sheet.write(index, 8, '6')
+        work_book.save(tup[1])
+        with open(tup[0], 'rb') as work_book:
+            return work_book.read()
+
+    def make_campus_records_context(self):
+        '''Create admin and coefficients of the campus event.'''
+        User.objects.get_or_create(username='notification-robot')
+        admin = mommy.make(User)
+        assign_perm('training_event.change_campusevent',
+                    admin, self.campus_event)
+        mommy.make(EventCoefficient,
+                   campus_event=self.campus_event,
+                   role=EventCoefficient.ROLE_PARTICIPATOR)
+        mommy.make(EventCoefficient,
+                   campus_event=self.campus_event,
+                   role=EventCoefficient.ROLE_EXPERT)
+        return {'user': admin}
+
+    def test_create_campus_records_report_all_errors(self):
+        '''Should report errors of all rows and create nothing.'''
+        context = self.make_campus_records_context()
+        users = mommy.make(User, _quantity=2)
+        mommy.make(Record, campus_event=self.campus_event, user=users[1],
+                   event_coefficient=self.event_coefficient)
+        excel = self.make_campus_records_excel([
+            (users[0].username, '参与'),
+            ('not-exist', '参与'),
+            (users[0].username, '参与'),
+            (self.user.username, '不存在'),
+            (users[1].username, '参与'),
+        ])
+
+        with self.assertRaises(BadRequest) as context_manager:
+            RecordService.create_campus_records_from_excel(excel, context)
+
+        message = str(context_manager.exception)
+        for error in ('第5行，用户名为not-exist的用户不存在',
+                      '第6行，用户名为{}的用户重复'.format(users[0].username),
+                      '第7行，不存在的参与形式',
+                      '第8行，已经存在用户名为{}的用户参加该活动的培训记录'.format(
+                          users[1].username)):
+            self.assertIn(error, message)
+        self.assertFalse(Record.objects.filter(user=users[0]).exists())
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_create_campus_records_in_bulk(self):
+        '''Should create records with permissions, notifications and urls.'''
+        context = self.make_campus_records_context()
+        users = mommy.make(User, _quantity=3)
+        excel = self.make_campus_records_excel(
+            [(user.username, '参与') for user in users])
+
+        count = RecordService.create_campus_records_from_excel(excel, context)
+
+        self.assertEqual(count, 3)
+        records = Record.objects.filter(campus_event=self.campus_event)
+        self.assertEqual({x.user_id for x in records},
+                         {user.id for user in users})
+        for record in records:
+            self.assertEqual(record.status, Record.STATUS_FEEDBACK_REQUIRED)
+            self.assertEqual(
+                (record.event_kind, record.event_name, record.event_time),
+                (Record.EVENT_KIND_CAMPUS, self.campus_event.name,
+                 self.campus_event.time))
+            self.assertTrue(record.user.has_perm(
+                'training_record.view_record', record))
+            self.assertTrue(TinyURL.objects.filter(
+                url='records/{}'.format(record.id)).exists())
+        self.assertEqual(Notification.objects.filter(
+            recipient__in=users).count(), 3)
+        self.assertEqual(OutboxMessage.objects.filter(
+            channel=OutboxMessage.CHANNEL_SMS).count(), 3)
+
+    def test_create_campus_records_constant_queries(self):
+        '''Should not issue more queries for more rows.'''
+        context = self.make_campus_records_context()
+        users = mommy.make(User, _quantity=6)
+        excel = self.make_campus_records_excel(
+            [(users[0].username, '参与')])
+        ContentType.objects.get_for_models(Record, Notification)
+        with CaptureQueriesContext(connection) as queries:
+            RecordService.create_campus_records_from_excel(excel, context)
+        Record.objects.filter(campus_event=self.campus_event).delete()
+        excel = self.make_campus_records_excel(
+            [(user.username, '参与') for user in users[1:]])
+
+        with self.assertNumQueries(len(queries.captured_queries)):
+            RecordService.create_campus_records_from_excel(excel, context)
+
+    def test_create_campus_records_xlsx(self):
+        '''Should create records from .xlsx file.'''
+        context = self.make_campus_records_context()
+        excel = SimpleUploadedFile('records.xlsx', make_xlsx({
+            1: [number_cell('B1', self.campus_event.id)],
+            4: [inline_string_cell('C4', self.user.username),
+                inline_string_cell('H4', '参与'),
+                number_cell('I4', 6)],
+        }))
+
+        count = RecordService.create_campus_records_from_excel(excel, context)
+
         self.assertEqual(count, 1)
+        self.assertTrue(Record.objects.filter(
+            campus_event=self.campus_event, user=self.user).exists())
+
+    def test_validate_campus_records_excel(self):
+        '''Should report errors of each row without creating records.'''
+        context = self.make_campus_records_context()
+        excel = self.make_campus_records_excel([
+            (self.user.username, '参与'),
+            ('not-exist', '参与'),
+            (self.user.username, '参与'),
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            report = RecordService.validate_campus_records_excel(
+                excel, context)
+
+        self.assertEqual(report, {
+            'campus_event': self.campus_event.id,
+            'num_records': 1,
+            'errors': [
+                {'row': 5, 'message': '第5行，用户名为not-exist的用户不存在'},
+                {'row': 6, 'message': '第6行，用户名为{}的用户重复'.format(
+                    self.user.username)},
+            ],
+        })
+        self.assertFalse(any(
+            query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            for query in queries.captured_queries))
+        self.assertFalse(Record.objects.filter(
+            campus_event=self.campus_event).exists())
+
+    def test_validate_campus_records_bad_file(self):
+        '''Should raise BadRequest if file is invalid.'''
+        with self.assertRaisesMessage(BadRequest, '无效的表格'):
+            RecordService.validate_campus_records_excel(b'some numbers', {})
+
+    @patch('training_record.services.transaction.on_commit')
+    def test_create_campus_records_invalidate(self, mocked_on_commit):
+        '''Should send records_bulk_created and invalidate caches.'''
+        context = self.make_campus_records_context()
+        excel = self.make_campus_records_excel([(self.user.username, '参与')])
+        handler = Mock()
+        records_bulk_created.connect(handler, sender=Record)
+        try:
+            RecordService.create_campus_records_from_excel(excel, context)
+        finally:
+            records_bulk_created.disconnect(handler, sender=Record)
+
+        records = handler.call_args[1]['records']
+        self.assertEqual([x.user for x in records], [self.user])
+        mocked_on_commit.assert_called_with(invalidate_all_caches)
 
     def test_department_admin_review_no_record(self):
         '''Should raise BadRequest if no such record.'''
@@ -487,6 +664,113 @@ class TestRecordService(TestCase):
         self.assertEqual(result, 0)
 
 
+@patch('training_record.services.is_admin_allowed_operating',
+       Mock(return_value=True))
+class TestBatchChangeRecordsStatus(TestCase):
+    '''Test RecordService.batch_change_records_status().'''
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.get_or_create(username='notification-robot')
+        mommy.make(Group, name='个人权限')
+        cls.admin = mommy.make(User)
+        assign_perm('training_record.review_record', cls.admin)
+        assign_perm('training_record.change_record', cls.admin)
+
+    def make_records(self, quantity):
+        '''Make off-campus records the admin can review.'''
+        records = [
+            mommy.make(Record, off_campus_event=mommy.make(OffCampusEvent),
+                       status=Record.STATUS_SUBMITTED)
+            for _ in range(quantity)
+        ]
+        for record in records:
+            assign_perm('training_record.review_record', self.admin, record)
+        return records
+
+    def test_bad_request(self):
+        '''Should raise BadRequest for bad actions, ids or users.'''
+        for ids, action, message in (
+                ([1], 'approve', '无效的操作'),
+                ('1,2', 'close', '请提供培训记录ID列表'),
+                ([], 'close', '请提供培训记录ID列表'),
+                (list(range(501)), 'close', '一次最多处理500条培训记录')):
+            with self.assertRaisesMessage(BadRequest, message):
+                RecordService.batch_change_records_status(
+                    ids, action, self.admin)
+        with self.assertRaisesMessage(BadRequest, '无权更改'):
+            RecordService.batch_change_records_status(
+                [1], 'close', mommy.make(User))
+
+    @patch('training_record.services.transaction.on_commit')
+    def test_batch_review(self, mocked_on_commit):
+        '''Should change records in bulk and report each record.'''
+        records = self.make_records(2)
+        forbidden = mommy.make(Record, off_campus_event=mommy.make(
+            OffCampusEvent))
+        campus_record = mommy.make(Record, campus_event=mommy.make(
+            CampusEvent))
+        assign_perm('training_record.review_record', self.admin,
+                    campus_record)
+        handler = Mock()
+        records_bulk_updated.connect(handler, sender=Record)
+        try:
+            results = RecordService.batch_change_records_status(
+                [records[0].id, forbidden.id, campus_record.id, -1,
+                 records[1].id], 'school_admin_reject', self.admin)
+        finally:
+            records_bulk_updated.disconnect(handler, sender=Record)
+
+        status = Record.STATUS_SCHOOL_ADMIN_REJECTED
+        self.assertEqual(results, [
+            {'id': records[0].id, 'success': True, 'status': status},
+            {'id': forbidden.id, 'success': False, 'message': '无权更改'},
+            {'id': campus_record.id, 'success': False,
+             'message': '无此培训记录'},
+            {'id': -1, 'success': False, 'message': '无此培训记录'},
+            {'id': records[1].id, 'success': True, 'status': status},
+        ])
+        self.assertEqual(
+            set(Record.objects.filter(status=status)), set(records))
+        self.assertEqual(set(StatusChangeLog.objects.values_list(
+            'record', 'pre_status', 'post_status', 'user')), {
+                (record.id, Record.STATUS_SUBMITTED, status, self.admin.id)
+                for record in records
+            })
+        self.assertEqual(set(Notification.objects.values_list(
+            'recipient', 'content')), {
+                (record.user_id,
+                 '您有一条培训记录已被学校管理员审核，当前状态：学校管理员审核不通过')
+                for record in records
+            })
+        self.assertEqual(handler.call_args[1]['records'], records)
+        mocked_on_commit.assert_called_once_with(invalidate_all_caches)
+
+    def test_batch_close(self):
+        '''Should close records with change permissions.'''
+        record = mommy.make(Record, campus_event=mommy.make(CampusEvent))
+        assign_perm('training_record.change_record', self.admin, record)
+
+        results = RecordService.batch_change_records_status(
+            [record.id], 'close', self.admin)
+
+        self.assertTrue(results[0]['success'])
+        record.refresh_from_db()
+        self.assertEqual(record.status, Record.STATUS_CLOSED)
+
+    def test_constant_queries(self):
+        '''Should not issue more queries for more records.'''
+        records = self.make_records(8)
+        ContentType.objects.get_for_models(Record, Notification)
+        with CaptureQueriesContext(connection) as queries:
+            RecordService.batch_change_records_status(
+                [records[0].id], 'department_admin_approve', self.admin)
+
+        with self.assertNumQueries(len(queries.captured_queries)):
+            RecordService.batch_change_records_status(
+                [record.id for record in records[1:]],
+                'department_admin_approve', self.admin)
+
+
 class TestCampusEventFeedbackService(TestCase):
     '''Test services provided by CampusEventFeedbackService.'''
     def test_create_feedback(self):
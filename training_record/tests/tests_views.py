@@ -6,7 +6,9 @@ from unittest.mock import patch, PropertyMock
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.db import connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from model_mommy import mommy
 from rest_framework import status
@@ -24,6 +26,7 @@ from training_event.models import EventCoefficient
 User = get_user_model()
 
 
+# pylint: disable=too-many-public-methods
 class TestRecordViewSet(APITestCase):
     '''Unit tests for Record view.'''
     @classmethod
@@ -127,6 +130,45 @@ class TestRecordViewSet(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 10)
 
+    @patch('auth.models.User.is_department_admin', new_callable=PropertyMock)
+    def test_list_records_for_review_by_priority(self, mocked_role):
+        '''Should order records in review queues and page them by cursor.'''
+        mocked_role.return_value = True
+        for status_ in (Record.STATUS_DEPARTMENT_ADMIN_APPROVED,
+                        Record.STATUS_SUBMITTED,
+                        Record.STATUS_SCHOOL_ADMIN_REJECTED,
+                        Record.STATUS_DEPARTMENT_ADMIN_REJECTED,
+                        Record.STATUS_SUBMITTED):
+            record = mommy.make(
+                Record, user=self.user, status=status_,
+                off_campus_event=mommy.make(
+                    training_event.models.OffCampusEvent))
+            PermissionService.assign_object_permissions(self.user, record)
+        url = reverse('record-list-records-for-review')
+
+        ids = []
+        response = self.client.get(url, {'cursor': '', 'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(record['id'] for record in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(
+            [Record.objects.get(id=id_).status for id_ in ids],
+            [Record.STATUS_SUBMITTED, Record.STATUS_SUBMITTED,
+             Record.STATUS_DEPARTMENT_ADMIN_REJECTED,
+             Record.STATUS_DEPARTMENT_ADMIN_APPROVED])
+        self.assertGreater(ids[0], ids[1])
+
+        mocked_role.return_value = False
+        response = self.client.get(url)
+        self.assertEqual(
+            [record['status'] for record in response.data['results']],
+            [Record.STATUS_DEPARTMENT_ADMIN_APPROVED,
+             Record.STATUS_SCHOOL_ADMIN_REJECTED])
+
     def test_search_record_with_no_query_params(self):
         '''should return matched records'''
         url = reverse('record-list') + '?start_time=2013-09-09&'\
@@ -160,6 +202,65 @@ class TestRecordViewSet(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(set(response.data.keys()), expected_keys)
 
+    def count_list_queries(self, num_records):
+        '''Return number of queries to list a page of num_records.'''
+        Record.objects.filter(user=self.user).delete()
+        campus_events = mommy.make(training_event.models.CampusEvent,
+                                   _quantity=num_records)
+        for campus_event in campus_events:
+            record = mommy.make(Record, user=self.user,
+                                campus_event=campus_event,
+                                status=Record.STATUS_SUBMITTED)
+            PermissionService.assign_object_permissions(self.user, record)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('record-list'),
+                                       {'limit': num_records})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), num_records)
+        self.assertTrue(all(record['allow_actions_from_user']
+                            for record in response.data['results']))
+        return len(context.captured_queries)
+
+    def test_list_records_constant_queries(self):
+        '''Should not query per record to check permissions.'''
+        # Warm up permissions cached on the user.
+        self.count_list_queries(1)
+
+        self.assertEqual(self.count_list_queries(5),
+                         self.count_list_queries(20))
+
+    def test_list_records_by_cursor(self):
+        '''Should page records by cursor in the order of offsets.'''
+        for status_ in (Record.STATUS_SUBMITTED,
+                        Record.STATUS_FEEDBACK_REQUIRED,
+                        Record.STATUS_SUBMITTED,
+                        Record.STATUS_FEEDBACK_REQUIRED,
+                        Record.STATUS_SUBMITTED):
+            record = mommy.make(Record, user=self.user, status=status_,
+                                campus_event=mommy.make(
+                                    training_event.models.CampusEvent))
+            PermissionService.assign_object_permissions(self.user, record)
+        url = reverse('record-list')
+        expected = [record['id'] for record in self.client.get(
+            url, {'limit': 10}).data['results']]
+
+        ids = []
+        response = self.client.get(url, {'cursor': '', 'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(record['id'] for record in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(ids, expected)
+        self.assertEqual(
+            [Record.objects.get(id=id_).status for id_ in ids[:2]],
+            [Record.STATUS_FEEDBACK_REQUIRED] * 2)
+
     @patch('training_record.utils.is_user_allowed_operating')
     def test_update_record(self, mocked_method):
         '''Record should be updated by PATCH request.'''
@@ -212,6 +313,21 @@ class TestRecordViewSet(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    @patch('training_record.views.RecordService'
+           '.batch_change_records_status')
+    def test_batch_change_status(self, mocked_change):
+        '''Should call batch_change_records_status.'''
+        results = [{'id': 1, 'success': False, 'message': '无此培训记录'}]
+        mocked_change.return_value = results
+        url = reverse('record-batch-change-status')
+
+        response = self.client.post(
+            url, {'ids': [1], 'action': 'close'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, results)
+        mocked_change.assert_called_with([1], 'close', self.user)
+
     @patch('training_record.services.NotificationService'
            '.send_system_notification')
     def test_school_admin_review(self, _):
@@ -301,6 +417,38 @@ class TestRecordViewSet(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertIn('count', response.data)
 
+    @patch('training_record.views.RecordService')
+    def test_batch_submit_dry_run(self, mocked_service):
+        '''Should return report of rows without creating records.'''
+        user = mommy.make(get_user_model())
+        group = mommy.make(Group, name="创新创业学院-管理员")
+        user.groups.add(group)
+        assign_perm('training_record.batchadd_record', group)
+        url = reverse('record-batch-submit') + '?dry_run=true'
+        file_data = io.BytesIO(b'some numbers')
+        report = {'campus_event': 1, 'num_records': 0, 'errors': []}
+        mocked_service.validate_campus_records_excel.return_value = report
+
+        self.client.force_authenticate(user)
+        response = self.client.post(url, {'file': file_data})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, report)
+        mocked_service.create_campus_records_from_excel.assert_not_called()
+
+    def test_batch_submit_no_file(self):
+        '''Should return 400 if no file is uploaded.'''
+        user = mommy.make(get_user_model())
+        group = mommy.make(Group, name="创新创业学院-管理员")
+        user.groups.add(group)
+        assign_perm('training_record.batchadd_record', group)
+        url = reverse('record-batch-submit')
+
+        self.client.force_authenticate(user)
+        response = self.client.post(url, {})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     @patch('training_record.views.RecordService')
     def test_get_number_of_records_without_feedback(self, mocked_service):
         '''Should return the count of records which requiring feedback'''
@@ -1,19 +1,15 @@
 '''Provide API views for training_record module.'''
 import django_filters
-from django.db.models import Q
+from django.db.models import Case, F, IntegerField, Q, Value, When
 from rest_framework import viewsets, status, decorators, mixins
 from rest_framework.response import Response
-from rest_framework_guardian import filters
 
+import auth.filters
 import auth.permissions
 from auth.models import User
 import training_record.models
 import training_record.filters
 from training_record.models import Record
-from training_record.utils import (
-    get_department_admin_actionable_status,
-    get_school_admin_actionable_status,
-)
 from training_record.services import RecordService
 from training_record.serializers import (CampusEventFeedbackSerializer,
                                          RecordWriteSerializer,
@@ -31,14 +27,15 @@ class RecordViewSet(DRFCacheMixin,
     '''Create API views for Record.'''
     queryset = (
         training_record.models.Record.objects.all()
+        .select_related('user__department')
         .select_related('campus_event__program__department')
         .select_related('off_campus_event')
         .select_related('event_coefficient')
         .select_related('feedback')
         .prefetch_related('contents', 'attachments')
-        .extra(select={
-            'is_status_feedback_required':
-            f'status={Record.STATUS_FEEDBACK_REQUIRED}'})
+        .annotate(is_status_feedback_required=Case(
+            When(status=Record.STATUS_FEEDBACK_REQUIRED, then=Value(1)),
+            default=Value(0), output_field=IntegerField()))
         .order_by('-is_status_feedback_required', '-create_time')
     )
     filter_class = training_record.filters.RecordFilter
@@ -54,6 +51,7 @@ class RecordViewSet(DRFCacheMixin,
         'school_admin_review': ['%(app_label)s.review_%(model_name)s'],
         'close_record': ['%(app_label)s.change_%(model_name)s'],
         'force_close_record': ['%(app_label)s.change_%(model_name)s'],
+        'batch_change_status': ['%(app_label)s.view_%(model_name)s'],
         'batch_submit': ['%(app_label)s.batchadd_%(model_name)s'],
         'get_number_of_records_without_feedback':
             ['%(app_label)s.view_%(model_name)s'],
@@ -62,7 +60,12 @@ class RecordViewSet(DRFCacheMixin,
         'list_records_by_event': ['%(app_label)s.view_%(model_name)s'],
         'get_recent_events': ['%(app_label)s.view_%(model_name)s'],
     }
-    filter_backends = (filters.DjangoObjectPermissionsFilter,
+    keyset_orderings = {
+        'list': ('-is_status_feedback_required', '-create_time', '-id'),
+        'list_records_for_review': ('-review_priority', '-create_time',
+                                    '-id'),
+    }
+    filter_backends = (auth.filters.ObjectPermissionsFilter,
                        django_filters.rest_framework.DjangoFilterBackend,)
     permission_classes = (
         auth.permissions.DjangoObjectPermissions,
@@ -112,43 +115,21 @@ class RecordViewSet(DRFCacheMixin,
     @decorators.action(detail=False, methods=['GET'],
                        url_path='list-records-for-review')
     def list_records_for_review(self, request):
-        '''Return all offCampusRecords for admin'''
+        '''Return all offCampusRecords for admin
+
+        Records are ordered by priorities in the review queue of the admin,
+        see Record.DEPARTMENT_REVIEW_PRIORITIES.
+        '''
+        if request.user.is_department_admin:
+            priority = 'department_review_priority'
+        else:
+            priority = 'school_review_priority'
         queryset = (
             self.filter_queryset(self.get_queryset())
-            .filter(off_campus_event__isnull=False)
-        )
-        if request.user.is_department_admin:
-            queryset = queryset.filter(
-                status__in=get_department_admin_actionable_status(),
-            )
-            queryset = queryset.extra(select={
-                'is_status_submitted':
-                f'status={Record.STATUS_SUBMITTED}',
-                'is_status_department_admin_rejected':
-                f'status={Record.STATUS_DEPARTMENT_ADMIN_REJECTED}',
-                'is_status_department_admin_approved':
-                f'status={Record.STATUS_DEPARTMENT_ADMIN_APPROVED}'
-                }).order_by(
-                    '-is_status_submitted',
-                    '-is_status_department_admin_rejected',
-                    '-is_status_department_admin_approved',
-                    '-create_time')
-            return self._get_paginated_response(queryset)
-        queryset = queryset.filter(
-            status__in=get_school_admin_actionable_status(),
+            .filter(**{f'{priority}__isnull': False})
+            .annotate(review_priority=F(priority))
+            .order_by('-review_priority', '-create_time', '-id')
         )
-        queryset = queryset.extra(select={
-            'is_status_department_admin_approved':
-            f'status={Record.STATUS_DEPARTMENT_ADMIN_APPROVED}',
-            'is_status_school_admin_rejected':
-            f'status={Record.STATUS_SCHOOL_ADMIN_REJECTED}',
-            'is_status_school_admin_approved':
-            f'status={Record.STATUS_SCHOOL_ADMIN_APPROVED}'
-            }).order_by(
-                '-is_status_department_admin_approved',
-                '-is_status_school_admin_rejected',
-                '-is_status_school_admin_approved',
-                '-create_time')
         return self._get_paginated_response(queryset)
 
     @decorators.action(detail=False, methods=['GET'], url_path='reviewed')
@@ -205,14 +186,33 @@ class RecordViewSet(DRFCacheMixin,
                                    request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @decorators.action(detail=False, methods=['POST'],
+                       url_path='batch-change-status')
+    def batch_change_status(self, request):
+        '''Review or close many records, return result of each record.'''
+        results = RecordService.batch_change_records_status(
+            request.data.get('ids'), request.data.get('action'),
+            request.user)
+        return Response(results, status=status.HTTP_200_OK)
+
     @decorators.action(detail=False, methods=['POST'],
                        url_path='batch-submit')
     def batch_submit(self, request):
-        '''Return count of records which are created.'''
-        excel = request.FILES.get('file').read()
+        '''Return count of records which are created.
+
+        With ?dry_run=true, rows are validated and a report of errors in
+        each row is returned, no record is created.
+        '''
+        excel = request.FILES.get('file')
+        if excel is None:
+            raise BadRequest('请上传表格')
         context = {
             'user': request.user,
         }
+        if request.query_params.get('dry_run') in ('true', '1'):
+            report = RecordService.validate_campus_records_excel(
+                excel, context)
+            return Response(report, status=status.HTTP_200_OK)
         count = RecordService.create_campus_records_from_excel(
             excel, context)
         return Response({'count': count}, status=status.HTTP_201_CREATED)
@@ -241,7 +241,7 @@ class RecordContentViewSet(DRFCacheMixin,
     queryset = training_record.models.RecordContent.objects.all()
     serializer_class = training_record.serializers.RecordContentSerializer
     filter_class = training_record.filters.RecordContentFilter
-    filter_backends = (filters.DjangoObjectPermissionsFilter,
+    filter_backends = (auth.filters.ObjectPermissionsFilter,
                        django_filters.rest_framework.DjangoFilterBackend,)
     permission_classes = (
         auth.permissions.DjangoObjectPermissions,
@@ -256,7 +256,7 @@ class RecordAttachmentViewSet(DRFCacheMixin,
     queryset = training_record.models.RecordAttachment.objects.all()
     serializer_class = training_record.serializers.RecordAttachmentSerializer
     filter_class = training_record.filters.RecordAttachmentFilter
-    filter_backends = (filters.DjangoObjectPermissionsFilter,
+    filter_backends = (auth.filters.ObjectPermissionsFilter,
                        django_filters.rest_framework.DjangoFilterBackend,)
     permission_classes = (
         auth.permissions.DjangoObjectPermissions,
@@ -272,6 +272,9 @@ class StatusChangeLogViewSet(DRFCacheMixin,
         .order_by('-time')
     )
     serializer_class = training_record.serializers.StatusChangeLogSerializer
+    keyset_orderings = {
+        'list': ('-time', '-id'),
+    }
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
     filter_fields = ('record',)
 
@@ -1,8 +1,8 @@
 '''Provide API views for training_review module.'''
 import django_filters
 from rest_framework import viewsets, mixins
-from rest_framework_guardian import filters
 
+import auth.filters
 import auth.permissions
 import training_review.models
 import training_review.serializers
@@ -22,7 +22,7 @@ class ReviewNoteViewSet(DRFCacheMixin,
     )
     serializer_class = training_review.serializers.ReviewNoteSerializer
     filter_class = training_review.filters.ReviewNoteFilter
-    filter_backends = (filters.DjangoObjectPermissionsFilter,
+    filter_backends = (auth.filters.ObjectPermissionsFilter,
                        django_filters.rest_framework.DjangoFilterBackend,)
     permission_classes = (
         auth.permissions.DjangoObjectPermissions,